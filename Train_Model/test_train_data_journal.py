@@ -0,0 +1,89 @@
+"""
+Unit tests for the train_data.json patch journal.
+
+Run with: python -m unittest test_train_data_journal.py
+"""
+
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from train_data_journal import TrainDataJournal, diff_patch, apply_patch
+
+
+class TestDiffPatch(unittest.TestCase):
+    """diff_patch / apply_patch round trips."""
+
+    def test_round_trip(self):
+        old = {"specs": {"capacity": 222},
+               "train_1": {"inputs": {"commanded speed": 10.0, "x": 1}},
+               "train_2": {"inputs": {}}}
+        new = {"specs": {"capacity": 222},
+               "train_1": {"inputs": {"commanded speed": 12.5}},
+               "train_3": {"inputs": {"speed limit": 40}}}
+        set_patch, deleted = diff_patch(old, new)
+        self.assertEqual(set_patch, {"train_1": {"inputs": {"commanded speed": 12.5}},
+                                     "train_3": {"inputs": {"speed limit": 40}}})
+        self.assertIn(["train_2"], deleted)
+        self.assertIn(["train_1", "inputs", "x"], deleted)
+        apply_patch(old, {"set": set_patch, "del": deleted})
+        self.assertEqual(old, new)
+
+
+class TestTrainDataJournal(unittest.TestCase):
+    """Journal writers, readers and compaction."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "train_data.json")
+        with open(self.path, "w") as f:
+            json.dump({"specs": {}, "train_1": {"inputs": {"commanded speed": 0.0}}}, f)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_writes_append_only_changes(self):
+        journal = TrainDataJournal(self.path)
+        data = journal.read()
+        data["train_1"]["inputs"]["commanded speed"] = 30.0
+        self.assertTrue(journal.write_document(data))
+        self.assertFalse(journal.write_document(data))
+        with open(journal.journal_path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records, [{"set": {"train_1": {"inputs": {"commanded speed": 30.0}}},
+                                    "del": []}])
+
+    def test_concurrent_writers_keep_each_others_changes(self):
+        first = TrainDataJournal(self.path)
+        second = TrainDataJournal(self.path)
+        a = first.read()
+        b = second.read()
+        a["train_1"]["inputs"]["commanded speed"] = 20.0
+        b["train_2"] = {"inputs": {"commanded speed": 15.0}}
+        first.write_document(a)
+        second.write_document(b)
+        merged = first.read()
+        self.assertEqual(merged["train_1"]["inputs"]["commanded speed"], 20.0)
+        self.assertEqual(merged["train_2"]["inputs"]["commanded speed"], 15.0)
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        writer = TrainDataJournal(self.path)
+        reader = TrainDataJournal(self.path)
+        writer.patch({"train_1": {"outputs": {"velocity_mph": 5.0}}})
+        self.assertEqual(reader.read()["train_1"]["outputs"]["velocity_mph"], 5.0)
+        self.assertTrue(writer.compact())
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["train_1"]["outputs"]["velocity_mph"], 5.0)
+        writer.patch({"train_1": {"outputs": {"velocity_mph": 6.0}}})
+        # Reader notices the new journal and replays it on top of the snapshot
+        self.assertEqual(reader.read()["train_1"]["outputs"]["velocity_mph"], 6.0)
+        self.assertTrue(reader.compact())
+        self.assertFalse(writer.compact())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,348 @@
+"""Append-only patch journal for train_data.json.
+
+train_data.json holds every train's specs/inputs/outputs, and rewriting the
+whole file on every cycle makes the write cost grow with the fleet. In
+journaled mode (TRAIN_DATA_JOURNAL=1) writers append small patch records to
+train_data.json.journal instead:
+
+    {"set": {"train_2": {"inputs": {"commanded speed": 25.0}}}, "del": []}
+
+"set" is merged recursively into the document and "del" lists key paths to
+remove. Readers keep their last byte offset into the journal and only replay
+records appended since then. A compactor periodically folds the journal back
+into train_data.json (the snapshot) and starts a new, empty journal, so
+modules that read train_data.json directly still see data that is at most one
+compaction interval old.
+
+Locking (POSIX): writers and full reloads hold a shared flock on the lock file,
+the compactor holds an exclusive one. On Windows only an in-process lock is
+used.
+"""
+
+import copy
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from channel_notify import publish_path
+from double_buffer import load as load_published, publish as publish_file
+
+JOURNAL_SUFFIX = ".journal"
+LOCK_SUFFIX = ".journal.lock"
+COMPACT_BYTES = 256 * 1024   # compact once the journal grows past this
+COMPACT_INTERVAL_S = 1.0     # ... or once per interval if it has any records
+
+
+def diff_patch(old, new, path=()):
+    """Compute the patch that turns old into new.
+
+    Returns:
+        tuple: (set_patch dict, list of deleted key paths)
+    """
+    set_patch = {}
+    deleted = []
+    if not isinstance(old, dict):
+        old = {}
+    for key, value in new.items():
+        if key not in old:
+            set_patch[key] = copy.deepcopy(value)
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub_set, sub_del = diff_patch(old[key], value, path + (key,))
+            if sub_set:
+                set_patch[key] = sub_set
+            deleted.extend(sub_del)
+        elif old[key] != value or type(old[key]) is not type(value):
+            set_patch[key] = copy.deepcopy(value)
+    for key in old:
+        if key not in new:
+            deleted.append(list(path + (key,)))
+    return set_patch, deleted
+
+
+def apply_patch(doc: dict, record: dict) -> None:
+    """Apply one journal record to doc in place."""
+    for key_path in record.get("del", []):
+        target = doc
+        for key in key_path[:-1]:
+            target = target.get(key)
+            if not isinstance(target, dict):
+                break
+        else:
+            if isinstance(target, dict):
+                target.pop(key_path[-1], None)
+    _merge(doc, record.get("set", {}))
+
+
+def _merge(target: dict, patch: dict) -> None:
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class TrainDataJournal:
+    """Journaled view of one JSON document (train_data.json)."""
+
+    def __init__(self, path: str, compact_bytes: int = COMPACT_BYTES,
+                 compact_interval_s: float = COMPACT_INTERVAL_S):
+        self.path = os.path.abspath(path)
+        self.journal_path = self.path + JOURNAL_SUFFIX
+        self.compact_bytes = compact_bytes
+        self.compact_interval_s = compact_interval_s
+        self._lock = threading.RLock()
+        self._lock_fd = None
+        if fcntl is not None:
+            self._lock_fd = os.open(self.path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o666)
+        self._doc = {}
+        self._journal = None
+        self._offset = 0
+        self._base = threading.local()
+        self._compactor = None
+        self._compactor_running = False
+        self._last_compact = time.monotonic()
+        with self._lock:
+            self._reload()
+
+    # ------------------------------------------------------------------
+    # Locking
+    # ------------------------------------------------------------------
+    def _flock(self, mode):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, mode)
+
+    def _shared(self):
+        self._flock(fcntl.LOCK_SH if fcntl else None)
+
+    def _exclusive(self):
+        self._flock(fcntl.LOCK_EX if fcntl else None)
+
+    def _unlock(self):
+        self._flock(fcntl.LOCK_UN if fcntl else None)
+
+    # ------------------------------------------------------------------
+    # Replay
+    # ------------------------------------------------------------------
+    def _journal_id(self):
+        """Identify the current journal file (inode + epoch header line).
+
+        The epoch header guards against the filesystem reusing the inode of
+        a journal that was replaced by an earlier compaction.
+        """
+        try:
+            with open(self.journal_path, "rb") as f:
+                header = f.readline(64)
+                return os.fstat(f.fileno()).st_ino, header if header.startswith(b'{"epoch"') else b""
+        except FileNotFoundError:
+            return None
+
+    def _load_snapshot(self):
+        return load_published(self.path)
+
+    def _reload(self):
+        """Load the snapshot and replay the whole journal (lock held)."""
+        self._shared()
+        try:
+            doc = {}
+            try:
+                doc = self._load_snapshot()
+                if not isinstance(doc, dict):
+                    doc = {}
+            except (FileNotFoundError, json.JSONDecodeError):
+                doc = {}
+            self._doc = doc
+            self._journal = self._journal_id()
+            self._offset = 0
+            self._replay()
+        finally:
+            self._unlock()
+
+    def _replay(self):
+        """Apply complete records appended after the current offset."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if "epoch" not in record:
+                    apply_patch(self._doc, record)
+            except (ValueError, TypeError) as e:
+                print(f"[TrainDataJournal] Skipping bad record in {self.journal_path}: {e}")
+        self._offset += end + 1
+
+    def refresh(self) -> None:
+        """Catch up with records appended by other writers."""
+        with self._lock:
+            if self._journal_id() != self._journal:
+                # Journal was compacted (or created) since we last looked
+                self._reload()
+            else:
+                self._replay()
+
+    def read(self) -> dict:
+        """Return a private copy of the current document.
+
+        The copy is also remembered as the base for the next write_document()
+        from this thread, so only the fields the caller changed are journaled.
+        """
+        with self._lock:
+            self.refresh()
+            doc = copy.deepcopy(self._doc)
+            self._base.doc = copy.deepcopy(doc)
+            return doc
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def append(self, set_patch: dict, deleted: list = None) -> bool:
+        """Append one patch record. Returns False if the patch is empty."""
+        if not set_patch and not deleted:
+            return False
+        line = (json.dumps({"set": set_patch, "del": deleted or []},
+                           separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            self._shared()
+            try:
+                fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+            finally:
+                self._unlock()
+            self.refresh()
+        publish_path(self.path)
+        return True
+
+    def patch(self, set_patch: dict) -> bool:
+        """Merge set_patch into the document (e.g. one train's inputs)."""
+        return self.append(set_patch)
+
+    def write_document(self, doc: dict) -> bool:
+        """Journal the difference between doc and the last read() base.
+
+        Fields the caller did not touch are not written, so concurrent
+        writers that changed other trains are not clobbered.
+        """
+        base = getattr(self._base, "doc", None)
+        if base is None:
+            with self._lock:
+                self.refresh()
+                base = self._doc
+        set_patch, deleted = diff_patch(base, doc)
+        self._base.doc = copy.deepcopy(doc)
+        return self.append(set_patch, deleted)
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+    def _header_size(self) -> int:
+        journal = self._journal
+        return len(journal[1]) if journal else 0
+
+    def compact(self) -> bool:
+        """Fold the journal into the snapshot and start a new journal."""
+        with self._lock:
+            self._exclusive()
+            try:
+                try:
+                    if os.path.getsize(self.journal_path) <= self._header_size():
+                        return False
+                except FileNotFoundError:
+                    return False
+                # Bring our view fully up to date while nobody can append
+                if self._journal_id() != self._journal:
+                    doc = {}
+                    try:
+                        doc = self._load_snapshot()
+                    except (FileNotFoundError, json.JSONDecodeError):
+                        pass
+                    self._doc = doc if isinstance(doc, dict) else {}
+                    self._journal = self._journal_id()
+                    self._offset = 0
+                self._replay()
+
+                publish_file(self.path, json.dumps(self._doc, indent=4))
+
+                new_journal = self.journal_path + ".tmp"
+                with open(new_journal, "wb") as f:
+                    f.write(json.dumps({"epoch": time.time_ns()}).encode("utf-8") + b"\n")
+                os.replace(new_journal, self.journal_path)
+                self._journal = self._journal_id()
+                self._offset = 0
+                return True
+            finally:
+                self._unlock()
+
+    def compact_if_needed(self) -> bool:
+        """Compact if the journal is large or the interval has elapsed."""
+        try:
+            size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return False
+        if size <= self._header_size():
+            return False
+        if (size < self.compact_bytes
+                and time.monotonic() - self._last_compact < self.compact_interval_s):
+            return False
+        compacted = self.compact()
+        self._last_compact = time.monotonic()
+        return compacted
+
+    def _compactor_loop(self):
+        while self._compactor_running:
+            time.sleep(0.1)
+            try:
+                self.compact_if_needed()
+            except Exception as e:
+                print(f"[TrainDataJournal] Compaction failed: {e}")
+
+    def start_compactor(self) -> None:
+        """Run compaction in a daemon thread."""
+        if self._compactor_running:
+            return
+        self._compactor_running = True
+        self._compactor = threading.Thread(target=self._compactor_loop, daemon=True)
+        self._compactor.start()
+
+    def stop_compactor(self) -> None:
+        self._compactor_running = False
+        if self._compactor is not None:
+            self._compactor.join(timeout=1.0)
+            self._compactor = None
+        self.compact()
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_train_data_journal(path: str) -> TrainDataJournal:
+    """Get the process-wide journal for path, starting its compactor."""
+    path = os.path.abspath(path)
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = TrainDataJournal(path)
+            journal.start_compactor()
+            _journals[path] = journal
+        return journal
@@ -1,26 +1,27 @@
 import json
 import os
+import sys
 from typing import Dict
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if os.path.dirname(BASE_DIR) not in sys.path:
+    sys.path.append(os.path.dirname(BASE_DIR))
+from double_buffer import load as load_published, publish as publish_file
+
 TRAIN_DATA_FILE = os.path.join(BASE_DIR, "train_data.json")
 TRAIN_STATES_FILE = os.path.join(BASE_DIR, "../train_controller/data/train_states.json")
 
 
 def _safe_read(path: str) -> Dict:
     try:
-        with open(path, "r") as f:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
+        data = load_published(path)
+        return data if isinstance(data, dict) else {}
     except Exception:
         return {}
 
 
 def _safe_write(path: str, data: Dict):
-    tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(data, f, indent=4)
-    os.replace(tmp, path)
+    publish_file(path, json.dumps(data, indent=4))
 
 
 def sync_train_data():
@@ -1,4 +1,4 @@
-import os, json, time, random
+import os, sys, json, time, random
 
 # === FIXED ABSOLUTE PATHS (MATCHING TRACK MODEL FIX) ===
 
@@ -20,63 +20,109 @@ TRACK_INPUT_FILE = os.path.join(PARENT_DIR, "track_model_Train_Model.json")
 # Wayside to Train JSON (from track_controller)
 WAYSIDE_TO_TRAIN_FILE = os.path.join(PARENT_DIR, "track_controller", "New_SW_Code", "wayside_to_train.json")
 
+# Shared-file infrastructure lives at the project root
+if PARENT_DIR not in sys.path:
+    sys.path.append(PARENT_DIR)
+# Change notification for the shared JSON channels
+from channel_notify import publish_path
+# Stat-validated parsed-JSON cache
+from json_cache import read_json, thaw
+# In-process / shared-memory SimBus for the shared channels (GROUP4_BUS)
+from sim_bus import active_bus_for
+# Double-buffered publishing of the shared files (readers never see a partial write)
+from double_buffer import publish as publish_file
+
+
+# === Controller state store (TRAIN_STATE_SHM=1 or TRAIN_STATE_SHARDS=1) ===
+def get_controller_state_store():
+    """Return the Train Controller's per-train state store, or None.
+
+    Only used when TRAIN_STATE_SHM=1 (shared memory) or TRAIN_STATE_SHARDS=1
+    (one file per train); otherwise the Train Model keeps reading and writing
+    train_states.json.
+    """
+    if (os.environ.get("TRAIN_STATE_SHM", "0") != "1"
+            and os.environ.get("TRAIN_STATE_SHARDS", "0") != "1"):
+        return None
+    controller_dir = os.path.join(PARENT_DIR, "train_controller")
+    if controller_dir not in sys.path:
+        sys.path.append(controller_dir)
+    try:
+        from api.train_controller_api import get_state_store
+        return get_state_store()
+    except Exception as e:
+        print(f"[WARNING] Controller state store unavailable, using {TRAIN_STATES_FILE}: {e}")
+        return None
+
+
+# === Journaled train_data.json (TRAIN_DATA_JOURNAL=1) ===
+USE_TRAIN_DATA_JOURNAL = os.environ.get("TRAIN_DATA_JOURNAL", "0") == "1"
+
+
+def get_journal(path):
+    """Return the patch journal for path if journaling applies to it, else None.
+
+    Only train_data.json is journaled: writers append per-train patches and
+    readers replay them instead of re-serializing the whole multi-train file.
+    """
+    if not USE_TRAIN_DATA_JOURNAL:
+        return None
+    if os.path.abspath(path) != os.path.abspath(TRAIN_DATA_FILE):
+        return None
+    from train_data_journal import get_train_data_journal
+    return get_train_data_journal(TRAIN_DATA_FILE)
+
 
 # === Safe IO ===
+def _load_json(path):
+    # Unchanged files come from the shared cache (one stat instead of a parse)
+    return thaw(read_json(path))
+
+
 def safe_read_json(path):
-    # Retry up to 3 times to handle race conditions
-    for attempt in range(3):
-        try:
-            with open(path, "r") as f:
-                data = json.load(f)
-                return data if isinstance(data, (dict, list)) else {}
-        except json.JSONDecodeError:
-            # Race condition - file was being written
-            if attempt < 2:
-                time.sleep(0.02)  # Wait 20ms before retry
-                continue
-            else:
-                print(f"[WARNING] Failed to read {path} after 3 attempts (race condition)")
-                return {}
-        except FileNotFoundError:
-            return {}
-        except Exception as e:
-            print(f"[WARNING] Unexpected error reading {path}: {e}")
-            return {}
+    bus = active_bus_for(path)
+    if bus is not None:
+        data = bus.read_path(path, {})
+        return data if isinstance(data, (dict, list)) else {}
+    journal = get_journal(path)
+    if journal is not None:
+        return journal.read()
+    try:
+        data = _load_json(path)
+        return data if isinstance(data, (dict, list)) else {}
+    except json.JSONDecodeError:
+        # Only possible for a file another program is rewriting in place
+        print(f"[WARNING] {path} is being rewritten; using empty data this cycle")
+        return {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[WARNING] Unexpected error reading {path}: {e}")
+        return {}
 
 
 def safe_write_json(path, data):
+    bus = active_bus_for(path)
+    if bus is not None:
+        bus.write_path(path, data)
+        return
+    journal = get_journal(path)
+    if journal is not None:
+        # Only the fields that changed since the last read are appended
+        journal.write_document(data)
+        return
+    _write_json_file(path, data)
+    publish_path(path)
+
+
+def _write_json_file(path, data):
     payload = json.dumps(data, indent=4)
     out_dir = os.path.dirname(os.path.abspath(path))
     if out_dir and not os.path.exists(out_dir):
         os.makedirs(out_dir, exist_ok=True)
-    
-    # For train_states.json, use direct write (Train Controller also uses direct write)
-    # Atomic writes cause too many PermissionErrors on Windows with multiple processes
-    if "train_states.json" in path:
-        with open(path, "w") as f:
-            f.write(payload)
-        return
-    
-    # For other files (train_data.json, etc), use atomic write with fallback
-    tmp = path + ".tmp"
-    for attempt in range(3):
-        try:
-            with open(tmp, "w") as f:
-                f.write(payload)
-            os.replace(tmp, path)
-            return
-        except PermissionError:
-            try:
-                if os.path.exists(tmp):
-                    os.remove(tmp)
-            except Exception:
-                pass
-            time.sleep(0.1 * (attempt + 1))
-        except Exception:
-            break
-    # Fallback to direct write
-    with open(path, "w") as f:
-        f.write(payload)
+
+    # A/B slots plus commit marker; works where os.replace contends
+    publish_file(path, payload)
 
 
 # === Train Data shape ===
@@ -95,15 +141,20 @@ DEFAULT_SPECS = {
 
 
 def ensure_train_data(path):
-    data = {}
-    if os.path.exists(path):
-        try:
-            with open(path, "r") as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except Exception:
-            data = {}
+    journal = get_journal(path)
+    if journal is not None:
+        data = journal.read()
+        specs = data.get("specs", {})
+        for k, v in DEFAULT_SPECS.items():
+            specs.setdefault(k, v)
+        data["specs"] = specs
+        data.setdefault("inputs", {})
+        data.setdefault("outputs", {})
+        journal.write_document(data)  # no-op unless defaults were missing
+        return data
+    data = safe_read_json(path)
+    if not isinstance(data, dict):
+        data = {}
     specs = data.get("specs", {})
     for k, v in DEFAULT_SPECS.items():
         specs.setdefault(k, v)
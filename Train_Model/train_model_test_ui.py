@@ -12,6 +12,21 @@ TRAIN_DATA_WATCH_MS = 1000  # refresh train list every 1s
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# Journaled train_data.json (see train_data_journal.py)
+if os.environ.get("TRAIN_DATA_JOURNAL", "0") == "1":
+    from train_data_journal import get_train_data_journal
+    train_data_journal = get_train_data_journal(TRAIN_DATA_FILE)
+else:
+    train_data_journal = None
+
+
+def read_train_data():
+    """Read train_data.json (replaying the journal when journaling is on)."""
+    if train_data_journal is not None:
+        return train_data_journal.read()
+    with open(TRAIN_DATA_FILE, "r") as f:
+        return json.load(f)
+
 DEFAULT_SPECS = {
     "length_ft": 66.0,
     "width_ft": 10.0,
@@ -142,8 +157,7 @@ class TrainModelTestUI(tk.Tk):
         try:
             if not os.path.exists(TRAIN_DATA_FILE):
                 return DEFAULT_SPECS.copy()
-            with open(TRAIN_DATA_FILE, "r") as f:
-                data = json.load(f)
+            data = read_train_data()
             if self.selected_train_id is not None:
                 key = f"train_{self.selected_train_id}"
                 specs = (data.get(key, {}) or {}).get("specs") or data.get("specs", {})
@@ -160,8 +174,7 @@ class TrainModelTestUI(tk.Tk):
         try:
             if self.selected_train_id is None or not os.path.exists(TRAIN_DATA_FILE):
                 return
-            with open(TRAIN_DATA_FILE, "r") as f:
-                data = json.load(f)
+            data = read_train_data()
             key = f"train_{self.selected_train_id}"
             section = data.get(key, {})
             inputs = section.get("inputs", {})
@@ -197,8 +210,7 @@ class TrainModelTestUI(tk.Tk):
         trains = []
         try:
             if os.path.exists(TRAIN_DATA_FILE):
-                with open(TRAIN_DATA_FILE, "r") as f:
-                    data = json.load(f)
+                data = read_train_data()
                 for k in sorted(data.keys()):
                     if k.startswith("train_"):
                         trains.append(k)
@@ -389,10 +401,9 @@ class TrainModelTestUI(tk.Tk):
     def write_jsons(self, inp, out, passengers_out):
         # Read existing train_data to preserve all sections
         existing_data = {}
-        if os.path.exists(TRAIN_DATA_FILE):
+        if os.path.exists(TRAIN_DATA_FILE) or train_data_journal is not None:
             try:
-                with open(TRAIN_DATA_FILE, "r") as f:
-                    existing_data = json.load(f)
+                existing_data = read_train_data()
             except:
                 pass
         
@@ -444,19 +455,23 @@ class TrainModelTestUI(tk.Tk):
         # Always update inputs for train_1 (Train Model generates outputs)
         train_data["train_1"]["inputs"] = train_1_inputs
         
-        try:
-            # Write atomically to avoid corruption
-            temp_file = TRAIN_DATA_FILE + ".tmp"
-            with open(temp_file, "w") as f:
-                json.dump(train_data, f, indent=4)
-            os.replace(temp_file, TRAIN_DATA_FILE)
-        except Exception as e:
-            print("train_data write error:", e)
+        if train_data_journal is not None:
+            # Append only what changed for this train
+            train_data_journal.write_document(train_data)
+        else:
             try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-            except:
-                pass
+                # Write atomically to avoid corruption
+                temp_file = TRAIN_DATA_FILE + ".tmp"
+                with open(temp_file, "w") as f:
+                    json.dump(train_data, f, indent=4)
+                os.replace(temp_file, TRAIN_DATA_FILE)
+            except Exception as e:
+                print("train_data write error:", e)
+                try:
+                    if os.path.exists(temp_file):
+                        os.remove(temp_file)
+                except:
+                    pass
         
         # If in remote mode, also send to server
         if self.server_url:
@@ -36,8 +36,16 @@ from train_model_core import (
     DEFAULT_SPECS,
     compute_passengers_disembarking,
     sync_wayside_to_train_data,
+    get_controller_state_store,
 )
 
+# Change notification (train_states.json / train_data.json writers publish);
+# train_model_core put the project root on sys.path
+from channel_notify import channel_for_path, current_generation, wait_for_any
+
+# Longest the file watcher blocks before re-checking the Track Model file
+WATCH_TIMEOUT_S = 1.0
+
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 # Remove the direct "import requests" and use dynamic import instead
@@ -62,6 +70,10 @@ class TrainModelUI(ttk.Frame):
         self.train_id = train_id
         self.server_url = server_url
         self.train_data_path = TRAIN_DATA_FILE
+        # Shared-memory controller state (None = use train_states.json)
+        self.state_store = (
+            get_controller_state_store() if train_id is not None else None
+        )
 
         style = ttk.Style(self)
         try:
@@ -86,6 +98,15 @@ class TrainModelUI(ttk.Frame):
         self._last_beacon_inputs = {}
         self._stop_event = threading.Event()
         self._last_mtimes = {"track": 0.0, "ctrl": 0.0, "train_data": 0.0}
+        # Held while a cycle reads/writes the shared files so the watcher can
+        # tell this UI's own writes apart from external changes
+        self._cycle_lock = threading.Lock()
+        self._watch_channels = []
+        for p in (TRAIN_STATES_FILE, self.train_data_path):
+            channel = channel_for_path(p)
+            if channel is not None:
+                self._watch_channels.append(channel)
+        self._seen_gens = self._current_generations()
         threading.Thread(target=self._watch_files, daemon=True).start()
 
         # TrainModelUI layout: 2 rows
@@ -240,7 +261,11 @@ class TrainModelUI(ttk.Frame):
             "brake_failure": "train_model_brake_failure",
             "signal_failure": "train_model_signal_failure",
         }
-        if flag_name == "emergency_brake":
+        if flag_name == "emergency_brake" and self.state_store is not None:
+            current = bool(self.state_store.read_field(self.train_id, flag_name))
+            new_val = not current
+            self.state_store.write(self.train_id, {flag_name: new_val})
+        elif flag_name == "emergency_brake":
             all_states = safe_read_json(TRAIN_STATES_FILE)
             if self.train_id is None:
                 current = bool(all_states.get(flag_name, False))
@@ -298,6 +323,9 @@ class TrainModelUI(ttk.Frame):
     # === Controller state IO ===
     def get_train_state(self):
         """Read Train Controller outputs from train_states.json"""
+        if self.state_store is not None:
+            _, outputs = self.state_store.read_sections(self.train_id)
+            return outputs or {}
         all_states = safe_read_json(TRAIN_STATES_FILE)
         if self.train_id is None:
             # Legacy mode: read from outputs section at root
@@ -329,6 +357,11 @@ class TrainModelUI(ttk.Frame):
                 print(f"[Train Model] Error updating state on server: {e}")
             return
 
+        # Shared-memory mode: write inputs in place
+        if self.state_store is not None:
+            self.state_store.write(self.train_id, updates)
+            return
+
         # Local mode: write to file (inputs section)
         all_states = safe_read_json(TRAIN_STATES_FILE)
         
@@ -434,6 +467,15 @@ class TrainModelUI(ttk.Frame):
         self._run_cycle(schedule=True)
 
     def _run_cycle(self, schedule: bool):
+        with self._cycle_lock:
+            self._run_cycle_unlocked(schedule)
+            # Our own writes above should not wake the file watcher
+            self._seen_gens = self._current_generations()
+
+    def _current_generations(self):
+        return {c: current_generation(c) for c in self._watch_channels}
+
+    def _run_cycle_unlocked(self, schedule: bool):
         # Sync wayside controller data to train inputs first
         sync_wayside_to_train_data()
         
@@ -668,14 +710,33 @@ class TrainModelUI(ttk.Frame):
             pass
 
     def _watch_files(self):
+        """Re-run the cycle as soon as an input file changes.
+
+        train_states.json and train_data.json publish change notifications, so
+        this thread blocks in wait_for_any() instead of polling them. The Track
+        Model file does not, so its mtime is compared each time the wait
+        returns (at least every WATCH_TIMEOUT_S).
+        """
+        watched = set(self._watch_channels)
         paths = {
             "track": os.path.abspath(TRACK_INPUT_FILE),
             "ctrl": os.path.abspath(TRAIN_STATES_FILE),
             "train_data": os.path.abspath(self.train_data_path),
         }
+        paths = {key: p for key, p in paths.items()
+                 if channel_for_path(p) not in watched}
         while not self._stop_event.is_set():
             try:
                 changed = False
+                if watched:
+                    wait_for_any(watched, self._seen_gens, timeout=WATCH_TIMEOUT_S)
+                    with self._cycle_lock:
+                        gens = self._current_generations()
+                        if gens != self._seen_gens:
+                            self._seen_gens = gens
+                            changed = True
+                else:
+                    time.sleep(0.2)
                 for key, p in paths.items():
                     mt = os.path.getmtime(p) if os.path.exists(p) else 0.0
                     if mt != self._last_mtimes.get(key, 0.0):
@@ -688,8 +749,7 @@ class TrainModelUI(ttk.Frame):
                         # Widget destroyed, stop trying to update
                         break
             except Exception:
-                pass
-            time.sleep(0.2)
+                time.sleep(0.2)
 
     def on_close(self):
         self._stop_event.set()
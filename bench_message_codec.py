@@ -0,0 +1,60 @@
+"""Benchmark the message codecs on the shared channel files.
+
+Encodes and decodes the current contents of every channel that has a schema
+with each codec and reports time per message and bytes per tick (one tick =
+one write of every channel).
+
+Usage:
+    python bench_message_codec.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from channel_notify import CHANNELS
+from message_codec import SCHEMAS, decode, get_codec, load_file
+
+CODECS = ("json", "compact", "binary")
+
+
+def _time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run(iterations=2000):
+    results = []
+    for channel in SCHEMAS:
+        path = CHANNELS.get(channel)
+        if not path or not os.path.exists(path):
+            print(f"[skip] {channel}: {path} not found")
+            continue
+        doc = load_file(path)
+        for name in CODECS:
+            codec = get_codec(channel, name)
+            payload = codec.encode(doc)
+            if decode(payload) != doc:
+                print(f"[WARN] {channel}/{name}: round trip differs")
+            enc_us = _time_per_call(lambda: codec.encode(doc), iterations)
+            dec_us = _time_per_call(lambda: decode(payload), iterations)
+            results.append((channel, name, len(payload), enc_us, dec_us))
+
+    print(f"{'channel':<22}{'codec':<9}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for channel, name, size, enc_us, dec_us in results:
+        print(f"{channel:<22}{name:<9}{size:>8}{enc_us:>12.1f}{dec_us:>12.1f}")
+
+    print("\nPer tick (every channel written and read once):")
+    for name in CODECS:
+        rows = [r for r in results if r[1] == name]
+        print(f"  {name:<8} {sum(r[2] for r in rows):>7} bytes"
+              f"  {sum(r[3] + r[4] for r in rows):>9.1f} us")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
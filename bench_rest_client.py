@@ -0,0 +1,118 @@
+"""Round trips per controller cycle for the Raspberry Pi REST client.
+
+A cycle is what the HW UI does between two periodic updates outside a
+transaction: a few get_state() reads (button handlers, mode checks) and a
+few update_state() writes. The client runs CYCLES of them against the
+stdlib stand-in server from bench_state_backends (backed by a JSON file in
+a temporary directory), and the server counts the requests and TCP
+connections it handled:
+
+    baseline   a new connection per call, as the client used to do
+    pooled     keep-alive session only
+    +cache     plus the read-through cache (cache_ttl)
+    +coalesce  plus coalesced update_state() (coalesce_s)
+
+Usage:
+    python bench_rest_client.py [cycles]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from bench_state_backends import JsonFileBackend, requests, start_stand_in_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_controller", "api"))
+
+try:
+    from train_controller_api_client import train_controller_api_client
+except ImportError:
+    train_controller_api_client = None
+
+TRAIN_ID = 1
+CYCLE_S = 0.1
+
+
+class _BaselineClient:
+    """get_state()/update_state() the way the client made them before: one bare request each."""
+
+    def __init__(self, server_url):
+        self.state_endpoint = f"{server_url}/api/train/{TRAIN_ID}/state"
+
+    def get_state(self):
+        sections = requests.get(self.state_endpoint, timeout=5.0).json()
+        return {**sections['inputs'], **sections['outputs']}
+
+    def update_state(self, fields):
+        requests.post(self.state_endpoint, json=fields, timeout=5.0)
+
+    def close(self):
+        pass
+
+
+def _cycle(api, tick):
+    state = api.get_state()
+    api.update_state({'driver_velocity': float(tick)})
+    if not api.get_state().get('manual_mode', False):
+        api.update_state({'power_command': state['power_command'] + 1.0})
+    api.update_state({'service_brake': api.get_state()['power_command'] < 0.0})
+    api.get_state()
+
+
+def _make(variant, url):
+    if variant == "baseline":
+        return _BaselineClient(url)
+    return train_controller_api_client(
+        TRAIN_ID, url, stream=False,
+        cache_ttl=0.0 if variant == "pooled" else 0.1,
+        coalesce_s=0.05 if variant == "+coalesce" else 0.0)
+
+
+def _run(variant, cycles, tmp):
+    backend = JsonFileBackend(os.path.join(tmp, f"client_{variant}.json"))
+    backend.update(TRAIN_ID, {'power_command': 0.0})
+    counts = {}
+    server, url = start_stand_in_server(backend, counts)
+    api = _make(variant, url)
+    try:
+        counts.clear()
+        spent = 0.0
+        for tick in range(cycles):
+            start = time.perf_counter()
+            _cycle(api, tick)
+            elapsed = time.perf_counter() - start
+            spent += elapsed
+            time.sleep(max(0.0, CYCLE_S - elapsed))
+        if hasattr(api, "flush"):
+            api.flush()
+        assert backend.get(TRAIN_ID)['driver_velocity'] == float(cycles - 1), "lost update"
+    finally:
+        api.close()
+        server.shutdown()
+        server.server_close()
+        backend.close()
+    return {
+        "requests/cycle": counts.get("requests", 0) / cycles,
+        "connections/cycle": counts.get("connections", 0) / cycles,
+        "ms/cycle": spent / cycles * 1e3,
+    }
+
+
+def run(cycles=50):
+    if requests is None or train_controller_api_client is None:
+        print("skipped (requests is not installed)")
+        return {}
+    results = {}
+    tmp = tempfile.TemporaryDirectory()
+    print(f"{'client':<12}{'requests/cycle':>16}{'connections/cycle':>19}{'ms/cycle':>10}")
+    for variant in ("baseline", "pooled", "+cache", "+coalesce"):
+        r = results[variant] = _run(variant, cycles, tmp.name)
+        print(f"{variant:<12}{r['requests/cycle']:>16.2f}{r['connections/cycle']:>19.2f}"
+              f"{r['ms/cycle']:>10.2f}")
+    tmp.cleanup()
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,229 @@
+"""Compare the controller StateBackend implementations.
+
+One thread per train does get() + update() in a loop, like a controller
+tick, for 1, 10 and 100 trains against each backend:
+
+    json    train_states.json in a temporary directory
+    sqlite  a temporary WAL database
+    shm     a private shared-memory segment
+    http    the REST endpoints, served by a small stdlib stand-in for
+            train_api_server (same URLs, backed by a shm store) so the
+            benchmark runs without Flask
+
+Reports operations per second, p50/p99 latency per operation and the
+ticks that failed (e.g. a connection the http stand-in dropped). Nothing
+outside the temporary directory is touched.
+
+Usage:
+    python bench_state_backends.py [backend ...]
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", os.path.join(_tmp.name, "notify"))
+os.environ.setdefault("GROUP4_STATE_DIR", os.path.join(_tmp.name, "state"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_controller", "api"))
+
+from shared_state_store import SharedStateStore
+from state_backend import (BACKENDS, HttpBackend, JsonFileBackend, SqliteStateBackend,
+                           StoreBackend, requests)
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS
+
+TRAIN_COUNTS = (1, 10, 100)
+TOTAL_TICKS = 1000
+
+
+def _shm_store(tag):
+    return SharedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS,
+                            name=f"group4_bench_{os.getpid()}_{tag}", max_trains=128,
+                            lock_path=os.path.join(_tmp.name, f"{tag}.lock"))
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """GET/POST /api/train/<id>/state, GET /api/trains and /api/health over a backend."""
+
+    backend = None
+    counts = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, name):
+        if self.counts is not None:
+            with self.counts_lock:
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def setup(self):
+        super().setup()
+        self._count("connections")
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if getattr(self, "command", None):
+            self._count("requests")
+            self.command = None
+
+    def _send(self, status, doc):
+        body = json.dumps(doc).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sections(self, state):
+        inputs, outputs = self.backend._split(state)
+        return {"inputs": inputs, "outputs": outputs}
+
+    def do_GET(self):
+        match = re.fullmatch(r"/api/train/(\d+)/state", self.path)
+        if match:
+            state = self.backend.get(int(match.group(1)))
+            if state is None:
+                self._send(404, {"error": "not found"})
+            else:
+                self._send(200, self._sections(state))
+        elif self.path == "/api/health":
+            self._send(200, {"status": "ok"})
+        elif self.path == "/api/trains":
+            self._send(200, {f"train_{tid}": self._sections(state)
+                             for tid, state in self.backend.snapshot().items()})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        match = re.fullmatch(r"/api/train/(\d+)/state", self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        updates = json.loads(self.rfile.read(length) or b"{}")
+        if not match:
+            self._send(404, {"error": "not found"})
+            return
+        self.backend.update(int(match.group(1)), updates)
+        self._send(200, {"message": "State updated"})
+
+
+class _StandInServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog for 100 controllers connecting at once."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_stand_in_server(backend, counts=None):
+    """Serve backend on a free localhost port; returns (server, url).
+
+    If counts is a dict, its "connections" and "requests" entries count
+    what the server handled.
+    """
+    handler = type("Handler", (_StandInHandler,), {"backend": backend, "counts": counts,
+                                                   "counts_lock": threading.Lock()})
+    server = _StandInServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _make(kind, tag):
+    """(backend, cleanup) for one run."""
+    if kind == "json":
+        backend = JsonFileBackend(os.path.join(_tmp.name, f"{tag}.json"))
+        return backend, backend.close
+    if kind == "sqlite":
+        backend = SqliteStateBackend(os.path.join(_tmp.name, f"{tag}.db"))
+        return backend, backend.close
+    store = _shm_store(tag)
+    if kind == "shm":
+        backend = StoreBackend(store)
+    else:
+        server, url = start_stand_in_server(StoreBackend(store))
+        backend = HttpBackend(url)
+
+    def cleanup():
+        backend.close()
+        if kind == "http":
+            server.shutdown()
+            server.server_close()
+        store.close()
+        store.unlink()
+    return backend, cleanup
+
+
+def _run(backend, trains):
+    ticks = max(10, TOTAL_TICKS // trains)
+    for train_id in range(1, trains + 1):
+        backend.update(train_id, {'kp': 10.0, 'ki': 0.5})
+    latencies = [[] for _ in range(trains)]
+    failures = [0] * trains
+    barrier = threading.Barrier(trains + 1)
+
+    def loop(i):
+        train_id = i + 1
+        barrier.wait()
+        for tick in range(ticks):
+            start = time.perf_counter()
+            try:
+                state = backend.get(train_id)
+                middle = time.perf_counter()
+                backend.update(train_id, {'power_command': state['power_command'] + 1.0,
+                                          'driver_velocity': float(tick)})
+            except OSError:
+                # Connection refused/reset or timed out (requests' errors are OSErrors)
+                failures[i] += 1
+                continue
+            end = time.perf_counter()
+            latencies[i].extend((middle - start, end - middle))
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(trains)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    for i, failed in enumerate(failures):
+        # A failed update may or may not have been applied, so only trains
+        # without failures have a known final value
+        if not failed:
+            assert backend.get(i + 1)['power_command'] == float(ticks), "lost update"
+    flat = sorted(l for per in latencies for l in per)
+    if not flat:
+        return {"ops/s": 0.0, "p50 ms": float("nan"), "p99 ms": float("nan"),
+                "failed": sum(failures)}
+    return {
+        "ops/s": len(flat) / elapsed,
+        "p50 ms": flat[len(flat) // 2] * 1e3,
+        "p99 ms": flat[int(len(flat) * 0.99)] * 1e3,
+        "failed": sum(failures),
+    }
+
+
+def run(kinds=BACKENDS):
+    results = {}
+    print(f"{'backend':<8}{'trains':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'failed':>8}")
+    for kind in kinds:
+        if kind == "http" and requests is None:
+            print(f"{kind:<8}  skipped (requests is not installed)")
+            continue
+        for trains in TRAIN_COUNTS:
+            backend, cleanup = _make(kind, f"{kind}{trains}")
+            try:
+                r = results[(kind, trains)] = _run(backend, trains)
+            finally:
+                cleanup()
+            print(f"{kind:<8}{trains:>8}{r['ops/s']:>10.0f}{r['p50 ms']:>10.2f}"
+                  f"{r['p99 ms']:>10.2f}{r['failed']:>8}")
+    return results
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:] or BACKENDS)
@@ -0,0 +1,93 @@
+"""Benchmark train_controller_api state access with many concurrent controllers.
+
+Runs N controller threads (default 50), one per train, each doing
+get_state() + save_state() in a loop like a controller tick, once with the
+single train_states.json file (one module-wide lock, every save rewrites all
+trains) and once with the sharded store (one file and stripe lock per
+train). Reports ticks/s and per-tick latency. Everything is written to a
+temporary directory; the repo's data files are not touched.
+
+Usage:
+    python bench_state_contention.py [controllers] [ticks per controller]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", os.path.join(_tmp.name, "notify"))
+os.environ.setdefault("GROUP4_STATE_DIR", os.path.join(_tmp.name, "state"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_controller", "api"))
+
+from sharded_state_store import ShardedStateStore
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS, train_controller_api
+
+
+def _controller(train_id, state_file, store):
+    """A train_controller_api bound to a temporary file or store."""
+    api = object.__new__(train_controller_api)
+    api.train_id = train_id
+    api.store = store
+    api.bus = None
+    api.state_file = state_file
+    api.default_inputs = DEFAULT_INPUTS.copy()
+    api.default_outputs = DEFAULT_OUTPUTS.copy()
+    api.train_states = {**api.default_inputs, **api.default_outputs}
+    api.save_state(api.train_states.copy())
+    return api
+
+
+def _run(apis, ticks):
+    latencies = [[] for _ in apis]
+    barrier = threading.Barrier(len(apis) + 1)
+
+    def loop(i, api):
+        barrier.wait()
+        for tick in range(ticks):
+            start = time.perf_counter()
+            state = api.get_state()
+            api.save_state({'power_command': state['power_command'] + 1.0,
+                            'driver_velocity': float(tick)})
+            latencies[i].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=loop, args=(i, api)) for i, api in enumerate(apis)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    flat = sorted(l for per in latencies for l in per)
+    return {
+        "ticks/s": len(flat) / elapsed,
+        "p50 ms": flat[len(flat) // 2] * 1e3,
+        "p99 ms": flat[int(len(flat) * 0.99)] * 1e3,
+    }
+
+
+def run(controllers=50, ticks=40):
+    single_file = os.path.join(_tmp.name, "train_states.json")
+    single = [_controller(i, single_file, None) for i in range(1, controllers + 1)]
+    store = ShardedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS,
+                              directory=os.path.join(_tmp.name, "train_states.d"))
+    sharded = [_controller(i, single_file, store) for i in range(1, controllers + 1)]
+
+    results = {"single file": _run(single, ticks), "sharded": _run(sharded, ticks)}
+    for api in sharded:
+        assert api.get_state()['power_command'] == float(ticks), "lost update"
+
+    print(f"{controllers} controllers x {ticks} ticks (get_state + save_state)")
+    print(f"{'layout':<14}{'ticks/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['ticks/s']:>10.0f}{r['p50 ms']:>10.2f}{r['p99 ms']:>10.2f}")
+    store.close()
+    return results
+
+
+if __name__ == "__main__":
+    run(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,100 @@
+"""Benchmark memory allocated by state reads in the controller loop.
+
+Replays the reads of one train_controller_hw_ui periodic_update tick (five
+get_state() calls plus read_current_adc()'s state.copy() and update) against
+a temporary train_states.json, once with the previous get_state() (parse the
+file, copy the defaults, merge inputs and outputs into a new dict) and once
+with the copy-on-write StateView. tracemalloc reports the peak bytes
+allocated during a tick.
+
+Usage:
+    python bench_state_views.py [ticks]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", os.path.join(_tmp.name, "notify"))
+os.environ.setdefault("GROUP4_STATE_DIR", os.path.join(_tmp.name, "state"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_controller", "api"))
+
+from state_transaction import TransactionScope
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS, train_controller_api
+
+
+class _DictCopyApi(train_controller_api):
+    """get_state() as it was before StateView: a fresh merged dict per call."""
+
+    def get_state(self):
+        section = self._load_states()[f"train_{self.train_id}"]
+        result = self.train_states.copy()
+        result.update(section['inputs'])
+        result.update(section['outputs'])
+        return result
+
+
+def _controller(cls, state_file):
+    api = object.__new__(cls)
+    api.train_id = 1
+    api.store = None
+    api.bus = None
+    api.state_file = state_file
+    api.default_inputs = DEFAULT_INPUTS.copy()
+    api.default_outputs = DEFAULT_OUTPUTS.copy()
+    api.train_states = {**api.default_inputs, **api.default_outputs}
+    api._transactions = TransactionScope()
+    api.save_state({**api.train_states, 'kp': 10.0, 'ki': 0.5, 'driver_velocity': 20.0})
+    return api
+
+
+def _tick(api):
+    """The state reads of one periodic_update, including read_current_adc."""
+    power = 0.0
+    for _ in range(5):
+        state = api.get_state()
+        power += state['driver_velocity'] - state['train_velocity']
+    new_state = state.copy()
+    new_state.update({'driver_velocity': 25.0, 'set_temperature': 68.0})
+    return power + new_state['driver_velocity'] * (new_state['kp'] or 0.0)
+
+
+def _measure(api, ticks):
+    _tick(api)  # warm caches
+    tracemalloc.start()
+    peaks = []
+    start = time.perf_counter()
+    for _ in range(ticks):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        _tick(api)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    peaks.sort()
+    return {
+        "peak B/tick": sum(peaks) / len(peaks),
+        "max B/tick": peaks[-1],
+        "ticks/s": ticks / elapsed,
+    }
+
+
+def run(ticks=500):
+    state_file = os.path.join(_tmp.name, "train_states.json")
+    results = {
+        "dict copies": _measure(_controller(_DictCopyApi, state_file), ticks),
+        "state views": _measure(_controller(train_controller_api, state_file), ticks),
+    }
+    print(f"{ticks} controller ticks (5 x get_state + read_current_adc copy), tracemalloc on")
+    print(f"{'get_state':<14}{'peak B/tick':>14}{'max B/tick':>14}{'ticks/s':>10}")
+    for name, r in results.items():
+        print(f"{name:<14}{r['peak B/tick']:>14.0f}{r['max B/tick']:>14}{r['ticks/s']:>10.0f}")
+    return results
+
+
+if __name__ == "__main__":
+    run(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,418 @@
+"""Local pub/sub message broker over Unix domain sockets.
+
+For multi-process runs on one machine. Instead of every module doing a
+read-modify-write cycle on the same shared JSON file, each module publishes
+the records it changed to a topic and receives everybody else's changes:
+
+    topic                   channel (file)          record = entry of
+    ctc.trains              ctc_track_controller    doc["Trains"]
+    wayside.train_commands  wayside_to_train        top-level "Train N"
+    track.arrays            track_to_wayside        top-level "G-..." arrays
+    train.telemetry         train_data              top-level "train_N", specs, ...
+
+The broker keeps the last value of every record (last-value cache), so a
+subscriber that connects late receives the current state of the topic
+immediately. Publishers only send records that differ from their local
+mirror, and a record set to None is deleted.
+
+Wire format: frames of a u32 length followed by compact JSON:
+    {"op": "sub", "topics": [...]}                      client -> broker
+    {"op": "pub", "topic": t, "records": {key: value}}  both directions
+    {"op": "snapshot", "topic": t, "records": {...}}    broker -> client
+
+Modules use the broker through SimBus (GROUP4_BUS=broker): BrokerTransport
+maps channel documents to topic records, so the CTC, both wayside
+controllers and the Train Model need no broker-specific code.
+
+Usage:
+    python broker.py [socket_path]          # run the broker
+    GROUP4_BUS=broker python <module>       # modules connect to it
+"""
+
+import errno
+import json
+import os
+import selectors
+import socket
+import struct
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from channel_notify import CHANNELS, publish_change, use_process_local
+from json_cache import thaw
+from sim_bus import TRANSPORTS, FileTransport
+
+BROKER_SOCKET = os.environ.get(
+    "GROUP4_BROKER_SOCKET", os.path.join(tempfile.gettempdir(), "group4_broker.sock")
+)
+MAX_BUFFERED = 16 * 1024 * 1024  # drop subscribers that fall this far behind
+
+# topic -> (channel, container key holding the records or None for top level)
+TOPICS = {
+    "ctc.trains": ("ctc_track_controller", "Trains"),
+    "wayside.train_commands": ("wayside_to_train", None),
+    "track.arrays": ("track_to_wayside", None),
+    "train.telemetry": ("train_data", None),
+}
+CHANNEL_TOPICS = {channel: topic for topic, (channel, _) in TOPICS.items()}
+
+_LENGTH = struct.Struct("<I")
+
+
+def _frame(message) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    return _LENGTH.pack(len(body)) + body
+
+
+def _split_frames(buf: bytearray):
+    """Pop every complete frame from buf and return the decoded messages."""
+    messages = []
+    while len(buf) >= _LENGTH.size:
+        (length,) = _LENGTH.unpack_from(buf, 0)
+        end = _LENGTH.size + length
+        if len(buf) < end:
+            break
+        messages.append(json.loads(bytes(buf[_LENGTH.size:end])))
+        del buf[:end]
+    return messages
+
+
+def _apply(records: dict, changes: dict) -> None:
+    for key, value in changes.items():
+        if value is None:
+            records.pop(key, None)
+        else:
+            records[key] = value
+
+
+# ----------------------------------------------------------------------
+# Broker
+# ----------------------------------------------------------------------
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.topics = set()
+
+
+class MessageBroker:
+    """Single-threaded selectors loop serving all clients."""
+
+    def __init__(self, path: str = BROKER_SOCKET):
+        self.path = path
+        self.cache = {topic: {} for topic in TOPICS}
+        self._sel = selectors.DefaultSelector()
+        self._server = None
+        self._running = False
+
+    def start(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._sel.register(self._server, selectors.EVENT_READ, None)
+        self._running = True
+
+    def serve_forever(self, poll_s: float = 0.5) -> None:
+        if self._server is None:
+            self.start()
+        while self._running:
+            for key, events in self._sel.select(timeout=poll_s):
+                if key.data is None:
+                    self._accept()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(conn)
+                if events & selectors.EVENT_WRITE and conn.sock.fileno() != -1:
+                    self._flush(conn)
+
+    def stop(self) -> None:
+        self._running = False
+
+    def close(self) -> None:
+        self._running = False
+        for key in list(self._sel.get_map().values()):
+            key.fileobj.close()
+        self._sel.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _accept(self):
+        sock, _ = self._server.accept()
+        sock.setblocking(False)
+        self._sel.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _drop(self, conn):
+        try:
+            self._sel.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(conn)
+            return
+        conn.inbuf += data
+        try:
+            messages = _split_frames(conn.inbuf)
+        except ValueError as e:
+            print(f"[Broker] Dropping client with a malformed frame: {e}")
+            self._drop(conn)
+            return
+        for message in messages:
+            self._handle(conn, message)
+
+    def _handle(self, conn, message):
+        op = message.get("op")
+        if op == "sub":
+            for topic in message.get("topics", []):
+                conn.topics.add(topic)
+                records = self.cache.setdefault(topic, {})
+                self._send(conn, {"op": "snapshot", "topic": topic, "records": records})
+        elif op == "pub":
+            topic = message.get("topic")
+            records = self.cache.setdefault(topic, {})
+            changes = {k: v for k, v in message.get("records", {}).items()
+                       if records.get(k) != v}
+            if not changes:
+                return
+            _apply(records, changes)
+            frame = _frame({"op": "pub", "topic": topic, "records": changes})
+            for key in list(self._sel.get_map().values()):
+                other = key.data
+                if other is not None and other is not conn and topic in other.topics:
+                    self._send(other, frame)
+
+    def _send(self, conn, message):
+        conn.outbuf += message if isinstance(message, bytes) else _frame(message)
+        if len(conn.outbuf) > MAX_BUFFERED:
+            print("[Broker] Dropping a subscriber that stopped reading")
+            self._drop(conn)
+            return
+        self._flush(conn)
+
+    def _flush(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+            del conn.outbuf[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._drop(conn)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbuf else 0)
+        try:
+            self._sel.modify(conn.sock, events, conn)
+        except (KeyError, ValueError):
+            pass
+
+
+# ----------------------------------------------------------------------
+# Client
+# ----------------------------------------------------------------------
+class BrokerClient:
+    """Connection to the broker with a local mirror of each subscribed topic."""
+
+    def __init__(self, path: str = BROKER_SOCKET, on_update=None, timeout: float = 2.0):
+        """Connect to the broker.
+
+        Args:
+            path: Broker socket path
+            on_update: Called as on_update(topic, changed_keys) from the reader
+                thread after the mirror was updated
+            timeout: Seconds to wait for the connection and for snapshots
+        """
+        self.timeout = timeout
+        self.on_update = on_update
+        self._mirror = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.sock.settimeout(None)
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _send(self, message):
+        with self._send_lock:
+            self.sock.sendall(_frame(message))
+
+    def _read_loop(self):
+        buf = bytearray()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                return
+            buf += data
+            for message in _split_frames(buf):
+                topic = message.get("topic")
+                records = message.get("records", {})
+                with self._lock:
+                    if message.get("op") == "snapshot":
+                        self._mirror[topic] = records
+                    else:
+                        _apply(self._mirror.setdefault(topic, {}), records)
+                    ready = self._snapshots.get(topic)
+                if ready is not None:
+                    ready.set()
+                if self.on_update is not None and records:
+                    self.on_update(topic, list(records))
+
+    def subscribe(self, topics) -> None:
+        """Subscribe and wait until the broker's last values have arrived."""
+        topics = list(topics)
+        with self._lock:
+            events = [self._snapshots.setdefault(t, threading.Event()) for t in topics]
+        self._send({"op": "sub", "topics": topics})
+        for topic, event in zip(topics, events):
+            if not event.wait(self.timeout):
+                raise TimeoutError(f"no snapshot for {topic} from the broker")
+
+    def view(self, topic: str) -> dict:
+        """Mutable copy of the current records of a topic."""
+        with self._lock:
+            return thaw(self._mirror.get(topic, {}))
+
+    def records(self, topic: str) -> dict:
+        """Current records of a topic, shared with the mirror (read-only)."""
+        with self._lock:
+            return dict(self._mirror.get(topic, {}))
+
+    def publish(self, topic: str, records: dict, deleted=(), base: dict = None) -> int:
+        """Publish the records that differ from base (and the deleted keys).
+
+        Args:
+            base: Records the caller started from, e.g. records() at read
+                time (default: the mirror). Only records changed since then
+                are sent, so updates other clients made meanwhile survive,
+                and keys of base missing from records are deleted.
+
+        Returns:
+            int: Number of records sent
+        """
+        with self._lock:
+            mirror = self._mirror.setdefault(topic, {})
+            if base is None:
+                base = mirror
+            else:
+                deleted = list(base)
+            changes = {k: thaw(v) for k, v in records.items() if base.get(k) != v}
+            changes.update({k: None for k in deleted if k in mirror and k not in records})
+            _apply(mirror, changes)
+        if changes:
+            self._send({"op": "pub", "topic": topic, "records": changes})
+        return len(changes)
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# ----------------------------------------------------------------------
+# SimBus transport
+# ----------------------------------------------------------------------
+class BrokerTransport:
+    """SimBus transport that exchanges brokered channels as topic records.
+
+    Channels without a topic (train_states) stay on the file transport.
+    Writes publish only changed records, so two modules updating different
+    trains of the same document no longer overwrite each other.
+    """
+
+    name = "broker"
+
+    def __init__(self, path: str = BROKER_SOCKET, client: BrokerClient = None,
+                 seed_from_files: bool = True):
+        self._files = FileTransport()
+        self._read = threading.local()
+        self._lock = threading.RLock()
+        # Every process hears about changes from the broker, so wake-ups stay local
+        use_process_local(channels=CHANNEL_TOPICS)
+        self.client = client or BrokerClient(path)
+        self.client.on_update = lambda topic, keys: publish_change(TOPICS[topic][0])
+        self.client.subscribe(TOPICS)
+        if seed_from_files:
+            self._seed()
+
+    def _seed(self):
+        """Publish the files' contents for topics nobody has published yet."""
+        for topic, (channel, _) in TOPICS.items():
+            if self.client.view(topic) or not os.path.exists(CHANNELS[channel]):
+                continue
+            try:
+                self.write(channel, self._files.read(channel))
+            except (OSError, ValueError) as e:
+                print(f"[Broker] Could not seed {topic} from {CHANNELS[channel]}: {e}")
+
+    def read(self, channel):
+        topic = CHANNEL_TOPICS.get(channel)
+        if topic is None:
+            return self._files.read(channel)
+        container = TOPICS[topic][1]
+        base = self.client.records(topic)
+        if not base and container is None:
+            raise FileNotFoundError(errno.ENOENT, "no message on topic", topic)
+        # Remember what this thread saw so a later write sends only its own
+        # changes: records other clients updated (or added) since the read
+        # are left alone, and only records dropped from the document are deleted
+        seen = getattr(self._read, "records", None)
+        if seen is None:
+            seen = self._read.records = {}
+        seen[channel] = base
+        records = thaw(base)
+        return {container: records} if container else records
+
+    def write(self, channel, doc):
+        topic = CHANNEL_TOPICS.get(channel)
+        if topic is None:
+            return self._files.write(channel, doc)
+        container = TOPICS[topic][1]
+        records = (doc.get(container) or {}) if container else doc
+        base = getattr(self._read, "records", {}).pop(channel, None)
+        self.client.publish(topic, records, base=base)
+        return publish_change(channel)
+
+    @contextmanager
+    def lock(self, channel):
+        with self._lock:
+            yield
+
+
+TRANSPORTS["broker"] = BrokerTransport
+
+
+if __name__ == "__main__":
+    broker = MessageBroker(sys.argv[1] if len(sys.argv) > 1 else BROKER_SOCKET)
+    broker.start()
+    print(f"[Broker] Listening on {broker.path} (topics: {', '.join(TOPICS)})")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
@@ -0,0 +1,396 @@
+"""Generation counters and change notification for the shared JSON channels.
+
+The modules exchange state through a handful of JSON files ("channels").
+Instead of polling them, writers call publish_change() after each write. That
+bumps the channel's generation counter and wakes every waiter. Consumers block
+in wait_for_change(channel, after_gen, timeout) and return as soon as the
+generation moves past after_gen, so latency no longer depends on a poll period
+and idle consumers use no CPU.
+
+Generation counters live in small files under NOTIFY_DIR (an 8-byte counter
+updated under flock). Each waiter binds a Unix datagram socket named
+"<channel>@<pid>-<n>.sock" in the same directory, and publishers send a
+one-byte datagram to every socket for that channel. Where Unix datagram
+sockets are unavailable (Windows), waiters poll the counter every
+FALLBACK_POLL_S instead.
+
+When every module runs in one process (sim_bus.MemoryTransport),
+use_process_local() keeps the counters in memory and wakes waiters with a
+condition variable, so no files or sockets are touched at all. It can also be
+limited to some channels, e.g. the ones a message broker already delivers to
+every process (broker.BrokerTransport).
+
+Usage:
+    gen = current_generation("ctc_track_controller")
+    while not done():
+        gen = wait_for_change("ctc_track_controller", gen, timeout=1.0)
+"""
+
+import atexit
+import itertools
+import os
+import select
+import socket
+import struct
+import tempfile
+import threading
+import time
+import weakref
+from typing import Dict, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Shared channels (name -> JSON file)
+CHANNELS = {
+    "ctc_track_controller": os.path.join(PROJECT_ROOT, "ctc_track_controller.json"),
+    "wayside_to_train": os.path.join(PROJECT_ROOT, "track_controller", "New_SW_Code", "wayside_to_train.json"),
+    "track_to_wayside": os.path.join(PROJECT_ROOT, "track_controller", "New_SW_Code", "track_to_wayside.json"),
+    "train_states": os.path.join(PROJECT_ROOT, "train_controller", "data", "train_states.json"),
+    "train_data": os.path.join(PROJECT_ROOT, "Train_Model", "train_data.json"),
+}
+
+NOTIFY_DIR = os.environ.get(
+    "GROUP4_NOTIFY_DIR", os.path.join(tempfile.gettempdir(), "group4_sim_notify")
+)
+FALLBACK_POLL_S = 0.05
+
+_HAS_UNIX_DGRAM = hasattr(socket, "AF_UNIX") and os.name == "posix"
+_COUNTER = struct.Struct("<Q")
+
+_lock = threading.Lock()
+_gen_fds: Dict[str, int] = {}
+_paths = {os.path.normcase(os.path.abspath(p)): name for name, p in CHANNELS.items()}
+_waiter_ids = itertools.count(1)
+_local = threading.local()
+_send_sock = None
+
+# Process-local generations (None = shared counters under NOTIFY_DIR)
+_local_gens: Optional[Dict[str, int]] = None
+_local_only: Optional[set] = None  # channels kept process-local (None = all)
+_local_cond = threading.Condition()
+
+
+def _ensure_dir() -> None:
+    os.makedirs(NOTIFY_DIR, exist_ok=True)
+
+
+def register_channel(name: str, path: str) -> None:
+    """Register an additional channel backed by path."""
+    CHANNELS[name] = path
+    _paths[os.path.normcase(os.path.abspath(path))] = name
+
+
+def channel_for_path(path: str) -> Optional[str]:
+    """Return the channel name for a JSON file path, or None."""
+    return _paths.get(os.path.normcase(os.path.abspath(path)))
+
+
+def use_process_local(enabled: bool = True, channels: Optional[Iterable[str]] = None) -> None:
+    """Keep generations and wake-ups inside this process (or go back to shared ones).
+
+    Args:
+        enabled: False switches every channel back to the shared counters
+        channels: Only make these channels process-local (None = all channels)
+    """
+    global _local_gens, _local_only
+    with _local_cond:
+        if not enabled:
+            _local_gens = _local_only = None
+        elif _local_gens is None:
+            _local_gens = {}
+            _local_only = None if channels is None else set(channels)
+        elif channels is None:
+            _local_only = None
+        elif _local_only is not None:
+            _local_only.update(channels)
+        _local_cond.notify_all()
+
+
+def is_process_local(channel: Optional[str] = None) -> bool:
+    """True if channel (or any channel, when None) uses process-local generations."""
+    if _local_gens is None:
+        return False
+    return channel is None or _local_only is None or channel in _local_only
+
+
+# ----------------------------------------------------------------------
+# Generation counters
+# ----------------------------------------------------------------------
+def _gen_fd(channel: str) -> int:
+    fd = _gen_fds.get(channel)
+    if fd is None:
+        with _lock:
+            fd = _gen_fds.get(channel)
+            if fd is None:
+                _ensure_dir()
+                fd = os.open(os.path.join(NOTIFY_DIR, f"{channel}.gen"),
+                             os.O_RDWR | os.O_CREAT, 0o666)
+                _gen_fds[channel] = fd
+    return fd
+
+
+def _read_counter(fd: int) -> int:
+    if hasattr(os, "pread"):
+        raw = os.pread(fd, _COUNTER.size, 0)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        raw = os.read(fd, _COUNTER.size)
+    return _COUNTER.unpack(raw)[0] if len(raw) == _COUNTER.size else 0
+
+
+def current_generation(channel: str) -> int:
+    """Return the channel's current generation (0 if never published)."""
+    if is_process_local(channel):
+        return _local_gens.get(channel, 0)
+    return _read_counter(_gen_fd(channel))
+
+
+def publish_change(channel: str) -> int:
+    """Bump the channel generation and wake all waiters.
+
+    Returns:
+        int: The new generation number
+    """
+    if is_process_local(channel):
+        with _local_cond:
+            gen = _local_gens[channel] = _local_gens.get(channel, 0) + 1
+            _local_cond.notify_all()
+        return gen
+    fd = _gen_fd(channel)
+    with _lock:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            gen = _read_counter(fd) + 1
+            if hasattr(os, "pwrite"):
+                os.pwrite(fd, _COUNTER.pack(gen), 0)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, _COUNTER.pack(gen))
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    _notify_waiters(channel)
+    return gen
+
+
+def publish_path(path: str) -> Optional[int]:
+    """publish_change() for the channel backed by path (no-op for other files)."""
+    channel = channel_for_path(path)
+    if channel is None:
+        return None
+    try:
+        return publish_change(channel)
+    except OSError as e:
+        print(f"[Notify] Failed to publish change for {channel}: {e}")
+        return None
+
+
+# ----------------------------------------------------------------------
+# Waking waiters
+# ----------------------------------------------------------------------
+def _socket_listing():
+    """List waiter sockets.
+
+    Listed on every publish: a cache keyed on the directory's mtime misses
+    waiters that bind within the same timestamp tick on filesystems with
+    coarse timestamps, and those would sleep until their timeout.
+    """
+    try:
+        return [n for n in os.listdir(NOTIFY_DIR) if n.endswith(".sock")]
+    except FileNotFoundError:
+        return []
+
+
+def _notify_waiters(channel: str) -> None:
+    global _send_sock
+    if not _HAS_UNIX_DGRAM:
+        return
+    prefix = f"{channel}@"
+    targets = [n for n in _socket_listing() if n.startswith(prefix)]
+    if not targets:
+        return
+    with _lock:
+        if _send_sock is None:
+            _send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            _send_sock.setblocking(False)
+        sock = _send_sock
+    for name in targets:
+        path = os.path.join(NOTIFY_DIR, name)
+        try:
+            sock.sendto(b"!", path)
+        except BlockingIOError:
+            pass  # waiter already has wake-ups queued
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Waiter process is gone - remove its stale socket
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        except OSError:
+            pass
+
+
+def _close_waiter(sock, path) -> None:
+    try:
+        sock.close()
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class _Waiter:
+    """A bound datagram socket that receives wake-ups for one channel.
+
+    Waiters are kept per thread, so the socket is closed when its thread
+    exits (and the thread's waiters are collected) or at interpreter exit.
+    """
+
+    def __init__(self, channel: str):
+        _ensure_dir()
+        self.path = os.path.join(NOTIFY_DIR, f"{channel}@{os.getpid()}-{next(_waiter_ids)}.sock")
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        self._finalizer = weakref.finalize(self, _close_waiter, self.sock, self.path)
+
+    def drain(self) -> None:
+        try:
+            while self.sock.recv(64):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self) -> None:
+        self._finalizer()
+
+
+def _get_waiter(channel: str) -> Optional[_Waiter]:
+    if not _HAS_UNIX_DGRAM:
+        return None
+    waiters = getattr(_local, "waiters", None)
+    if waiters is None:
+        waiters = _local.waiters = {}
+    waiter = waiters.get(channel)
+    if waiter is None:
+        try:
+            waiter = waiters[channel] = _Waiter(channel)
+        except OSError as e:
+            print(f"[Notify] Falling back to polling for {channel}: {e}")
+            return None
+    return waiter
+
+
+@atexit.register
+def _cleanup() -> None:
+    for fd in _gen_fds.values():
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+# ----------------------------------------------------------------------
+# Waiting
+# ----------------------------------------------------------------------
+def wait_for_any(channels: Iterable[str], after_gens: Dict[str, int],
+                 timeout: Optional[float] = None) -> Dict[str, int]:
+    """Block until any channel's generation differs from after_gens.
+
+    Args:
+        channels: Channel names to watch
+        after_gens: Last generation seen per channel (missing = 0)
+        timeout: Seconds to wait at most (None = forever)
+
+    Returns:
+        dict: Current generation of every watched channel. On timeout the
+        result simply equals after_gens.
+    """
+    channels = list(channels)
+    shared = [c for c in channels if not is_process_local(c)]
+    if not shared:
+        return _wait_local(channels, after_gens, timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    # Process-local channels in a mixed wait are polled with the fallback period
+    waiters = [w for w in (_get_waiter(c) for c in shared) if w is not None]
+    polling = len(waiters) < len(channels)
+    while True:
+        for waiter in waiters:
+            waiter.drain()
+        gens = {c: current_generation(c) for c in channels}
+        if any(gens[c] != after_gens.get(c, 0) for c in channels):
+            return gens
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return gens
+        if polling:
+            time.sleep(FALLBACK_POLL_S if remaining is None else min(FALLBACK_POLL_S, remaining))
+        else:
+            select.select([w.sock for w in waiters], [], [], remaining)
+
+
+def _wait_local(channels, after_gens, timeout):
+    def changed():
+        return (not all(is_process_local(c) for c in channels)
+                or any(_local_gens.get(c, 0) != after_gens.get(c, 0) for c in channels))
+
+    with _local_cond:
+        _local_cond.wait_for(changed, timeout)
+    return {c: current_generation(c) for c in channels}
+
+
+def wait_for_change(channel: str, after_gen: int, timeout: Optional[float] = None) -> int:
+    """Block until the channel's generation differs from after_gen.
+
+    Returns:
+        int: The current generation (equal to after_gen on timeout)
+    """
+    return wait_for_any([channel], {channel: after_gen}, timeout)[channel]
+
+
+class ChangeTracker:
+    """Cheap "did this channel change since I last looked?" check.
+
+    Combines the channel generation with the file's stat signature, so writes
+    from processes that do not publish (e.g. the Track Model) are noticed too.
+    channel may be None to track an unregistered file by stat alone.
+    """
+
+    def __init__(self, channel: Optional[str], path: Optional[str] = None):
+        self.channel = channel
+        self.path = path or CHANNELS.get(channel)
+        self._token = None
+
+    def changed(self) -> bool:
+        """Return True if the channel changed since the previous call."""
+        gen = None
+        if self.channel is not None:
+            try:
+                gen = current_generation(self.channel)
+            except OSError:
+                pass
+        try:
+            st = os.stat(self.path)
+            sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except (OSError, TypeError):
+            sig = None
+        token = (gen, sig)
+        if token == self._token:
+            return False
+        self._token = token
+        return True
+
+    def reset(self) -> None:
+        """Force the next changed() call to return True."""
+        self._token = None
@@ -38,6 +38,13 @@ def run_wayside_sw_ui_2():
     ui2.mainloop()
 
 def main():
+    # --in-memory: exchange all channel data through an in-process SimBus
+    # instead of the JSON files (nothing is written to disk)
+    if "--in-memory" in sys.argv:
+        from sim_bus import set_bus
+        set_bus("memory")
+        print("[SimBus] Running with in-memory channels")
+
     # Start CTC UI in thread
     ctc_thread = threading.Thread(target=run_ctc_ui)
     ctc_thread.daemon = True
@@ -0,0 +1,17 @@
+"""pytest configuration shared by every test in the tree.
+
+Point the cross-process notification and published-state directories at
+private temporary directories before any test module is imported, so test
+runs never write generation counters, waiter sockets or A/B slot files into
+the live simulation's directories (or read another concurrent run's).
+"""
+
+import os
+import tempfile
+
+_notify_dir = tempfile.TemporaryDirectory(prefix="group4_test_notify_")
+os.environ["GROUP4_NOTIFY_DIR"] = _notify_dir.name
+
+# Same for the A/B slot and commit marker files of double_buffer
+_state_dir = tempfile.TemporaryDirectory(prefix="group4_test_state_")
+os.environ["GROUP4_STATE_DIR"] = _state_dir.name
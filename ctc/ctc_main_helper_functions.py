@@ -2,6 +2,8 @@ import json, os, time
 from watchdog.observers import Observer 
 from watchdog.events import FileSystemEventHandler 
 
+from message_codec import load_file
+
 class JSONFileWatcher(FileSystemEventHandler): 
     def __init__(self,path,callback): 
         self.path = os.path.abspath(path)
@@ -10,20 +12,15 @@ class JSONFileWatcher(FileSystemEventHandler):
         self.last_mtime = 0
         self.load_json() 
 
-    def load_json(self, retries=5, delay=0.2):
-        for _ in range(retries): 
-            try: 
-                if not os.path.exists(self.path):
-                    raise FileNotFoundError(self.path)
-                if os.path.getsize(self.path) == 0:
-                    raise ValueError("File is Empty")
-                with open(self.path, "r") as f: 
-                    data = json.load(f)
-                self.last_data = data
-                return data 
-            except (json.JSONDecodeError,ValueError):
-                time.sleep(delay)
-        return None 
+    def load_json(self):
+        # Double-buffered files are always complete; a half-written plain
+        # file is skipped and picked up by the next modified event
+        try: 
+            data = load_file(self.path)
+            self.last_data = data
+            return data 
+        except (OSError, ValueError):
+            return None 
     
     def on_modified(self,event): 
         if os.path.abspath(event.src_path) == self.path: 
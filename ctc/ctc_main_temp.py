@@ -1,44 +1,45 @@
 
 import json, time, os
 from datetime import datetime
-from .ctc_main_helper_functions import JSONFileWatcher
-from watchdog.observers import Observer
 from .track.map import route_lookup_via_station, route_lookup_via_id, route_info
+from channel_notify import (ChangeTracker, channel_for_path, current_generation,
+                            publish_path, wait_for_change)
+from double_buffer import load as load_published, publish as publish_file
+from message_codec import decode
+from sim_bus import active_bus_for
 
-def safe_json_read(file_path, max_retries=3, delay=0.1):
-    """Safely read JSON with retry logic to handle race conditions."""
-    for attempt in range(max_retries):
-        try:
-            with open(file_path, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError as e:
-            if attempt < max_retries - 1:
-                time.sleep(delay * (2 ** attempt))  # exponential backoff
-            else:
-                print(f"[CTC] Failed to read {file_path} after {max_retries} attempts: {e}")
-                return None
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(delay * (2 ** attempt))
-            else:
-                print(f"[CTC] Error reading {file_path}: {e}")
-                return None
-    return None
+def safe_json_read(file_path):
+    """Read a shared JSON file without sleeping on a concurrent write.
 
-def safe_json_write(file_path, data, max_retries=3, delay=0.1):
-    """Safely write JSON with retry logic to handle race conditions."""
-    for attempt in range(max_retries):
-        try:
-            with open(file_path, "w") as f:
-                json.dump(data, f, indent=4)
-            return True
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(delay * (2 ** attempt))
-            else:
-                print(f"[CTC] Failed to write {file_path} after {max_retries} attempts: {e}")
-                return False
-    return False
+    Files written with safe_json_write() are double-buffered, so a read
+    always sees the last complete version. Returns None if the file cannot
+    be read.
+    """
+    bus = active_bus_for(file_path)
+    if bus is not None:
+        return bus.read_path(file_path, None)
+    try:
+        return load_published(file_path, decode)
+    except json.JSONDecodeError as e:
+        print(f"[CTC] {file_path} is half-written by another program: {e}")
+        return None
+    except Exception as e:
+        print(f"[CTC] Error reading {file_path}: {e}")
+        return None
+
+def safe_json_write(file_path, data):
+    """Publish a shared JSON file (double-buffered) and wake its readers."""
+    bus = active_bus_for(file_path)
+    if bus is not None:
+        bus.write_path(file_path, data)
+        return True
+    try:
+        publish_file(file_path, json.dumps(data, indent=4))
+        publish_path(file_path)
+        return True
+    except Exception as e:
+        print(f"[CTC] Failed to write {file_path}: {e}")
+        return False
 
 def track_update_handler(new_data, train, data_file_ctc_data):
     try:
@@ -118,20 +119,12 @@ def dispatch_train(train, line, station, arrival_time_str,
 
     # Ensure the track controller file exists (create minimal structure if missing)
     if not os.path.exists(data_file_track_cont):
-        try:
-            with open(data_file_track_cont, 'w') as f:
-                json.dump({"Trains": {}}, f, indent=4)
-        except Exception:
-            # If we cannot create the file, let the watcher raise a clear error
-            pass
+        # If we cannot create the file, let the watcher raise a clear error
+        safe_json_write(data_file_track_cont, {"Trains": {}})
 
     # Ensure the ctc data file exists with minimal structure so UI updates succeed
     if not os.path.exists(data_file_ctc_data):
-        try:
-            with open(data_file_ctc_data, 'w') as f:
-                json.dump({"Dispatcher": {"Trains": {}}}, f, indent=4)
-        except Exception:
-            pass
+        safe_json_write(data_file_ctc_data, {"Dispatcher": {"Trains": {}}})
 
     # Ensure both files contain default train entries expected by the UI/dispatcher
     def _ensure_train_entries():
@@ -167,8 +160,8 @@ def dispatch_train(train, line, station, arrival_time_str,
                 "Active": 0,
                 "Suggested Authority": 0,
                 "Suggested Speed": 0,
-                "Train Position": None,
-                "Train State": ""
+                "Train Position": 0,
+                "Train State": 0
             })
 
         safe_json_write(data_file_track_cont, track_updates)
@@ -231,10 +224,23 @@ def dispatch_train(train, line, station, arrival_time_str,
         except Exception as e:
             print(f"Train position data missing: {e}")
 
-    watcher = JSONFileWatcher(data_file_track_cont, _track_update_handler)
-    observer = Observer()
-    observer.schedule(watcher, os.path.dirname(data_file_track_cont), recursive=False)
-    observer.start()
+    # Follow the track controller file through change notifications. The
+    # timeout keeps picking up writers that do not publish changes.
+    track_channel = channel_for_path(data_file_track_cont)
+    track_gen = current_generation(track_channel) if track_channel else 0
+    track_tracker = ChangeTracker(track_channel, data_file_track_cont)
+    track_tracker.changed()  # only react to modifications from now on
+
+    def _wait_for_track_update(timeout=0.5):
+        nonlocal track_gen
+        if track_channel is not None:
+            track_gen = wait_for_change(track_channel, track_gen, timeout=timeout)
+        elif timeout > 0:
+            time.sleep(timeout)
+        if track_tracker.changed():
+            new_data = safe_json_read(data_file_track_cont)
+            if new_data is not None:
+                _track_update_handler(new_data)
 
     try:
         # In single-station dispatch mode, only dispatch to the destination station directly
@@ -278,7 +284,7 @@ def dispatch_train(train, line, station, arrival_time_str,
             # Wait for train to reach station
             print(f"[WAIT] Waiting for train to reach block {next_station_loc}, current train_pos={train_pos}")
             while train_pos is None or train_pos != next_station_loc:
-                time.sleep(0.5)
+                _wait_for_track_update()
                 print(f"[WAIT] Still waiting... train_pos={train_pos}, target={next_station_loc}")
             print(f"[REACHED] Train has reached block {next_station_loc}")
             
@@ -300,11 +306,12 @@ def dispatch_train(train, line, station, arrival_time_str,
                 if updates and updates["Trains"][train]["Active"] == 0:
                     print(f"[CTC] {train} has stopped at station (Active=0 by track controller)")
                     break
-                time.sleep(0.5)
+                _wait_for_track_update()
             
-            # Wait for dwell time
-            time.sleep(dwell_time_s)
-            time.sleep(0.5)
+            # Wait for dwell time (still following track updates)
+            dwell_end = time.monotonic() + dwell_time_s + 0.5
+            while time.monotonic() < dwell_end:
+                _wait_for_track_update(max(0.0, min(0.5, dwell_end - time.monotonic())))
             
             # Keep current station visible while dwelling (Active = 0)
             # When we reactivate the train (set Active = 1), clear the current station
@@ -336,10 +343,7 @@ def dispatch_train(train, line, station, arrival_time_str,
                 print("train at destination")
                 break
     except KeyboardInterrupt:
-        print("stopping observer")
-    finally:
-        observer.stop()
-        observer.join()
+        print("stopping dispatch")
 
 def dispatch_schedule(schedule_file_path,
                       data_file_ctc_data='ctc_data.json',
@@ -18,9 +18,15 @@ class CTCUI:
         self.sys = sys
         self.Observer = Observer
         self.FileSystemEventHandler = FileSystemEventHandler
+        # Double-buffered publishing of the shared CTC files
+        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        if project_root not in sys.path:
+            sys.path.append(project_root)
+        from double_buffer import load as load_published, publish as publish_file
+        self.load_published = load_published
+        self.publish_file = publish_file
 
         # Use absolute path to project root ctc_data.json so it's consistent across components
-        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
         self.data_file = os.path.join(project_root, 'ctc_data.json')
         self.default_data = {
             "Dispatcher": {
@@ -75,8 +81,7 @@ class CTCUI:
     def setup_json_file(self):
         # Always reset `ctc_data.json` to default on UI start so active trains/table is fresh
         try:
-            with open(self.data_file, "w") as f:
-                self.json.dump(self.default_data, f, indent=4)
+            self._write_shared(self.data_file, self.default_data)
         except Exception as e:
             print(f"Warning: failed to write default ctc_data.json: {e}")
         # Also reset the project-root track controller file so Active flags start cleared
@@ -92,23 +97,26 @@ class CTCUI:
                     "Train Position": 0,
                     "Train State": 0
                 }
-            with open(track_file, 'w') as tf:
-                self.json.dump(default_track, tf, indent=4)
+            self._write_shared(track_file, default_track)
         except Exception as e:
             print(f"Warning: failed to write default ctc_track_controller.json: {e}")
 
+    def _read_shared(self, path):
+        return self.load_published(path)
+
+    def _write_shared(self, path, data):
+        self.publish_file(path, self.json.dumps(data, indent=4))
+
     def load_data(self):
         if self.os.path.exists(self.data_file):
-            with open(self.data_file, "r") as f:
-                try:
-                    return self.json.load(f)
-                except self.json.JSONDecodeError:
-                    return {}
+            try:
+                return self._read_shared(self.data_file)
+            except self.json.JSONDecodeError:
+                return {}
         return {}
 
     def save_data(self, data):
-        with open(self.data_file, "w") as f:
-            self.json.dump(data, f, indent=4)
+        self._write_shared(self.data_file, data)
 
 
     def setup_ui(self):
@@ -412,8 +420,7 @@ class CTCUI:
         if not self.os.path.exists(self.data_file):
             return
         try:
-            with open(self.data_file, "r") as f:
-                data = self.json.load(f)
+            data = self._read_shared(self.data_file)
         except self.json.JSONDecodeError:
             return
         dispatcher_data = data.get("Dispatcher", {})
@@ -426,8 +433,7 @@ class CTCUI:
         track_updates = {}
         if self.os.path.exists(track_file):
             try:
-                with open(track_file, 'r') as tf:
-                    track_updates = self.json.load(tf)
+                track_updates = self._read_shared(track_file)
             except Exception:
                 track_updates = {}
 
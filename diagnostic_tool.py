@@ -86,12 +86,56 @@ def test_update_train_state(server_url, train_id):
         print(f"✗ Error updating train state: {e}")
         return False
 
+def fetch_train_states(server_url, train_ids, fields=None):
+    """Fetch several trains in one request; returns ({train_id: state}, missing train IDs)"""
+    params = {"ids": ",".join(str(t) for t in train_ids)}
+    if fields:
+        params["fields"] = ",".join(fields)
+    response = requests.get(f"{server_url}/api/trains/state", params=params, timeout=2.0)
+    response.raise_for_status()
+    body = response.json()
+    return {int(k.split("_")[1]): v for k, v in body.get("trains", {}).items()}, body.get("missing", [])
+
+def patch_train_states(server_url, updates):
+    """Update several trains in one request; returns the per-train results"""
+    response = requests.patch(f"{server_url}/api/trains/state",
+                              json={str(t): fields for t, fields in updates.items()}, timeout=2.0)
+    if response.status_code not in (200, 207):
+        response.raise_for_status()
+    return response.json().get("results", {})
+
+def test_bulk_train_states(server_url, train_ids):
+    """Test reading and patching a whole rack of trains in one round trip each"""
+    print(f"\nTesting bulk read/update for Trains {train_ids}...")
+    try:
+        updates = {t: {"commanded_speed": 40.0 + t} for t in train_ids}
+        results = patch_train_states(server_url, updates)
+        failed = {t: r for t, r in results.items() if not r.get("ok")}
+        if failed:
+            print(f"✗ Bulk update rejected for: {failed}")
+            return False
+        print(f"✓ Bulk update applied to {len(results)} trains in one request")
+        
+        states, missing = fetch_train_states(server_url, train_ids, ["commanded_speed"])
+        if missing:
+            print(f"⚠ Trains not found on server: {missing}")
+        wrong = [t for t in train_ids
+                 if states.get(t, {}).get("inputs", {}).get("commanded_speed") != 40.0 + t]
+        if wrong:
+            print(f"⚠ Bulk read returned unexpected values for trains {wrong}")
+            return False
+        print(f"✓ Bulk read returned {len(states)} trains in one request")
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Error in bulk request: {e}")
+        return False
+
 def check_local_files():
     """Check if local JSON files exist and are readable"""
     print("\nChecking local files...")
     
     files_to_check = [
-        "Train Model/train_data.json",
+        "Train_Model/train_data.json",
         "train_controller/data/train_states.json"
     ]
     
@@ -119,9 +163,10 @@ def main():
     print("=" * 70)
     
     if len(sys.argv) < 2:
-        print("\nUsage: python diagnostic_tool.py <server_url> [train_id]")
+        print("\nUsage: python diagnostic_tool.py <server_url> [train_id] [rack_train_ids]")
         print("\nExample:")
         print("  python diagnostic_tool.py http://192.168.1.100:5000 1")
+        print("  python diagnostic_tool.py http://192.168.1.100:5000 1 1,2,3,4")
         print("\nThis tool tests the connection between:")
         print("  - Train Model Test UI")
         print("  - REST API Server")
@@ -130,6 +175,7 @@ def main():
     
     server_url = sys.argv[1].rstrip('/')
     train_id = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rack_ids = [int(t) for t in sys.argv[3].split(",")] if len(sys.argv) > 3 else [train_id]
     
     print(f"\nServer URL: {server_url}")
     print(f"Train ID: {train_id}")
@@ -137,7 +183,7 @@ def main():
     
     # Run tests
     tests_passed = 0
-    tests_total = 4
+    tests_total = 5
     
     # Test 1: Server connection
     if test_server_connection(server_url):
@@ -155,6 +201,10 @@ def main():
     if test_update_train_state(server_url, train_id):
         tests_passed += 1
     
+    # Test 5: Bulk read/update of the rack
+    if test_bulk_train_states(server_url, rack_ids):
+        tests_passed += 1
+    
     # Summary
     print("\n" + "=" * 70)
     print(f"  RESULTS: {tests_passed}/{tests_total} tests passed")
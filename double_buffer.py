@@ -0,0 +1,320 @@
+"""Double-buffered publishing for the shared state files.
+
+Writers used to rewrite the shared JSON files in place or with os.replace,
+so readers had to catch half-written files and sleep before retrying, and on
+Windows os.replace fails while another process has the file open.
+
+publish(path, payload) instead writes generation-numbered A/B slot files and
+then a small commit marker:
+
+    <STATE_DIR>/<name>-<hash>.a / .b   slot: magic, generation, length, crc32,
+                                       then the encoded document
+    <STATE_DIR>/<name>-<hash>.commit   marker: magic, generation, slot,
+                                       signature of the mirror file, crc32
+
+Generation g always goes into slot g % 2 and the marker is written only after
+the slot is complete, so the other slot always holds the previous committed
+generation. Slots and marker are rewritten in place (never replaced), which
+also works where os.replace contends. Writers are serialized with a process
+lock plus an fcntl lock on the marker (POSIX only).
+
+A reader takes the slot named by the marker and checks generation and crc. If
+the marker is torn or that slot is being rewritten, it takes the newest
+valid slot instead, so a read never sleeps or retries.
+
+The file at path itself is still written after each publish (the "mirror"),
+for tools that open it directly. The marker records the mirror's stat
+signature; if the mirror changes after that (edited by hand, reset by git, or
+written by a program outside this repo such as the Track Model), readers
+load the mirror, and fall back to the committed slot if it is half-written.
+
+Usage:
+    publish(path, json.dumps(doc).encode())   # writer
+    doc = load(path)                          # reader (parsed, never sleeps)
+    token = version(path)                     # cheap change token for caches
+    discard(path)                             # owner shutdown: drop the slots
+
+STATE_DIR defaults to a directory under the system temp dir and can be moved
+with GROUP4_STATE_DIR (tests point it at a private temporary directory).
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows - process lock only
+    fcntl = None
+
+STATE_DIR = os.environ.get(
+    "GROUP4_STATE_DIR", os.path.join(tempfile.gettempdir(), "group4_sim_state")
+)
+
+_SLOT = struct.Struct("<4sQII")          # magic, generation, length, crc32
+_COMMIT = struct.Struct("<4sQB3xQQQ")    # magic, generation, slot, mirror ino/size/mtime_ns
+_CRC = struct.Struct("<I")
+_SLOT_MAGIC = b"G4AB"
+_COMMIT_MAGIC = b"G4CM"
+
+_lock = threading.Lock()
+_files = {}
+
+
+def _pread(fd, n):
+    if hasattr(os, "pread"):
+        return os.pread(fd, n, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, n)
+
+
+def _pwrite(fd, data):
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, 0)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _mirror_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class _Files:
+    """Slot and marker files of one published path."""
+
+    def __init__(self, path):
+        self.path = path
+        name = os.path.basename(path)
+        digest = hashlib.sha1(os.path.normcase(path).encode("utf-8")).hexdigest()[:12]
+        base = os.path.join(STATE_DIR, f"{name}-{digest}")
+        self.marker_path = base + ".commit"
+        self.slot_paths = (base + ".a", base + ".b")
+        self.lock = threading.Lock()
+        self._marker_fd = None
+
+    def marker_fd(self, create=False):
+        if self._marker_fd is None:
+            if not create and not os.path.exists(self.marker_path):
+                return None
+            if create:
+                os.makedirs(STATE_DIR, exist_ok=True)
+            fd = os.open(self.marker_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+            with _lock:
+                if self._marker_fd is None:
+                    self._marker_fd = fd
+                else:
+                    os.close(fd)
+        return self._marker_fd
+
+    # ------------------------------------------------------------------
+    def read_commit(self):
+        """(generation, slot, mirror signature) or None if missing or torn."""
+        fd = self.marker_fd()
+        if fd is None:
+            return None
+        raw = _pread(fd, _COMMIT.size + _CRC.size)
+        if len(raw) != _COMMIT.size + _CRC.size:
+            return None
+        if _CRC.unpack_from(raw, _COMMIT.size)[0] != zlib.crc32(raw[:_COMMIT.size]):
+            return None
+        magic, gen, slot, ino, size, mtime_ns = _COMMIT.unpack_from(raw, 0)
+        if magic != _COMMIT_MAGIC or slot > 1:
+            return None
+        signature = None if (ino, size, mtime_ns) == (0, 0, 0) else (ino, size, mtime_ns)
+        return gen, slot, signature
+
+    def write_commit(self, gen, slot, signature):
+        head = _COMMIT.pack(_COMMIT_MAGIC, gen, slot, *(signature or (0, 0, 0)))
+        _pwrite(self.marker_fd(create=True), head + _CRC.pack(zlib.crc32(head)))
+
+    def read_slot(self, slot, gen=None):
+        """(generation, payload) of a complete slot, or None."""
+        try:
+            with open(self.slot_paths[slot], "rb") as f:
+                raw = f.read()
+        except OSError:
+            return None
+        if len(raw) < _SLOT.size:
+            return None
+        magic, slot_gen, length, crc = _SLOT.unpack_from(raw, 0)
+        payload = raw[_SLOT.size:_SLOT.size + length]
+        if magic != _SLOT_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+            return None
+        if gen is not None and slot_gen != gen:
+            return None
+        return slot_gen, payload
+
+    def write_slot(self, slot, gen, payload):
+        fd = os.open(self.slot_paths[slot], os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            data = _SLOT.pack(_SLOT_MAGIC, gen, len(payload), zlib.crc32(payload)) + payload
+            _pwrite(fd, data)
+            os.ftruncate(fd, len(data))
+        finally:
+            os.close(fd)
+
+    def committed(self):
+        """(generation, payload, mirror signature) of the newest complete generation."""
+        commit = self.read_commit()
+        if commit is not None:
+            gen, slot, signature = commit
+            found = self.read_slot(slot, gen)
+            if found is not None:
+                return gen, found[1], signature
+        # Marker torn or its slot being rewritten: newest complete slot wins
+        found = [s for s in (self.read_slot(0), self.read_slot(1)) if s is not None]
+        if not found:
+            return None
+        gen, payload = max(found)
+        return gen, payload, commit[2] if commit is not None else None
+
+
+def _files_for(path):
+    path = os.path.abspath(path)
+    files = _files.get(path)
+    if files is None:
+        with _lock:
+            files = _files.setdefault(path, _Files(path))
+    return files
+
+
+def _write_mirror(path, payload):
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=d, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            pass  # Windows: a reader holds the file open
+        os.remove(tmp_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Readers using load() get the committed slot while this is half-written
+    with open(path, "wb") as f:
+        f.write(payload)
+
+
+def publish(path: str, payload) -> int:
+    """Publish a new version of path (bytes, or str encoded as UTF-8).
+
+    Returns:
+        int: The new generation of path
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    files = _files_for(path)
+    with files.lock:
+        fd = files.marker_fd(create=True)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            commit = files.read_commit()
+            if commit is not None:
+                gen = commit[0] + 1
+            else:
+                found = [s for s in (files.read_slot(0), files.read_slot(1)) if s is not None]
+                gen = max(found)[0] + 1 if found else 1
+            files.write_slot(gen & 1, gen, payload)
+            _write_mirror(files.path, payload)
+            files.write_commit(gen, gen & 1, _mirror_signature(files.path))
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    return gen
+
+
+def read_bytes(path: str) -> bytes:
+    """Current contents of path; see load() for which copy is used.
+
+    Raises:
+        FileNotFoundError: path does not exist
+    """
+    return _read(path)[0]
+
+
+def _read(path):
+    files = _files_for(path)
+    committed = files.committed() if files.marker_fd() is not None else None
+    if committed is not None:
+        _, payload, signature = committed
+        current = _mirror_signature(files.path)
+        if current is None:
+            raise FileNotFoundError(2, "No such file or directory", files.path)
+        if current == signature:
+            return payload, None
+        fallback = payload
+    else:
+        fallback = None
+    with open(files.path, "rb") as f:
+        return f.read(), fallback
+
+
+def load(path: str, decode=json.loads):
+    """Parsed contents of path without sleeping or retrying.
+
+    The committed slot is used while the mirror file is the one publish()
+    wrote; a mirror changed since is loaded instead, falling back to the
+    committed slot if it does not parse.
+
+    Raises:
+        FileNotFoundError: path does not exist
+        json.JSONDecodeError: never published and the file is half-written
+    """
+    payload, fallback = _read(path)
+    try:
+        return decode(payload)
+    except ValueError:
+        if fallback is None:
+            raise
+        return decode(fallback)
+
+
+def discard(path: str) -> None:
+    """Remove the slot and marker files of path, keeping the mirror file.
+
+    Called by the owner of a published file when it shuts down after its last
+    publish(). Readers then load the mirror directly, and the next publish()
+    starts new slots.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        files = _files.pop(path, None)
+    if files is None:
+        files = _Files(path)
+    with files.lock:
+        if files._marker_fd is not None:
+            os.close(files._marker_fd)
+            files._marker_fd = None
+        for p in files.slot_paths + (files.marker_path,):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+def version(path: str):
+    """Change token for a published path, or None if path was never published."""
+    files = _files_for(path)
+    if files.marker_fd() is None:
+        return None
+    commit = files.read_commit()
+    if commit is None:
+        return ("torn", os.urandom(8))
+    return (commit[0], _mirror_signature(files.path))
@@ -0,0 +1,212 @@
+"""Process-wide cache of parsed JSON files, validated by stat.
+
+Several modules parse the same shared JSON file more than once per tick. This
+cache keeps the parsed document for each path together with the file's
+(inode, size, mtime_ns) signature - plus the channel generation from
+channel_notify for files that publish changes, which catches rewrites that
+keep the same size within one mtime tick. A read costs one stat() when the
+file has not changed. Files published through double_buffer are validated
+by their commit generation instead and parsed from the committed slot, so a
+concurrent writer never causes a decode error.
+
+Cached documents are shared, so they are returned read-only (FrozenDict /
+FrozenList, which are still dict/list subclasses). Callers that modify the
+result use read_json_copy() or thaw() to get a private mutable copy.
+
+Usage:
+    doc = read_json(path)            # read-only, raises on missing/invalid file
+    data = read_json_copy(path, {})  # mutable copy, default on error
+    print(stats())                   # {'hits': ..., 'misses': ..., 'entries': ...}
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from channel_notify import channel_for_path, current_generation
+# Files published through double_buffer are read from their committed slot
+from double_buffer import load as _load_published, version as _published_version
+# Shared files may be written by any message codec (JSON or binary)
+from message_codec import decode as _decode
+
+MAX_ENTRIES = 64
+
+
+class FrozenDict(dict):
+    """Read-only dict returned for cached documents."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("cached JSON documents are read-only; use thaw() for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class FrozenList(list):
+    """Read-only list returned for cached documents."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("cached JSON documents are read-only; use thaw() for a mutable copy")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def copy(self):
+        return list(self)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze(obj):
+    """Return a read-only version of a parsed JSON value."""
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """Return a mutable deep copy of a (possibly frozen) JSON value."""
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+class JsonCache:
+    """LRU cache of parsed JSON documents keyed on the file's stat signature."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # abspath -> (signature, frozen doc)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(path, st):
+        generation = None
+        channel = channel_for_path(path)
+        if channel is not None:
+            try:
+                generation = current_generation(channel)
+            except OSError:
+                pass
+        return (st.st_ino, st.st_size, st.st_mtime_ns, generation)
+
+    def read(self, path: str):
+        """Return the parsed, read-only document at path.
+
+        Raises:
+            FileNotFoundError: path does not exist
+            json.JSONDecodeError: file is empty or being rewritten
+        """
+        path = os.path.abspath(path)
+        token = _published_version(path)
+        if token is not None:
+            return self._read_published(path, token)
+        with open(path, "rb") as f:
+            # Signature of the file we actually opened (not of a later replacement)
+            signature = self._signature(path, os.fstat(f.fileno()))
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] == signature:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+            doc = freeze(_decode(f.read()))
+        self._store(path, signature, doc)
+        return doc
+
+    def _store(self, path, signature, doc):
+        with self._lock:
+            self._entries[path] = (signature, doc)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_published(self, path, token):
+        signature = ("published", token)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        doc = freeze(_load_published(path, _decode))
+        self._store(path, signature, doc)
+        return doc
+
+    def invalidate(self, path: str = None) -> None:
+        """Drop one path (or everything) from the cache."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+_cache = JsonCache()
+
+
+def read_json(path: str):
+    """Read-only parsed document at path from the process-wide cache."""
+    return _cache.read(path)
+
+
+def read_json_copy(path: str, default=None):
+    """Mutable copy of the document at path, or default if it cannot be read."""
+    try:
+        return thaw(_cache.read(path))
+    except (OSError, ValueError):
+        return default
+
+
+def invalidate(path: str = None) -> None:
+    _cache.invalidate(path)
+
+
+def stats() -> dict:
+    """Hit/miss counters of the process-wide cache."""
+    return _cache.stats()
+
+
+def reset_stats() -> None:
+    _cache.reset_stats()
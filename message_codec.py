@@ -0,0 +1,468 @@
+"""Message codecs and schema registry for the inter-module channels.
+
+All inter-module traffic is pretty-printed JSON with long human-readable keys
+(e.g. 456 "G-Failures" ints per track_to_wayside write). This module registers
+a schema per channel and can encode a message three ways:
+
+    "json"    - today's format (indent=4), the default
+    "compact" - JSON without whitespace
+    "binary"  - fixed-layout struct/array encoding driven by the schema
+
+The codec is chosen per channel: GROUP4_CODEC_<CHANNEL>=binary overrides
+GROUP4_CODEC, which overrides CHANNEL_CODECS. Readers never need to know
+which codec a writer used: decode() recognizes binary messages by their
+magic prefix and parses everything else as JSON. A message that does not fit
+its schema (unknown keys, None positions, over-long strings) is written as
+compact JSON instead, so switching a channel to binary never loses data.
+
+Binary layout (little endian):
+    header   "G4B" + version (u8) + schema id (u8)
+    records  count (u16), then per record: key (16s), presence mask, fields
+    arrays   presence mask, then each array at its fixed length
+    extras   length (u32) + compact JSON of top-level keys outside the schema
+
+Only modules that read through decode() (json_cache, train_model_core,
+the waysides, CTC dispatch) understand binary files, so binary is opt-in per channel; keep
+"json" for files read by tools outside this repo (e.g. the Track Model).
+"""
+
+import array
+import json
+import math
+import os
+import struct
+import sys
+
+from channel_notify import channel_for_path
+from double_buffer import load as load_published
+
+MAGIC = b"G4B"
+VERSION = 1
+BINARY_CONTENT_TYPE = "application/x-group4-binary"
+KEY_BYTES = 16
+
+_HEADER = struct.Struct("<3sBB")
+_COUNT = struct.Struct("<H")
+_EXTRAS = struct.Struct("<I")
+
+# struct format and validator per field kind
+_KINDS = {
+    "num": "d",       # int or float, decoded as float
+    "opt_num": "d",   # like num, None stored as NaN
+    "int": "i",
+    "bool": "?",
+    "str": "s",       # fixed-size utf-8, NUL padded
+}
+_ARRAY_KINDS = {
+    "flag": "B",      # small non-negative ints (0/1 flags, light bits)
+    "num": "d",
+    "num32": "f",     # per-block mph / yards (must be exact in float32)
+}
+
+
+class Unencodable(ValueError):
+    """Raised when a message does not fit its binary schema."""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class RecordSchema:
+    """Schema for a map of keyed records, e.g. {"Train 1": {...}, ...}.
+
+    Args:
+        name: Channel name
+        schema_id: Unique id stored in the binary header
+        fields: List of (path, kind) or (path, "str", size); path is a tuple
+            of keys into the record, e.g. ("Beacon", "Next Station")
+        container: Top-level key holding the records ("Trains"), or None if
+            the records are the top-level keys themselves
+    """
+
+    def __init__(self, name, schema_id, fields, container=None):
+        self.name = name
+        self.schema_id = schema_id
+        self.container = container
+        self.fields = []
+        fmt = "<"
+        for field in fields:
+            path, kind = tuple(field[0]), field[1]
+            if kind == "str":
+                size = field[2] if len(field) > 2 else 32
+                fmt += f"{size}s"
+            else:
+                size = 0
+                fmt += _KINDS[kind]
+            self.fields.append((path, kind, size))
+        # Nested sections (e.g. ("inputs",)) get their own presence bits so
+        # empty sections survive a round trip
+        self.sections = []
+        for path, _, _ in self.fields:
+            for depth in range(1, len(path)):
+                if path[:depth] not in self.sections:
+                    self.sections.append(path[:depth])
+        self.mask_bytes = (len(self.fields) + len(self.sections) + 7) // 8
+        self.record = struct.Struct(fmt)
+        self.key = struct.Struct(f"<{KEY_BYTES}s")
+
+    # -- encoding -------------------------------------------------------
+    def _pack_value(self, kind, size, value, present):
+        if not present:
+            return b"" if kind == "str" else (False if kind == "bool" else 0)
+        if kind == "num":
+            if not _is_number(value):
+                raise Unencodable(f"{value!r} is not a number")
+            return float(value)
+        if kind == "opt_num":
+            if value is None:
+                return math.nan
+            if not _is_number(value):
+                raise Unencodable(f"{value!r} is not a number")
+            return float(value)
+        if kind == "int":
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise Unencodable(f"{value!r} is not an int")
+            return value
+        if kind == "bool":
+            if not isinstance(value, bool):
+                raise Unencodable(f"{value!r} is not a bool")
+            return value
+        if not isinstance(value, str):
+            raise Unencodable(f"{value!r} is not a string")
+        raw = value.encode("utf-8")
+        if len(raw) > size or b"\x00" in raw:
+            raise Unencodable(f"string longer than {size} bytes")
+        return raw
+
+    def _records(self, doc):
+        if self.container is None:
+            return doc, {}
+        records = doc.get(self.container)
+        if not isinstance(records, dict):
+            raise Unencodable(f"missing {self.container!r}")
+        return records, {k: v for k, v in doc.items() if k != self.container}
+
+    def encode_body(self, doc):
+        records, extras = self._records(doc)
+        if len(records) > 0xFFFF:
+            raise Unencodable("too many records")
+        known = {}
+        for path, _, _ in self.fields:
+            known.setdefault(path[:-1], set()).add(path[-1])
+        out = [_COUNT.pack(len(records))]
+        for key, record in records.items():
+            raw_key = str(key).encode("utf-8")
+            if not isinstance(key, str) or len(raw_key) > KEY_BYTES or not isinstance(record, dict):
+                raise Unencodable(f"record {key!r} does not fit")
+            _check_known(record, known, ())
+            mask = 0
+            values = []
+            for i, (path, kind, size) in enumerate(self.fields):
+                present, value = _lookup(record, path)
+                if present:
+                    mask |= 1 << i
+                values.append(self._pack_value(kind, size, value, present))
+            for i, section in enumerate(self.sections, len(self.fields)):
+                if _lookup(record, section)[0]:
+                    mask |= 1 << i
+            out.append(self.key.pack(raw_key))
+            out.append(mask.to_bytes(self.mask_bytes, "little"))
+            out.append(self.record.pack(*values))
+        return b"".join(out), extras
+
+    # -- decoding -------------------------------------------------------
+    def decode_body(self, data, offset):
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        records = {}
+        for _ in range(count):
+            (raw_key,) = self.key.unpack_from(data, offset)
+            offset += self.key.size
+            mask = int.from_bytes(data[offset:offset + self.mask_bytes], "little")
+            offset += self.mask_bytes
+            values = self.record.unpack_from(data, offset)
+            offset += self.record.size
+            record = {}
+            for i, section in enumerate(self.sections, len(self.fields)):
+                if mask & (1 << i):
+                    target = record
+                    for key in section:
+                        target = target.setdefault(key, {})
+            for i, ((path, kind, _), value) in enumerate(zip(self.fields, values)):
+                if not mask & (1 << i):
+                    continue
+                if kind == "str":
+                    value = value.rstrip(b"\x00").decode("utf-8")
+                elif kind == "opt_num" and math.isnan(value):
+                    value = None
+                target = record
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = value
+            records[raw_key.rstrip(b"\x00").decode("utf-8")] = record
+        doc = records if self.container is None else {self.container: records}
+        return doc, offset
+
+
+class ArraySchema:
+    """Schema for a bundle of fixed-length arrays, e.g. track_to_wayside.
+
+    Args:
+        name: Channel name
+        schema_id: Unique id stored in the binary header
+        fields: List of (key, kind, length) with kind "flag" or "num"
+    """
+
+    def __init__(self, name, schema_id, fields):
+        self.name = name
+        self.schema_id = schema_id
+        self.fields = [(key, _ARRAY_KINDS[kind], length) for key, kind, length in fields]
+        self.mask_bytes = (len(self.fields) + 7) // 8
+
+    def encode_body(self, doc):
+        mask = 0
+        chunks = []
+        for i, (key, typecode, length) in enumerate(self.fields):
+            if key not in doc:
+                continue
+            values = doc[key]
+            if not isinstance(values, list) or len(values) != length:
+                raise Unencodable(f"{key!r} is not a list of {length}")
+            try:
+                packed = array.array(typecode, values)
+            except (TypeError, OverflowError) as e:
+                raise Unencodable(f"{key!r}: {e}")
+            if typecode != "B" and packed.tolist() != values:
+                # Values float32 cannot represent exactly stay in JSON
+                raise Unencodable(f"{key!r} loses precision")
+            mask |= 1 << i
+            chunks.append(packed)
+        out = [mask.to_bytes(self.mask_bytes, "little")]
+        for chunk in chunks:
+            if sys.byteorder != "little":
+                chunk.byteswap()
+            out.append(chunk.tobytes())
+        names = {key for key, _, _ in self.fields}
+        return b"".join(out), {k: v for k, v in doc.items() if k not in names}
+
+    def decode_body(self, data, offset):
+        mask = int.from_bytes(data[offset:offset + self.mask_bytes], "little")
+        offset += self.mask_bytes
+        doc = {}
+        for i, (key, typecode, length) in enumerate(self.fields):
+            if not mask & (1 << i):
+                continue
+            values = array.array(typecode)
+            nbytes = values.itemsize * length
+            values.frombytes(data[offset:offset + nbytes])
+            if sys.byteorder != "little":
+                values.byteswap()
+            offset += nbytes
+            doc[key] = values.tolist()
+        return doc, offset
+
+
+def _lookup(record, path):
+    target = record
+    for key in path:
+        if not isinstance(target, dict) or key not in target:
+            return False, None
+        target = target[key]
+    return True, target
+
+
+def _check_known(record, known, prefix):
+    """Reject records with keys the schema cannot represent."""
+    names = known.get(prefix, set())
+    for key, value in record.items():
+        if key in names:
+            continue
+        if prefix + (key,) in known and isinstance(value, dict):
+            _check_known(value, known, prefix + (key,))
+            continue
+        raise Unencodable(f"unknown field {'/'.join(prefix + (key,))!r}")
+
+
+# ----------------------------------------------------------------------
+# Schema registry
+# ----------------------------------------------------------------------
+SCHEMAS = {}
+_SCHEMAS_BY_ID = {}
+
+
+def register_schema(schema):
+    """Register a schema under its channel name and id."""
+    if schema.schema_id in _SCHEMAS_BY_ID and _SCHEMAS_BY_ID[schema.schema_id].name != schema.name:
+        raise ValueError(f"schema id {schema.schema_id} already used by {_SCHEMAS_BY_ID[schema.schema_id].name}")
+    SCHEMAS[schema.name] = schema
+    _SCHEMAS_BY_ID[schema.schema_id] = schema
+    return schema
+
+
+register_schema(RecordSchema("wayside_to_train", 1, [
+    (("Commanded Speed",), "num"),
+    (("Commanded Authority",), "num"),
+    (("Beacon", "Current Station"), "str", 32),
+    (("Beacon", "Next Station"), "str", 32),
+    (("Train Speed",), "num"),
+]))
+
+register_schema(ArraySchema("track_to_wayside", 2, [
+    ("G-Occupancy", "flag", 152),
+    ("G-Failures", "flag", 456),
+    ("G-lights", "flag", 24),
+    ("G-switches", "flag", 6),
+    ("G-gates", "flag", 2),
+    ("G-Commanded Speed", "num32", 152),
+    ("G-Commanded Authority", "num32", 152),
+]))
+
+register_schema(RecordSchema("ctc_track_controller", 3, [
+    (("Active",), "int"),
+    (("Suggested Speed",), "num"),
+    (("Suggested Authority",), "num"),
+    (("Train Position",), "int"),
+    (("Train State",), "int"),
+], container="Trains"))
+
+_TRAIN_STATE_INPUTS = [
+    ("commanded_speed", "num"), ("commanded_authority", "num"), ("speed_limit", "num"),
+    ("train_velocity", "num"), ("current_station", "str", 32), ("next_stop", "str", 32),
+    ("station_side", "str", 16), ("train_temperature", "num"),
+    ("train_model_engine_failure", "bool"), ("train_model_signal_failure", "bool"),
+    ("train_model_brake_failure", "bool"), ("train_controller_engine_failure", "bool"),
+    ("train_controller_signal_failure", "bool"), ("train_controller_brake_failure", "bool"),
+    ("beacon_read_blocked", "bool"),
+]
+_TRAIN_STATE_OUTPUTS = [
+    ("manual_mode", "bool"), ("driver_velocity", "num"), ("service_brake", "bool"),
+    ("right_door", "bool"), ("left_door", "bool"), ("interior_lights", "bool"),
+    ("exterior_lights", "bool"), ("set_temperature", "num"), ("temperature_up", "bool"),
+    ("temperature_down", "bool"), ("announcement", "str", 128), ("announce_pressed", "bool"),
+    ("emergency_brake", "bool"), ("kp", "opt_num"), ("ki", "opt_num"),
+    ("engineering_panel_locked", "bool"), ("power_command", "num"),
+]
+register_schema(RecordSchema("train_states", 4,
+    [(("inputs", f[0]),) + f[1:] for f in _TRAIN_STATE_INPUTS]
+    + [(("outputs", f[0]),) + f[1:] for f in _TRAIN_STATE_OUTPUTS]))
+
+
+# ----------------------------------------------------------------------
+# Codecs
+# ----------------------------------------------------------------------
+class JsonCodec:
+    """Today's human-readable format."""
+
+    name = "json"
+    content_type = "application/json"
+
+    def encode(self, doc) -> bytes:
+        return json.dumps(doc, indent=4).encode("utf-8")
+
+
+class CompactJsonCodec:
+    """JSON without whitespace."""
+
+    name = "compact"
+    content_type = "application/json"
+
+    def encode(self, doc) -> bytes:
+        return json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+
+class BinaryCodec:
+    """Fixed-layout binary encoding for one schema (compact JSON fallback)."""
+
+    name = "binary"
+    content_type = BINARY_CONTENT_TYPE
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def encode(self, doc) -> bytes:
+        try:
+            if not isinstance(doc, dict):
+                raise Unencodable("message is not an object")
+            body, extras = self.schema.encode_body(doc)
+        except (Unencodable, struct.error):
+            return CompactJsonCodec().encode(doc)
+        tail = json.dumps(extras, separators=(",", ":")).encode("utf-8") if extras else b""
+        return b"".join([_HEADER.pack(MAGIC, VERSION, self.schema.schema_id),
+                         body, _EXTRAS.pack(len(tail)), tail])
+
+
+# Default codec per channel; everything starts on today's JSON format
+CHANNEL_CODECS = {name: "json" for name in SCHEMAS}
+
+
+def codec_name(channel) -> str:
+    """Configured codec name for a channel ("json", "compact" or "binary")."""
+    env = os.environ.get(f"GROUP4_CODEC_{str(channel).upper()}") or os.environ.get("GROUP4_CODEC")
+    return (env or CHANNEL_CODECS.get(channel, "json")).lower()
+
+
+def get_codec(channel, name=None):
+    """Codec instance for a channel (binary only for channels with a schema)."""
+    name = name or codec_name(channel)
+    if name == "binary" and channel in SCHEMAS:
+        return BinaryCodec(SCHEMAS[channel])
+    if name in ("compact", "binary"):
+        return CompactJsonCodec()
+    return JsonCodec()
+
+
+def encode(channel, doc, codec=None) -> bytes:
+    """Encode a message for a channel with its configured (or given) codec."""
+    return get_codec(channel, codec).encode(doc)
+
+
+def encode_for_path(path, doc) -> bytes:
+    """Encode the contents of a shared file using its channel's codec."""
+    return encode(channel_for_path(path), doc)
+
+
+def is_binary(data) -> bool:
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decode(data):
+    """Decode a message written by any codec (binary or JSON)."""
+    if isinstance(data, str):
+        return json.loads(data)
+    if not is_binary(data):
+        return json.loads(data)
+    _, version, schema_id = _HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError(f"unsupported binary message version {version}")
+    schema = _SCHEMAS_BY_ID.get(schema_id)
+    if schema is None:
+        raise ValueError(f"unknown message schema id {schema_id}")
+    try:
+        doc, offset = schema.decode_body(data, _HEADER.size)
+        (tail_len,) = _EXTRAS.unpack_from(data, offset)
+        offset += _EXTRAS.size
+    except (struct.error, UnicodeDecodeError) as e:
+        # Same error a half-written JSON file gives, so existing retry paths apply
+        raise json.JSONDecodeError(f"truncated {schema.name} message: {e}", "", 0)
+    if tail_len:
+        doc.update(json.loads(bytes(data[offset:offset + tail_len])))
+    return doc
+
+
+def load_file(path):
+    """Read and decode a shared file, whatever codec wrote it."""
+    return load_published(path, decode)
+
+
+def pretty(data) -> str:
+    """Debug pretty-printer for a message (bytes from any codec, or a dict)."""
+    doc = data if isinstance(data, (dict, list)) else decode(data)
+    return json.dumps(doc, indent=4, sort_keys=False)
+
+
+if __name__ == "__main__":
+    # python message_codec.py <file> : pretty-print a shared file of any codec
+    for file_path in sys.argv[1:]:
+        print(f"== {file_path}")
+        print(pretty(load_file(file_path)))
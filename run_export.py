@@ -0,0 +1,395 @@
+"""Columnar export of simulation runs for offline analysis.
+
+The shared JSON files only ever hold the latest tick. RunExporter streams
+every tick of fleet and track state into chunked columnar files instead:
+
+    <run>/index.json                       tables, columns, closed chunks
+    <run>/fleet/000000/velocity.npy        one row per train per tick
+    <run>/fleet/000000/train_id.npy
+    ...
+    <run>/track/000000/sim_time.npy        one row per tick
+    <run>/track/000000/G-Occupancy.npy     (ticks, blocks)
+    ...
+
+Each column of the open chunk is an .npy file that rows are appended to as
+they arrive; its header (which records the shape) is rewritten when the
+chunk closes, after chunk_ticks ticks. Memory use does not depend on run
+length. A chunk is listed in index.json (replaced atomically) only once it is
+closed, so a reader - or a crash - never sees a half-written chunk.
+
+The files are standard NumPy .npy (format 1.0) written with the stdlib, so
+exporting doesn't need NumPy. load_run() memory-maps the chunks: with NumPy
+installed columns come back as read-only np.memmap arrays, otherwise as
+memoryviews over mmap. Either way nothing is parsed and slicing a time range
+only touches the chunks that overlap it.
+
+Usage:
+    exporter = RunExporter("runs/evening")
+    exporter.record(sim_time, trains={1: state, 2: state}, track=track_doc)
+    exporter.close()
+
+    run = load_run("runs/evening")
+    velocity = run.column("fleet", "velocity")
+    window = run.slice("fleet", 3600.0, 3660.0, ["train_id", "velocity"])
+
+    python run_export.py <run dir> [interval_s]   # record the live JSON files
+"""
+
+import ast
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from double_buffer import load as load_published
+from track_arrays import SEGMENTS as TRACK_SEGMENTS
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+TRAIN_STATES_FILE = os.path.join(PROJECT_ROOT, "train_controller", "data", "train_states.json")
+TRACK_JSON_FILE = os.path.join(PROJECT_ROOT, "track_controller", "New_SW_Code", "track_to_wayside.json")
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+CHUNK_TICKS = 3600
+
+# Fleet columns: column -> (train state field, type code)
+FLEET_FIELDS = {
+    "velocity": ("train_velocity", "d"),
+    "power_command": ("power_command", "d"),
+    "commanded_speed": ("commanded_speed", "d"),
+    "authority": ("commanded_authority", "d"),
+    "speed_limit": ("speed_limit", "d"),
+    "driver_velocity": ("driver_velocity", "d"),
+    "service_brake": ("service_brake", "B"),
+    "emergency_brake": ("emergency_brake", "B"),
+    "manual_mode": ("manual_mode", "B"),
+    "engine_failure": ("train_model_engine_failure", "B"),
+    "signal_failure": ("train_model_signal_failure", "B"),
+    "brake_failure": ("train_model_brake_failure", "B"),
+}
+
+# array type code -> .npy descr (data is always written little endian)
+_DESCR = {"d": "<f8", "B": "|u1", "i": "<i4"}
+_CODES = {descr: code for code, descr in _DESCR.items()}
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_LEN = 118  # magic + length + header = 128 bytes, room for any shape
+
+
+def _npy_header(code: str, shape: tuple) -> bytes:
+    header = repr({"descr": _DESCR[code], "fortran_order": False, "shape": shape})
+    header = header.ljust(_NPY_HEADER_LEN - 1) + "\n"
+    return _NPY_MAGIC + struct.pack("<H", _NPY_HEADER_LEN) + header.encode("latin1")
+
+
+def _read_npy_header(f):
+    """(type code, shape, data offset) of an open .npy file."""
+    magic = f.read(8)
+    if magic[:6] != _NPY_MAGIC[:6]:
+        raise ValueError("not an .npy file")
+    size = struct.unpack("<H" if magic[6] == 1 else "<I", f.read(2 if magic[6] == 1 else 4))[0]
+    header = ast.literal_eval(f.read(size).decode("latin1"))
+    if header["fortran_order"] or header["descr"] not in _CODES:
+        raise ValueError(f"unsupported .npy layout {header}")
+    return _CODES[header["descr"]], tuple(header["shape"]), f.tell()
+
+
+def _file_name(column: str) -> str:
+    return column.replace(" ", "_").replace("/", "_") + ".npy"
+
+
+class _ColumnWriter:
+    """One column of the open chunk: rows appended straight to its .npy file."""
+
+    def __init__(self, path, code, width):
+        self.code = code
+        self.width = width  # values per row (0 = scalar column)
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.file.write(_npy_header(code, (0,) if not width else (0, width)))
+
+    def append(self, values: array) -> None:
+        if sys.byteorder == "big":
+            values.byteswap()
+        self.file.write(values.tobytes())
+        self.rows += len(values) // max(self.width, 1)
+
+    def close(self) -> None:
+        self.file.seek(0)
+        self.file.write(_npy_header(self.code, (self.rows,) if not self.width
+                                    else (self.rows, self.width)))
+        self.file.close()
+
+
+class _TableWriter:
+    """The open chunk of one table."""
+
+    def __init__(self, exporter, name, columns):
+        self.exporter = exporter
+        self.name = name
+        self.columns = columns  # column -> (type code, width)
+        self.writers = None
+        self.chunk = 0
+        self.t_start = self.t_end = None
+
+    def append(self, sim_time, rows: dict) -> None:
+        """rows: column -> array of values for this tick."""
+        if self.writers is None:
+            path = os.path.join(self.exporter.path, self.name, f"{self.chunk:06d}")
+            os.makedirs(path, exist_ok=True)
+            self.writers = {column: _ColumnWriter(os.path.join(path, _file_name(column)),
+                                                  code, width)
+                            for column, (code, width) in self.columns.items()}
+            self.t_start = sim_time
+        for column, values in rows.items():
+            self.writers[column].append(values)
+        self.t_end = sim_time
+
+    def close_chunk(self) -> None:
+        if self.writers is None:
+            return
+        rows = self.writers["sim_time"].rows
+        for writer in self.writers.values():
+            writer.close()
+        self.exporter.index["tables"][self.name]["chunks"].append({
+            "id": f"{self.chunk:06d}", "rows": rows,
+            "t_start": self.t_start, "t_end": self.t_end,
+        })
+        self.writers = None
+        self.chunk += 1
+
+
+class RunExporter:
+    """Streams per-tick fleet and track state into chunked .npy columns.
+
+    Attributes:
+        path: Run directory.
+        chunk_ticks: Ticks per chunk.
+    """
+
+    def __init__(self, path: str, chunk_ticks: int = CHUNK_TICKS, track_segments=None):
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        self.ticks = 0
+        segments = TRACK_SEGMENTS if track_segments is None else track_segments
+        self.track_segments = [(name, code, count) for name, code, count in segments]
+        fleet_columns = {"sim_time": ("d", 0), "train_id": ("i", 0)}
+        fleet_columns.update({column: (code, 0) for column, (_, code) in FLEET_FIELDS.items()})
+        track_columns = {"sim_time": ("d", 0)}
+        track_columns.update({name: (code, count) for name, code, count in self.track_segments})
+        self.index = {
+            "version": INDEX_VERSION,
+            "tables": {
+                name: {"columns": {column: {"dtype": _DESCR[code], "width": width,
+                                            "file": _file_name(column)}
+                                   for column, (code, width) in columns.items()},
+                       "chunks": []}
+                for name, columns in (("fleet", fleet_columns), ("track", track_columns))
+            },
+        }
+        os.makedirs(path, exist_ok=True)
+        self.fleet = _TableWriter(self, "fleet", fleet_columns)
+        self.track = _TableWriter(self, "track", track_columns)
+        self._write_index()
+
+    def record(self, sim_time: float, trains: dict = None, track: dict = None) -> None:
+        """Append one tick.
+
+        Args:
+            sim_time: Simulation time of the tick in seconds (increasing).
+            trains: train_id -> flat train state (or train_states.json style
+                {"inputs": ..., "outputs": ...} sections). Missing fields are
+                recorded as NaN / 0.
+            track: Track arrays by segment name (track_to_wayside.json or
+                TrackArrays.snapshot()); missing segments are recorded as 0.
+        """
+        sim_time = float(sim_time)
+        if trains:
+            ids = sorted(trains)
+            states = [_flatten(trains[train_id]) for train_id in ids]
+            rows = {"sim_time": array("d", [sim_time] * len(ids)),
+                    "train_id": array("i", ids)}
+            for column, (field, code) in FLEET_FIELDS.items():
+                missing = float("nan") if code == "d" else 0
+                rows[column] = array(code, [_value(s.get(field), code, missing) for s in states])
+            self.fleet.append(sim_time, rows)
+        if track is not None:
+            rows = {"sim_time": array("d", [sim_time])}
+            for name, code, count in self.track_segments:
+                values = list(track.get(name) or [])[:count]
+                values += [0] * (count - len(values))
+                rows[name] = array(code, [_value(v, code, 0) for v in values])
+            self.track.append(sim_time, rows)
+        self.ticks += 1
+        if self.ticks % self.chunk_ticks == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """Close the open chunks and list them in the index."""
+        self.fleet.close_chunk()
+        self.track.close_chunk()
+        self._write_index()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_index(self) -> None:
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+
+def _flatten(state) -> dict:
+    if "inputs" in state or "outputs" in state:
+        return {**state.get("inputs", {}), **state.get("outputs", {})}
+    return state
+
+
+def _value(value, code, missing):
+    if value is None:
+        return missing
+    if code == "d":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return missing
+    return int(bool(value)) if code == "B" else int(value)
+
+
+# ----------------------------------------------------------------------
+# Loading
+# ----------------------------------------------------------------------
+class Run:
+    """A recorded run; columns are memory-mapped, chunk by chunk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self._maps = {}
+
+    def tables(self) -> list:
+        return list(self.index["tables"])
+
+    def columns(self, table: str) -> list:
+        return list(self.index["tables"][table]["columns"])
+
+    def chunks(self, table: str) -> list:
+        return self.index["tables"][table]["chunks"]
+
+    def _map(self, table, chunk_id, column):
+        """(type code, shape, mmap, data offset) of one chunk column."""
+        key = (table, chunk_id, column)
+        if key not in self._maps:
+            name = self.index["tables"][table]["columns"][column]["file"]
+            with open(os.path.join(self.path, table, chunk_id, name), "rb") as f:
+                code, shape, offset = _read_npy_header(f)
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[key] = (code, shape, mapped, offset)
+        return self._maps[key]
+
+    def chunk_column(self, table: str, chunk_id: str, column: str, start: int = 0, stop: int = None):
+        """Rows start:stop of one chunk column, without copying.
+
+        Returns an np.memmap with NumPy installed, else a memoryview.
+        """
+        code, shape, mapped, offset = self._map(table, chunk_id, column)
+        rows = shape[0]
+        stop = rows if stop is None else min(stop, rows)
+        start = min(start, stop)
+        if np is not None:
+            data = np.memmap(os.path.join(self.path, table, chunk_id,
+                                          self.index["tables"][table]["columns"][column]["file"]),
+                             dtype=_DESCR[code], mode="r", offset=offset, shape=shape)
+            return data[start:stop]
+        row_bytes = struct.calcsize(code) * (shape[1] if len(shape) > 1 else 1)
+        view = memoryview(mapped)[offset + start * row_bytes:offset + stop * row_bytes]
+        return view.cast(code, (stop - start,) + tuple(shape[1:]))
+
+    def column(self, table: str, column: str):
+        """A whole column: one array (NumPy) or a list of per-chunk memoryviews."""
+        parts = [self.chunk_column(table, chunk["id"], column) for chunk in self.chunks(table)]
+        return _join(parts)
+
+    def slice(self, table: str, start: float, end: float, columns=None) -> dict:
+        """Columns for rows with start <= sim_time < end, reading only the
+        chunks that overlap the range."""
+        columns = self.columns(table) if columns is None else columns
+        parts = {column: [] for column in columns}
+        for chunk in self.chunks(table):
+            if chunk["t_end"] < start or chunk["t_start"] >= end:
+                continue
+            times = self.chunk_column(table, chunk["id"], "sim_time")
+            lo = bisect.bisect_left(times, start)
+            hi = bisect.bisect_left(times, end)
+            for column in columns:
+                parts[column].append(self.chunk_column(table, chunk["id"], column, lo, hi))
+        return {column: _join(p) for column, p in parts.items()}
+
+    def close(self) -> None:
+        for _, _, mapped, _ in self._maps.values():
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # columns handed out still use it; unmapped with the last one
+        self._maps.clear()
+
+
+def _join(parts):
+    if np is not None:
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0)
+    return parts
+
+
+def load_run(path: str) -> Run:
+    """Open a run directory written by RunExporter."""
+    return Run(path)
+
+
+def _read(path):
+    try:
+        return load_published(path)
+    except (OSError, ValueError):
+        return {}
+
+
+def follow(exporter: RunExporter, interval_s: float = 0.1,
+           states_file: str = TRAIN_STATES_FILE, track_file: str = TRACK_JSON_FILE) -> None:
+    """Record the live train_states.json and track_to_wayside.json every
+    interval_s until interrupted; sim_time is seconds since start."""
+    start = time.monotonic()
+    try:
+        while True:
+            states = _read(states_file)
+            trains = {int(key.split("_")[1]): state for key, state in states.items()
+                      if key.startswith("train_") and isinstance(state, dict)}
+            exporter.record(time.monotonic() - start, trains, _read(track_file))
+            time.sleep(interval_s)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python run_export.py <run dir> [interval_s]")
+        sys.exit(2)
+    follow(RunExporter(sys.argv[1]), float(sys.argv[2]) if len(sys.argv) > 2 else 0.1)
@@ -0,0 +1,388 @@
+"""SimBus: named message channels with pluggable transports.
+
+The modules exchange state through the shared JSON files listed in
+channel_notify.CHANNELS. SimBus gives those channels a read/write API whose
+storage is chosen by a transport:
+
+    "file"   - the JSON files on disk (the default), published through
+               double_buffer so readers never see a half-written file
+    "memory" - a dict inside this process; no disk I/O at all
+    "shm"    - one shared-memory segment per channel (binary codec), for
+               several processes on the same machine
+    "broker" - records published through the Unix-socket broker (broker.py)
+
+With the memory transport, CTC dispatch, both wayside controllers, the Train
+Model and train_controller_api can run together in one process (see
+combine_ctc_wayside_test.py) entirely in RAM, which is what high-speed and
+batch runs want. Channel change notification switches to process-local
+counters at the same time (channel_notify.use_process_local()), so waiting
+modules still wake up immediately.
+
+Modules keep their file paths and ask active_bus_for(path) whether a
+non-file bus owns that path; if it returns None they use the file as before.
+
+Usage:
+    set_bus("memory")                     # or GROUP4_BUS=memory / shm / broker / file
+    bus = get_bus()
+    bus.write("wayside_to_train", {...})
+    bus.update("ctc_track_controller", lambda doc: doc["Trains"].clear())
+    bus.flush_to_files()                  # keep the final state of a RAM run
+"""
+
+import errno
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import channel_notify
+from channel_notify import CHANNELS, channel_for_path, current_generation, publish_change
+from double_buffer import publish as publish_file
+from json_cache import read_json, thaw
+from message_codec import decode, encode, encode_for_path, load_file
+
+# Seqlock backoff and segment bookkeeping shared with the train state store
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_controller", "api"))
+from shared_state_store import _MAX_BACKOFF_S, _SPIN_BEFORE_SLEEP, _untrack
+
+try:
+    import fcntl
+except ImportError:  # Windows - process lock only
+    fcntl = None
+
+_MISSING = object()
+
+
+def _missing(channel):
+    return FileNotFoundError(errno.ENOENT, "no message on channel", channel)
+
+
+class FileTransport:
+    """Channels are the shared files on disk (current behavior)."""
+
+    name = "file"
+
+    def read(self, channel):
+        return thaw(read_json(CHANNELS[channel]))
+
+    def write(self, channel, doc):
+        path = CHANNELS[channel]
+        publish_file(path, encode_for_path(path, doc))
+        return publish_change(channel)
+
+    @contextmanager
+    def lock(self, channel):
+        yield
+
+
+class MemoryTransport:
+    """Channels live in a dict in this process.
+
+    Each channel is seeded from its file the first time it is read (unless
+    seed_from_files is False); writes never touch the disk.
+    """
+
+    name = "memory"
+
+    def __init__(self, seed_from_files: bool = True):
+        self.seed_from_files = seed_from_files
+        self._docs = {}
+        self._lock = threading.RLock()
+        channel_notify.use_process_local()
+
+    def _seed(self, channel):
+        if channel in self._docs:
+            return
+        doc = _MISSING
+        path = CHANNELS.get(channel)
+        if self.seed_from_files and path and os.path.exists(path):
+            try:
+                doc = load_file(path)
+            except (OSError, ValueError) as e:
+                print(f"[SimBus] Could not seed {channel} from {path}: {e}")
+        self._docs[channel] = doc
+
+    def read(self, channel):
+        with self._lock:
+            self._seed(channel)
+            doc = self._docs[channel]
+        if doc is _MISSING:
+            raise _missing(channel)
+        return thaw(doc)
+
+    def write(self, channel, doc):
+        doc = thaw(doc)
+        with self._lock:
+            self._docs[channel] = doc
+        return publish_change(channel)
+
+    @contextmanager
+    def lock(self, channel):
+        with self._lock:
+            yield
+
+    def channels(self):
+        with self._lock:
+            return [c for c, doc in self._docs.items() if doc is not _MISSING]
+
+
+class SharedMemoryTransport:
+    """One shared-memory segment per channel holding the encoded message.
+
+    Segment layout: magic, sequence (u64), length (u32), then the message.
+    Writers hold a process lock plus an fcntl file lock and bump the sequence
+    to an odd value while writing; readers retry if it moved (seqlock),
+    backing off with short sleeps so a descheduled writer gets the CPU back,
+    and give up after READ_TIMEOUT_S.
+    """
+
+    name = "shm"
+    SEGMENT_BYTES = 1 << 20
+    READ_TIMEOUT_S = 1.0
+
+    _HEAD = struct.Struct("<4sQI")
+    _MAGIC = b"G4SB"
+
+    def __init__(self, prefix: str = "group4_bus", seed_from_files: bool = True):
+        self.prefix = prefix
+        self.seed_from_files = seed_from_files
+        self._segments = {}
+        self._lock_fds = {}
+        self._held = {}
+        self._lock = threading.RLock()
+
+    def _segment(self, channel):
+        shm = self._segments.get(channel)
+        if shm is not None:
+            return shm
+        from multiprocessing import shared_memory
+        with self.lock(channel):
+            shm = self._segments.get(channel)
+            if shm is not None:
+                return shm
+            name = f"{self.prefix}_{channel}"
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=self.SEGMENT_BYTES)
+                self._HEAD.pack_into(shm.buf, 0, self._MAGIC, 0, 0)
+                created = True
+            except FileExistsError:
+                shm = shared_memory.SharedMemory(name=name)
+                _untrack(shm)
+                created = False
+            self._segments[channel] = shm
+            path = CHANNELS.get(channel)
+            if created and self.seed_from_files and path and os.path.exists(path):
+                try:
+                    self._store(shm, encode(channel, load_file(path), "binary"))
+                except (OSError, ValueError) as e:
+                    print(f"[SimBus] Could not seed {channel} from {path}: {e}")
+        return shm
+
+    def _store(self, shm, payload):
+        if len(payload) > self.SEGMENT_BYTES - self._HEAD.size:
+            raise ValueError(f"message of {len(payload)} bytes does not fit the segment")
+        _, seq, _ = self._HEAD.unpack_from(shm.buf, 0)
+        self._HEAD.pack_into(shm.buf, 0, self._MAGIC, seq + 1, 0)
+        shm.buf[self._HEAD.size:self._HEAD.size + len(payload)] = payload
+        self._HEAD.pack_into(shm.buf, 0, self._MAGIC, seq + 2, len(payload))
+
+    def read(self, channel):
+        buf = self._segment(channel).buf
+        spins = 0
+        backoff = 0.00001
+        deadline = None
+        while True:
+            _, seq, length = self._HEAD.unpack_from(buf, 0)
+            if not seq & 1:
+                payload = bytes(buf[self._HEAD.size:self._HEAD.size + length])
+                if self._HEAD.unpack_from(buf, 0)[1] == seq:
+                    if seq == 0:
+                        raise _missing(channel)
+                    return decode(payload)
+            spins += 1
+            if spins < _SPIN_BEFORE_SLEEP:
+                continue
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.READ_TIMEOUT_S
+            elif now >= deadline:
+                raise BlockingIOError(errno.EAGAIN, "channel is being rewritten", channel)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF_S)
+
+    def write(self, channel, doc):
+        payload = encode(channel, doc, "binary")
+        shm = self._segment(channel)
+        with self.lock(channel):
+            self._store(shm, payload)
+        return publish_change(channel)
+
+    @contextmanager
+    def lock(self, channel):
+        """Cross-process writer lock for a channel (reentrant within a thread)."""
+        with self._lock:
+            fd = self._lock_fds.get(channel)
+            if fd is None and fcntl is not None:
+                fd = self._lock_fds[channel] = os.open(
+                    os.path.join(tempfile.gettempdir(), f"{self.prefix}_{channel}.lock"),
+                    os.O_RDWR | os.O_CREAT, 0o666)
+            outermost = not self._held.get(channel)
+            self._held[channel] = self._held.get(channel, 0) + 1
+            if fd is not None and outermost:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._held[channel] -= 1
+                if fd is not None and outermost:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def close(self, unlink: bool = False) -> None:
+        with self._lock:
+            for shm in self._segments.values():
+                try:
+                    if unlink:
+                        shm.unlink()
+                    shm.close()
+                except (OSError, BufferError):
+                    pass
+            self._segments.clear()
+            for fd in self._lock_fds.values():
+                os.close(fd)
+            self._lock_fds.clear()
+
+
+TRANSPORTS = {
+    "file": FileTransport,
+    "memory": MemoryTransport,
+    "shm": SharedMemoryTransport,
+}
+
+
+def _transport_class(name):
+    if name == "broker" and name not in TRANSPORTS:
+        import broker  # registers BrokerTransport
+    try:
+        return TRANSPORTS[name]
+    except KeyError:
+        raise ValueError(f"unknown SimBus transport {name!r}") from None
+
+
+class SimBus:
+    """Named channels on top of one transport."""
+
+    def __init__(self, transport=None):
+        if transport is None or isinstance(transport, str):
+            transport = _transport_class(transport or "file")()
+        self.transport = transport
+
+    @property
+    def name(self) -> str:
+        return self.transport.name
+
+    def read(self, channel: str, default=_MISSING):
+        """Mutable copy of the channel's current message.
+
+        Raises FileNotFoundError when the channel is empty and no default is given.
+        """
+        try:
+            return self.transport.read(channel)
+        except FileNotFoundError:
+            if default is _MISSING:
+                raise
+            return default
+
+    def write(self, channel: str, doc) -> int:
+        """Replace the channel's message and wake its readers.
+
+        Returns:
+            int: The channel's new generation
+        """
+        return self.transport.write(channel, doc)
+
+    def update(self, channel: str, fn, default=None):
+        """Read-modify-write a channel under the transport's lock.
+
+        fn gets the current message (or a copy of default) and either modifies
+        it in place and returns None, or returns the new message.
+        """
+        with self.transport.lock(channel):
+            doc = self.read(channel, thaw(default) if default is not None else {})
+            result = fn(doc)
+            doc = doc if result is None else result
+            self.write(channel, doc)
+            return doc
+
+    def generation(self, channel: str) -> int:
+        return current_generation(channel)
+
+    def wait_for_change(self, channel: str, after_gen: int, timeout=None) -> int:
+        return channel_notify.wait_for_change(channel, after_gen, timeout)
+
+    def read_path(self, path: str, default=_MISSING):
+        """read() for the channel backed by a shared file path."""
+        return self.read(self._channel(path), default)
+
+    def write_path(self, path: str, doc) -> int:
+        """write() for the channel backed by a shared file path."""
+        return self.write(self._channel(path), doc)
+
+    @staticmethod
+    def _channel(path):
+        channel = channel_for_path(path)
+        if channel is None:
+            raise KeyError(f"{path} is not a SimBus channel")
+        return channel
+
+    def flush_to_files(self, channels=None) -> None:
+        """Write the current message of each channel to its file on disk."""
+        if self.name == "file":
+            return
+        files = FileTransport()
+        if channels is None:
+            channels = (self.transport.channels() if hasattr(self.transport, "channels")
+                        else list(CHANNELS))
+        for channel in channels:
+            try:
+                files.write(channel, self.read(channel))
+            except FileNotFoundError:
+                pass
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus() -> SimBus:
+    """The process-wide bus (transport from GROUP4_BUS, default "file")."""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            name = os.environ.get("GROUP4_BUS", "file").lower()
+            try:
+                _bus = SimBus(name)
+            except OSError as e:
+                print(f"[SimBus] {name} transport unavailable, using files: {e}")
+                _bus = SimBus("file")
+        return _bus
+
+
+def set_bus(bus) -> SimBus:
+    """Install a bus (or a transport name) for every module in this process."""
+    global _bus
+    if not isinstance(bus, SimBus):
+        bus = SimBus(bus)
+    with _bus_lock:
+        _bus = bus
+    return bus
+
+
+def active_bus_for(path: str):
+    """The bus that owns path, or None when path should be used as a file."""
+    bus = get_bus()
+    if bus.name == "file" or channel_for_path(path) is None:
+        return None
+    return bus
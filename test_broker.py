@@ -0,0 +1,125 @@
+"""
+Unit tests for the Unix-socket pub/sub broker.
+
+Run with: python -m unittest test_broker.py
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+_notify_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", _notify_dir.name)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import channel_notify
+from broker import BrokerClient, BrokerTransport, MessageBroker
+from sim_bus import SimBus
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets unavailable")
+class TestBroker(unittest.TestCase):
+    """Last-value cache, change-only publishing and the SimBus transport."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "broker.sock")
+        self.broker = MessageBroker(self.path)
+        self.broker.start()
+        self.thread = threading.Thread(target=self.broker.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.broker.stop()
+        self.thread.join(2.0)
+        self.broker.close()
+        self.tmp.cleanup()
+        channel_notify.use_process_local(False)
+
+    def _client(self, **kwargs):
+        client = BrokerClient(self.path, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_late_subscriber_gets_last_values(self):
+        publisher = self._client()
+        publisher.subscribe(["ctc.trains"])
+        publisher.publish("ctc.trains", {"Train 1": {"Active": 1}, "Train 2": {"Active": 0}})
+        self.assertTrue(_wait_until(lambda: "Train 2" in self.broker.cache["ctc.trains"]))
+        late = self._client()
+        late.subscribe(["ctc.trains"])
+        self.assertEqual(late.view("ctc.trains")["Train 1"], {"Active": 1})
+
+    def test_only_changed_records_are_published(self):
+        received = []
+        subscriber = self._client(on_update=lambda topic, keys: received.append(keys))
+        subscriber.subscribe(["track.arrays"])
+        publisher = self._client()
+        publisher.subscribe(["track.arrays"])
+        self.assertEqual(publisher.publish("track.arrays", {"G-switches": [0, 1], "G-gates": [1, 1]}), 2)
+        self.assertEqual(publisher.publish("track.arrays", {"G-switches": [0, 1], "G-gates": [0, 1]}), 1)
+        self.assertTrue(_wait_until(lambda: len(received) == 2))
+        self.assertEqual(received[1], ["G-gates"])
+        self.assertEqual(subscriber.view("track.arrays")["G-gates"], [0, 1])
+
+    def test_deleted_records(self):
+        publisher = self._client()
+        publisher.subscribe(["train.telemetry"])
+        publisher.publish("train.telemetry", {"train_1": {"x": 1}, "train_2": {"x": 2}})
+        publisher.publish("train.telemetry", {"train_1": {"x": 1}}, deleted=["train_2"])
+        self.assertTrue(_wait_until(lambda: "train_2" not in self.broker.cache["train.telemetry"]))
+
+    def test_transport_merges_concurrent_record_updates(self):
+        first = SimBus(BrokerTransport(self.path, seed_from_files=False))
+        second = SimBus(BrokerTransport(self.path, seed_from_files=False))
+        self.clients += [first.transport.client, second.transport.client]
+        first.write("ctc_track_controller", {"Trains": {"Train 1": {"Train Position": 0},
+                                                        "Train 2": {"Train Position": 0}}})
+        self.assertTrue(_wait_until(
+            lambda: "Train 2" in second.read("ctc_track_controller")["Trains"]))
+
+        # Both read the same document, then each changes a different train
+        doc_a = first.read("ctc_track_controller")
+        doc_b = second.read("ctc_track_controller")
+        doc_a["Trains"]["Train 1"]["Train Position"] = 63
+        doc_b["Trains"]["Train 2"]["Train Position"] = 101
+        first.write("ctc_track_controller", doc_a)
+        # The second client hears about Train 1 before it writes its stale copy
+        self.assertTrue(_wait_until(
+            lambda: second.transport.client.view("ctc.trains")["Train 1"]["Train Position"] == 63))
+        second.write("ctc_track_controller", doc_b)
+
+        expected = {"Train 1": {"Train Position": 63}, "Train 2": {"Train Position": 101}}
+        self.assertTrue(_wait_until(
+            lambda: first.read("ctc_track_controller")["Trains"] == expected
+            and second.read("ctc_track_controller")["Trains"] == expected))
+
+    def test_transport_wakes_local_waiters(self):
+        first = SimBus(BrokerTransport(self.path, seed_from_files=False))
+        second = SimBus(BrokerTransport(self.path, seed_from_files=False))
+        self.clients += [first.transport.client, second.transport.client]
+        gen = second.generation("wayside_to_train")
+        first.write("wayside_to_train", {"Train 1": {"Commanded Speed": 5}})
+        self.assertGreater(second.wait_for_change("wayside_to_train", gen, timeout=2.0), gen)
+        self.assertTrue(_wait_until(
+            lambda: second.read("wayside_to_train", {}).get("Train 1") == {"Commanded Speed": 5}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Unit tests for channel generation counters and change notification.
+
+Run with: python -m unittest test_channel_notify.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+_notify_dir = tempfile.TemporaryDirectory()
+os.environ["GROUP4_NOTIFY_DIR"] = _notify_dir.name
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import channel_notify
+from channel_notify import (ChangeTracker, CHANNELS, channel_for_path, current_generation,
+                            publish_change, publish_path, wait_for_any, wait_for_change)
+
+
+class TestChannelNotify(unittest.TestCase):
+    """Generation counters, waiting and change tracking."""
+
+    def setUp(self):
+        # Another test module may have imported channel_notify first; keep
+        # this test's sockets in its own directory either way
+        patcher = mock.patch.object(channel_notify, "NOTIFY_DIR", _notify_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_publish_bumps_generation(self):
+        gen = current_generation("train_states")
+        self.assertEqual(publish_change("train_states"), gen + 1)
+        self.assertEqual(current_generation("train_states"), gen + 1)
+
+    def test_publish_path_maps_files_to_channels(self):
+        self.assertEqual(channel_for_path(CHANNELS["wayside_to_train"]), "wayside_to_train")
+        self.assertIsNone(publish_path(os.path.join(_notify_dir.name, "other.json")))
+        gen = current_generation("wayside_to_train")
+        self.assertEqual(publish_path(CHANNELS["wayside_to_train"]), gen + 1)
+
+    def test_wait_wakes_on_publish(self):
+        gen = current_generation("ctc_track_controller")
+        timer = threading.Timer(0.1, publish_change, args=("ctc_track_controller",))
+        timer.start()
+        start = time.monotonic()
+        new_gen = wait_for_change("ctc_track_controller", gen, timeout=5.0)
+        self.assertEqual(new_gen, gen + 1)
+        self.assertLess(time.monotonic() - start, 2.0)
+
+    def test_wait_times_out_without_change(self):
+        gen = current_generation("track_to_wayside")
+        start = time.monotonic()
+        self.assertEqual(wait_for_change("track_to_wayside", gen, timeout=0.2), gen)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_wait_for_any_returns_changed_channel(self):
+        gens = {c: current_generation(c) for c in ("train_states", "train_data")}
+        publish_change("train_data")
+        result = wait_for_any(gens.keys(), gens, timeout=1.0)
+        self.assertEqual(result["train_data"], gens["train_data"] + 1)
+        self.assertEqual(result["train_states"], gens["train_states"])
+
+    def test_change_tracker(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            f.write("{}")
+        try:
+            tracker = ChangeTracker("train_data", f.name)
+            self.assertTrue(tracker.changed())
+            self.assertFalse(tracker.changed())
+            publish_change("train_data")
+            self.assertTrue(tracker.changed())
+            with open(f.name, "w") as out:
+                out.write('{"a": 1}')
+            self.assertTrue(tracker.changed())
+            self.assertFalse(tracker.changed())
+        finally:
+            os.remove(f.name)
+
+    def test_waiter_bound_after_a_publish_is_woken_by_the_next(self):
+        if not channel_notify._HAS_UNIX_DGRAM:
+            self.skipTest("Unix datagram sockets unavailable")
+        publish_change("wayside_to_train")  # lists the directory
+        gen = current_generation("wayside_to_train")
+        woken = []
+        waiting = threading.Thread(target=lambda: woken.append(
+            wait_for_change("wayside_to_train", gen, timeout=5.0)))
+        # Binds right after that listing (within one timestamp tick on a
+        # filesystem with coarse timestamps)
+        waiting.start()
+        deadline = time.monotonic() + 5.0
+        while not [n for n in os.listdir(_notify_dir.name) if n.startswith("wayside_to_train@")]:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+        start = time.monotonic()
+        publish_change("wayside_to_train")
+        waiting.join(timeout=5.0)
+        self.assertEqual(woken, [gen + 1])
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_waiter_socket_closed_when_its_thread_exits(self):
+        if not channel_notify._HAS_UNIX_DGRAM:
+            self.skipTest("Unix datagram sockets unavailable")
+
+        def sockets():
+            return [n for n in os.listdir(_notify_dir.name) if n.startswith("track_to_wayside@")]
+
+        before = sockets()
+        thread = threading.Thread(target=wait_for_change, args=(
+            "track_to_wayside", current_generation("track_to_wayside"), 0.01))
+        thread.start()
+        thread.join()
+        deadline = time.monotonic() + 5.0
+        while sockets() != before:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+    def test_stale_waiter_sockets_are_removed(self):
+        if not channel_notify._HAS_UNIX_DGRAM:
+            self.skipTest("Unix datagram sockets unavailable")
+        stale = os.path.join(_notify_dir.name, "train_states@999999-1.sock")
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(stale)
+        sock.close()  # bound path remains, nobody listening
+        publish_change("train_states")
+        self.assertFalse(os.path.exists(stale))
+
+
+if __name__ == '__main__':
+    unittest.main()
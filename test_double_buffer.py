@@ -0,0 +1,98 @@
+"""
+Unit tests for double-buffered publishing of the shared files.
+
+Run with: python -m unittest test_double_buffer.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+_state_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_STATE_DIR", _state_dir.name)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import double_buffer
+import json_cache
+from double_buffer import discard, load, publish, read_bytes, version
+
+
+class TestDoubleBuffer(unittest.TestCase):
+    """Commit protocol, torn-write fallbacks and the mirror file."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "train_states.json")
+        self.files = double_buffer._files_for(self.path)
+
+    def tearDown(self):
+        discard(self.path)
+        self.tmp.cleanup()
+
+    def test_publish_and_load(self):
+        self.assertIsNone(version(self.path))
+        self.assertEqual(publish(self.path, json.dumps({"train_1": 1})), 1)
+        self.assertEqual(publish(self.path, json.dumps({"train_1": 2})), 2)
+        self.assertEqual(load(self.path), {"train_1": 2})
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {"train_1": 2})
+        self.assertEqual(version(self.path)[0], 2)
+
+    def test_slot_being_rewritten_falls_back_to_previous_generation(self):
+        publish(self.path, b'{"gen": 1}')
+        publish(self.path, b'{"gen": 2}')
+        # A writer on generation 4 is halfway through slot 0 while the
+        # marker still names generation 2 in that slot
+        with open(self.files.slot_paths[0], "r+b") as f:
+            f.truncate(20)
+        self.assertEqual(load(self.path), {"gen": 1})
+
+    def test_torn_marker_uses_newest_complete_slot(self):
+        publish(self.path, b'{"gen": 1}')
+        publish(self.path, b'{"gen": 2}')
+        with open(self.files.marker_path, "r+b") as f:
+            f.write(b"\x00\x00")
+        self.assertEqual(load(self.path), {"gen": 2})
+        self.assertEqual(publish(self.path, b'{"gen": 3}'), 3)
+
+    def test_external_mirror_change_is_read(self):
+        publish(self.path, b'{"gen": 1}')
+        token = version(self.path)
+        with open(self.path, "w") as f:
+            json.dump({"edited": True}, f)
+        os.utime(self.path, ns=(1, 1))
+        self.assertNotEqual(version(self.path), token)
+        self.assertEqual(load(self.path), {"edited": True})
+        # Half-written by another program: last committed version instead
+        with open(self.path, "w") as f:
+            f.write('{"edi')
+        self.assertEqual(load(self.path), {"gen": 1})
+
+    def test_deleted_mirror_is_missing(self):
+        publish(self.path, b"{}")
+        os.remove(self.path)
+        with self.assertRaises(FileNotFoundError):
+            read_bytes(self.path)
+
+    def test_slots_live_in_state_dir_and_discard_removes_them(self):
+        publish(self.path, json.dumps({"a": 1}))
+        slot_files = self.files.slot_paths + (self.files.marker_path,)
+        self.assertEqual(os.path.dirname(self.files.marker_path), double_buffer.STATE_DIR)
+        self.assertTrue(os.path.exists(self.files.marker_path))
+        discard(self.path)
+        self.assertFalse(any(os.path.exists(p) for p in slot_files))
+        self.assertIsNone(version(self.path))
+        self.assertEqual(load(self.path), {"a": 1})  # mirror is kept
+        self.assertEqual(publish(self.path, json.dumps({"a": 2})), 1)
+
+    def test_json_cache_reads_committed_version(self):
+        publish(self.path, json.dumps({"a": 1}))
+        self.assertEqual(json_cache.read_json(self.path), {"a": 1})
+        publish(self.path, json.dumps({"a": 2}))
+        self.assertEqual(json_cache.read_json(self.path), {"a": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Unit tests for the stat-validated parsed-JSON cache.
+
+Run with: python -m unittest test_json_cache.py
+"""
+
+import copy
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from json_cache import JsonCache, FrozenDict, FrozenList, thaw
+
+
+class TestJsonCache(unittest.TestCase):
+    """Cache hits, invalidation on change and read-only documents."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "train_data.json")
+        self._write({"train_1": {"outputs": {"velocity_mph": 10.0}}, "G-Occupancy": [0, 1]})
+        self.cache = JsonCache(max_entries=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, data):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def test_unchanged_file_is_a_hit(self):
+        first = self.cache.read(self.path)
+        second = self.cache.read(self.path)
+        self.assertIs(first, second)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+
+    def test_rewrite_is_a_miss(self):
+        self.cache.read(self.path)
+        self._write({"train_1": {"outputs": {"velocity_mph": 12.0}}})
+        doc = self.cache.read(self.path)
+        self.assertEqual(doc["train_1"]["outputs"]["velocity_mph"], 12.0)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_documents_are_read_only(self):
+        doc = self.cache.read(self.path)
+        self.assertIsInstance(doc, dict)
+        self.assertIsInstance(doc["G-Occupancy"], list)
+        with self.assertRaises(TypeError):
+            doc["train_2"] = {}
+        with self.assertRaises(TypeError):
+            doc["train_1"]["outputs"].setdefault("x", 1)
+        with self.assertRaises(TypeError):
+            doc["G-Occupancy"].append(1)
+        self.assertEqual(json.loads(json.dumps(doc)), thaw(doc))
+
+    def test_thaw_and_deepcopy_give_mutable_copies(self):
+        doc = self.cache.read(self.path)
+        for mutable in (thaw(doc), copy.deepcopy(doc)):
+            self.assertNotIsInstance(mutable, FrozenDict)
+            self.assertNotIsInstance(mutable["G-Occupancy"], FrozenList)
+            mutable["train_1"]["outputs"]["velocity_mph"] = 1.0
+        self.assertEqual(self.cache.read(self.path)["train_1"]["outputs"]["velocity_mph"], 10.0)
+
+    def test_lru_eviction(self):
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.tmp.name, f"f{i}.json")
+            with open(path, "w") as f:
+                json.dump({"i": i}, f)
+            paths.append(path)
+            self.cache.read(path)
+        self.assertEqual(self.cache.stats()["entries"], 2)
+        self.cache.read(paths[0])
+        self.assertEqual(self.cache.stats()["misses"], 4)
+
+    def test_invalid_json_is_not_cached(self):
+        with open(self.path, "w") as f:
+            f.write("{")
+        with self.assertRaises(ValueError):
+            self.cache.read(self.path)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Unit tests for the message codecs and schema registry.
+
+Run with: python -m unittest test_message_codec.py
+"""
+
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import message_codec
+from message_codec import codec_name, decode, encode, is_binary, pretty
+
+
+class TestMessageCodec(unittest.TestCase):
+    """Round trips, fallbacks and per-channel codec selection."""
+
+    def setUp(self):
+        self.wayside = {
+            "Train 1": {"Commanded Speed": 12.5, "Commanded Authority": 300.0,
+                        "Beacon": {"Current Station": "Pioneer", "Next Station": "Edgebrook"},
+                        "Train Speed": 11.0},
+            "Train 2": {"Commanded Speed": 0.0, "Commanded Authority": 0.0},
+        }
+        self.track = {"G-Occupancy": [0] * 152, "G-switches": [1, 0, 0, 1, 0, 0],
+                      "G-Commanded Speed": [10.5] * 152}
+        self.track["G-Occupancy"][63] = 1
+
+    def test_binary_round_trip(self):
+        for channel, doc in (("wayside_to_train", self.wayside), ("track_to_wayside", self.track)):
+            payload = encode(channel, doc, "binary")
+            self.assertTrue(is_binary(payload))
+            self.assertEqual(decode(payload), doc)
+            self.assertLess(len(payload), len(encode(channel, doc, "json")))
+
+    def test_ctc_defaults_fit_the_binary_schema(self):
+        # The defaults the wayside and CTC fill in for a new train
+        doc = {"Trains": {"Train 1": {"Active": 0, "Suggested Authority": 0, "Suggested Speed": 0,
+                                      "Train Position": 0, "Train State": 0}},
+               "Block Closure": [], "Switch Suggestion": []}
+        payload = encode("ctc_track_controller", doc, "binary")
+        self.assertTrue(is_binary(payload))
+        self.assertEqual(decode(payload), doc)
+
+    def test_train_states_sections_and_optional_numbers(self):
+        doc = {"inputs": {"commanded_speed": 20.0, "station_side": "left"},
+               "outputs": {"kp": None, "ki": 0.5, "emergency_brake": True}}
+        self.assertEqual(decode(encode("train_states", doc, "binary")), doc)
+        empty = {"inputs": {}, "outputs": {}}
+        self.assertEqual(decode(encode("train_states", empty, "binary")), empty)
+
+    def test_unknown_keys_fall_back_to_compact_json(self):
+        doc = dict(self.wayside)
+        doc["Train 1"] = dict(doc["Train 1"], Extra=1)
+        payload = encode("wayside_to_train", doc, "binary")
+        self.assertFalse(is_binary(payload))
+        self.assertEqual(json.loads(payload), doc)
+
+    def test_top_level_extras_are_kept(self):
+        doc = dict(self.track, note="manual override")
+        self.assertEqual(decode(encode("track_to_wayside", doc, "binary")), doc)
+
+    def test_truncated_binary_raises_json_error(self):
+        payload = encode("wayside_to_train", self.wayside, "binary")
+        with self.assertRaises(json.JSONDecodeError):
+            decode(payload[:20])
+
+    def test_codec_selection_from_environment(self):
+        with mock.patch.dict(os.environ, {"GROUP4_CODEC": "compact",
+                                          "GROUP4_CODEC_TRACK_TO_WAYSIDE": "binary"}):
+            self.assertEqual(codec_name("track_to_wayside"), "binary")
+            self.assertEqual(codec_name("wayside_to_train"), "compact")
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(codec_name("wayside_to_train"), "json")
+            self.assertEqual(encode("wayside_to_train", self.wayside),
+                             json.dumps(self.wayside, indent=4).encode("utf-8"))
+
+    def test_pretty_prints_any_codec(self):
+        payload = encode("wayside_to_train", self.wayside, "binary")
+        self.assertEqual(json.loads(pretty(payload)), self.wayside)
+        self.assertIn("wayside_to_train", message_codec.SCHEMAS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Unit tests for the columnar run exporter.
+
+Run with: python -m unittest test_run_export.py
+"""
+
+import json
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_export import INDEX_FILE, RunExporter, load_run, np
+
+SEGMENTS = [("G-Occupancy", "B", 4), ("G-Commanded Speed", "d", 4)]
+
+
+def _values(column):
+    """Plain list of a column (NumPy array or list of memoryviews)."""
+    if np is not None:
+        return column.tolist()
+    if isinstance(column, list):
+        return [row for part in column for row in part.tolist()]
+    return column.tolist()
+
+
+class TestRunExporter(unittest.TestCase):
+    """Chunked .npy columns, the index and memory-mapped loading."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "run")
+        self.exporter = RunExporter(self.path, chunk_ticks=4, track_segments=SEGMENTS)
+
+    def tearDown(self):
+        self.exporter.close()
+        self.tmp.cleanup()
+
+    def record(self, ticks):
+        for tick in range(ticks):
+            trains = {
+                1: {"inputs": {"train_velocity": float(tick)},
+                    "outputs": {"power_command": 10.0 * tick, "emergency_brake": tick == 3}},
+                2: {"train_velocity": 2.0 * tick, "commanded_authority": 100.0},
+            }
+            track = {"G-Occupancy": [tick % 2, 0, 1], "G-Commanded Speed": [1.5] * 4}
+            self.exporter.record(tick * 0.5, trains, track)
+
+    def test_only_closed_chunks_are_indexed(self):
+        self.record(6)
+        with open(os.path.join(self.path, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.assertEqual([c["rows"] for c in index["tables"]["fleet"]["chunks"]], [8])
+        self.assertEqual(index["tables"]["track"]["chunks"][0]["t_end"], 1.5)
+        self.exporter.close()
+        run = load_run(self.path)
+        self.assertEqual([c["rows"] for c in run.chunks("fleet")], [8, 4])
+        run.close()
+
+    def test_columns_round_trip(self):
+        self.record(10)
+        self.exporter.close()
+        run = load_run(self.path)
+        self.assertEqual(_values(run.column("fleet", "train_id")), [1, 2] * 10)
+        velocity = _values(run.column("fleet", "velocity"))
+        self.assertEqual(velocity[:6], [0.0, 0.0, 1.0, 2.0, 2.0, 4.0])
+        authority = _values(run.column("fleet", "authority"))
+        self.assertTrue(math.isnan(authority[0]))
+        self.assertEqual(authority[1], 100.0)
+        self.assertEqual(_values(run.column("fleet", "emergency_brake"))[6], 1)
+        occupancy = _values(run.column("track", "G-Occupancy"))
+        self.assertEqual(occupancy[:2], [[0, 0, 1, 0], [1, 0, 1, 0]])
+        run.close()
+
+    def test_slice_reads_overlapping_chunks(self):
+        self.record(12)
+        self.exporter.close()
+        run = load_run(self.path)
+        window = run.slice("fleet", 1.5, 2.5, ["sim_time", "train_id"])
+        self.assertEqual(_values(window["sim_time"]), [1.5, 1.5, 2.0, 2.0])
+        self.assertEqual(_values(window["train_id"]), [1, 2, 1, 2])
+        track = run.slice("track", 5.0, 100.0)
+        self.assertEqual(_values(track["sim_time"]), [5.0, 5.5])
+        run.close()
+
+    def test_files_are_standard_npy(self):
+        self.record(4)
+        with open(os.path.join(self.path, "track", "000000", "G-Commanded_Speed.npy"), "rb") as f:
+            data = f.read()
+        self.assertEqual(data[:8], b"\x93NUMPY\x01\x00")
+        self.assertEqual(len(data), 128 + 4 * 4 * 8)
+        self.assertIn(b"'shape': (4, 4)", data[:128])
+        self.assertTrue(data[:128].endswith(b"\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
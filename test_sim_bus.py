@@ -0,0 +1,134 @@
+"""
+Unit tests for the SimBus channels and transports.
+
+Run with: python -m unittest test_sim_bus.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+_notify_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", _notify_dir.name)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import channel_notify
+from sim_bus import MemoryTransport, SharedMemoryTransport, SimBus, active_bus_for, set_bus
+
+
+class TestMemoryBus(unittest.TestCase):
+    """In-process transport: copies, read-modify-write and wake-ups."""
+
+    def setUp(self):
+        self.bus = set_bus(SimBus(MemoryTransport(seed_from_files=False)))
+
+    def tearDown(self):
+        set_bus("file")
+        channel_notify.use_process_local(False)
+
+    def test_read_returns_private_copies(self):
+        self.bus.write("wayside_to_train", {"Train 1": {"Commanded Speed": 10}})
+        doc = self.bus.read("wayside_to_train")
+        doc["Train 1"]["Commanded Speed"] = 99
+        self.assertEqual(self.bus.read("wayside_to_train")["Train 1"]["Commanded Speed"], 10)
+
+    def test_empty_channel(self):
+        with self.assertRaises(FileNotFoundError):
+            self.bus.read("track_to_wayside")
+        self.assertEqual(self.bus.read("track_to_wayside", {}), {})
+
+    def test_update_is_read_modify_write(self):
+        self.bus.write("ctc_track_controller", {"Trains": {"Train 1": {"Active": 1}}})
+        self.bus.update("ctc_track_controller",
+                        lambda doc: doc["Trains"]["Train 1"].update({"Active": 0}))
+        self.assertEqual(self.bus.read("ctc_track_controller")["Trains"]["Train 1"]["Active"], 0)
+
+    def test_waiters_wake_without_files(self):
+        self.assertTrue(channel_notify.is_process_local())
+        gen = self.bus.generation("train_data")
+        timer = threading.Timer(0.05, self.bus.write, args=("train_data", {"train_1": {}}))
+        timer.start()
+        start = time.monotonic()
+        self.assertEqual(self.bus.wait_for_change("train_data", gen, timeout=5.0), gen + 1)
+        self.assertLess(time.monotonic() - start, 2.0)
+
+    def test_paths_route_to_the_bus(self):
+        path = channel_notify.CHANNELS["train_states"]
+        self.assertIs(active_bus_for(path), self.bus)
+        self.assertIsNone(active_bus_for(os.path.join(_notify_dir.name, "other.json")))
+        self.bus.write_path(path, {"train_1": {"inputs": {}, "outputs": {}}})
+        self.assertIn("train_1", self.bus.read("train_states"))
+
+    def test_file_bus_is_not_active(self):
+        set_bus("file")
+        self.assertIsNone(active_bus_for(channel_notify.CHANNELS["train_states"]))
+
+    def test_train_model_io_uses_the_bus(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Train_Model"))
+        import train_model_core
+        path = channel_notify.CHANNELS["wayside_to_train"]
+        with open(path, "rb") as f:
+            on_disk = f.read()
+        train_model_core.safe_write_json(path, {"Train 9": {"Commanded Speed": 5}})
+        self.assertEqual(train_model_core.safe_read_json(path), {"Train 9": {"Commanded Speed": 5}})
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), on_disk)
+
+
+class TestSharedMemoryBus(unittest.TestCase):
+    """Shared-memory transport round trip between two handles."""
+
+    def setUp(self):
+        prefix = f"group4_bus_test_{os.getpid()}"
+        try:
+            self.writer = SharedMemoryTransport(prefix, seed_from_files=False)
+            self.reader = SharedMemoryTransport(prefix, seed_from_files=False)
+            self.writer._segment("wayside_to_train")
+        except (OSError, ImportError) as e:
+            self.skipTest(f"shared memory unavailable: {e}")
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close(unlink=True)
+
+    def test_round_trip(self):
+        with self.assertRaises(FileNotFoundError):
+            self.reader.read("wayside_to_train")
+        doc = {"Train 1": {"Commanded Speed": 12.5, "Commanded Authority": 300.0,
+                           "Beacon": {"Current Station": "Pioneer", "Next Station": ""},
+                           "Train Speed": 11.0}}
+        SimBus(self.writer).write("wayside_to_train", doc)
+        self.assertEqual(SimBus(self.reader).read("wayside_to_train"), doc)
+
+    def hold_write(self, seconds):
+        """Leave the channel mid-write (odd sequence) for `seconds`."""
+        shm = self.writer._segment("wayside_to_train")
+        head = SharedMemoryTransport._HEAD
+        magic, seq, length = head.unpack_from(shm.buf, 0)
+        head.pack_into(shm.buf, 0, magic, seq + 1, length)
+        timer = threading.Timer(seconds, head.pack_into, (shm.buf, 0, magic, seq, length))
+        timer.start()
+        return timer
+
+    def test_read_waits_out_a_slow_writer(self):
+        self.writer.write("wayside_to_train", {"Train 1": {"Commanded Speed": 3.0}})
+        timer = self.hold_write(0.05)
+        started = time.monotonic()
+        self.assertEqual(self.reader.read("wayside_to_train"), {"Train 1": {"Commanded Speed": 3.0}})
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+        timer.join()
+
+    def test_read_gives_up_after_the_timeout(self):
+        self.writer.write("wayside_to_train", {"Train 1": {"Commanded Speed": 3.0}})
+        self.reader.READ_TIMEOUT_S = 0.05
+        timer = self.hold_write(0.2)
+        with self.assertRaises(BlockingIOError):
+            self.reader.read("wayside_to_train")
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Unit tests for the memory-mapped track arrays.
+
+Run with: python -m unittest test_track_arrays.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+_notify_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", _notify_dir.name)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from track_arrays import SEGMENTS, TrackArrays, TrackJsonMirror
+
+
+class TestTrackArrays(unittest.TestCase):
+    """Layout, seeding, in-place slot updates and the JSON mirror."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.tmp.name, "track_to_wayside.json")
+        self.bin_path = os.path.join(self.tmp.name, "track_to_wayside.bin")
+        seed = {name: [0] * count for name, _, count in SEGMENTS}
+        seed["G-Failures"][7] = 1
+        seed["G-Commanded Speed"][0] = 12.5
+        with open(self.json_path, "w") as f:
+            json.dump(seed, f)
+        self.arrays = TrackArrays(self.bin_path, self.json_path)
+
+    def tearDown(self):
+        self.arrays.close()
+        self.tmp.cleanup()
+
+    def test_seeded_from_json(self):
+        self.assertEqual(self.arrays.read("G-Failures")[7], 1)
+        self.assertEqual(self.arrays.read("G-Commanded Speed")[0], 12.5)
+        for name, _, count in SEGMENTS:
+            self.assertEqual(len(self.arrays.read(name)), count)
+
+    def test_writes_are_shared_between_mappings(self):
+        other = TrackArrays(self.bin_path, self.json_path)
+        try:
+            with self.arrays.writer() as data:
+                data["G-switches"][2] = True
+                data["G-Commanded Authority"][1] = 300
+            self.assertEqual(other.read("G-switches"), [0, 0, 1, 0, 0, 0])
+            self.assertEqual(other.read("G-Commanded Authority")[1], 300.0)
+            self.assertEqual(other.view("G-switches")[2], 1)
+        finally:
+            other.close()
+
+    def test_only_touched_segments_change_version(self):
+        before = {name: self.arrays.version(name) for name, _, _ in SEGMENTS}
+        with self.arrays.writer() as data:
+            data["G-gates"][1] = 1
+            data["G-lights"][0] = 0  # unchanged value
+        self.assertEqual(self.arrays.version("G-gates"), before["G-gates"] + 2)
+        self.assertEqual(self.arrays.version("G-lights"), before["G-lights"])
+
+    def test_update_overwrites_whole_arrays(self):
+        self.arrays.update({"G-lights": [1] * 24, "G-Commanded Speed": [5.0] * 200, "Other": [1]})
+        self.assertEqual(self.arrays.read("G-lights"), [1] * 24)
+        self.assertEqual(self.arrays.read("G-Commanded Speed"), [5.0] * 152)
+
+    def test_mirror_exports_and_imports_failures(self):
+        mirror = TrackJsonMirror(self.arrays, self.json_path)
+        self.arrays.update({"G-switches": [1, 1, 0, 0, 0, 0]})
+        mirror.sync_now()
+        with open(self.json_path) as f:
+            self.assertEqual(json.load(f)["G-switches"], [1, 1, 0, 0, 0, 0])
+
+        doc = self.arrays.snapshot()
+        doc["G-Failures"][3] = 1
+        doc["G-switches"] = [0] * 6  # not an external segment: ignored
+        with open(self.json_path, "w") as f:
+            json.dump(doc, f)
+        os.utime(self.json_path, ns=(1, 1))
+        mirror.sync_now()
+        self.assertEqual(self.arrays.read("G-Failures")[3], 1)
+        self.assertEqual(self.arrays.read("G-switches"), [1, 1, 0, 0, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
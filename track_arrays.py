@@ -0,0 +1,373 @@
+"""Memory-mapped fixed-width track arrays (binary twin of track_to_wayside.json).
+
+track_to_wayside.json only holds fixed-length arrays, yet every wayside
+parses and rewrites the whole file to change a few slots. With
+TRACK_ARRAYS_MMAP=1 the arrays live in a small binary file that every process
+maps into memory; waysides update their own slots in place and readers copy
+a segment without any JSON parsing.
+
+Layout (little endian):
+    header      magic "G4TA", layout version (u16), segment count (u16),
+                data offset (u32), padding to 16 bytes
+    descriptors one per segment: version (u64), name (24s), count (u32),
+                offset (u32), type code (c) + padding (48 bytes each)
+    data        each segment's values, 8-byte aligned
+                ("B" = 0/1 flags, "d" = float64 per block)
+
+Every segment has its own version counter used as a seqlock: writers make it
+odd while they write and even again when done, readers retry a copy if the
+version moved. Writers are serialized with a process lock plus an fcntl lock
+on the file (POSIX only).
+
+TrackJsonMirror keeps track_to_wayside.json up to date for readers outside
+this repo, and imports G-Failures when the Track Model rewrites the JSON.
+
+Usage:
+    arrays = get_track_arrays()          # None unless TRACK_ARRAYS_MMAP=1
+    faults = arrays.read("G-Failures")
+    with arrays.writer() as data:
+        data["G-switches"][2] = 1
+"""
+
+import atexit
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows - process lock only
+    fcntl = None
+
+from channel_notify import publish_change
+from double_buffer import discard as discard_published, load as load_published, publish as publish_file
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+TRACK_JSON_FILE = os.path.join(PROJECT_ROOT, "track_controller", "New_SW_Code", "track_to_wayside.json")
+TRACK_ARRAYS_FILE = os.path.join(PROJECT_ROOT, "track_controller", "New_SW_Code", "track_to_wayside.bin")
+
+USE_TRACK_ARRAYS = os.environ.get("TRACK_ARRAYS_MMAP", "0") == "1"
+
+# (name, type code, count) - same arrays and lengths as track_to_wayside.json
+SEGMENTS = [
+    ("G-Occupancy", "B", 152),
+    ("G-Failures", "B", 456),
+    ("G-lights", "B", 24),
+    ("G-switches", "B", 6),
+    ("G-gates", "B", 2),
+    ("G-Commanded Speed", "d", 152),
+    ("G-Commanded Authority", "d", 152),
+]
+# Segments written by the Track Model into the JSON file
+EXTERNAL_SEGMENTS = ("G-Failures",)
+
+_MAGIC = b"G4TA"
+_LAYOUT_VERSION = 1
+_HEADER = struct.Struct("<4sHHI4x")
+_DESC = struct.Struct("<Q24sIIc7x")
+_VERSION = struct.Struct("<Q")
+READ_RETRIES = 1000
+
+
+class _Segment:
+    def __init__(self, index, name, code, count, offset):
+        self.index = index
+        self.name = name
+        self.code = code
+        self.count = count
+        self.offset = offset
+        self.size = count * struct.calcsize(code)
+        self.version_offset = _HEADER.size + index * _DESC.size
+        self.convert = int if code == "B" else float
+
+
+class _Slots:
+    """Writable view of one segment handed out by TrackArrays.writer()."""
+
+    def __init__(self, arrays, segment):
+        self._arrays = arrays
+        self._segment = segment
+        self._view = arrays.view(segment.name)
+        self.dirty = False
+
+    def _touch(self):
+        if not self.dirty:
+            self._arrays._bump(self._segment)  # odd: write in progress
+            self.dirty = True
+
+    def __len__(self):
+        return self._segment.count
+
+    def __getitem__(self, index):
+        return self._view[index]
+
+    def __setitem__(self, index, value):
+        value = self._segment.convert(value)
+        if self._view[index] != value:
+            self._touch()
+            self._view[index] = value
+
+    def assign(self, values) -> None:
+        """Overwrite the segment from the start with values (extra values are ignored)."""
+        for i, value in enumerate(list(values)[:self._segment.count]):
+            self[i] = value
+
+
+class TrackArrays:
+    """mmap-backed track arrays shared by every process on the machine."""
+
+    def __init__(self, path: str = TRACK_ARRAYS_FILE, seed_json: str = TRACK_JSON_FILE):
+        """Map the array file, creating (and seeding from seed_json) if needed."""
+        self.path = path
+        self.segments = {}
+        offset = _HEADER.size + len(SEGMENTS) * _DESC.size
+        offset = (offset + 7) & ~7
+        self.data_offset = offset
+        for index, (name, code, count) in enumerate(SEGMENTS):
+            segment = _Segment(index, name, code, count, offset)
+            self.segments[name] = segment
+            offset = (offset + segment.size + 7) & ~7
+        self.total_size = offset
+
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        self._file_lock()
+        try:
+            if not self._layout_matches():
+                self._initialize(seed_json)
+        finally:
+            self._file_unlock()
+        self.map = mmap.mmap(self._fd, self.total_size)
+        self.buf = memoryview(self.map)
+
+    # ------------------------------------------------------------------
+    # Creation and locking
+    # ------------------------------------------------------------------
+    def _file_lock(self):
+        self._lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _file_unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _layout_matches(self) -> bool:
+        if os.fstat(self._fd).st_size != self.total_size:
+            return False
+        head = os.pread(self._fd, self.data_offset, 0)
+        magic, version, count, data_offset = _HEADER.unpack_from(head, 0)
+        if (magic, version, count, data_offset) != (_MAGIC, _LAYOUT_VERSION, len(SEGMENTS),
+                                                    self.data_offset):
+            return False
+        for segment in self.segments.values():
+            _, name, seg_count, offset, code = _DESC.unpack_from(head, segment.version_offset)
+            if (name.rstrip(b"\x00").decode(), seg_count, offset, code.decode()) != (
+                    segment.name, segment.count, segment.offset, segment.code):
+                return False
+        return True
+
+    def _initialize(self, seed_json):
+        image = bytearray(self.total_size)
+        _HEADER.pack_into(image, 0, _MAGIC, _LAYOUT_VERSION, len(SEGMENTS), self.data_offset)
+        for segment in self.segments.values():
+            _DESC.pack_into(image, segment.version_offset, 0, segment.name.encode(),
+                            segment.count, segment.offset, segment.code.encode())
+        doc = {}
+        if seed_json and os.path.exists(seed_json):
+            try:
+                with open(seed_json, "rb") as f:
+                    doc = json.loads(f.read())
+            except (OSError, ValueError) as e:
+                print(f"[TrackArrays] Could not seed from {seed_json}: {e}")
+        for name, segment in self.segments.items():
+            values = list(doc.get(name, []))[:segment.count]
+            values = [segment.convert(v or 0) for v in values]
+            values += [segment.convert(0)] * (segment.count - len(values))
+            struct.pack_into(f"<{segment.count}{segment.code}", image, segment.offset, *values)
+        os.ftruncate(self._fd, self.total_size)
+        os.pwrite(self._fd, bytes(image), 0)
+
+    # ------------------------------------------------------------------
+    # Accessors
+    # ------------------------------------------------------------------
+    def view(self, name: str) -> memoryview:
+        """Raw memoryview of a segment (no seqlock; use read() for a coherent copy)."""
+        segment = self.segments[name]
+        return self.buf[segment.offset:segment.offset + segment.size].cast(segment.code)
+
+    def version(self, name: str) -> int:
+        return _VERSION.unpack_from(self.buf, self.segments[name].version_offset)[0]
+
+    def versions(self) -> tuple:
+        return tuple(self.version(name) for name in self.segments)
+
+    def read(self, name: str) -> list:
+        """Coherent copy of one segment."""
+        segment = self.segments[name]
+        view = self.view(name)
+        for _ in range(READ_RETRIES):
+            before = _VERSION.unpack_from(self.buf, segment.version_offset)[0]
+            if before & 1:
+                continue
+            values = view.tolist()
+            if _VERSION.unpack_from(self.buf, segment.version_offset)[0] == before:
+                return values
+        raise BlockingIOError(f"track segment {name} is being rewritten")
+
+    def snapshot(self) -> dict:
+        """All segments as a dict shaped like track_to_wayside.json."""
+        return {name: self.read(name) for name in self.segments}
+
+    def _bump(self, segment):
+        offset = segment.version_offset
+        _VERSION.pack_into(self.buf, offset, _VERSION.unpack_from(self.buf, offset)[0] + 1)
+
+    @contextmanager
+    def writer(self):
+        """Update slots in place: yields {name: slots}; only touched segments change version."""
+        self._file_lock()
+        slots = {name: _Slots(self, segment) for name, segment in self.segments.items()}
+        try:
+            yield slots
+        finally:
+            changed = [s for s in slots.values() if s.dirty]
+            for s in changed:
+                self._bump(s._segment)  # even: write complete
+                s._view.release()
+            for s in slots.values():
+                if not s.dirty:
+                    s._view.release()
+            self._file_unlock()
+        if changed:
+            publish_change("track_to_wayside")
+
+    def update(self, patch: dict) -> None:
+        """Overwrite whole arrays from a dict shaped like track_to_wayside.json."""
+        with self.writer() as data:
+            for name, values in (patch or {}).items():
+                if name in data:
+                    data[name].assign(values)
+
+    def close(self) -> None:
+        try:
+            self.buf.release()
+            self.map.close()
+        except (BufferError, ValueError):
+            pass
+        os.close(self._fd)
+
+
+class TrackJsonMirror:
+    """Keeps track_to_wayside.json in step with the array file.
+
+    Exports the arrays whenever a segment version changed, and imports
+    EXTERNAL_SEGMENTS when someone else (the Track Model) rewrote the JSON.
+    Only one process mirrors at a time (non-blocking lock on a side file).
+    """
+
+    def __init__(self, arrays: TrackArrays, path: str = TRACK_JSON_FILE, interval_s: float = 0.5):
+        self.arrays = arrays
+        self.path = path
+        self.interval_s = interval_s
+        self._last_versions = None
+        self._last_signature = None
+        self._owner_fd = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            return None
+
+    def _is_owner(self) -> bool:
+        if self._owner_fd is not None or fcntl is None:
+            return True
+        fd = os.open(self.arrays.path + ".mirror.lock", os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._owner_fd = fd
+        return True
+
+    def sync_now(self) -> None:
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        signature = self._signature()
+        if signature is not None and signature != self._last_signature:
+            try:
+                doc = load_published(self.path)
+                self.arrays.update({k: doc[k] for k in EXTERNAL_SEGMENTS if k in doc})
+            except (OSError, ValueError):
+                pass  # half-written by the other side; picked up next time
+        versions = self.arrays.versions()
+        if versions == self._last_versions and signature == self._last_signature:
+            return
+        payload = json.dumps(self.arrays.snapshot(), indent=4)
+        publish_file(self.path, payload)
+        self._last_versions = versions
+        self._last_signature = self._signature()
+
+    def _run(self):
+        while self._running:
+            try:
+                if self._is_owner():
+                    self.sync_now()
+            except Exception as e:
+                print(f"[TrackArrays] JSON mirror failed: {e}")
+            time.sleep(self.interval_s)
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop mirroring; the owning process also drops the JSON file's A/B slots."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_s * 2)
+        if self._owner_fd is not None:
+            discard_published(self.path)
+
+
+_arrays = None
+_arrays_lock = threading.Lock()
+
+
+def get_track_arrays():
+    """This process's TrackArrays (with its JSON mirror), or None if disabled."""
+    global _arrays
+    if not USE_TRACK_ARRAYS:
+        return None
+    with _arrays_lock:
+        if _arrays is None:
+            arrays = TrackArrays()
+            arrays.mirror = TrackJsonMirror(arrays)
+            arrays.mirror.start()
+            atexit.register(arrays.mirror.stop)
+            _arrays = arrays
+        return _arrays
+
+
+if __name__ == "__main__":
+    # python track_arrays.py [file] : print segment versions and contents
+    arrays = TrackArrays(sys.argv[1] if len(sys.argv) > 1 else TRACK_ARRAYS_FILE)
+    for name in arrays.segments:
+        print(f"{name:<24} v{arrays.version(name):<6} {arrays.read(name)}")
@@ -10,6 +10,27 @@ from track_controller.New_SW_Code.Green_Line_PLC_XandLdown import process_states
 import threading
 import csv
 
+from channel_notify import ChangeTracker, publish_path
+from json_cache import read_json, thaw
+from message_codec import encode_for_path
+from sim_bus import active_bus_for
+from double_buffer import publish as publish_file
+from track_arrays import get_track_arrays
+
+
+def _load_json(path, readonly=False):
+    """Parse path, sharing the parsed document with other readers in this process.
+
+    With readonly=True the cached document itself is returned and must not be
+    modified. Channels owned by an in-memory/shared-memory SimBus are read
+    from the bus instead of the file.
+    """
+    bus = active_bus_for(path)
+    if bus is not None:
+        return bus.read_path(path)
+    data = read_json(path)
+    return data if readonly else thaw(data)
+
 
 class sw_wayside_controller:
     def __init__(self, vital,plc=""):
@@ -55,6 +76,10 @@ class sw_wayside_controller:
         self.blocks_with_gates: list = [19,108]
         self.running: bool = True
         self.file_lock = threading.Lock()
+        # mmap-backed track arrays (TRACK_ARRAYS_MMAP=1): slots are updated in place
+        self.track_arrays = get_track_arrays()
+        # Skip re-parsing shared inputs that have not changed since the last tick
+        self._ctc_tracker = ChangeTracker("ctc_track_controller", self.ctc_comm_file)
         self.cmd_trains: dict = {}
         # Per-train tracking dictionaries
         self.train_idx: dict = {}  # Track index for each train
@@ -251,12 +276,20 @@ class sw_wayside_controller:
                 "Train 4": {"Commanded Speed": 0, "Commanded Authority": 0, "Beacon": {"Current Station": "", "Next Station": ""}, "Train Speed": 0},
                 "Train 5": {"Commanded Speed": 0, "Commanded Authority": 0, "Beacon": {"Current Station": "", "Next Station": ""}, "Train Speed": 0}
             }
-            with open(self.train_comm_file, 'w') as f:
-                json.dump(clean_data, f, indent=4)
+            self._write_channel(self.train_comm_file, clean_data)
             print(f"[{self.active_plc}] Initialized wayside_to_train.json")
         except Exception as e:
             print(f"[{self.active_plc}] Warning: Could not initialize wayside_to_train.json: {e}")
 
+    def _write_channel(self, path, data):
+        """Write a shared JSON file (or its SimBus channel) and wake its readers."""
+        bus = active_bus_for(path)
+        if bus is not None:
+            bus.write_path(path, data)
+            return
+        publish_file(path, encode_for_path(path, data))
+        publish_path(path)
+
     def stop(self):
         # Stop PLC processing loop
         self.running = False
@@ -419,10 +452,9 @@ class sw_wayside_controller:
                         # This is a handoff - take over the train
                         # Read current authority from the shared JSON file (written by previous controller)
                         try:
-                            with open(self.train_comm_file, 'r') as f:
-                                train_data = json.load(f)
-                                current_auth = train_data.get(train, {}).get("Commanded Authority", sug_auth)
-                                current_speed = train_data.get(train, {}).get("Commanded Speed", self.active_trains[train]["Suggested Speed"])
+                            train_data = _load_json(self.train_comm_file)
+                            current_auth = train_data.get(train, {}).get("Commanded Authority", sug_auth)
+                            current_speed = train_data.get(train, {}).get("Commanded Speed", self.active_trains[train]["Suggested Speed"])
                         except:
                             # If file not found or error, use CTC values
                             current_auth = sug_auth
@@ -734,14 +766,12 @@ class sw_wayside_controller:
                 for retry in range(max_retries):
                     try:
                         with self.file_lock:
-                            with open(self.ctc_comm_file,'r') as f:
-                                data = json.load(f)
+                            data = _load_json(self.ctc_comm_file)
                             # Update position AND set Active=0 when authority is exhausted
                             data["Trains"][cmd_train]["Train Position"] = final_pos
                             data["Trains"][cmd_train]["Active"] = 0
                             print(f"[Wayside] {cmd_train} authority exhausted at position {final_pos}, set Active=0")
-                            with open(self.ctc_comm_file,'w') as f:
-                                json.dump(data,f,indent=4)
+                            self._write_channel(self.ctc_comm_file, data)
                         break
                     except (json.JSONDecodeError, IOError) as e:
                         if retry < max_retries - 1:
@@ -797,13 +827,11 @@ class sw_wayside_controller:
                     if new_pos == -1:
                         auth = 0
                         with self.file_lock:
-                            with open(self.ctc_comm_file,'r') as f:
-                                data = json.load(f)
+                            data = _load_json(self.ctc_comm_file)
                             # Update Active AND preserve position
                             data["Trains"][cmd_train]["Active"] = 0
                             data["Trains"][cmd_train]["Train Position"] = pos
-                            with open(self.ctc_comm_file,'w') as f:
-                                json.dump(data,f,indent=4)
+                            self._write_channel(self.ctc_comm_file, data)
                         ttr.append(cmd_train)
                     else:
                         # Successfully moved to new block
@@ -821,11 +849,9 @@ class sw_wayside_controller:
                         for retry in range(max_retries):
                             try:
                                 with self.file_lock:
-                                    with open(self.ctc_comm_file,'r') as f:
-                                        data = json.load(f)
+                                    data = _load_json(self.ctc_comm_file)
                                     data["Trains"][cmd_train]["Train Position"] = new_pos
-                                    with open(self.ctc_comm_file,'w') as f:
-                                        json.dump(data,f,indent=4)
+                                    self._write_channel(self.ctc_comm_file, data)
                                 break
                             except (json.JSONDecodeError, IOError) as e:
                                 if retry < max_retries - 1:
@@ -854,12 +880,10 @@ class sw_wayside_controller:
                     try:
                         with self.file_lock:
                             # Read and write in same critical section to avoid race condition
-                            with open(self.ctc_comm_file,'r') as f:
-                                data = json.load(f)
+                            data = _load_json(self.ctc_comm_file)
                             # Update ONLY this train's position, keep everything else from fresh read
                             data["Trains"][cmd_train]["Train Position"] = self.cmd_trains[cmd_train]["pos"]
-                            with open(self.ctc_comm_file,'w') as f:
-                                json.dump(data,f,indent=4)
+                            self._write_channel(self.ctc_comm_file, data)
                         break  # Success, exit retry loop
                     except (json.JSONDecodeError, IOError) as e:
                         if retry < max_retries - 1:
@@ -1125,8 +1149,7 @@ class sw_wayside_controller:
             train_data_path = os.path.join(os.path.dirname(os.path.dirname(current_dir)), 'Train_Model', 'train_data.json')
             
             if os.path.exists(train_data_path):
-                with open(train_data_path, 'r') as f:
-                    train_data = json.load(f)
+                train_data = _load_json(train_data_path, readonly=True)
                     
                 # Read speeds for each train
                 for i in range(1, 6):
@@ -1145,97 +1168,100 @@ class sw_wayside_controller:
         return train_speeds
     
     def load_inputs_ctc(self):
+        if not self._ctc_tracker.changed():
+            return  # CTC file unchanged since the last tick
         max_retries = 3
         for retry in range(max_retries):
             try:
                 with self.file_lock:
-                    with open(self.ctc_comm_file, 'r') as f:
-                        data = json.load(f)
-                        # Ensure trains section exists and contains expected keys
-                        trains = data.get("Trains", {})
-                        for tname, tinfo in list(trains.items()):
-                            if not isinstance(tinfo, dict):
-                                trains[tname] = {}
-                                tinfo = trains[tname]
-                            # Set defaults for keys the controller expects
-                            tinfo.setdefault("Train Position", 0)
-                            tinfo.setdefault("Train State", "")
-                            tinfo.setdefault("Active", 0)
-                            tinfo.setdefault("Suggested Authority", 0)
-                            tinfo.setdefault("Suggested Speed", 0)
-                        # Update in-memory structures
-                        data["Trains"] = trains
-                        self.active_trains = trains
-                        self.closed_blocks = data.get("Block Closure", [])
-                        self.ctc_sugg_switches = data.get("Switch Suggestion", [])
+                    data = _load_json(self.ctc_comm_file)
+                    # Ensure trains section exists and contains expected keys
+                    trains = data.get("Trains", {})
+                    for tname, tinfo in list(trains.items()):
+                        if not isinstance(tinfo, dict):
+                            trains[tname] = {}
+                            tinfo = trains[tname]
+                        # Set defaults for keys the controller expects
+                        tinfo.setdefault("Train Position", 0)
+                        tinfo.setdefault("Train State", 0)
+                        tinfo.setdefault("Active", 0)
+                        tinfo.setdefault("Suggested Authority", 0)
+                        tinfo.setdefault("Suggested Speed", 0)
+                    # Update in-memory structures
+                    data["Trains"] = trains
+                    self.active_trains = trains
+                    self.closed_blocks = data.get("Block Closure", [])
+                    self.ctc_sugg_switches = data.get("Switch Suggestion", [])
                 break  # Success
             except (json.JSONDecodeError, IOError) as e:
                 if retry < max_retries - 1:
                     time.sleep(0.01)
                 else:
                     print(f"Warning: Failed to load CTC inputs after {max_retries} attempts: {e}")
+                    self._ctc_tracker.reset()
             
             
 
     def load_inputs_track(self):
         #read track to wayside json file
         with self.file_lock:
-            with open(self.track_comm_file, 'r') as f:
-                data = json.load(f)
-                #self.occupied_blocks = data.get("G-Occupancy", [0]*152)
-                self.input_faults = data.get("G-Failures", [0]*152*3)
+            if self.track_arrays is not None:
+                self.input_faults = self.track_arrays.read("G-Failures")
+                return
+            data = _load_json(self.track_comm_file)
+            #self.occupied_blocks = data.get("G-Occupancy", [0]*152)
+            self.input_faults = data.get("G-Failures", [0]*152*3)
         
      
     def load_track_outputs(self):
         with self.file_lock:
-            with open(self.track_comm_file, 'r') as f:
-                data = json.load(f)
+            if self.track_arrays is not None:
+                with self.track_arrays.writer() as data:
+                    self._update_track_outputs(data)
+                return
+            data = _load_json(self.track_comm_file)
+            self._update_track_outputs(data)
 
-            # Update only the switches, lights, and gates managed by this controller
-            if self.active_plc == "Green_Line_PLC_XandLup.py":
-                # Controller 1: switches 0-3, lights 0-11 & 20-23, gate 0
-                for i in range(4):
-                    data["G-switches"][i] = self.switch_states[i]
-                for i in range(12):
-                    data["G-lights"][i] = self.light_states[i]
-                for i in range(20, 24):
-                    data["G-lights"][i] = self.light_states[i]
-                data["G-gates"][0] = self.gate_states[0]
-                
-                # Controller 1: Update occupancy for blocks 0-69 and 144-150 only
-                for i in range(0, 70):
-                    data["G-Occupancy"][i] = self.occupied_blocks[i]
-                for i in range(144, 151):
-                    data["G-Occupancy"][i] = self.occupied_blocks[i]
-                
-            elif self.active_plc == "Green_Line_PLC_XandLdown.py":
-                # Controller 2: switches 4-5, lights 12-19, gate 1
-                for i in range(4, 6):
-                    data["G-switches"][i] = self.switch_states[i]
-                for i in range(12, 20):
-                    data["G-lights"][i] = self.light_states[i]
-                data["G-gates"][1] = self.gate_states[1]
-                
-                # Controller 2: Update occupancy for blocks 70-143 only
-                for i in range(70, 144):
-                    data["G-Occupancy"][i] = self.occupied_blocks[i]
+            # Now rewrite cleanly (overwrite file)
+            self._write_channel(self.track_comm_file, data)
 
-            # Handle up to 5 trains - each controller updates only its managed trains
-            train_ids = ["Train 1", "Train 2", "Train 3", "Train 4", "Train 5"]
+    def _update_track_outputs(self, data):
+        # Update only the switches, lights, and gates managed by this controller
+        if self.active_plc == "Green_Line_PLC_XandLup.py":
+            # Controller 1: switches 0-3, lights 0-11 & 20-23, gate 0
+            for i in range(4):
+                data["G-switches"][i] = self.switch_states[i]
+            for i in range(12):
+                data["G-lights"][i] = self.light_states[i]
+            for i in range(20, 24):
+                data["G-lights"][i] = self.light_states[i]
+            data["G-gates"][0] = self.gate_states[0]
             
-            for i, train_id in enumerate(train_ids):
-                if train_id in self.cmd_trains:
-                    data["G-Commanded Authority"][i] = self.cmd_trains[train_id]["cmd auth"]
-                    data["G-Commanded Speed"][i] = self.cmd_trains[train_id]["cmd speed"]
-                
-
+            # Controller 1: Update occupancy for blocks 0-69 and 144-150 only
+            for i in range(0, 70):
+                data["G-Occupancy"][i] = self.occupied_blocks[i]
+            for i in range(144, 151):
+                data["G-Occupancy"][i] = self.occupied_blocks[i]
             
-
-            # Now rewrite cleanly (overwrite file)
-            with open(self.track_comm_file, 'w') as f:
-                json.dump(data, f, indent=4)
-
+        elif self.active_plc == "Green_Line_PLC_XandLdown.py":
+            # Controller 2: switches 4-5, lights 12-19, gate 1
+            for i in range(4, 6):
+                data["G-switches"][i] = self.switch_states[i]
+            for i in range(12, 20):
+                data["G-lights"][i] = self.light_states[i]
+            data["G-gates"][1] = self.gate_states[1]
             
+            # Controller 2: Update occupancy for blocks 70-143 only
+            for i in range(70, 144):
+                data["G-Occupancy"][i] = self.occupied_blocks[i]
+
+        # Handle up to 5 trains - each controller updates only its managed trains
+        train_ids = ["Train 1", "Train 2", "Train 3", "Train 4", "Train 5"]
+        
+        for i, train_id in enumerate(train_ids):
+            if train_id in self.cmd_trains:
+                data["G-Commanded Authority"][i] = self.cmd_trains[train_id]["cmd auth"]
+                data["G-Commanded Speed"][i] = self.cmd_trains[train_id]["cmd speed"]
 
     def load_ctc_outputs(self):
         pass
@@ -1244,8 +1270,7 @@ class sw_wayside_controller:
         """Write commanded speed and authority directly to train communication file"""
         # Don't use file_lock here since both controllers need to write independently
         try:
-            with open(self.train_comm_file, 'r') as f:
-                data = json.load(f)
+            data = _load_json(self.train_comm_file)
         except:
             # If file doesn't exist or is corrupted, create fresh structure
             data = {
@@ -1299,8 +1324,7 @@ class sw_wayside_controller:
                         # If no beacon at current block, keep existing beacon data (don't clear it)
                 # else: don't update - other controller is managing this train
 
-        with open(self.train_comm_file, 'w') as f:
-            json.dump(data, f, indent=4)
+        self._write_channel(self.train_comm_file, data)
 
 
         
@@ -7,8 +7,8 @@ import os
 os.environ["TK_SILENCE_DEPRECATION"] = "1"
 import tkinter as tk
 from typing import List, Dict
+import sys
 import json
-import tempfile
 
 from hw_wayside_controller import HW_Wayside_Controller
 from hw_display import HW_Display
@@ -101,6 +101,17 @@ CTC_OUT_FILE   = os.path.join(_PROJECT_ROOT, "hw_wayside_to_ctc.json")         #
 TRACK_COMM_FILE = os.path.join(_PROJECT_ROOT, "track_controller", "New_SW_Code", "track_to_wayside.json")  # Shared state between controllers
 
 POLL_MS = 500
+
+# Change notification and parsed-JSON cache: files that did not change
+# between polls are not re-parsed
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from channel_notify import publish_path
+from json_cache import read_json
+from message_codec import encode_for_path
+from sim_bus import active_bus_for
+from track_arrays import get_track_arrays
+from double_buffer import publish as publish_file
 ENABLE_LOCAL_AUTH_DECAY = True  # locally decrement authority based on speed 
 
 
@@ -129,8 +140,7 @@ def _read_ctc_json() -> dict:
         return defaults
 
     try:
-        with open(CTC_IN_FILE, "r", encoding="utf-8") as f:
-            raw = json.load(f) or {}
+        raw = read_json(CTC_IN_FILE) or {}
     except Exception as e:
         print(f"[WARN] JSON read failed: {e}")
         return defaults
@@ -187,12 +197,21 @@ def _read_ctc_json() -> dict:
 
 
 def _safe_read_track_json() -> dict:
-    """Read the shared track state file (matching SW behavior)."""
+    """Read the shared track state file (matching SW behavior).
+
+    Arrays in the returned dict are shared with the JSON cache and read-only;
+    only the top level is a private copy.
+    """
+    arrays = get_track_arrays()
+    if arrays is not None:
+        return arrays.snapshot()
+    bus = active_bus_for(TRACK_COMM_FILE)
+    if bus is not None:
+        return bus.read_path(TRACK_COMM_FILE, {}) or {}
     if not os.path.exists(TRACK_COMM_FILE):
         return {}
     try:
-        with open(TRACK_COMM_FILE, "r", encoding="utf-8") as f:
-            return json.load(f) or {}
+        return dict(read_json(TRACK_COMM_FILE) or {})
     except Exception as e:
         print(f"[WARN] Track file read failed: {e}")
         return {}
@@ -203,15 +222,19 @@ def _atomic_write_track_json(patch: dict) -> None:
     Reads current state, updates HW's portion, writes atomically.
     """
     try:
+        arrays = get_track_arrays()
+        if arrays is not None:
+            # Only HW's arrays are rewritten, in place
+            arrays.update(patch)
+            return
         base = _safe_read_track_json()
         base.update(patch or {})
-        d = os.path.dirname(TRACK_COMM_FILE) or "."
-        with tempfile.NamedTemporaryFile("w", delete=False, dir=d, encoding="utf-8") as tmp:
-            json.dump(base, tmp, indent=2)
-            tmp.flush()
-            os.fsync(tmp.fileno())
-            tmp_path = tmp.name
-        os.replace(tmp_path, TRACK_COMM_FILE)
+        bus = active_bus_for(TRACK_COMM_FILE)
+        if bus is not None:
+            bus.write_path(TRACK_COMM_FILE, base)
+            return
+        publish_file(TRACK_COMM_FILE, encode_for_path(TRACK_COMM_FILE, base))
+        publish_path(TRACK_COMM_FILE)
     except Exception as e:
         print(f"[WARN] Track file write failed: {e}")
 
@@ -231,13 +254,11 @@ def _write_ctc_occupancy(occupancy: List[int]) -> None:
         base: Dict = {}
 
         if os.path.exists(CTC_IN_FILE):
-            with open(CTC_IN_FILE, "r", encoding="utf-8") as f:
-                base = json.load(f) or {}
+            base = dict(read_json(CTC_IN_FILE) or {})
 
         base["G-Occupancy"] = list(occupancy)
 
-        with open(CTC_OUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(base, f, indent=2)
+        publish_file(CTC_OUT_FILE, json.dumps(base, indent=2))
 
     except Exception as e:
         print(f"[WARN] CTC occupancy write failed: {e}")
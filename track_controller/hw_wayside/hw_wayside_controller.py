@@ -7,10 +7,34 @@ import time
 from hw_vital_check import HW_Vital_Check
 import importlib.util
 import os
+import sys
 import json
 import csv
 import datetime
 
+# Shared-file infrastructure (change notification, cache, codecs, SimBus, A/B publishing)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from channel_notify import ChangeTracker, publish_path
+from json_cache import read_json, thaw
+from message_codec import encode_for_path
+from sim_bus import active_bus_for
+from double_buffer import publish as publish_file
+
+
+def _load_json(path: str, readonly: bool = False) -> Any:
+    """Parse `path`, sharing the parsed document with other readers in this process.
+
+    With readonly=True the cached document itself is returned and must not be modified.
+    Channels owned by an in-memory/shared-memory SimBus are read from the bus.
+    """
+    bus = active_bus_for(path)
+    if bus is not None:
+        return bus.read_path(path)
+    data = read_json(path)
+    return data if readonly else thaw(data)
+
 plc_module = None
 
 _SWITCH_NAMES = {0: "Left", 1: "Right"} 
@@ -205,6 +229,8 @@ class HW_Wayside_Controller:
         self.cumulative_distance: Dict[str, float] = {}
         self.last_ctc_authority: Dict[str, float] = {}  # Track last CTC authority for reactivation detection
         self.file_lock = threading.Lock()
+        # Skip re-parsing shared inputs that have not changed since the last tick
+        self._ctc_tracker = ChangeTracker("ctc_track_controller", self.ctc_comm_file)
         self.trains_to_handoff = []
         
         # managed_blocks: blocks this controller writes commands for
@@ -507,16 +533,27 @@ class HW_Wayside_Controller:
 
     # ------------------ CTC inputs (multi-train) -------------------
 
+    def _write_channel(self, path: str, data: Any) -> None:
+        """Atomically write a shared JSON file (or its SimBus channel) and wake its readers."""
+        bus = active_bus_for(path)
+        if bus is not None:
+            bus.write_path(path, data)
+            return
+        publish_file(path, encode_for_path(path, data))
+        publish_path(path)
+
     def load_ctc_inputs(self) -> None:
         """Read `self.ctc_comm_file` and populate `self.active_trains`.
 
         This reads the CTC-supplied train information (Active, Suggested Authority, Suggested Speed, Train Position).
+        The file is only re-parsed when it changed since the last call.
         """
+        if not self._ctc_tracker.changed():
+            return
         try:
             if not os.path.exists(self.ctc_comm_file):
                 return
-            with open(self.ctc_comm_file, 'r', encoding='utf-8') as f:
-                data = json.load(f) or {}
+            data = _load_json(self.ctc_comm_file) or {}
             trains = data.get('Trains', {}) or {}
             # Ensure expected keys exist for robustness
             for tname, tinfo in list(trains.items()):
@@ -529,7 +566,7 @@ class HW_Wayside_Controller:
                 tinfo.setdefault('Suggested Speed', 0)
             self.active_trains = trains
         except Exception:
-            pass
+            self._ctc_tracker.reset()
 
     def _load_track_data(self):
         """Load track data from CSV file: section, block_num, length, bidirectional, forward_next, reverse_next, etc.
@@ -853,13 +890,12 @@ class HW_Wayside_Controller:
                     if is_handoff:
                         # Read prior controller outputs (wayside_to_train) to obtain remaining auth/speed
                         try:
-                            with open(self.train_comm_file, 'r', encoding='utf-8') as f:
-                                train_data = json.load(f)
-                                # File stores in mph/yards, convert to m/s and meters
-                                current_auth_yds = train_data.get(tname, {}).get('Commanded Authority', sug_auth_m * 1.09361)
-                                current_speed_mph = train_data.get(tname, {}).get('Commanded Speed', sug_speed_mph)
-                                current_auth = float(current_auth_yds) * 0.9144  # yards to meters
-                                current_speed = float(current_speed_mph) * 0.44704  # mph to m/s
+                            train_data = _load_json(self.train_comm_file)
+                            # File stores in mph/yards, convert to m/s and meters
+                            current_auth_yds = train_data.get(tname, {}).get('Commanded Authority', sug_auth_m * 1.09361)
+                            current_speed_mph = train_data.get(tname, {}).get('Commanded Speed', sug_speed_mph)
+                            current_auth = float(current_auth_yds) * 0.9144  # yards to meters
+                            current_speed = float(current_speed_mph) * 0.44704  # mph to m/s
                         except Exception:
                             current_auth = sug_auth_m
                             current_speed = sug_speed_ms
@@ -995,8 +1031,7 @@ class HW_Wayside_Controller:
                             with self.file_lock:
                                 if not os.path.exists(self.ctc_comm_file):
                                     break
-                                with open(self.ctc_comm_file, 'r', encoding='utf-8') as f:
-                                    data = json.load(f)
+                                data = _load_json(self.ctc_comm_file)
                                 if 'Trains' in data and tname in data['Trains']:
                                     data['Trains'][tname]['Active'] = 0
                                     data['Trains'][tname]['Train Position'] = final_pos
@@ -1006,8 +1041,7 @@ class HW_Wayside_Controller:
                                     data['Trains'].setdefault(tname, {})
                                     data['Trains'][tname]['Active'] = 0
                                     data['Trains'][tname]['Train Position'] = final_pos
-                                with open(self.ctc_comm_file, 'w', encoding='utf-8') as f:
-                                    json.dump(data, f, indent=2)
+                                self._write_channel(self.ctc_comm_file, data)
                             break
                         except (json.JSONDecodeError, IOError) as e:
                             if retry < max_retries - 1:
@@ -1036,14 +1070,12 @@ class HW_Wayside_Controller:
                                 with self.file_lock:
                                     if not os.path.exists(self.ctc_comm_file):
                                         break
-                                    with open(self.ctc_comm_file, 'r', encoding='utf-8') as f:
-                                        data = json.load(f)
+                                    data = _load_json(self.ctc_comm_file)
                                     data.setdefault('Trains', {})
                                     data['Trains'].setdefault(tname, {})
                                     data['Trains'][tname]['Active'] = 0
                                     data['Trains'][tname]['Train Position'] = pos
-                                    with open(self.ctc_comm_file, 'w', encoding='utf-8') as f:
-                                        json.dump(data, f, indent=2)
+                                    self._write_channel(self.ctc_comm_file, data)
                                 break
                             except (json.JSONDecodeError, IOError) as e:
                                 if retry < max_retries - 1:
@@ -1065,13 +1097,11 @@ class HW_Wayside_Controller:
                                 with self.file_lock:
                                     if not os.path.exists(self.ctc_comm_file):
                                         break
-                                    with open(self.ctc_comm_file, 'r', encoding='utf-8') as f:
-                                        data = json.load(f)
+                                    data = _load_json(self.ctc_comm_file)
                                     data.setdefault('Trains', {})
                                     data['Trains'].setdefault(tname, {})
                                     data['Trains'][tname]['Train Position'] = new_pos
-                                    with open(self.ctc_comm_file, 'w', encoding='utf-8') as f:
-                                        json.dump(data, f, indent=2)
+                                    self._write_channel(self.ctc_comm_file, data)
                                 break
                             except (json.JSONDecodeError, IOError) as e:
                                 if retry < max_retries - 1:
@@ -1136,8 +1166,7 @@ class HW_Wayside_Controller:
             tm_path = os.path.join(base, '..', '..', 'Train_Model', 'train_data.json')
             tm_path = os.path.normpath(tm_path)
             if os.path.exists(tm_path):
-                with open(tm_path, 'r', encoding='utf-8') as f:
-                    tdata = json.load(f)
+                tdata = _load_json(tm_path, readonly=True)
                 for i in range(1, 6):
                     key = f'train_{i}'
                     tname = f'Train {i}'
@@ -1159,8 +1188,7 @@ class HW_Wayside_Controller:
         try:
             # Read existing file or create fresh structure
             try:
-                with open(self.train_comm_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                data = _load_json(self.train_comm_file)
             except Exception:
                 data = {}
             # Ensure trains keys
@@ -1204,15 +1232,7 @@ class HW_Wayside_Controller:
                                 data[tkey]["Beacon"]["Next Station"] = block_data['reverse_beacon']['next_station']
                             # If no beacon at current block, keep existing beacon data (don't clear it)
 
-            # Atomic write
-            d = os.path.dirname(self.train_comm_file) or '.'
-            import tempfile
-            with tempfile.NamedTemporaryFile('w', delete=False, dir=d, encoding='utf-8') as tmp:
-                json.dump(data, tmp, indent=2)
-                tmp.flush()
-                os.fsync(tmp.fileno())
-                tmp_path = tmp.name
-            os.replace(tmp_path, self.train_comm_file)
+            self._write_channel(self.train_comm_file, data)
         except Exception as e:
             print(f"[WARN] load_train_outputs failed: {e}")
 
@@ -1454,10 +1474,7 @@ class HW_Wayside_Controller:
         we populate Train 1 fields; otherwise leave zeros. Uses atomic tempfile write.
         """
         try:
-            base = {}
-            if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    base = json.load(f) or {}
+            base = _load_json(filepath) or {}
         except Exception:
             base = {}
 
@@ -1480,16 +1497,8 @@ class HW_Wayside_Controller:
         except Exception:
             pass
 
-        # Atomic write
         try:
-            d = os.path.dirname(filepath) or '.'
-            import tempfile
-            with tempfile.NamedTemporaryFile('w', delete=False, dir=d, encoding='utf-8') as tmp:
-                json.dump(base, tmp, indent=2)
-                tmp.flush()
-                os.fsync(tmp.fileno())
-                tmp_path = tmp.name
-            os.replace(tmp_path, filepath)
+            self._write_channel(filepath, base)
         except Exception as e:
             print(f"[WARN] wayside->train write failed: {e}")
 
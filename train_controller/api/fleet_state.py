@@ -0,0 +1,425 @@
+"""In-memory fleet state for the REST server, persisted write-behind.
+
+The server used to parse train_states.json for every GET and rewrite it for
+every POST, all under one file lock. FleetState keeps every train's
+{"inputs": ..., "outputs": ...} in memory instead and is the source of truth
+for the endpoints: reads and writes are dict operations under one in-memory
+lock.
+
+A background thread (start()/stop()) persists the trains changed since the
+last pass every interval seconds, and once more on stop(). Only the fields
+changed through the server are written, on top of a fresh read of the file,
+so changes that local modules (controller UIs, Train Model, train manager)
+made to other fields are kept. Those changes are merged back into memory on
+the same pass; fields with pending server-side writes win.
+
+Every change bumps a monotonic fleet version, and versions[train_key] holds
+the version of each train's last change (field_versions[train_key][field]
+that of each field, for patch()). The last CHANGE_LOG_SIZE changes are
+kept as (version, train_key, changed fields) so stream clients can be sent
+just what changed since the version they have (changes_since(),
+wait_for_changes()).
+
+Versions start over when the server restarts, so clients get them as tags,
+"<epoch>.<version>" (tag()), with an epoch that is new for every FleetState;
+parse_tag() turns a tag from another run into None. A train's tag is its
+ETag.
+
+Usage:
+    fleet = FleetState(TRAIN_STATES_FILE, load=..., save=...)
+    fleet.start()
+    fleet.update(3, {'power_command': 1200.0})
+    state = fleet.get(3)
+    fleet.stop()          # final flush
+"""
+
+import os
+import threading
+import uuid
+from collections import deque
+from itertools import islice
+
+try:
+    from . import train_state_schema as schema
+except ImportError:
+    import train_state_schema as schema
+
+# Seconds between write-behind passes
+WRITE_BEHIND_S = float(os.environ.get("GROUP4_WRITE_BEHIND_S", "0.2"))
+
+# Changes kept for stream clients resuming from a version
+CHANGE_LOG_SIZE = 10000
+
+SECTIONS = (schema.INPUTS, schema.OUTPUTS)
+
+
+def _sections(entry) -> dict:
+    """{"inputs": ..., "outputs": ...} of a train_states.json entry (legacy flat entries are split)."""
+    if not isinstance(entry, dict):
+        return {schema.INPUTS: {}, schema.OUTPUTS: {}}
+    if schema.INPUTS in entry or schema.OUTPUTS in entry:
+        return {section: dict(entry.get(section) or {}) for section in SECTIONS}
+    return schema.split_fields(entry)
+
+
+def _flat(sections) -> dict:
+    """Inputs and outputs of a train merged into one {field: value} dict."""
+    return {**sections[schema.INPUTS], **sections[schema.OUTPUTS]}
+
+
+def parse_train_id(key) -> int:
+    """Train ID from a "3" or "train_3" key."""
+    return int(str(key)[6:] if str(key).startswith("train_") else key)
+
+
+def bulk_update(body: dict, apply) -> dict:
+    """Validate a bulk update and apply the valid part of it in one call.
+
+    Args:
+        body: The caller's train keys ("3" or "train_3") -> {field: value}.
+        apply: Function taking {train_id: validated fields} and returning
+            {train_id: extra result fields}, e.g. {"version": 7}.
+
+    Returns:
+        dict: A result under each of the caller's keys, as given:
+        {"ok": True, ...} or {"ok": False, "error": ...}.
+    """
+    results, valid, keys = {}, {}, {}
+    for key, updates in body.items():
+        try:
+            train_id = parse_train_id(key)
+            if not isinstance(updates, dict):
+                raise ValueError("expected an object of fields")
+            fields = schema.validate(updates)
+        except ValueError as e:
+            results[key] = {"ok": False, "error": str(e)}
+            continue
+        valid.setdefault(train_id, {}).update(fields)
+        keys.setdefault(train_id, []).append(key)
+    for train_id, extra in apply(valid).items():
+        for key in keys[train_id]:
+            results[key] = {"ok": True, **extra}
+    return results
+
+
+class FleetState:
+    """Every train's state, in memory, with write-behind persistence.
+
+    Attributes:
+        path: The train_states.json file persisted to.
+        epoch: Identifies this run's versions in tags.
+        version: Fleet version, bumped by every change.
+        versions: train_key -> version of the train's last change.
+        field_versions: train_key -> {field: version of its last change}.
+    """
+
+    def __init__(self, path: str, load, save, interval: float = WRITE_BEHIND_S):
+        """
+        Args:
+            path: train_states.json.
+            load: Function returning the parsed file (an unchanged file may
+                return the same object, which skips the merge).
+            save: Function writing a whole document to the file.
+            interval: Seconds between write-behind passes.
+        """
+        self.path = path
+        self._load = load
+        self._save = save
+        self.interval = interval
+        self._lock = threading.RLock()
+        self.trains = {}
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.versions = {}
+        self.field_versions = {}
+        self._dirty = {}      # train_key -> {(section, field)}
+        self._deleted = set()
+        self._seen = None     # last document merged from the file
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)  # (version, train_key, fields or None)
+        self._changed = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+        self.merge_from_file()
+
+    @staticmethod
+    def key(train_id) -> str:
+        return f"train_{int(train_id)}"
+
+    def tag(self, version: int) -> str:
+        """Tag of a version of this run ("<epoch>.<version>")."""
+        return f"{self.epoch}.{version}"
+
+    def parse_tag(self, tag):
+        """Version from a tag of this run (or a bare version number), else None."""
+        epoch, _, version = str(tag).strip().strip('"').rpartition(".")
+        if epoch and epoch != self.epoch:
+            return None
+        try:
+            return int(version)
+        except ValueError:
+            return None
+
+    def _bump(self, key, fields):
+        """Record a change to a train: fields is {name: new value}, None if it was deleted."""
+        self.version += 1
+        self.versions[key] = self.version
+        if fields is None:
+            self.field_versions.pop(key, None)
+        else:
+            changed = self.field_versions.setdefault(key, {})
+            for name in fields:
+                changed[name] = self.version
+        self._changes.append((self.version, key, fields))
+        self._changed.notify_all()
+
+    # ------------------------------------------------------------------
+    # Change log
+    # ------------------------------------------------------------------
+    def changes_since(self, version: int, keys=None):
+        """Changes after a version, oldest first.
+
+        Args:
+            version: Fleet version the caller is up to date with.
+            keys: Only return changes to these train keys (all trains if None).
+
+        Returns:
+            list: (version, train_key, fields) tuples, fields None for a
+            deleted train; None if the log no longer reaches back to the
+            version (or it is from a previous server run), in which case the
+            caller has to start over from a snapshot.
+        """
+        with self._lock:
+            if version == self.version:
+                return []
+            if version > self.version or not self._changes or self._changes[0][0] > version + 1:
+                return None
+            # Versions in the log are consecutive
+            start = version + 1 - self._changes[0][0]
+            return [change for change in islice(self._changes, start, None)
+                    if keys is None or change[1] in keys]
+
+    def wait_for_changes(self, version: int, timeout: float) -> int:
+        """Block until the fleet version passes a version (or timeout); returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def get(self, train_id):
+        """Copy of a train's sections, or None if it doesn't exist."""
+        with self._lock:
+            sections = self.trains.get(self.key(train_id))
+            if sections is None:
+                return None
+            return {section: dict(values) for section, values in sections.items()}
+
+    def get_versioned(self, train_id):
+        """(copy of a train's sections, version of its last change); (None, None) if missing."""
+        with self._lock:
+            state = self.get(train_id)
+            return state, None if state is None else self.versions[self.key(train_id)]
+
+    def get_many(self, train_ids) -> dict:
+        """Copies of several trains' sections, read under one lock (None for missing trains)."""
+        with self._lock:
+            return {train_id: self.get(train_id) for train_id in train_ids}
+
+    def snapshot(self) -> dict:
+        """Copy of every train's sections, keyed train_X."""
+        with self._lock:
+            return {key: {section: dict(values) for section, values in sections.items()}
+                    for key, sections in self.trains.items()}
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def update(self, train_id, fields: dict) -> dict:
+        """Apply validated fields to a train (created with defaults if new).
+
+        Returns:
+            dict: Copy of the train's sections after the update.
+        """
+        key = self.key(train_id)
+        with self._lock:
+            sections = self.trains.get(key)
+            changed = set()
+            new = sections is None
+            if new:
+                sections = self.trains[key] = schema.default_sections()
+                changed = {(section, name) for section in SECTIONS for name in sections[section]}
+                self._deleted.discard(key)
+            for section, values in schema.split_fields(fields).items():
+                current = sections[section]
+                for name, value in values.items():
+                    if name not in current or current[name] != value:
+                        current[name] = value
+                        changed.add((section, name))
+            if changed:
+                self._dirty.setdefault(key, set()).update(changed)
+                self._bump(key, _flat(sections) if new else
+                           {name: sections[section][name] for section, name in changed})
+            return {section: dict(values) for section, values in sections.items()}
+
+    def patch(self, train_id, fields: dict, base: int):
+        """Apply validated fields unless another writer changed one of them after version base.
+
+        Changes to other fields since base don't matter, so concurrent
+        writers of different fields all succeed.
+
+        Returns:
+            tuple: (sections, version, conflicts): the train after the call
+            and its version, and the fields changed since base (nothing is
+            applied if there are any). sections is None if the train doesn't
+            exist.
+        """
+        key = self.key(train_id)
+        with self._lock:
+            if key not in self.trains:
+                return None, None, []
+            changed = self.field_versions.get(key, {})
+            conflicts = sorted(name for name in fields if changed.get(name, 0) > base)
+            state = self.get(train_id) if conflicts else self.update(train_id, fields)
+            return state, self.versions[key], conflicts
+
+    def update_many(self, updates: dict) -> dict:
+        """Apply validated fields to several trains in one locked operation.
+
+        Args:
+            updates: train_id -> fields.
+
+        Returns:
+            dict: train_id -> version of the train after its update.
+        """
+        with self._lock:
+            versions = {}
+            for train_id, fields in updates.items():
+                self.update(train_id, fields)
+                versions[train_id] = self.versions.get(self.key(train_id), 0)
+            return versions
+
+    def reset(self, train_id) -> dict:
+        """Put a train back to the schema defaults; returns its sections."""
+        key = self.key(train_id)
+        with self._lock:
+            sections = self.trains[key] = schema.default_sections()
+            self._dirty[key] = {(section, name) for section in SECTIONS for name in sections[section]}
+            self._deleted.discard(key)
+            self._bump(key, _flat(sections))
+            return {section: dict(values) for section, values in sections.items()}
+
+    def delete(self, train_id) -> bool:
+        """Remove a train; False if it didn't exist."""
+        key = self.key(train_id)
+        with self._lock:
+            if self.trains.pop(key, None) is None:
+                return False
+            self._dirty.pop(key, None)
+            self._deleted.add(key)
+            self._bump(key, None)
+            return True
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def merge_from_file(self) -> None:
+        """Take in changes local modules made to the file.
+
+        Fields with pending server-side writes keep their in-memory value;
+        trains missing from the file are dropped unless they have pending
+        writes. An empty or unreadable file is ignored.
+        """
+        doc = self._load()
+        if doc is self._seen or not doc or not isinstance(doc, dict):
+            return
+        with self._lock:
+            self._seen = doc
+            on_disk = {key for key in doc if key.startswith("train_")}
+            for key in on_disk:
+                if key in self._deleted:
+                    continue
+                incoming = _sections(doc[key])
+                sections = self.trains.get(key)
+                if sections is None:
+                    self.trains[key] = incoming
+                    self._bump(key, _flat(incoming))
+                    continue
+                pending = self._dirty.get(key, ())
+                changed = {}
+                for section in SECTIONS:
+                    current = sections[section]
+                    for name, value in incoming[section].items():
+                        if (section, name) in pending:
+                            continue
+                        if name not in current or current[name] != value:
+                            current[name] = value
+                            changed[name] = value
+                if changed:
+                    self._bump(key, changed)
+            for key in list(self.trains):
+                if key not in on_disk and key not in self._dirty:
+                    del self.trains[key]
+                    self._bump(key, None)
+
+    def flush(self) -> None:
+        """Write the pending changes onto a fresh read of the file.
+
+        Trains the file doesn't have (new ones, or all of them if the file
+        is missing or unreadable) are written whole.
+        """
+        with self._lock:
+            if not self._dirty and not self._deleted:
+                return
+        doc = self._load()
+        doc = {key: _sections(entry) if key.startswith("train_") else entry
+               for key, entry in (doc.items() if isinstance(doc, dict) else ())}
+        with self._lock:
+            dirty, deleted = self._dirty, self._deleted
+            self._dirty, self._deleted = {}, set()
+            for key in deleted:
+                doc.pop(key, None)
+            for key, sections in self.trains.items():
+                if key not in doc:
+                    doc[key] = {section: dict(values) for section, values in sections.items()}
+                    continue
+                for section, name in dirty.get(key, ()):
+                    doc[key][section][name] = sections[section][name]
+        try:
+            self._save(doc)
+        except Exception:
+            # Keep the changes pending for the next pass
+            with self._lock:
+                for key, fields in dirty.items():
+                    if key in self.trains:
+                        self._dirty.setdefault(key, set()).update(fields)
+                self._deleted |= deleted - set(self.trains)
+            raise
+
+    def sync(self) -> None:
+        """One write-behind pass: merge file changes in, then flush."""
+        self.merge_from_file()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[FleetState] Write-behind failed: {e}")
+
+    def start(self) -> None:
+        """Start the write-behind thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="fleet-write-behind",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the write-behind thread and persist what is still pending."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(1.0, self.interval * 2))
+            self._thread = None
+        self.flush()
@@ -0,0 +1,267 @@
+"""Sharded per-train state store.
+
+train_states.json holds every train, so each save re-parses and rewrites all
+of them behind one lock. With TRAIN_STATE_SHARDS=1 every train gets its own
+file instead, plus a small manifest listing the trains:
+
+    data/train_states.d/manifest.json   {"trains": [1, 2, ...]}
+    data/train_states.d/train_<id>.json {"inputs": {...}, "outputs": {...}}
+
+Writers of a train take one of STRIPES striped locks (a process lock plus an
+fcntl lock on a stripe lock file, POSIX only), read-modify-write only that
+train's shard and publish it through double_buffer. Trains on different
+stripes never wait for each other, and readers take no lock at all: shards
+are double-buffered, so a read always sees the last complete version.
+
+The store has the same interface as SharedStateStore, so the API, the REST
+server and the Train Model use either one, and JsonExportAdapter assembles
+train_states.json from the shards for modules that still read the file.
+"""
+
+import json
+import os
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows - process lock only
+    fcntl = None
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from double_buffer import publish as publish_file, version
+from json_cache import read_json
+
+SHARD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "data", "train_states.d")
+MANIFEST_NAME = "manifest.json"
+STRIPES = 16
+
+
+class ShardedStateStore:
+    """One JSON shard per train plus a manifest, with striped writer locks."""
+
+    def __init__(self, input_template: dict, output_template: dict,
+                 directory: str = SHARD_DIR, stripes: int = STRIPES):
+        """Open (or create) the shard directory.
+
+        Args:
+            input_template: Default inputs (field name -> default value)
+            output_template: Default outputs (field name -> default value)
+            directory: Directory holding the manifest and the shards
+            stripes: Number of writer locks shared by the trains
+        """
+        self.directory = directory
+        self.input_defaults = dict(input_template)
+        self.output_defaults = dict(output_template)
+        self.stripes = stripes
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._lock_fds = [None] * stripes
+        self._manifest_lock = threading.Lock()
+        self._manifest_fd = self._open_lock("manifest.lock")
+
+        # The first process to open the store exports train_states.json
+        self.owner = True
+        self._owner_fd = self._open_lock("export.lock")
+        if self._owner_fd is not None:
+            try:
+                fcntl.flock(self._owner_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.owner = False
+                os.close(self._owner_fd)
+                self._owner_fd = None
+
+    # ------------------------------------------------------------------
+    # Files and locking
+    # ------------------------------------------------------------------
+    def _open_lock(self, name):
+        if fcntl is None:
+            return None
+        return os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, 0o666)
+
+    def shard_path(self, train_id: int) -> str:
+        return os.path.join(self.directory, f"train_{int(train_id)}.json")
+
+    def _stripe(self, train_id):
+        stripe = int(train_id) % self.stripes
+        self._locks[stripe].acquire()
+        fd = self._lock_fds[stripe]
+        if fd is None and fcntl is not None:
+            fd = self._lock_fds[stripe] = self._open_lock(f"stripe_{stripe}.lock")
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        return stripe
+
+    def _release(self, stripe):
+        fd = self._lock_fds[stripe]
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._locks[stripe].release()
+
+    def _load(self, path):
+        """Parsed shard or manifest (read-only when it comes from the JSON cache)."""
+        return read_json(path)
+
+    def _publish(self, path, doc):
+        publish_file(path, json.dumps(doc, indent=4))
+
+    # ------------------------------------------------------------------
+    # Manifest
+    # ------------------------------------------------------------------
+    def train_ids(self) -> list:
+        try:
+            return sorted(int(t) for t in self._load(self.manifest_path).get("trains", []))
+        except (OSError, ValueError):
+            return []
+
+    def _update_manifest(self, add=None, remove=None):
+        with self._manifest_lock:
+            if self._manifest_fd is not None:
+                fcntl.flock(self._manifest_fd, fcntl.LOCK_EX)
+            try:
+                trains = set(self.train_ids())
+                before = set(trains)
+                if add is not None:
+                    trains.add(int(add))
+                if remove is not None:
+                    trains.discard(int(remove))
+                if trains != before or not os.path.exists(self.manifest_path):
+                    self._publish(self.manifest_path, {"trains": sorted(trains)})
+            finally:
+                if self._manifest_fd is not None:
+                    fcntl.flock(self._manifest_fd, fcntl.LOCK_UN)
+
+    @property
+    def generation(self):
+        """Changes whenever the manifest or any shard is republished (for exporters)."""
+        paths = [self.manifest_path] + [self.shard_path(t) for t in self.train_ids()]
+        return tuple(version(p) for p in paths)
+
+    # ------------------------------------------------------------------
+    # Per-train records
+    # ------------------------------------------------------------------
+    def has_train(self, train_id: int) -> bool:
+        return os.path.exists(self.shard_path(train_id))
+
+    def ensure_train(self, train_id: int, initial: dict = None) -> bool:
+        """Create the shard for train_id if it does not exist yet.
+
+        Returns:
+            bool: True if a new shard was created
+        """
+        stripe = self._stripe(train_id)
+        try:
+            if self.has_train(train_id):
+                return False
+            values = {**self.input_defaults, **self.output_defaults, **(initial or {})}
+            self._publish(self.shard_path(train_id), self._split(values, None, None))
+        finally:
+            self._release(stripe)
+        self._update_manifest(add=train_id)
+        return True
+
+    def remove_train(self, train_id: int) -> bool:
+        stripe = self._stripe(train_id)
+        try:
+            if not self.has_train(train_id):
+                return False
+            os.remove(self.shard_path(train_id))
+        finally:
+            self._release(stripe)
+        self._update_manifest(remove=train_id)
+        return True
+
+    def _split(self, fields, inputs, outputs):
+        """Route fields into copies of the inputs/outputs sections."""
+        inputs = dict(self.input_defaults if inputs is None else inputs)
+        outputs = dict(self.output_defaults if outputs is None else outputs)
+        for name, value in fields.items():
+            if name in self.input_defaults:
+                inputs[name] = value
+            elif name in self.output_defaults:
+                outputs[name] = value
+        return {'inputs': inputs, 'outputs': outputs}
+
+    def read_sections(self, train_id: int):
+        """Return (inputs, outputs) dicts for a train, or (None, None)."""
+        try:
+            shard = self._load(self.shard_path(train_id))
+        except (OSError, ValueError):
+            return None, None
+        inputs = {**self.input_defaults, **shard.get('inputs', {})}
+        outputs = {**self.output_defaults, **shard.get('outputs', {})}
+        return inputs, outputs
+
+    def read(self, train_id: int):
+        """Return the merged inputs + outputs for a train, or None."""
+        inputs, outputs = self.read_sections(train_id)
+        if inputs is None:
+            return None
+        inputs.update(outputs)
+        return inputs
+
+    def read_field(self, train_id: int, name: str):
+        if name not in self.input_defaults and name not in self.output_defaults:
+            raise KeyError(name)
+        fields = self.read(train_id)
+        return None if fields is None else fields.get(name)
+
+    def write(self, train_id: int, fields: dict) -> None:
+        """Update fields of one train's shard (created with defaults if missing).
+
+        Unknown keys (train_id, nested train_X dicts) are ignored.
+        """
+        created = False
+        stripe = self._stripe(train_id)
+        try:
+            inputs, outputs = self.read_sections(train_id)
+            created = inputs is None
+            shard = self._split(fields, inputs, outputs)
+            if created or shard != {'inputs': inputs, 'outputs': outputs}:
+                self._publish(self.shard_path(train_id), shard)
+        finally:
+            self._release(stripe)
+        if created:
+            self._update_manifest(add=train_id)
+
+    def write_field(self, train_id: int, name: str, value) -> None:
+        self.write(train_id, {name: value})
+
+    # ------------------------------------------------------------------
+    # JSON compatibility
+    # ------------------------------------------------------------------
+    def export_dict(self) -> dict:
+        """Assemble the fleet view in the train_states.json layout."""
+        result = {}
+        for train_id in self.train_ids():
+            inputs, outputs = self.read_sections(train_id)
+            if inputs is not None:
+                result[f"train_{train_id}"] = {'inputs': inputs, 'outputs': outputs}
+        return result
+
+    def import_dict(self, data: dict) -> None:
+        """Load train_X sections from a train_states.json style dict."""
+        for key, section in (data or {}).items():
+            if not key.startswith("train_") or not isinstance(section, dict):
+                continue
+            try:
+                train_id = int(key.split("_", 1)[1])
+            except ValueError:
+                continue
+            if 'inputs' in section or 'outputs' in section:
+                values = {**section.get('inputs', {}), **section.get('outputs', {})}
+            else:
+                values = section
+            self.write(train_id, values)
+
+    def close(self) -> None:
+        for fd in self._lock_fds + [self._manifest_fd, self._owner_fd]:
+            if fd is not None:
+                os.close(fd)
+        self._lock_fds = [None] * self.stripes
+        self._manifest_fd = self._owner_fd = None
@@ -0,0 +1,532 @@
+"""Shared-memory train state store.
+
+Keeps one fixed-layout record per train in a multiprocessing.shared_memory
+segment so the Train Controllers, the Train Model UI and the REST server can
+read and write individual fields in place instead of re-parsing and rewriting
+the whole train_states.json file on every update.
+
+Layout:
+    [header][record 0][record 1]...[record MAX_TRAINS-1]
+
+    header: magic, layout checksum, record count, record size, generation
+    record: train_id, inputs seq, outputs seq, inputs fields, outputs fields
+
+Each section (inputs / outputs) is protected by a seqlock: writers bump the
+sequence counter to an odd value, write the fields, then bump it back to an
+even value. Readers copy the section and retry only if the counter moved or
+was odd, so reads never take a lock. Retries back off with short sleeps and
+give up with TimeoutError after READ_TIMEOUT_S, so a writer that died
+mid-update cannot wedge its readers. Writers are serialized with a process
+lock plus an fcntl file lock (POSIX only).
+
+The record layout is derived from the field templates (default_inputs /
+default_outputs) so every process that uses the same templates agrees on the
+offsets. Floats are stored as doubles, booleans as single bytes, strings as
+fixed-size UTF-8 buffers and None-able gains (kp / ki) as NaN.
+
+JsonExportAdapter periodically exports the store to train_states.json so
+modules that still read the file keep working.
+"""
+
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from multiprocessing import shared_memory
+
+try:
+    import fcntl
+except ImportError:  # Windows - process lock only
+    fcntl = None
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from double_buffer import discard as discard_published, publish as publish_file
+
+SEGMENT_NAME = "group4_train_states"
+MAX_TRAINS = 64
+STRING_BYTES = 64
+LONG_STRING_BYTES = 256
+LONG_STRING_FIELDS = ('announcement',)
+READ_TIMEOUT_S = 1.0
+_SPIN_BEFORE_SLEEP = 64
+_MAX_BACKOFF_S = 0.001
+
+_MAGIC = b"G4TS"
+_HEADER = struct.Struct("<4sIIIQ")  # magic, layout crc, max trains, record size, generation
+_HEADER_SIZE = 32
+_GEN_OFFSET = 16
+_SEQ = struct.Struct("<Q")
+_RECORD_HEAD = struct.Struct("<qQQ")  # train_id, inputs seq, outputs seq
+_FREE_SLOT = 0
+
+
+def _field_code(name, default):
+    """Return the struct format code used to store a template field."""
+    if isinstance(default, bool):
+        return "?"
+    if default is None or isinstance(default, (int, float)):
+        return "d"
+    if name in LONG_STRING_FIELDS:
+        return f"{LONG_STRING_BYTES}s"
+    return f"{STRING_BYTES}s"
+
+
+class _Section:
+    """Packed layout of one section (inputs or outputs) of a train record."""
+
+    def __init__(self, template: dict, offset: int, seq_offset: int):
+        self.names = list(template.keys())
+        self.defaults = dict(template)
+        self.codes = [_field_code(n, template[n]) for n in self.names]
+        self.nullable = {n for n in self.names if template[n] is None}
+        self.struct = struct.Struct("<" + "".join(self.codes))
+        self.offset = offset
+        self.seq_offset = seq_offset
+        self.size = self.struct.size
+        self.field_offsets = {}
+        self.field_structs = {}
+        pos = offset
+        for name, code in zip(self.names, self.codes):
+            fs = struct.Struct("<" + code)
+            self.field_offsets[name] = pos
+            self.field_structs[name] = fs
+            pos += fs.size
+
+    def encode(self, name, value):
+        code = self.field_structs[name].format[-1]
+        if code == "?":
+            return bool(value)
+        if code == "d":
+            if value is None:
+                return math.nan
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return 0.0
+        if value is None:
+            value = ""
+        return str(value).encode("utf-8")[:self.field_structs[name].size]
+
+    def decode(self, values):
+        return {name: _decode_field(self, name, raw) for name, raw in zip(self.names, values)}
+
+
+class SharedStateStore:
+    """Fixed-layout per-train state records in shared memory."""
+
+    def __init__(self, input_template: dict, output_template: dict,
+                 name: str = SEGMENT_NAME, max_trains: int = MAX_TRAINS,
+                 lock_path: str = None, read_timeout_s: float = READ_TIMEOUT_S):
+        """Create or attach to the shared segment.
+
+        Args:
+            input_template: Default inputs (field name -> default value)
+            output_template: Default outputs (field name -> default value)
+            name: Shared memory segment name
+            max_trains: Number of train records in the segment
+            lock_path: Optional file used for the cross-process writer lock
+            read_timeout_s: How long a reader retries a section whose writer
+                has not finished before raising TimeoutError
+        """
+        self.name = name
+        self.max_trains = max_trains
+        self.read_timeout_s = read_timeout_s
+        head = _RECORD_HEAD.size
+        self.inputs = _Section(input_template, head, 8)
+        self.outputs = _Section(output_template, head + self.inputs.size, 16)
+        size = head + self.inputs.size + self.outputs.size
+        self.record_size = (size + 7) & ~7
+        self.layout_crc = zlib.crc32(
+            (self.inputs.struct.format + "|" + self.outputs.struct.format + "|"
+             + ",".join(self.inputs.names + self.outputs.names)).encode())
+
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self.lock_path = None
+        if fcntl is not None:
+            if lock_path is None:
+                lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+            self.lock_path = lock_path
+            self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        self._slots = {}
+
+        total = _HEADER_SIZE + self.record_size * max_trains
+        self.owner = False
+        self._writer_lock()
+        try:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+                self.owner = True
+            except FileExistsError:
+                self.shm = shared_memory.SharedMemory(name=name)
+                _untrack(self.shm)
+                magic, crc, count, rec_size, _ = _HEADER.unpack_from(self.shm.buf, 0)
+                if (magic != _MAGIC or crc != self.layout_crc or count != max_trains
+                        or rec_size != self.record_size):
+                    # Stale segment from an older layout - replace it
+                    self.shm.close()
+                    stale = shared_memory.SharedMemory(name=name)
+                    stale.unlink()
+                    stale.close()
+                    self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+                    self.owner = True
+            if self.owner:
+                self.shm.buf[:total] = bytes(total)
+                _HEADER.pack_into(self.shm.buf, 0, _MAGIC, self.layout_crc,
+                                  max_trains, self.record_size, 0)
+        finally:
+            self._writer_unlock()
+        self.buf = self.shm.buf
+
+    # ------------------------------------------------------------------
+    # Locking
+    # ------------------------------------------------------------------
+    def _writer_lock(self):
+        self._lock.acquire()
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _writer_unlock(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    # ------------------------------------------------------------------
+    # Slot management
+    # ------------------------------------------------------------------
+    def _record_offset(self, slot):
+        return _HEADER_SIZE + slot * self.record_size
+
+    def _slot_train_id(self, slot):
+        return struct.unpack_from("<q", self.buf, self._record_offset(slot))[0]
+
+    def _find_slot(self, train_id):
+        slot = self._slots.get(train_id)
+        if slot is not None and self._slot_train_id(slot) == train_id:
+            return slot
+        for slot in range(self.max_trains):
+            if self._slot_train_id(slot) == train_id:
+                self._slots[train_id] = slot
+                return slot
+        self._slots.pop(train_id, None)
+        return None
+
+    def _bump_generation(self):
+        gen = struct.unpack_from("<Q", self.buf, _GEN_OFFSET)[0]
+        struct.pack_into("<Q", self.buf, _GEN_OFFSET, gen + 1)
+
+    @property
+    def generation(self) -> int:
+        """Counter incremented on every write (used by exporters/pollers)."""
+        return struct.unpack_from("<Q", self.buf, _GEN_OFFSET)[0]
+
+    def has_train(self, train_id: int) -> bool:
+        return self._find_slot(int(train_id)) is not None
+
+    def train_ids(self) -> list:
+        ids = []
+        for slot in range(self.max_trains):
+            tid = self._slot_train_id(slot)
+            if tid != _FREE_SLOT:
+                ids.append(tid)
+        return sorted(ids)
+
+    def ensure_train(self, train_id: int, initial: dict = None) -> bool:
+        """Allocate a record for train_id if it does not exist yet.
+
+        Args:
+            train_id: Train identifier (must be non-zero)
+            initial: Optional flat field values for the new record
+
+        Returns:
+            bool: True if a new record was created
+        """
+        train_id = int(train_id)
+        if train_id == _FREE_SLOT:
+            raise ValueError("train_id 0 is reserved for free slots")
+        if self._find_slot(train_id) is not None:
+            return False
+        self._writer_lock()
+        try:
+            if self._find_slot(train_id) is not None:
+                return False
+            for slot in range(self.max_trains):
+                if self._slot_train_id(slot) == _FREE_SLOT:
+                    base = self._record_offset(slot)
+                    values = {**self.inputs.defaults, **self.outputs.defaults}
+                    if initial:
+                        values.update(initial)
+                    self._write_section(base, self.inputs, values)
+                    self._write_section(base, self.outputs, values)
+                    struct.pack_into("<q", self.buf, base, train_id)
+                    self._slots[train_id] = slot
+                    self._bump_generation()
+                    return True
+            raise RuntimeError(f"Shared state store is full ({self.max_trains} trains)")
+        finally:
+            self._writer_unlock()
+
+    def remove_train(self, train_id: int) -> bool:
+        train_id = int(train_id)
+        self._writer_lock()
+        try:
+            slot = self._find_slot(train_id)
+            if slot is None:
+                return False
+            struct.pack_into("<q", self.buf, self._record_offset(slot), _FREE_SLOT)
+            self._slots.pop(train_id, None)
+            self._bump_generation()
+            return True
+        finally:
+            self._writer_unlock()
+
+    # ------------------------------------------------------------------
+    # Seqlock read / write
+    # ------------------------------------------------------------------
+    def _write_section(self, base, section, values):
+        """Write the fields of values that belong to section (writer lock held)."""
+        names = [n for n in values if n in section.field_offsets]
+        if not names:
+            return False
+        seq_pos = base + section.seq_offset
+        seq = _SEQ.unpack_from(self.buf, seq_pos)[0]
+        _SEQ.pack_into(self.buf, seq_pos, seq + 1)
+        try:
+            for name in names:
+                section.field_structs[name].pack_into(
+                    self.buf, base + section.field_offsets[name],
+                    section.encode(name, values[name]))
+        finally:
+            _SEQ.pack_into(self.buf, seq_pos, seq + 2)
+        return True
+
+    def _seq_read(self, seq_pos, copy):
+        """Run copy() until it completes without a concurrent write.
+
+        Spins briefly, then sleeps with exponential backoff (capped at
+        _MAX_BACKOFF_S). Raises TimeoutError if the sequence counter stays
+        odd or keeps moving for longer than read_timeout_s.
+        """
+        spins = 0
+        backoff = 0.00001
+        deadline = None
+        while True:
+            before = _SEQ.unpack_from(self.buf, seq_pos)[0]
+            if not before & 1:
+                value = copy()
+                if _SEQ.unpack_from(self.buf, seq_pos)[0] == before:
+                    return value
+            spins += 1
+            if spins < _SPIN_BEFORE_SLEEP:
+                continue
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.read_timeout_s
+            elif now >= deadline:
+                raise TimeoutError(
+                    f"Shared state record at {seq_pos} stayed mid-write for "
+                    f"{self.read_timeout_s}s (writer died?)")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF_S)
+
+    def _read_section(self, base, section):
+        start = base + section.offset
+        raw = self._seq_read(base + section.seq_offset,
+                             lambda: bytes(self.buf[start:start + section.size]))
+        return section.decode(section.struct.unpack(raw))
+
+    def _read_record(self, train_id, read):
+        """read(base) of the train's record, or None if there is no such train.
+
+        The slot is looked up outside the seqlocks, so the train may be
+        removed and its slot reused by another train while read() runs. The
+        slot's train_id is checked once read() has succeeded and the lookup
+        is retried if it changed.
+        """
+        while True:
+            slot = self._find_slot(train_id)
+            if slot is None:
+                return None
+            value = read(self._record_offset(slot))
+            if self._slot_train_id(slot) == train_id:
+                return value
+
+    def read_sections(self, train_id: int):
+        """Return (inputs, outputs) dicts for a train, or (None, None)."""
+        sections = self._read_record(int(train_id), lambda base: (
+            self._read_section(base, self.inputs), self._read_section(base, self.outputs)))
+        return sections if sections is not None else (None, None)
+
+    def read(self, train_id: int):
+        """Return the merged inputs + outputs for a train, or None."""
+        inputs, outputs = self.read_sections(train_id)
+        if inputs is None:
+            return None
+        inputs.update(outputs)
+        return inputs
+
+    def read_field(self, train_id: int, name: str):
+        """Read a single field without decoding the rest of the record."""
+        section = self.inputs if name in self.inputs.field_offsets else self.outputs
+        if name not in section.field_offsets:
+            raise KeyError(name)
+        fs = section.field_structs[name]
+        value = self._read_record(int(train_id), lambda base: self._seq_read(
+            base + section.seq_offset,
+            lambda: fs.unpack_from(self.buf, base + section.field_offsets[name])))
+        if value is None:
+            return None
+        return _decode_field(section, name, value[0])
+
+    def write(self, train_id: int, fields: dict) -> None:
+        """Write fields in place, routing each one to its section.
+
+        Unknown keys (train_id, nested train_X dicts) are ignored. The record
+        is created with defaults if the train does not exist yet.
+        """
+        train_id = int(train_id)
+        if self._find_slot(train_id) is None:
+            self.ensure_train(train_id)
+        self._writer_lock()
+        try:
+            slot = self._find_slot(train_id)
+            if slot is None:
+                return
+            base = self._record_offset(slot)
+            changed = self._write_section(base, self.inputs, fields)
+            changed = self._write_section(base, self.outputs, fields) or changed
+            if changed:
+                self._bump_generation()
+        finally:
+            self._writer_unlock()
+
+    def write_field(self, train_id: int, name: str, value) -> None:
+        self.write(train_id, {name: value})
+
+    # ------------------------------------------------------------------
+    # JSON compatibility
+    # ------------------------------------------------------------------
+    def export_dict(self) -> dict:
+        """Return the store in the train_states.json layout."""
+        result = {}
+        for train_id in self.train_ids():
+            inputs, outputs = self.read_sections(train_id)
+            if inputs is not None:
+                result[f"train_{train_id}"] = {'inputs': inputs, 'outputs': outputs}
+        return result
+
+    def import_dict(self, data: dict) -> None:
+        """Load train_X sections from a train_states.json style dict."""
+        for key, section in (data or {}).items():
+            if not key.startswith("train_") or not isinstance(section, dict):
+                continue
+            try:
+                train_id = int(key.split("_", 1)[1])
+            except ValueError:
+                continue
+            if 'inputs' in section or 'outputs' in section:
+                values = {**section.get('inputs', {}), **section.get('outputs', {})}
+            else:
+                values = section
+            self.ensure_train(train_id, values)
+            self.write(train_id, values)
+
+    def close(self) -> None:
+        try:
+            self.buf = None
+            self.shm.close()
+        except Exception:
+            pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def unlink(self) -> None:
+        """Destroy the segment and its lock file (owner shutdown)."""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        if self.lock_path is not None:
+            try:
+                os.remove(self.lock_path)
+            except OSError:
+                pass
+
+
+def _decode_field(section, name, raw):
+    code = section.field_structs[name].format[-1]
+    if code == "s":
+        return raw.rstrip(b"\x00").decode("utf-8", errors="ignore")
+    if name in section.nullable and isinstance(raw, float) and math.isnan(raw):
+        return None
+    return raw
+
+
+def _untrack(shm):
+    """Stop the resource tracker from unlinking a segment we only attached to.
+
+    Python < 3.13 registers attached segments too and would destroy the
+    segment when this process exits, even though another process owns it.
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class JsonExportAdapter:
+    """Periodically mirrors a SharedStateStore into a train_states.json file."""
+
+    def __init__(self, store: SharedStateStore, path: str, interval_s: float = 0.5):
+        self.store = store
+        self.path = path
+        self.interval_s = interval_s
+        self._last_generation = None
+        self._running = False
+        self._thread = None
+
+    def export_now(self) -> bool:
+        """Write the JSON file if the store changed since the last export."""
+        generation = self.store.generation
+        if generation == self._last_generation:
+            return False
+        data = self.store.export_dict()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        publish_file(self.path, json.dumps(data, indent=4))
+        self._last_generation = generation
+        return True
+
+    def _run(self):
+        while self._running:
+            try:
+                self.export_now()
+            except Exception as e:
+                print(f"[SharedStateStore] JSON export failed: {e}")
+            time.sleep(self.interval_s)
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop exporting: write the final file and drop its A/B slots."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_s * 2)
+        try:
+            self.export_now()
+        except Exception:
+            pass
+        discard_published(self.path)
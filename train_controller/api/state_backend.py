@@ -0,0 +1,432 @@
+"""Pluggable persistence for per-train controller state.
+
+Controller state used to be persisted three unrelated ways: train_states.json
+in train_controller_api, REST calls in train_controller_api_client and an
+unused SQLite schema in database/database.py. Every backend here implements
+the same StateBackend protocol instead (the sqlite one on that database's
+train_states table):
+
+    get(train_id)          merged inputs + outputs (a StateView) or None
+    update(train_id, f)    write only the fields in f (routed to inputs/outputs)
+    snapshot()             {train_id: state} for every train
+    subscribe(callback)    callback(train_id, changed_fields) on every change,
+                           changed_fields is None when a train was removed;
+                           returns a function that unsubscribes
+    close()
+
+Backends:
+    json    JsonFileBackend     train_states.json (double-buffered, cached reads)
+    sqlite  SqliteStateBackend  train_states in train_controller.db (train_database)
+    shm     StoreBackend        SharedStateStore segment (or any per-train store)
+    http    HttpBackend         the REST server (train_api_server.py)
+
+The backend is chosen with GROUP4_STATE_BACKEND (default json) or the
+--state-backend command-line flag (see add_backend_arguments()); the HTTP
+backend talks to GROUP4_STATE_SERVER.
+
+Usage:
+    backend = create_backend("sqlite")
+    backend.update(1, {'power_command': 1200.0})
+    power = backend.get(1)['power_command']
+"""
+
+import json
+import os
+import sys
+import threading
+from collections.abc import Mapping
+from typing import Callable, Dict, Optional, Protocol, runtime_checkable
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+try:
+    from . import train_state_schema as schema
+    from .state_view import StateView
+    from .train_controller_api import (DEFAULT_INPUTS, DEFAULT_OUTPUTS, STATE_BACKEND, _STATE_FILE,
+                                       _file_lock, _read_json_file, get_shared_state_store,
+                                       publish_change, publish_file)
+except ImportError:
+    import train_state_schema as schema
+    from state_view import StateView
+    from train_controller_api import (DEFAULT_INPUTS, DEFAULT_OUTPUTS, STATE_BACKEND, _STATE_FILE,
+                                      _file_lock, _read_json_file, get_shared_state_store,
+                                      publish_change, publish_file)
+
+# train_controller_api put the project root on sys.path
+from channel_notify import current_generation, wait_for_change
+from json_cache import read_json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "database"))
+from database import train_database
+
+BACKENDS = ("json", "sqlite", "shm", "http")
+DEFAULT_BACKEND = STATE_BACKEND
+DEFAULT_SERVER = os.environ.get("GROUP4_STATE_SERVER", "http://localhost:5000")
+SQLITE_FILE = os.path.join(os.path.dirname(os.path.dirname(_STATE_FILE)), "train_controller.db")
+POLL_S = 0.05
+
+
+@runtime_checkable
+class StateBackend(Protocol):
+    """Per-train controller state storage."""
+
+    def get(self, train_id: int) -> Optional[Mapping]: ...
+
+    def update(self, train_id: int, fields: Mapping) -> None: ...
+
+    def snapshot(self) -> Dict[int, Mapping]: ...
+
+    def subscribe(self, callback: Callable[[int, Optional[dict]], None]) -> Callable[[], None]: ...
+
+    def close(self) -> None: ...
+
+
+class _BackendBase:
+    """Field routing and polling-based subscriptions shared by the backends."""
+
+    poll_interval = POLL_S
+
+    def __init__(self, input_template: dict = None, output_template: dict = None):
+        self.input_defaults = dict(DEFAULT_INPUTS if input_template is None else input_template)
+        self.output_defaults = dict(DEFAULT_OUTPUTS if output_template is None else output_template)
+        self.defaults = {**self.input_defaults, **self.output_defaults}
+        self._callbacks = []
+        self._watch_lock = threading.Lock()
+        self._watcher = None
+        self._closed = threading.Event()
+
+    def _split(self, fields):
+        """(inputs, outputs) parts of fields; unknown keys are dropped."""
+        inputs, outputs = {}, {}
+        for name, value in fields.items():
+            if name in self.input_defaults:
+                inputs[name] = value
+            elif name in self.output_defaults:
+                outputs[name] = value
+        return inputs, outputs
+
+    def _view(self, inputs, outputs):
+        return StateView(self.defaults, inputs, outputs)
+
+    # ------------------------------------------------------------------
+    # Subscriptions
+    # ------------------------------------------------------------------
+    def _change_token(self):
+        """Cheap value that changes whenever any train changes (None = always diff)."""
+        return None
+
+    def _wait_for_change(self, token, timeout):
+        """Block until the change token may have moved past token."""
+        self._closed.wait(timeout)
+
+    def _fleet(self):
+        return {tid: dict(state) for tid, state in self.snapshot().items()}
+
+    def subscribe(self, callback):
+        with self._watch_lock:
+            self._callbacks.append(callback)
+            if self._watcher is None:
+                # Changes from here on are reported, including ones made
+                # before the thread gets to run
+                self._watcher = threading.Thread(
+                    target=self._watch, args=(self._change_token(), self._fleet()), daemon=True)
+                self._watcher.start()
+
+        def unsubscribe():
+            with self._watch_lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+        return unsubscribe
+
+    def _watch(self, token, last):
+        while not self._closed.is_set():
+            self._wait_for_change(token, self.poll_interval)
+            new_token = self._change_token()
+            if new_token is not None and new_token == token:
+                continue
+            token = new_token
+            try:
+                current = self._fleet()
+            except Exception as e:
+                print(f"[StateBackend] Snapshot failed: {e}")
+                continue
+            events = []
+            for tid, state in current.items():
+                before = last.get(tid)
+                if before is None:
+                    events.append((tid, state))
+                    continue
+                changed = {k: v for k, v in state.items() if before.get(k) != v or k not in before}
+                if changed:
+                    events.append((tid, changed))
+            events.extend((tid, None) for tid in last if tid not in current)
+            last = current
+            with self._watch_lock:
+                callbacks = list(self._callbacks)
+            for tid, changed in events:
+                for callback in callbacks:
+                    try:
+                        callback(tid, changed)
+                    except Exception as e:
+                        print(f"[StateBackend] Subscriber error: {e}")
+
+    def close(self) -> None:
+        self._closed.set()
+        watcher = self._watcher
+        if watcher is not None and watcher is not threading.current_thread():
+            watcher.join(timeout=2.0)
+
+
+class JsonFileBackend(_BackendBase):
+    """train_states.json with train_X sections (the train_controller_api layout)."""
+
+    def __init__(self, path: str = _STATE_FILE, **templates):
+        super().__init__(**templates)
+        self.path = path
+
+    def _load(self, shared):
+        if not os.path.exists(self.path):
+            return {}
+        if shared:
+            return read_json(self.path)
+        return _read_json_file(self.path)
+
+    def _section_view(self, section):
+        if 'inputs' in section or 'outputs' in section:
+            return self._view(section.get('inputs', {}), section.get('outputs', {}))
+        return StateView(self.defaults, section)
+
+    def get(self, train_id):
+        section = self._load(shared=True).get(f"train_{int(train_id)}")
+        return None if section is None else self._section_view(section)
+
+    def update(self, train_id, fields):
+        inputs, outputs = self._split(fields)
+        key = f"train_{int(train_id)}"
+        with _file_lock:
+            all_states = self._load(shared=False)
+            section = all_states.get(key)
+            if not isinstance(section, dict) or 'inputs' not in section:
+                section = {'inputs': dict(self.input_defaults), 'outputs': dict(self.output_defaults)}
+            section['inputs'].update(inputs)
+            section['outputs'].update(outputs)
+            all_states[key] = section
+            publish_file(self.path, json.dumps(all_states, indent=4))
+        publish_change("train_states")
+
+    def snapshot(self):
+        result = {}
+        for key, section in self._load(shared=True).items():
+            if key.startswith("train_") and key[6:].isdigit() and isinstance(section, dict):
+                result[int(key[6:])] = self._section_view(section)
+        return result
+
+    def _change_token(self):
+        return current_generation("train_states")
+
+    def _wait_for_change(self, token, timeout):
+        wait_for_change("train_states", token, timeout)
+
+
+class SqliteStateBackend(_BackendBase):
+    """The train_states table of the controller database (database/database.py).
+
+    Rows are read and written through train_database, so this backend and
+    every other train_database user share one schema (one column per
+    train_state_schema field) in train_controller.db. update() is a single
+    UPSERT of just the given columns, and readers never block the writer in
+    WAL mode. Values are validated against the schema (ValueError).
+    """
+
+    def __init__(self, path: str = SQLITE_FILE, database: train_database = None, **templates):
+        """
+        Args:
+            path: Database file (ignored when database is given)
+            database: An open train_database to use; it stays open on close()
+            templates: input_template / output_template for field routing
+        """
+        super().__init__(**templates)
+        self._owns_db = database is None
+        self.db = train_database(path) if database is None else database
+        self.path = self.db.db_path
+        self._export = (None, None)  # (change token, export_dict() result)
+
+    def _state(self, fields):
+        inputs, outputs = self._split(fields)
+        return self._view(inputs, outputs)
+
+    def get(self, train_id):
+        fields = self.db.get_state(train_id)
+        return None if fields is None else self._state(fields)
+
+    def update(self, train_id, fields):
+        self.db.update_train_state(train_id, fields)
+
+    def snapshot(self):
+        return {tid: self._state(fields) for tid, fields in self.db.get_all_states().items()}
+
+    def _change_token(self):
+        return self.db.change_token()
+
+    # train_states.json layout, for FleetState persistence in the REST server
+    def export_dict(self) -> dict:
+        """Every train as train_X: {inputs, outputs} (same object while unchanged)."""
+        token = self._change_token()
+        if self._export[0] != token:
+            doc = {}
+            for tid, fields in self.db.get_all_states().items():
+                inputs, outputs = self._split(fields)
+                doc[f"train_{tid}"] = {'inputs': inputs, 'outputs': outputs}
+            self._export = (token, doc)
+        return self._export[1]
+
+    def import_dict(self, data: dict) -> None:
+        """Write the train_X sections of a train_states.json style dict."""
+        states = {}
+        for key, section in (data or {}).items():
+            if key.startswith("train_") and key[6:].isdigit() and isinstance(section, dict):
+                states[int(key[6:])] = {**section.get('inputs', {}), **section.get('outputs', {})}
+        try:
+            self.db.update_many(states)
+        except ValueError:
+            # Write train by train so one bad value doesn't drop the fleet
+            for train_id, fields in states.items():
+                try:
+                    self.db.update_train_state(train_id, fields)
+                except ValueError as e:
+                    print(f"[StateBackend] Skipped train {train_id}: {e}")
+
+    def close(self) -> None:
+        super().close()
+        if self._owns_db:
+            self.db.close()
+
+
+class StoreBackend(_BackendBase):
+    """A per-train store (SharedStateStore or ShardedStateStore) as a backend."""
+
+    def __init__(self, store=None, **templates):
+        if store is None:
+            store = get_shared_state_store()
+        super().__init__(**templates)
+        self.store = store
+
+    def get(self, train_id):
+        inputs, outputs = self.store.read_sections(train_id)
+        return None if inputs is None else self._view(inputs, outputs)
+
+    def update(self, train_id, fields):
+        self.store.write(train_id, fields)
+        publish_change("train_states")
+
+    def snapshot(self):
+        result = {}
+        for tid in self.store.train_ids():
+            state = self.get(tid)
+            if state is not None:
+                result[tid] = state
+        return result
+
+    def _change_token(self):
+        return self.store.generation
+
+
+class HttpBackend(_BackendBase):
+    """The REST server's /api/train/<id>/state and /api/trains endpoints."""
+
+    poll_interval = 0.5
+
+    def __init__(self, server_url: str = DEFAULT_SERVER, timeout: float = 5.0, **templates):
+        if requests is None:
+            raise ImportError("HttpBackend requires the 'requests' package")
+        super().__init__(**templates)
+        self.server_url = server_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _state_from_json(self, data):
+        if 'inputs' in data or 'outputs' in data:
+            return self._view(data.get('inputs', {}), data.get('outputs', {}))
+        return StateView(self.defaults, data)
+
+    def get(self, train_id):
+        response = self.session.get(f"{self.server_url}/api/train/{int(train_id)}/state",
+                                    timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return self._state_from_json(response.json())
+
+    def update(self, train_id, fields):
+        response = self.session.post(f"{self.server_url}/api/train/{int(train_id)}/state",
+                                     json=dict(fields), timeout=self.timeout)
+        response.raise_for_status()
+
+    def snapshot(self):
+        response = self.session.get(f"{self.server_url}/api/trains", timeout=self.timeout)
+        response.raise_for_status()
+        return {int(key[6:]): self._state_from_json(section)
+                for key, section in response.json().items()
+                if key.startswith("train_") and key[6:].isdigit()}
+
+    def close(self) -> None:
+        super().close()
+        self.session.close()
+
+
+def create_backend(kind: str = None, **options) -> StateBackend:
+    """Create the backend named kind (default GROUP4_STATE_BACKEND).
+
+    Args:
+        kind: One of BACKENDS
+        options: Passed to the backend (path, store, server_url, timeout, templates)
+
+    Raises:
+        ValueError: Unknown backend name
+    """
+    kind = (kind or DEFAULT_BACKEND).lower()
+    if kind == "json":
+        return JsonFileBackend(**options)
+    if kind == "sqlite":
+        return SqliteStateBackend(**options)
+    if kind == "shm":
+        return StoreBackend(**options)
+    if kind == "http":
+        return HttpBackend(**options)
+    raise ValueError(f"Unknown state backend '{kind}' (expected one of {', '.join(BACKENDS)})")
+
+
+_shared_backends = {}
+_shared_lock = threading.Lock()
+
+
+def shared_backend(kind: str = None) -> StateBackend:
+    """This process's backend of the given kind (created on first use)."""
+    kind = (kind or DEFAULT_BACKEND).lower()
+    with _shared_lock:
+        backend = _shared_backends.get(kind)
+        if backend is None:
+            backend = _shared_backends[kind] = create_backend(kind)
+        return backend
+
+
+def backend_from_args(args):
+    """The backend selected by add_backend_arguments() flags, for train_controller_api.
+
+    Returns the backend name, or an HttpBackend for --state-server.
+    """
+    if args.state_backend == "http":
+        return HttpBackend(server_url=args.state_server)
+    return args.state_backend
+
+
+def add_backend_arguments(parser) -> None:
+    """Add --state-backend / --state-server to an argparse parser."""
+    parser.add_argument("--state-backend", choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help=f"Controller state backend (default: {DEFAULT_BACKEND}, "
+                             f"or set GROUP4_STATE_BACKEND)")
+    parser.add_argument("--state-server", type=str, default=DEFAULT_SERVER,
+                        help=f"Server URL for the http state backend (default: {DEFAULT_SERVER})")
@@ -0,0 +1,88 @@
+"""Batched state updates for one controller cycle.
+
+A periodic update used to call get_state() and update_state() a dozen times,
+and every update_state() re-read and rewrote the whole state. Inside
+
+    with api.transaction() as st:
+        ...
+
+the state is read once. get_state() and update_state() on the same API object
+(and thread) then work on the in-memory working copy st, so controller logic
+such as set_emergency_brake() or auto_manage_service_brake() runs unchanged.
+When the block exits, only the fields whose values changed are written, in
+one save. Transactions do not nest: an inner transaction() joins the outer
+one.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class StateTransaction(dict):
+    """Working copy of a train's state that remembers which fields were set."""
+
+    def __init__(self, snapshot: dict):
+        super().__init__(snapshot)
+        self._original = dict(snapshot)
+        self._dirty = set()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._dirty.add(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    @property
+    def dirty(self) -> set:
+        """Names of the fields assigned since the snapshot."""
+        return set(self._dirty)
+
+    def changes(self) -> dict:
+        """Fields assigned since the snapshot whose value actually differs."""
+        return {
+            key: self[key] for key in self._dirty
+            if key not in self._original or self._original[key] != self[key]
+        }
+
+
+class TransactionScope:
+    """Tracks the open transaction of one API object, per thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        """The open StateTransaction of the calling thread, or None."""
+        return getattr(self._local, 'txn', None)
+
+    @contextmanager
+    def run(self, read, commit):
+        """Open a transaction (or join the open one).
+
+        Args:
+            read: Callable returning the state snapshot
+            commit: Callable writing a dict of changed fields
+        """
+        txn = self.active
+        if txn is not None:
+            yield txn
+            return
+        txn = StateTransaction(read())
+        self._local.txn = txn
+        try:
+            yield txn
+        finally:
+            # Changes made before an error are still written, as the
+            # individual update_state() calls would have done
+            self._local.txn = None
+            changes = txn.changes()
+            if changes:
+                commit(changes)
@@ -0,0 +1,92 @@
+"""Copy-on-write views of a train's state.
+
+get_state() used to copy the default template, merge the inputs and outputs
+sections into it and return the new dict, and callers often copied that again
+before changing a field. A StateView instead looks fields up in a stack of
+layers (defaults, inputs, outputs - later layers win) that it shares with the
+parsed state file, so reading costs no copies at all.
+
+Layers are never modified. Assigning or deleting a field records it in a
+small private overlay owned by the view, and copy() returns a new view over
+the same layers in constant time, so
+
+    new_state = state.copy()
+    new_state.update({'driver_velocity': 20.0})
+
+allocates one view and a one-field overlay instead of two full dicts. Use
+dict(view) where a real dict is needed (json.dumps, isinstance checks).
+"""
+
+from collections.abc import Mapping, MutableMapping
+
+_DELETED = object()
+
+
+class StateView(MutableMapping):
+    """Mapping over shared read-only layers with a private overlay for writes."""
+
+    __slots__ = ('_layers', '_overlay')
+
+    def __init__(self, *layers: Mapping):
+        self._layers = layers
+        self._overlay = None
+
+    def _lookup(self, key):
+        if self._overlay is not None and key in self._overlay:
+            return self._overlay[key]
+        for layer in reversed(self._layers):
+            if key in layer:
+                return layer[key]
+        return _DELETED
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is _DELETED else value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _DELETED
+
+    def __setitem__(self, key, value):
+        if self._overlay is None:
+            self._overlay = {}
+        self._overlay[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self[key] = _DELETED
+
+    def __iter__(self):
+        seen = set()
+        layers = self._layers + ((self._overlay,) if self._overlay else ())
+        for layer in layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    if self._lookup(key) is not _DELETED:
+                        yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        """A new view of the same fields; neither side sees the other's later writes."""
+        if self._overlay:
+            # The overlay becomes a shared layer, so neither view may change it
+            self._layers = self._layers + (self._overlay,)
+            self._overlay = None
+        return StateView(*self._layers)
+
+    __copy__ = copy
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return f"StateView({dict(self)!r})"
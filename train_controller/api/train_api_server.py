@@ -6,10 +6,12 @@ to access train state data over the network.
 
 Author: James Struyk, Julen Coca-Knorr
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+import atexit
 import json
 import os
+import sys
 from threading import Lock, Thread
 from datetime import datetime
 import time
@@ -22,23 +24,71 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 DATA_DIR = os.path.join(parent_dir, "data")
 TRAIN_STATES_FILE = os.path.join(DATA_DIR, "train_states.json")
-TRAIN_DATA_FILE = os.path.join(os.path.dirname(parent_dir), "Train Model", "train_data.json")
+TRAIN_MODEL_DIR = os.path.join(os.path.dirname(parent_dir), "Train_Model")
+TRAIN_DATA_FILE = os.path.join(TRAIN_MODEL_DIR, "train_data.json")
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Per-train state store (TRAIN_STATE_SHM=1 shared memory, TRAIN_STATE_SHARDS=1
+# one file per train, or GROUP4_STATE_BACKEND=shm). When enabled the endpoints
+# read/write train records directly, /api/trains is assembled from them and
+# train_states.json is only an export. GROUP4_STATE_BACKEND=sqlite persists the
+# in-memory fleet to train_controller.db instead of train_states.json. "http"
+# is how clients reach this server, so here it means the default (json).
+from train_controller_api import (STATE_BACKEND, USE_STATE_STORE, get_shared_state_store,
+                                  get_state_store)
+from train_controller_api import publish_path, publish_file
+import train_state_schema as schema
+from fleet_state import FleetState, bulk_update, parse_train_id
+
+# Parsed-JSON cache: unchanged files are not re-parsed on every request
+from json_cache import read_json, thaw
+if USE_STATE_STORE:
+    state_store = get_state_store()
+elif STATE_BACKEND == "shm":
+    state_store = get_shared_state_store()
+else:
+    state_store = None
+
+# Binary message codec for clients that send Accept: application/x-group4-binary
+from message_codec import BINARY_CONTENT_TYPE, encode as encode_message
+
+# train_data.json -> train states sync, woken by change notifications
+from train_data_watch import TrainDataWatch
+
+# Journaled train_data.json (TRAIN_DATA_JOURNAL=1, see Train_Model/train_data_journal.py)
+train_data_journal = None
+if os.environ.get("TRAIN_DATA_JOURNAL", "0") == "1":
+    sys.path.append(TRAIN_MODEL_DIR)
+    from train_data_journal import get_train_data_journal
+    try:
+        train_data_journal = get_train_data_journal(TRAIN_DATA_FILE)
+    except Exception as e:
+        print(f"[Server] train_data.json journal unavailable: {e}")
+
+# Event history (train_database in ../database), opened on first use
+sys.path.append(os.path.join(parent_dir, "database"))
+from database import train_database
+event_db = None
+event_db_lock = Lock()
+
 # Thread-safe file access
 file_lock = Lock()
 sync_running = True  # Flag to control sync thread
 
-def read_json_file(filepath):
-    """Thread-safe JSON file read."""
+def read_json_file(filepath, readonly=False):
+    """Thread-safe JSON file read.
+    
+    With readonly=True the shared cached document is returned as-is (it must
+    not be modified); otherwise the caller gets its own mutable copy.
+    """
     with file_lock:
         try:
             if not os.path.exists(filepath):
                 return {}
-            with open(filepath, 'r') as f:
-                return json.load(f)
+            data = read_json(filepath)
+            return data if readonly else thaw(data)
         except (FileNotFoundError, json.JSONDecodeError) as e:
             print(f"[Server] Error reading {filepath}: {e}")
             return {}
@@ -48,10 +98,40 @@ def write_json_file(filepath, data):
     with file_lock:
         try:
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=4)
+            publish_file(filepath, json.dumps(data, indent=4))
         except Exception as e:
             print(f"[Server] Error writing {filepath}: {e}")
+            return
+    publish_path(filepath)
+
+# In-memory fleet state (json / sqlite backends): the endpoints read and write
+# it, and a write-behind thread persists it to train_states.json or to the
+# controller database
+fleet = None
+if state_store is None and STATE_BACKEND == "sqlite":
+    from state_backend import SqliteStateBackend
+    fleet_db = SqliteStateBackend()
+    fleet = FleetState(fleet_db.path, load=fleet_db.export_dict, save=fleet_db.import_dict)
+elif state_store is None:
+    fleet = FleetState(TRAIN_STATES_FILE,
+                       load=lambda: read_json_file(TRAIN_STATES_FILE, readonly=True),
+                       save=lambda doc: write_json_file(TRAIN_STATES_FILE, doc))
+if fleet is not None:
+    fleet.start()
+    atexit.register(fleet.stop)  # persist what is still pending on shutdown
+
+def read_train_data():
+    """train_data.json, replaying the journal when journaling is on."""
+    if train_data_journal is not None:
+        return train_data_journal.read()
+    return read_json_file(TRAIN_DATA_FILE, readonly=True)
+
+def write_train_inputs(train_id, inputs):
+    """Update only a train's train_data.json inputs in its state."""
+    if state_store is not None:
+        state_store.write(train_id, inputs)
+    else:
+        fleet.update(train_id, inputs)
 
 def sync_train_data_to_states():
     """Background thread that syncs train_data.json to train_states.json.
@@ -59,116 +139,49 @@ def sync_train_data_to_states():
     This allows the Train Model Test UI to write inputs to train_data.json,
     and this server automatically syncs those inputs to train_states.json
     for hardware controllers to read via REST API.
-    """
-    global sync_running
-    print("[Server] Train data sync thread started (500ms interval)")
-    
-    while sync_running:
-        try:
-            # Read train_data.json from Train Model
-            train_data = read_json_file(TRAIN_DATA_FILE)
-            
-            if not train_data:
-                time.sleep(0.5)
-                continue
-            
-            # Read current train_states.json
-            train_states = read_json_file(TRAIN_STATES_FILE)
-            
-            # Sync each train_X section
-            for key in train_data.keys():
-                if key.startswith("train_"):
-                    section = train_data[key]
-                    inputs = section.get("inputs", {})
-                    outputs = section.get("outputs", {})
-                    
-                    # Ensure train exists in states with proper inputs/outputs structure
-                    if key not in train_states:
-                        # Extract train_id from key
-                        train_id = int(key.split("_")[1])
-                        train_states[key] = {
-                            "inputs": {
-                                "commanded_speed": 0.0,
-                                "commanded_authority": 0.0,
-                                "speed_limit": 0.0,
-                                "train_velocity": 0.0,
-                                "next_stop": "",
-                                "station_side": "Right",
-                                "train_temperature": 70.0,
-                                "train_model_engine_failure": False,
-                                "train_model_signal_failure": False,
-                                "train_model_brake_failure": False,
-                                "train_controller_engine_failure": False,
-                                "train_controller_signal_failure": False,
-                                "train_controller_brake_failure": False,
-                                "current_station": "",
-                                "beacon_read_blocked": False
-                            },
-                            "outputs": {
-                                "manual_mode": False,
-                                "driver_velocity": 0.0,
-                                "service_brake": False,
-                                "right_door": False,
-                                "left_door": False,
-                                "interior_lights": True,
-                                "exterior_lights": True,
-                                "set_temperature": 70.0,
-                                "temperature_up": False,
-                                "temperature_down": False,
-                                "announcement": "",
-                                "announce_pressed": False,
-                                "emergency_brake": False,
-                                "kp": None,
-                                "ki": None,
-                                "engineering_panel_locked": False,
-                                "power_command": 0.0
-                            }
-                        }
-                    
-                    # Ensure inputs/outputs structure exists (handle legacy flat format)
-                    if "inputs" not in train_states[key]:
-                        train_states[key] = {
-                            "inputs": {},
-                            "outputs": {}
-                        }
-                    
-                    # Update ONLY inputs section with train_data (preserve outputs!)
-                    train_states[key]["inputs"]["commanded_speed"] = inputs.get("commanded speed", 0.0)
-                    train_states[key]["inputs"]["commanded_authority"] = inputs.get("commanded authority", 0.0)
-                    train_states[key]["inputs"]["speed_limit"] = inputs.get("speed limit", 0.0)
-                    train_states[key]["inputs"]["train_velocity"] = outputs.get("velocity_mph", 0.0)
-                    train_states[key]["inputs"]["train_temperature"] = outputs.get("temperature_F", 70.0)
-                    train_states[key]["inputs"]["train_model_engine_failure"] = inputs.get("train_model_engine_failure", False)
-                    train_states[key]["inputs"]["train_model_signal_failure"] = inputs.get("train_model_signal_failure", False)
-                    train_states[key]["inputs"]["train_model_brake_failure"] = inputs.get("train_model_brake_failure", False)
-                    
-                    # Also sync beacon info (current_station, next_station, side_door)
-                    train_states[key]["inputs"]["current_station"] = inputs.get("current station", "")
-                    train_states[key]["inputs"]["next_stop"] = inputs.get("next station", "")
-                    train_states[key]["inputs"]["station_side"] = inputs.get("side_door", "Right")
-            
-            # Write updated states back
-            write_json_file(TRAIN_STATES_FILE, train_states)
-            
-        except Exception as e:
-            print(f"[Server] Error in sync thread: {e}")
-        
-        time.sleep(0.5)  # Sync every 500ms (same as UI update rate)
     
+    The thread blocks until the train_data channel is published (Train Model
+    writes and journal appends), checking the file's stat only when it wakes
+    up, and writes only the trains whose inputs changed (see TrainDataWatch).
+    """
+    print("[Server] Train data sync thread started (change-driven)")
+    TrainDataWatch(read_train_data, write_train_inputs, TRAIN_DATA_FILE).run(lambda: sync_running)
     print("[Server] Train data sync thread stopped")
 
 # ========== Train State Endpoints ==========
 
+def state_response(state):
+    """Return a train state as JSON, or binary if the client asked for it."""
+    best = request.accept_mimetypes.best_match(["application/json", BINARY_CONTENT_TYPE])
+    if best == BINARY_CONTENT_TYPE:
+        return Response(encode_message("train_states", state, "binary"),
+                        mimetype=BINARY_CONTENT_TYPE), 200
+    return jsonify(state), 200
+
 @app.route('/api/train/<int:train_id>/state', methods=['GET'])
 def get_train_state(train_id):
-    """Get state for a specific train."""
-    data = read_json_file(TRAIN_STATES_FILE)
-    train_key = f"train_{train_id}"
+    """Get state for a specific train.
     
-    if train_key in data:
-        return jsonify(data[train_key]), 200
-    else:
+    In JSON mode the response carries the train's version as an ETag, and a
+    request whose If-None-Match still matches gets 304 with no body.
+    """
+    if state_store is not None:
+        inputs, outputs = state_store.read_sections(train_id)
+        if inputs is None:
+            return jsonify({"error": f"Train {train_id} not found"}), 404
+        return state_response({"inputs": inputs, "outputs": outputs})
+    
+    state, version = fleet.get_versioned(train_id)
+    if state is None:
         return jsonify({"error": f"Train {train_id} not found"}), 404
+    etag = fleet.tag(version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response, _ = state_response(state)
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
 
 @app.route('/api/train/<int:train_id>/state', methods=['POST', 'PUT'])
 def update_train_state(train_id):
@@ -177,135 +190,155 @@ def update_train_state(train_id):
     if not updates:
         return jsonify({"error": "No data provided"}), 400
     
-    data = read_json_file(TRAIN_STATES_FILE)
-    train_key = f"train_{train_id}"
+    try:
+        fields = schema.validate(updates)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Define which fields go in inputs vs outputs
-    input_fields = {'commanded_speed', 'commanded_authority', 'speed_limit', 'train_velocity', 
-                    'current_station', 'next_stop', 'station_side', 'train_temperature',
-                    'train_model_engine_failure', 'train_model_signal_failure', 
-                    'train_model_brake_failure', 'train_controller_engine_failure',
-                    'train_controller_signal_failure', 'train_controller_brake_failure',
-                    'beacon_read_blocked'}
-    output_fields = {'manual_mode', 'driver_velocity', 'service_brake', 'right_door', 'left_door',
-                     'interior_lights', 'exterior_lights', 'set_temperature', 'temperature_up',
-                     'temperature_down', 'announcement', 'announce_pressed', 'emergency_brake',
-                     'kp', 'ki', 'engineering_panel_locked', 'power_command'}
+    if state_store is not None:
+        state_store.write(train_id, fields)
+        inputs, outputs = state_store.read_sections(train_id)
+        print(f"[Server] Train {train_id} state updated: {list(updates.keys())}")
+        return jsonify({"message": "State updated",
+                        "state": {"inputs": inputs, "outputs": outputs}}), 200
     
-    # Initialize train if it doesn't exist with proper structure
-    if train_key not in data:
-        data[train_key] = {
-            "inputs": {
-                "commanded_speed": 0.0,
-                "commanded_authority": 0.0,
-                "speed_limit": 0.0,
-                "train_velocity": 0.0,
-                "next_stop": "",
-                "station_side": "Right",
-                "train_temperature": 70.0,
-                "current_station": "",
-                "train_model_engine_failure": False,
-                "train_model_signal_failure": False,
-                "train_model_brake_failure": False,
-                "train_controller_engine_failure": False,
-                "train_controller_signal_failure": False,
-                "train_controller_brake_failure": False,
-                "beacon_read_blocked": False
-            },
-            "outputs": {
-                "manual_mode": False,
-                "driver_velocity": 0.0,
-                "service_brake": False,
-                "emergency_brake": False,
-                "power_command": 0.0,
-                "kp": None,
-                "ki": None,
-                "right_door": False,
-                "left_door": False,
-                "interior_lights": True,
-                "exterior_lights": True,
-                "set_temperature": 70.0,
-                "temperature_up": False,
-                "temperature_down": False,
-                "announcement": "",
-                "announce_pressed": False,
-                "engineering_panel_locked": False
-            }
-        }
+    # Creates the train with defaults if it doesn't exist
+    state = fleet.update(train_id, fields)
+    
+    print(f"[Server] Train {train_id} state updated: {list(updates.keys())}")
+    return jsonify({"message": "State updated", "state": state}), 200
+
+@app.route('/api/train/<int:train_id>/state', methods=['PATCH'])
+def patch_train_state(train_id):
+    """Field-level update, conditional with If-Match: <ETag from a GET>.
     
-    # Ensure inputs/outputs structure exists
-    if "inputs" not in data[train_key]:
-        data[train_key] = {"inputs": {}, "outputs": {}}
+    Applied unless another writer changed one of the sent fields after that
+    version; changes to other fields merge. On a conflict nothing is applied
+    and the response is 409 with the conflicting fields and the current
+    state and version. A tag this run never issued (e.g. from before a
+    server restart) gets 412 with the current state and version. Without
+    If-Match it behaves like POST.
+    """
+    updates = request.json
+    if not updates:
+        return jsonify({"error": "No data provided"}), 400
     
-    # Update fields in appropriate sections
-    for key, value in updates.items():
-        if key in input_fields:
-            data[train_key]["inputs"][key] = value
-        elif key in output_fields:
-            data[train_key]["outputs"][key] = value
+    try:
+        fields = schema.validate(updates)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    write_json_file(TRAIN_STATES_FILE, data)
+    if not request.if_match:
+        return update_train_state(train_id)
+    if state_store is not None:
+        return jsonify({"error": "If-Match needs the in-memory fleet state (JSON mode)"}), 503
     
-    print(f"[Server] Train {train_id} state updated: {list(updates.keys())}")
-    return jsonify({"message": "State updated", "state": data[train_key]}), 200
+    if request.if_match.star_tag:
+        base = fleet.version
+    else:
+        versions = [fleet.parse_tag(tag) for tag in request.if_match.as_set()]
+        versions = [v for v in versions if v is not None]
+        if not versions:
+            # Stale tag (from before a server restart): the precondition fails
+            state, version = fleet.get_versioned(train_id)
+            if state is None:
+                return jsonify({"error": f"Train {train_id} not found"}), 404
+            etag = fleet.tag(version)
+            response = jsonify({"error": "Precondition Failed", "version": etag, "state": state})
+            response.status_code = 412
+            response.set_etag(etag)
+            return response
+        base = max(versions)
+    state, version, conflicts = fleet.patch(train_id, fields, base)
+    if state is None:
+        return jsonify({"error": f"Train {train_id} not found"}), 404
+    etag = fleet.tag(version)
+    if conflicts:
+        response = jsonify({"error": "Conflict", "conflicts": conflicts,
+                            "version": etag, "state": state})
+        response.status_code = 409
+    else:
+        print(f"[Server] Train {train_id} state patched: {list(updates.keys())}")
+        response = jsonify({"message": "State updated", "version": etag, "state": state})
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/trains', methods=['GET'])
 def get_all_trains():
     """Get all train states."""
-    data = read_json_file(TRAIN_STATES_FILE)
+    if state_store is not None:
+        return jsonify(state_store.export_dict()), 200
     
-    # Filter to only return train_X entries
-    trains = {k: v for k, v in data.items() if k.startswith('train_')}
+    return jsonify(fleet.snapshot()), 200
+
+def filter_fields(state, fields):
+    """Only the requested fields of a {"inputs", "outputs"} state (all if fields is None)."""
+    if fields is None:
+        return state
+    return {section: {k: v for k, v in values.items() if k in fields}
+            for section, values in state.items()}
+
+@app.route('/api/trains/state', methods=['GET'])
+def get_trains_state():
+    """Several trains in one request: ?ids=1,2,3&fields=power_command,... (both optional)."""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of train IDs"}), 400
+    fields = request.args.get('fields')
+    fields = {f.strip() for f in fields.split(',') if f.strip()} if fields else None
+    
+    if state_store is not None:
+        if not ids:
+            ids = state_store.train_ids()
+        states = {}
+        for train_id in ids:
+            inputs, outputs = state_store.read_sections(train_id)
+            states[train_id] = None if inputs is None else {"inputs": inputs, "outputs": outputs}
+    elif ids:
+        states = fleet.get_many(ids)
+    else:
+        states = {parse_train_id(key): state for key, state in fleet.snapshot().items()}
+    
+    trains = {f"train_{train_id}": filter_fields(state, fields)
+              for train_id, state in states.items() if state is not None}
+    missing = [train_id for train_id, state in states.items() if state is None]
+    return jsonify({"trains": trains, "missing": missing}), 200
+
+@app.route('/api/trains/state', methods=['PATCH'])
+def patch_trains_state():
+    """Partial updates for several trains: {"<id>": {field: value, ...}, ...}.
+    
+    Valid updates are applied together under one lock; the response has a
+    result under each key as sent (ok + version, or the validation error).
+    """
+    body = request.json
+    if not isinstance(body, dict) or not body:
+        return jsonify({"error": "No data provided"}), 400
+    
+    def apply(valid):
+        if state_store is None:
+            return {train_id: {"version": version}
+                    for train_id, version in fleet.update_many(valid).items()}
+        for train_id, fields in valid.items():
+            state_store.write(train_id, fields)
+        return {train_id: {} for train_id in valid}
     
-    return jsonify(trains), 200
+    results = bulk_update(body, apply)
+    rejected = sum(not result["ok"] for result in results.values())
+    print(f"[Server] Bulk update: {len(body) - rejected} trains updated, {rejected} rejected")
+    status = 200 if not rejected else 207
+    return jsonify({"results": results}), status
 
 @app.route('/api/train/<int:train_id>/reset', methods=['POST'])
 def reset_train_state(train_id):
     """Reset a train to default state."""
-    data = read_json_file(TRAIN_STATES_FILE)
-    train_key = f"train_{train_id}"
+    default_state = schema.default_sections()
     
-    default_state = {
-        "inputs": {
-            "commanded_speed": 0.0,
-            "commanded_authority": 0.0,
-            "speed_limit": 0.0,
-            "train_velocity": 0.0,
-            "next_stop": "",
-            "station_side": "Right",
-            "train_temperature": 70.0,
-            "current_station": "",
-            "train_model_engine_failure": False,
-            "train_model_signal_failure": False,
-            "train_model_brake_failure": False,
-            "train_controller_engine_failure": False,
-            "train_controller_signal_failure": False,
-            "train_controller_brake_failure": False,
-            "beacon_read_blocked": False
-        },
-        "outputs": {
-            "manual_mode": False,
-            "driver_velocity": 0.0,
-            "service_brake": False,
-            "emergency_brake": False,
-            "right_door": False,
-            "left_door": False,
-            "interior_lights": True,
-            "exterior_lights": True,
-            "set_temperature": 70.0,
-            "temperature_up": False,
-            "temperature_down": False,
-            "announcement": "",
-            "announce_pressed": False,
-            "kp": None,
-            "ki": None,
-            "engineering_panel_locked": False,
-            "power_command": 0.0
-        }
-    }
-    
-    data[train_key] = default_state
-    write_json_file(TRAIN_STATES_FILE, data)
+    if state_store is not None:
+        state_store.write(train_id, {**default_state["inputs"], **default_state["outputs"]})
+    else:
+        fleet.reset(train_id)
     
     print(f"[Server] Train {train_id} reset to defaults")
     return jsonify({"message": "State reset", "state": default_state}), 200
@@ -313,16 +346,145 @@ def reset_train_state(train_id):
 @app.route('/api/train/<int:train_id>', methods=['DELETE'])
 def delete_train(train_id):
     """Delete a train's state."""
-    data = read_json_file(TRAIN_STATES_FILE)
-    train_key = f"train_{train_id}"
+    if state_store is not None:
+        if state_store.remove_train(train_id):
+            print(f"[Server] Train {train_id} deleted")
+            return jsonify({"message": f"Train {train_id} deleted"}), 200
+        return jsonify({"error": f"Train {train_id} not found"}), 404
     
-    if train_key in data:
-        del data[train_key]
-        write_json_file(TRAIN_STATES_FILE, data)
+    if fleet.delete(train_id):
         print(f"[Server] Train {train_id} deleted")
         return jsonify({"message": f"Train {train_id} deleted"}), 200
-    else:
-        return jsonify({"error": f"Train {train_id} not found"}), 404
+    return jsonify({"error": f"Train {train_id} not found"}), 404
+
+# ========== State Streams (Server-Sent Events) ==========
+
+# Seconds between heartbeats on a stream with no changes
+STREAM_HEARTBEAT_S = 15.0
+
+def sse_message(event, data, event_id=None):
+    """One Server-Sent Events message."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def stream_since():
+    """Fleet version a reconnecting client already has (?since= or Last-Event-ID), or None.
+    
+    Either is a tag ("<epoch>.<version>", the event IDs) or a bare version;
+    a tag from before a server restart gives None.
+    """
+    value = request.args.get('since') or request.headers.get('Last-Event-ID')
+    return fleet.parse_tag(value) if value else None
+
+def state_stream(train_ids, since):
+    """SSE messages with the changes to some trains (every train if train_ids is None).
+    
+    Starts with a "snapshot" of the trains' flat states unless the client
+    resumes from a version the change log still covers; after that only
+    "diff" messages (changed fields) and "deleted" messages, each with the
+    fleet version's tag as its event ID, plus a "heartbeat" when nothing was sent
+    for STREAM_HEARTBEAT_S.
+    """
+    keys = None if train_ids is None else {fleet.key(train_id) for train_id in train_ids}
+    version = fleet.version
+    changes = None if since is None else fleet.changes_since(since, keys)
+    last_sent = time.monotonic()
+    while True:
+        if changes is None:
+            # New client, or too far behind: send the current state
+            version = fleet.version
+            trains = {key: {**state["inputs"], **state["outputs"]}
+                      for key, state in fleet.snapshot().items() if keys is None or key in keys}
+            yield sse_message("snapshot", {"epoch": fleet.epoch, "version": version,
+                                           "trains": trains}, fleet.tag(version))
+            last_sent = time.monotonic()
+            changes = []
+        for change_version, key, fields in changes:
+            if change_version > version:
+                break  # sent on the next pass
+            data = {"version": change_version, "train_id": parse_train_id(key)}
+            if fields is None:
+                yield sse_message("deleted", data, fleet.tag(change_version))
+            else:
+                data["fields"] = fields
+                yield sse_message("diff", data, fleet.tag(change_version))
+            last_sent = time.monotonic()
+        idle = time.monotonic() - last_sent
+        if idle >= STREAM_HEARTBEAT_S:
+            yield sse_message("heartbeat", {"version": version})
+            last_sent, idle = time.monotonic(), 0.0
+        current = fleet.wait_for_changes(version, STREAM_HEARTBEAT_S - idle)
+        changes = fleet.changes_since(version, keys) if current != version else []
+        version = current
+
+def stream_response(train_ids):
+    """Event-stream response for state_stream(), resuming from the client's version."""
+    if state_store is not None:
+        return jsonify({"error": "Streams need the in-memory fleet state (JSON mode)"}), 503
+    return Response(state_stream(train_ids, stream_since()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/train/<int:train_id>/stream', methods=['GET'])
+def stream_train_state(train_id):
+    """Stream a train's changes (?since=<version> to resume)."""
+    return stream_response([train_id])
+
+@app.route('/api/trains/stream', methods=['GET'])
+def stream_trains_state():
+    """Stream changes to several trains: ?ids=1,2,3 (default: every train)."""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of train IDs"}), 400
+    return stream_response(ids or None)
+
+# ========== Event History Endpoints ==========
+
+def get_event_db():
+    """The controller database holding the event history (opened on first use)."""
+    global event_db
+    with event_db_lock:
+        if event_db is None:
+            event_db = train_database()
+        return event_db
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """Query events: ?train_id=&block=&type=&start=&end=&limit= (all optional)."""
+    db = get_event_db()
+    events = db.get_events(train_id=request.args.get('train_id', type=int),
+                           block=request.args.get('block', type=int),
+                           event_type=request.args.get('type'),
+                           start=request.args.get('start', type=float),
+                           end=request.args.get('end', type=float),
+                           limit=request.args.get('limit', default=1000, type=int))
+    return jsonify({"events": events}), 200
+
+@app.route('/api/events', methods=['POST'])
+def post_events():
+    """Record events: a list (or {"events": [...]}) of {t, event_type, train_id, block, value, detail}."""
+    db = get_event_db()
+    events = request.json
+    if isinstance(events, dict):
+        events = events.get("events")
+    if not isinstance(events, list):
+        return jsonify({"error": "No events provided"}), 400
+    try:
+        db.record_events(events)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid event: {e}"}), 400
+    return jsonify({"message": "Events recorded", "count": len(events)}), 200
+
+@app.route('/api/block/<int:block>/trains', methods=['GET'])
+def get_block_trains(block):
+    """Trains that occupied a block between ?start= and ?end= (simulation seconds)."""
+    db = get_event_db()
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    if start is None or end is None:
+        return jsonify({"error": "start and end are required"}), 400
+    return jsonify({"block": block, "start": start, "end": end,
+                    "trains": db.trains_in_block(block, start, end)}), 200
 
 # ========== Health Check ==========
 
@@ -345,9 +507,17 @@ def root():
             "GET /api/health": "Server health check",
             "GET /api/trains": "Get all train states",
             "GET /api/train/<id>/state": "Get specific train state",
+            "GET /api/trains/state?ids=&fields=": "Get several trains (optionally only some fields)",
+            "PATCH /api/trains/state": "Update several trains in one request",
+            "GET /api/train/<id>/stream": "Stream a train's changes (Server-Sent Events)",
+            "GET /api/trains/stream?ids=": "Stream changes to several trains",
             "POST /api/train/<id>/state": "Update train state",
+            "PATCH /api/train/<id>/state": "Update fields if unchanged since If-Match (409 on conflict, 412 on a stale tag)",
             "POST /api/train/<id>/reset": "Reset train to defaults",
-            "DELETE /api/train/<id>": "Delete train"
+            "DELETE /api/train/<id>": "Delete train",
+            "GET /api/events": "Query train/block events",
+            "POST /api/events": "Record events",
+            "GET /api/block/<block>/trains": "Trains in a block over a time range"
         }
     }), 200
 
@@ -365,7 +535,14 @@ if __name__ == '__main__':
     print("  GET  /api/trains              - Get all trains")
     print("  GET  /api/train/<id>/state    - Get train state")
     print("  POST /api/train/<id>/state    - Update train state")
+    print("  PATCH /api/train/<id>/state   - Update fields, If-Match: <ETag> (409 on conflict, 412 stale)")
     print("  POST /api/train/<id>/reset    - Reset train state")
+    print("  GET  /api/trains/state        - Get several trains (?ids=&fields=)")
+    print("  PATCH /api/trains/state       - Update several trains")
+    print("  GET  /api/train/<id>/stream   - Stream train changes (SSE, ?since=)")
+    print("  GET  /api/trains/stream       - Stream changes to several trains (?ids=)")
+    print("  GET  /api/events              - Query event history")
+    print("  GET  /api/block/<n>/trains    - Trains in a block over a time range")
     print("=" * 70)
     
     # Start background sync thread
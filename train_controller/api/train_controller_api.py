@@ -1,28 +1,176 @@
 """Train Controller API module for state management and module communication.
 
 This module handles data persistence using JSON files and provides interfaces
-for communication between Train Controller and Train Model modules. 
+for communication between Train Controller and Train Model modules. Per-train
+state can optionally live in a shared-memory store (see shared_state_store.py)
+or in one file per train (see sharded_state_store.py).
 """
 
+import atexit
 import json
 import os
+import sys
 import threading
+from collections.abc import Mapping
 from typing import Dict, Optional
 
+try:
+    from . import train_state_schema as schema
+    from .state_transaction import TransactionScope
+    from .state_view import StateView
+except ImportError:
+    import train_state_schema as schema
+    from state_transaction import TransactionScope
+    from state_view import StateView
+
+# Shared-file infrastructure (change notification, SimBus, A/B publishing, JSON cache)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from channel_notify import publish_change, publish_path
+from sim_bus import active_bus_for
+from double_buffer import load as load_published, publish as publish_file
+from json_cache import read_json
+
+
+def _read_json_file(path: str):
+    """Parse a shared JSON file (its last complete version if double-buffered)."""
+    return load_published(path)
+
+
 # Global file lock for thread-safe access to train_states.json
 # Using RLock (reentrant lock) to allow same thread to acquire lock multiple times
 _file_lock = threading.Lock()
 
+# Default state template with inputs/outputs sections (see train_state_schema.py)
+DEFAULT_INPUTS = dict(schema.DEFAULT_INPUTS)
+DEFAULT_OUTPUTS = dict(schema.DEFAULT_OUTPUTS)
+
+# Set TRAIN_STATE_SHM=1 to keep per-train state in shared memory instead of
+# re-reading/re-writing train_states.json on every call. The JSON file is still
+# exported periodically for modules that read it directly.
+USE_SHARED_MEMORY = os.environ.get("TRAIN_STATE_SHM", "0") == "1"
+# Set TRAIN_STATE_SHARDS=1 to keep one state file per train with per-train
+# locks (see sharded_state_store.py); train_states.json is exported the same way.
+USE_SHARDED_STATE = os.environ.get("TRAIN_STATE_SHARDS", "0") == "1"
+USE_STATE_STORE = USE_SHARED_MEMORY or USE_SHARDED_STATE
+# Set GROUP4_STATE_BACKEND=sqlite|http (or pass backend=) to keep controller
+# state in another StateBackend (see state_backend.py); "shm" selects the
+# shared-memory store above and "json" the train_states.json code below.
+STATE_BACKEND = os.environ.get("GROUP4_STATE_BACKEND", "json").lower()
+_shared_store = None
+_sharded_store = None
+_shared_store_lock = threading.Lock()
+
+_STATE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "train_states.json")
+
+
+def _export_from_owner(store, JsonExportAdapter, seed=True):
+    """Seed a new store from train_states.json and keep exporting the file."""
+    if seed:
+        try:
+            if os.path.exists(_STATE_FILE):
+                store.import_dict(_read_json_file(_STATE_FILE))
+        except Exception as e:
+            print(f"[WARNING] Could not seed state store: {e}")
+    store.exporter = JsonExportAdapter(store, _STATE_FILE)
+    store.exporter.start()
+    atexit.register(store.exporter.stop)
+
+
+def get_shared_state_store():
+    """Get (or create) this process's handle to the shared-memory state store.
+
+    The process that creates the segment seeds it from train_states.json and
+    runs the JSON export adapter so legacy readers keep working.
+    """
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            try:
+                from .shared_state_store import SharedStateStore, JsonExportAdapter
+            except ImportError:
+                from shared_state_store import SharedStateStore, JsonExportAdapter
+            store = SharedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS)
+            if store.owner:
+                _export_from_owner(store, JsonExportAdapter)
+            _shared_store = store
+        return _shared_store
+
+
+def get_sharded_state_store():
+    """Get (or create) this process's handle to the per-train sharded store.
+
+    The first process to open it exports train_states.json; shards persist on
+    disk, so the file is only imported when there are no shards yet.
+    """
+    global _sharded_store
+    with _shared_store_lock:
+        if _sharded_store is None:
+            try:
+                from .shared_state_store import JsonExportAdapter
+                from .sharded_state_store import ShardedStateStore
+            except ImportError:
+                from shared_state_store import JsonExportAdapter
+                from sharded_state_store import ShardedStateStore
+            store = ShardedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS)
+            if store.owner:
+                _export_from_owner(store, JsonExportAdapter, seed=not store.train_ids())
+            _sharded_store = store
+        return _sharded_store
+
+
+def get_state_store():
+    """The configured per-train state store (sharded files or shared memory)."""
+    if USE_SHARDED_STATE:
+        return get_sharded_state_store()
+    return get_shared_state_store()
+
+
 class train_controller_api:
     """Manages train state persistence and module communication using JSON."""
     
-    def __init__(self, train_id=None):
+    # StateBackend holding this train's state (None = store or JSON file)
+    backend = None
+
+    def __init__(self, train_id=None, use_shared_memory=None, backend=None):
         """Initialize API with default state.
         
         Args:
             train_id: Optional train ID for multi-train support. If None, uses root level (legacy).
+            use_shared_memory: Keep state in the per-train state store (multi-train mode only).
+                Defaults to the TRAIN_STATE_SHM / TRAIN_STATE_SHARDS environment settings.
+            backend: StateBackend instance or name ("json", "sqlite", "shm", "http") for
+                multi-train mode. Defaults to GROUP4_STATE_BACKEND.
         """
         self.train_id = train_id  # None means root level, otherwise use train_X
+        self._transactions = TransactionScope()
+        
+        if backend is None:
+            backend = STATE_BACKEND
+        if train_id is not None and isinstance(backend, str):
+            if backend == "shm":
+                use_shared_memory = True
+            elif backend != "json":
+                try:
+                    try:
+                        from .state_backend import shared_backend
+                    except ImportError:
+                        from state_backend import shared_backend
+                    self.backend = shared_backend(backend)
+                except Exception as e:
+                    print(f"[WARNING] State backend '{backend}' unavailable, using JSON file: {e}")
+        elif train_id is not None:
+            self.backend = backend
+        
+        if use_shared_memory is None:
+            use_shared_memory = USE_STATE_STORE
+        self.store = None
+        if self.backend is None and use_shared_memory and train_id is not None:
+            try:
+                self.store = get_shared_state_store() if backend == "shm" else get_state_store()
+            except Exception as e:
+                print(f"[WARNING] State store unavailable, using JSON file: {e}")
         
         # Create data directory in train_controller folder
         base_dir = os.path.dirname(os.path.dirname(__file__))
@@ -30,47 +178,12 @@ class train_controller_api:
         os.makedirs(self.data_dir, exist_ok=True)
         
         self.state_file = os.path.join(self.data_dir, "train_states.json")
+        # SimBus channel for train_states (None = use the JSON file)
+        self.bus = active_bus_for(self.state_file)
         
         # Default state template with inputs/outputs sections
-        self.default_inputs = {
-            # Inputs FROM Train Model
-            'commanded_speed': 0.0,
-            'commanded_authority': 0.0,
-            'speed_limit': 0.0,
-            'train_velocity': 0.0,
-            'current_station': '',
-            'next_stop': '',
-            'station_side': '',
-            'train_temperature': 0.0,
-            'train_model_engine_failure': False,
-            'train_model_signal_failure': False,
-            'train_model_brake_failure': False,
-            'train_controller_engine_failure': False,
-            'train_controller_signal_failure': False,
-            'train_controller_brake_failure': False,
-            'beacon_read_blocked': False,
-        }
-        
-        self.default_outputs = {
-            # Outputs TO Train Model (Train Controller commands)
-            'manual_mode': False,
-            'driver_velocity': 0.0,
-            'service_brake': False,
-            'right_door': False,
-            'left_door': False,
-            'interior_lights': False,
-            'exterior_lights': False,
-            'set_temperature': 70.0,
-            'temperature_up': False,
-            'temperature_down': False,
-            'announcement': '',
-            'announce_pressed': False,
-            'emergency_brake': False,
-            'kp': None,  # Must be set through UI
-            'ki': None,  # Must be set through UI
-            'engineering_panel_locked': False,
-            'power_command': 0.0,
-        }
+        self.default_inputs = DEFAULT_INPUTS.copy()
+        self.default_outputs = DEFAULT_OUTPUTS.copy()
         
         # Legacy flat structure for backward compatibility
         self.train_states = {**self.default_inputs, **self.default_outputs}
@@ -78,15 +191,18 @@ class train_controller_api:
         # Check if train state already exists before initializing
         # Only initialize if this is a NEW train
         train_exists = False
-        if os.path.exists(self.state_file):
+        if self.backend is not None:
+            train_exists = self.backend.get(self.train_id) is not None
+        elif self.store is not None:
+            train_exists = self.store.has_train(self.train_id)
+        elif self._states_exist():
             try:
-                with open(self.state_file, 'r') as f:
-                    existing_states = json.load(f)
-                    if self.train_id is not None:
-                        train_key = f"train_{self.train_id}"
-                        train_exists = train_key in existing_states
-                    else:
-                        train_exists = bool(existing_states)
+                existing_states = self._load_states()
+                if self.train_id is not None:
+                    train_key = f"train_{self.train_id}"
+                    train_exists = train_key in existing_states
+                else:
+                    train_exists = bool(existing_states)
             except:
                 pass
         
@@ -112,42 +228,89 @@ class train_controller_api:
         else:
             print(f"[API INIT] Train {train_id} already exists, preserving existing state")
 
+    def _states_exist(self) -> bool:
+        return self.bus is not None or os.path.exists(self.state_file)
+
+    def _load_states(self) -> dict:
+        """Parse train_states.json, or read it from the SimBus channel."""
+        if self.bus is not None:
+            return self.bus.read_path(self.state_file, {})
+        return _read_json_file(self.state_file)
+
+    def _store_states(self, all_states: dict) -> None:
+        """Write train_states.json (or its SimBus channel) and wake its readers."""
+        if self.bus is not None:
+            self.bus.write_path(self.state_file, all_states)
+            return
+        # A/B slots plus commit marker: readers never see a partial write
+        publish_file(self.state_file, json.dumps(all_states, indent=4))
+        publish_path(self.state_file)
+
+    def _active_transaction(self):
+        scope = getattr(self, '_transactions', None)
+        return scope.active if scope is not None else None
+
+    def transaction(self):
+        """Batch a controller cycle into one read and one write.
+
+        Usage:
+            with api.transaction() as st:
+                ...  # get_state()/update_state() work on st in memory
+
+        Only the fields that changed are saved when the block exits (see
+        state_transaction.py).
+        """
+        return self._transactions.run(self.get_state, self.save_state)
+
     def update_state(self, state_dict: dict) -> None:
         """Update train state with new values.
         
         Args:
             state_dict: Dictionary containing updated values
         """
+        txn = self._active_transaction()
+        if txn is not None:
+            txn.update(state_dict)
+            return
         current_state = self.get_state()
         current_state.update(state_dict)
         self.save_state(current_state)
 
-    def get_state(self) -> dict:
+    def _read_states_shared(self) -> dict:
+        """Parsed train_states.json shared with other readers (do not modify)."""
+        if self.bus is None:
+            return read_json(self.state_file)
+        return self._load_states()
+
+    def get_state(self) -> Mapping:
         """Get current train state.
         
         Returns:
-            dict: Current state of the train (merged inputs + outputs). Returns default state if there are any issues.
+            Mapping: Current state of the train (merged inputs + outputs) as a
+            copy-on-write StateView. Returns default state if there are any issues.
         """
+        txn = self._active_transaction()
+        if txn is not None:
+            return dict(txn)
+        if self.backend is not None:
+            state = self.backend.get(self.train_id)
+            if state is None:
+                return StateView(self.train_states, {'train_id': self.train_id})
+            return state
+        if self.store is not None:
+            inputs, outputs = self.store.read_sections(self.train_id)
+            if inputs is None:
+                return StateView(self.train_states, {'train_id': self.train_id})
+            return StateView(self.train_states, inputs, outputs)
         with _file_lock:
             try:
-                if os.path.exists(self.state_file):
-                    # Retry up to 3 times to handle race conditions with other processes
-                    for attempt in range(3):
-                        try:
-                            with open(self.state_file, 'r') as f:
-                                all_states = json.load(f)
-                                break  # Success!
-                        except json.JSONDecodeError as e:
-                            if attempt < 2:  # Retry on first 2 attempts
-                                import time
-                                time.sleep(0.01)  # Wait 10ms before retry
-                                continue
-                            else:  # Final attempt failed
-                                print(f"[WARNING] JSON decode error after 3 attempts (race condition): {e}")
-                                return self.train_states.copy()
-                    else:
-                        # This shouldn't happen, but just in case
-                        return self.train_states.copy()
+                if self._states_exist():
+                    try:
+                        all_states = self._read_states_shared()
+                    except json.JSONDecodeError as e:
+                        # Only a file rewritten in place by another program
+                        print(f"[WARNING] train_states.json is being rewritten: {e}")
+                        return StateView(self.train_states)
                     
                     # Successfully loaded all_states, now process it
                     try:
@@ -159,40 +322,32 @@ class train_controller_api:
                                     section = all_states[train_key]
                                     # Check if it has new inputs/outputs structure
                                     if 'inputs' in section and 'outputs' in section:
-                                        # Merge defaults first, then inputs and outputs
-                                        result = self.train_states.copy()
-                                        result.update(section.get('inputs', {}))
-                                        result.update(section.get('outputs', {}))
-                                        return result
+                                        # Defaults first, then inputs and outputs
+                                        return StateView(self.train_states,
+                                                         section.get('inputs', {}),
+                                                         section.get('outputs', {}))
                                     else:
-                                        # Old flat structure - merge with defaults
-                                        result = self.train_states.copy()
-                                        result.update(section)
-                                        return result
+                                        # Old flat structure - over the defaults
+                                        return StateView(self.train_states, section)
                                 else:
                                     # Return default state if train section doesn't exist
-                                    default = self.train_states.copy()
-                                    default['train_id'] = self.train_id
-                                    return default
+                                    return StateView(self.train_states, {'train_id': self.train_id})
                             else:
                                 # Legacy mode: read from root level, support both old and new structure
                                 if 'inputs' in all_states and 'outputs' in all_states:
-                                    result = self.train_states.copy()
-                                    result.update(all_states.get('inputs', {}))
-                                    result.update(all_states.get('outputs', {}))
-                                    return result
+                                    return StateView(self.train_states,
+                                                     all_states.get('inputs', {}),
+                                                     all_states.get('outputs', {}))
                                 else:
-                                    result = self.train_states.copy()
-                                    result.update(all_states)
-                                    return result
+                                    return StateView(self.train_states, all_states)
                     except Exception as e:
                         print(f"[WARNING] Error processing state: {e}")
-                        return self.train_states.copy()
+                        return StateView(self.train_states)
                 else:
-                    return self.train_states.copy()
+                    return StateView(self.train_states)
             except Exception as e:
                 print(f"Error accessing state file: {e}")
-                return self.train_states.copy()
+                return StateView(self.train_states)
 
     def save_state(self, state: dict) -> None:
         """Save train state to file with inputs/outputs structure.
@@ -202,10 +357,32 @@ class train_controller_api:
             
         The method separates state into inputs (from Train Model) and outputs (to Train Model).
         """
+        txn = self._active_transaction()
+        if txn is not None and isinstance(state, Mapping):
+            txn.update(state)
+            return
+        if self.backend is not None:
+            try:
+                if not isinstance(state, Mapping):
+                    raise ValueError(f"save_state() requires dict, got {type(state)}")
+                self.backend.update(self.train_id, state)
+            except Exception as e:
+                print(f"[ERROR] Failed to save train state to the state backend: {e}")
+            return
+        if self.store is not None:
+            try:
+                if not isinstance(state, Mapping):
+                    raise ValueError(f"save_state() requires dict, got {type(state)}")
+                self.store.write(self.train_id, state)
+            except Exception as e:
+                print(f"[ERROR] Failed to save train state to the state store: {e}")
+                return
+            publish_change("train_states")
+            return
         with _file_lock:
             try:
                 # Validate state parameter
-                if not isinstance(state, dict):
+                if not isinstance(state, Mapping):
                     raise ValueError(f"save_state() requires dict, got {type(state)}")
                 
                 # Use state as-is (no merging with defaults - preserves existing values)
@@ -216,9 +393,8 @@ class train_controller_api:
                 
                 if self.train_id is not None:
                     # Multi-train mode: update specific train's section at ROOT level only
-                    if os.path.exists(self.state_file):
-                        with open(self.state_file, 'r') as f:
-                            all_states = json.load(f)
+                    if self._states_exist():
+                        all_states = self._load_states()
                     else:
                         all_states = {}
                     
@@ -242,18 +418,11 @@ class train_controller_api:
                         inputs = self.default_inputs.copy()
                         outputs = self.default_outputs.copy()
                     
-                    # Update ONLY the fields present in complete_state (preserves other fields)
-                    for key, value in complete_state.items():
-                        # Skip nested train_X sections and train_id
-                        if key.startswith('train_') and isinstance(value, dict):
-                            continue
-                        elif key == 'train_id':
-                            continue
-                        # Categorize into inputs or outputs and update
-                        elif key in self.default_inputs:
-                            inputs[key] = value
-                        elif key in self.default_outputs:
-                            outputs[key] = value
+                    # Update ONLY the fields present in complete_state (preserves other fields);
+                    # the schema routes each field (train_id and nested train_X sections are not fields)
+                    sections = schema.split_fields(complete_state)
+                    inputs.update(sections[schema.INPUTS])
+                    outputs.update(sections[schema.OUTPUTS])
                     
                     # Only store inputs and outputs sections
                     all_states[train_key] = {
@@ -261,14 +430,11 @@ class train_controller_api:
                         'outputs': outputs
                     }
                     
-                    # Direct write (file lock prevents race conditions)
-                    with open(self.state_file, 'w') as f:
-                        json.dump(all_states, f, indent=4)
+                    self._store_states(all_states)
                 else:
                     # Legacy mode: save with inputs/outputs structure at root
-                    if os.path.exists(self.state_file):
-                        with open(self.state_file, 'r') as f:
-                            all_states = json.load(f)
+                    if self._states_exist():
+                        all_states = self._load_states()
                     else:
                         all_states = {}
                     
@@ -278,15 +444,11 @@ class train_controller_api:
                         all_states['outputs'] = self.default_outputs.copy()
                     
                     # Sort complete_state into inputs and outputs
-                    for key, value in complete_state.items():
-                        if key in self.default_inputs:
-                            all_states['inputs'][key] = value
-                        elif key in self.default_outputs:
-                            all_states['outputs'][key] = value
+                    sections = schema.split_fields(complete_state)
+                    all_states['inputs'].update(sections[schema.INPUTS])
+                    all_states['outputs'].update(sections[schema.OUTPUTS])
                     
-                    # Direct write (file lock prevents race conditions)
-                    with open(self.state_file, 'w') as f:
-                        json.dump(all_states, f, indent=4)
+                    self._store_states(all_states)
 
             except Exception as e:
                 print(f"[ERROR] Failed to save train state: {e}")
@@ -307,13 +469,15 @@ class train_controller_api:
 
             print(f"[DEBUG] Reading Train Model data from: {train_data_path}")
 
+            bus = active_bus_for(train_data_path)
+            if bus is not None:
+                return bus.read_path(train_data_path, None)
+
             if not os.path.exists(train_data_path):
                 print("[TrainControllerAPI] train_data.json not found in Train_Model folder.")
                 return None
 
-            with open(train_data_path, 'r') as f:
-                data = json.load(f)
-            return data
+            return _read_json_file(train_data_path)
 
         except json.JSONDecodeError:
             print("[TrainControllerAPI] Invalid JSON format in train_data.json.")
@@ -339,20 +503,15 @@ class train_controller_api:
             inputs = data.get("inputs", {})
             outputs = data.get("outputs", {})
 
+        sections = {'inputs': inputs, 'outputs': outputs}
         mapped_data = {
-            'commanded_speed': inputs.get('commanded speed', 0.0),
-            'commanded_authority': inputs.get('commanded authority', 0.0),
-            'speed_limit': inputs.get('speed limit', 0.0),
-            'train_velocity': outputs.get('velocity_mph', 0.0),
-            'train_temperature': outputs.get('temperature_F', 0.0),
-            'train_model_engine_failure': inputs.get('train_model_engine_failure', False),
-            'train_model_signal_failure': inputs.get('train_model_signal_failure', False),
-            'train_model_brake_failure': inputs.get('train_model_brake_failure', False),
-            # NOTE: manual_mode is a controller-only state, not read from train_data.json
-            # NOTE: Do NOT read beacon info (current_station, next_stop, station_side) from train_data.json
-            # The Train Model writes beacon info to train_states.json with proper signal failure handling
-            # Reading from inputs here would bypass the frozen data logic during signal failure
+            name: sections[section].get(key, schema.DEFAULTS[name])
+            for name, (section, key) in schema.TRAIN_DATA_FIELDS.items()
         }
+        # NOTE: manual_mode is a controller-only state, not read from train_data.json
+        # NOTE: Do NOT read beacon info (current_station, next_stop, station_side) from train_data.json
+        # The Train Model writes beacon info to train_states.json with proper signal failure handling
+        # Reading from inputs here would bypass the frozen data logic during signal failure
 
         # Update controller state
         self.receive_from_train_model(mapped_data)
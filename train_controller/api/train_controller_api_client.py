@@ -8,13 +8,71 @@ Author: James Struyk, Julen Coca-Knorr
 """
 import requests
 import json
+import atexit
+import os
+import sys
+import threading
+import time
 from typing import Dict, Optional
 
+# Binary message codec (GROUP4_REST_CODEC=binary)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from message_codec import BINARY_CONTENT_TYPE, decode as decode_message
+
+try:
+    from . import train_state_schema as schema
+    from .state_transaction import TransactionScope
+except ImportError:
+    import train_state_schema as schema
+    from state_transaction import TransactionScope
+
+# Seconds a fetched state answers get_state() without another request
+READ_CACHE_TTL_S = float(os.environ.get("GROUP4_REST_CACHE_TTL_S", "0.1"))
+# Seconds update_state() calls are collected before they are sent as one POST
+WRITE_COALESCE_S = float(os.environ.get("GROUP4_REST_COALESCE_S", "0.05"))
+# Keep-alive connections kept open to the server
+POOL_SIZE = 4
+
+# Mirror the train's state from the server's change stream (GROUP4_REST_STREAM=0 to poll)
+USE_STREAM = os.environ.get("GROUP4_REST_STREAM", "1") != "0"
+# Seconds without a stream message (the server sends heartbeats) before reconnecting
+STREAM_READ_TIMEOUT_S = 45.0
+# Seconds between reconnect attempts
+STREAM_RETRY_S = 2.0
+
+
+def _flat_state(state: dict) -> dict:
+    """Flat {field: value} of a server state ({"inputs", "outputs"} sections are merged)."""
+    if 'inputs' in state or 'outputs' in state:
+        return {**state.get('inputs', {}), **state.get('outputs', {})}
+    return state
+
+
+def _sse_messages(lines):
+    """(event, data) pairs from the lines of a Server-Sent Events response."""
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif not line.startswith(":"):
+            name, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if name == "event":
+                event = value
+            elif name == "data":
+                data.append(value)
+
+
 class train_controller_api_client:
     """Client API that communicates with REST server."""
     
     def __init__(self, train_id: int, server_url: str = "http://192.168.1.100:5000", 
-                 timeout: float = 5.0, max_retries: int = 3):
+                 timeout: float = 5.0, max_retries: int = 3, stream: Optional[bool] = None,
+                 cache_ttl: float = READ_CACHE_TTL_S, coalesce_s: float = WRITE_COALESCE_S):
         """Initialize API client.
         
         Args:
@@ -22,71 +80,67 @@ class train_controller_api_client:
             server_url: URL of the REST API server (e.g., "http://192.168.1.100:5000")
             timeout: Request timeout in seconds (default: 5.0)
             max_retries: Maximum number of retries for failed requests (default: 3)
+            stream: Keep a local mirror of the state from the server's change
+                stream (default: GROUP4_REST_STREAM, on)
+            cache_ttl: Seconds a fetched state is reused by get_state()
+                (default: 0.1, 0 to fetch every time)
+            coalesce_s: Seconds update_state() calls are merged into one POST
+                (default: 0.05, 0 to send each one right away)
         """
         self.train_id = train_id
         self.server_url = server_url.rstrip('/')
         self.state_endpoint = f"{self.server_url}/api/train/{train_id}/state"
         self.timeout = timeout
         self.max_retries = max_retries
+        self.cache_ttl = cache_ttl
+        self.coalesce_s = coalesce_s
+        self._transactions = TransactionScope()
+        
+        # One pooled keep-alive session instead of a new connection per call
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         
-        # Cache for state when server is unreachable
+        # Ask the server for binary-encoded state when configured (falls back to JSON)
+        self._request_headers = {}
+        if os.environ.get("GROUP4_REST_CODEC", "").lower() == "binary":
+            self._request_headers["Accept"] = f"{BINARY_CONTENT_TYPE}, application/json;q=0.5"
+        
+        # Last fetched state: reused for cache_ttl seconds, and the fallback
+        # when the server is unreachable
         self._cached_state = None
+        self._cached_at = 0.0
+        self._etag = None  # server's version of the cached state (If-None-Match)
+        
+        # update_state() fields waiting for the coalesced POST
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        atexit.register(self.flush)
         
         # Default state (fallback if server unreachable)
-        self.default_state = {
-            "train_id": train_id,
-            # Inputs FROM Train Model
-            "commanded_speed": 0.0,
-            "commanded_authority": 0.0,
-            "speed_limit": 0.0,
-            "train_velocity": 0.0,
-            "current_station": "",
-            "next_stop": "",
-            "station_side": "",
-            "train_temperature": 70.0,
-            
-            # Train Model Failure Flags (activated by Train Model)
-            "train_model_engine_failure": False,
-            "train_model_signal_failure": False,
-            "train_model_brake_failure": False,
-            
-            # Train Controller Failure Flags (detected by Train Controller)
-            "train_controller_engine_failure": False,
-            "train_controller_signal_failure": False,
-            "train_controller_brake_failure": False,
-            
-            # Signal for Train Controller (set by Train Model when beacon read is blocked)
-            "beacon_read_blocked": False,
-            
-            # Internal Train Controller State
-            "manual_mode": False,
-            "driver_velocity": 0.0,
-            "service_brake": False,
-            "right_door": False,
-            "left_door": False,
-            "interior_lights": False,
-            "exterior_lights": False,
-            "set_temperature": 70.0,
-            "temperature_up": False,
-            "temperature_down": False,
-            "announcement": "",
-            "announce_pressed": False,
-            "emergency_brake": False,
-            "kp": 0.0,
-            "ki": 0.0,
-            "engineering_panel_locked": False,
-            
-            # Outputs TO Train Model
-            "power_command": 0.0
-        }
+        self.default_state = schema.default_state(train_id)
+        
+        # Local mirror kept up to date by the change stream; get_state() reads
+        # it while the stream is connected and polls otherwise
+        self._mirror = None
+        self._mirror_epoch = None
+        self._mirror_version = None
+        self._mirror_live = False
+        self._mirror_lock = threading.Lock()
+        self._stream_stop = threading.Event()
+        self._stream_thread = None
         
         # Test connection
         self._test_connection()
+        if USE_STREAM if stream is None else stream:
+            self.start_stream()
     
     def _test_connection(self):
         """Test connection to server."""
         try:
-            health = requests.get(f"{self.server_url}/api/health", timeout=self.timeout)
+            health = self.session.get(f"{self.server_url}/api/health", timeout=self.timeout)
             if health.status_code == 200:
                 print(f"[API Client] ✓ Connected to server: {self.server_url}")
                 print(f"[API Client] ✓ Managing Train {self.train_id}")
@@ -104,13 +158,33 @@ class train_controller_api_client:
         Returns:
             dict: Current train state. Returns cached/default state if server unreachable.
         """
+        txn = self._transactions.active
+        if txn is not None:
+            return dict(txn)
+        if self._mirror_live:
+            with self._mirror_lock:
+                return dict(self._mirror)
+        if self._cached_state is not None and time.monotonic() - self._cached_at < self.cache_ttl:
+            return self._cached_state.copy()
+        headers = self._request_headers
+        if self._etag is not None and self._cached_state is not None:
+            headers = {**headers, "If-None-Match": self._etag}
         for attempt in range(self.max_retries):
             try:
-                response = requests.get(self.state_endpoint, timeout=self.timeout)
+                response = self.session.get(self.state_endpoint, headers=headers,
+                                            timeout=self.timeout)
+                if response.status_code == 304:
+                    # Unchanged on the server: keep using the cached copy
+                    self._cached_at = time.monotonic()
+                    return self._cached_state.copy()
                 if response.status_code == 200:
-                    state = response.json()
+                    state = _flat_state(self._decode_response(response))
+                    with self._pending_lock:
+                        state.update(self._pending)  # writes not sent yet
                     self._cached_state = state  # Update cache
-                    return state
+                    self._cached_at = time.monotonic()
+                    self._etag = response.headers.get("ETag")
+                    return state.copy()
                 elif response.status_code == 404:
                     # Train doesn't exist yet, return defaults
                     if attempt == 0:  # Only print once
@@ -133,19 +207,69 @@ class train_controller_api_client:
             return self._cached_state.copy()
         return self.default_state.copy()
     
+    def _decode_response(self, response) -> dict:
+        """Parse a response body written by either the JSON or the binary codec."""
+        if response.headers.get("Content-Type", "").startswith(BINARY_CONTENT_TYPE):
+            return decode_message(response.content)
+        return response.json()
+    
+    def transaction(self):
+        """Batch a controller cycle into one GET and one POST of the changed fields.
+
+        Same interface as train_controller_api.transaction().
+        """
+        return self._transactions.run(self.get_state, self.update_state)
+
     def update_state(self, state_dict: dict) -> None:
         """Update train state on server.
         
+        Calls within coalesce_s of each other are merged and sent as one
+        POST (flush() sends them right away); get_state() sees them
+        immediately.
+        
         Args:
             state_dict: Dictionary of state values to update.
         """
+        txn = self._transactions.active
+        if txn is not None:
+            txn.update(state_dict)
+            return
+        if self._cached_state is not None:
+            self._cached_state.update(state_dict)
+        self._apply_to_mirror(state_dict)
+        if self.coalesce_s <= 0:
+            self._post_state(state_dict)
+            return
+        with self._pending_lock:
+            self._pending.update(state_dict)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.coalesce_s, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def flush(self) -> None:
+        """Send the coalesced update_state() fields now."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if pending:
+            self._post_state(pending)
+    
+    def close(self) -> None:
+        """Send pending writes, stop the change stream and close the connections."""
+        self.flush()
+        self.stop_stream()
+        self.session.close()
+    
+    def _post_state(self, state_dict: dict) -> None:
+        """POST fields to the server, with retries."""
         for attempt in range(self.max_retries):
             try:
-                response = requests.post(self.state_endpoint, json=state_dict, timeout=self.timeout)
+                response = self.session.post(self.state_endpoint, json=state_dict,
+                                             timeout=self.timeout)
                 if response.status_code == 200:
-                    # Update local cache with successful write
-                    if self._cached_state is not None:
-                        self._cached_state.update(state_dict)
                     return  # Success
                 elif attempt == self.max_retries - 1:
                     print(f"[API Client] Update failed with status {response.status_code}")
@@ -157,10 +281,47 @@ class train_controller_api_client:
             except requests.exceptions.RequestException as e:
                 if attempt == self.max_retries - 1:
                     print(f"[API Client] Update request failed: {e}")
+    
+    def patch_state(self, state_dict: dict, if_match: Optional[str] = None) -> bool:
+        """Update fields only if no other writer changed them on the server.
         
-        # Update local cache even if server update failed
-        if self._cached_state is not None:
-            self._cached_state.update(state_dict)
+        Sends PATCH with If-Match: the version of the state this client last
+        read (or if_match). Changes other writers made to other fields since
+        then are merged, not a conflict.
+        
+        Args:
+            state_dict: Dictionary of state values to update.
+            if_match: ETag to check against (default: the version of the
+                mirror, or of the last state fetched).
+        
+        Returns:
+            bool: True if applied. False on a conflict, a stale If-Match
+            or an error; after a conflict or stale tag the cache holds the
+            server's current state and version, so get_state() and a retry
+            work on fresh values.
+        """
+        self.flush()
+        if if_match is None and self._mirror_live:
+            # The mirror has every change up to its version
+            if_match = f'"{self._mirror_epoch}.{self._mirror_version}"'
+        headers = {"If-Match": if_match or self._etag or '""'}
+        try:
+            response = self.session.patch(self.state_endpoint, json=state_dict,
+                                          headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"[API Client] Patch request failed: {e}")
+            return False
+        if response.status_code not in (200, 409, 412):
+            print(f"[API Client] Patch failed with status {response.status_code}")
+            return False
+        state = _flat_state(response.json().get("state", {}))
+        self._cached_state = state
+        self._cached_at = time.monotonic()
+        self._etag = response.headers.get("ETag")
+        if response.status_code != 200:
+            return False
+        self._apply_to_mirror(state_dict)
+        return True
     
     def save_state(self, state: dict) -> None:
         """Save complete train state to server.
@@ -173,17 +334,156 @@ class train_controller_api_client:
     
     def reset_state(self) -> None:
         """Reset train state to defaults on server."""
+        self.flush()  # so pending writes don't land after the reset
         try:
             reset_endpoint = f"{self.server_url}/api/train/{self.train_id}/reset"
-            response = requests.post(reset_endpoint, timeout=self.timeout)
+            response = self.session.post(reset_endpoint, timeout=self.timeout)
             if response.status_code == 200:
                 print(f"[API Client] Train {self.train_id} state reset")
                 self._cached_state = None  # Clear cache
+                self._etag = None
             else:
                 print(f"[API Client] Reset failed with status {response.status_code}")
         except requests.exceptions.RequestException as e:
             print(f"[API Client] Reset request failed: {e}")
     
+    # ------------------------------------------------------------------
+    # Change stream
+    # ------------------------------------------------------------------
+    def start_stream(self) -> None:
+        """Mirror this train's state from GET /api/train/<id>/stream.
+        
+        A background thread applies the server's snapshot and diffs to a
+        local copy, and get_state() answers from it while connected. On a
+        dropped connection it reconnects from the last version it has, so
+        only the changes missed in between are sent again.
+        """
+        if self._stream_thread is None:
+            self._stream_stop.clear()
+            self._stream_thread = threading.Thread(target=self._run_stream,
+                                                   name=f"train-{self.train_id}-stream",
+                                                   daemon=True)
+            self._stream_thread.start()
+    
+    def stop_stream(self) -> None:
+        """Stop mirroring; get_state() goes back to polling the server."""
+        self._stream_stop.set()
+        self._mirror_live = False
+        if self._stream_thread is not None:
+            self._stream_thread.join(timeout=1.0)
+            self._stream_thread = None
+    
+    def _run_stream(self):
+        url = f"{self.server_url}/api/train/{self.train_id}/stream"
+        while not self._stream_stop.is_set():
+            params = {}
+            if self._mirror_version is not None:
+                params['since'] = f"{self._mirror_epoch}.{self._mirror_version}"
+            try:
+                with requests.get(url, params=params, stream=True,
+                                  timeout=(self.timeout, STREAM_READ_TIMEOUT_S)) as response:
+                    if response.status_code in (404, 501, 503):
+                        print(f"[API Client] Server has no change stream ({response.status_code}), polling instead")
+                        return
+                    if response.status_code == 200:
+                        if self._mirror is not None:
+                            self._mirror_live = True  # resumed; the snapshot is skipped
+                        for event, data in _sse_messages(response.iter_lines(decode_unicode=True)):
+                            if self._stream_stop.is_set():
+                                return
+                            self._apply_stream_message(event, json.loads(data))
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if self._mirror_live:
+                    print(f"[API Client] Change stream lost: {e}")
+            if self._mirror_live:
+                # Polling falls back to the last mirrored state
+                with self._mirror_lock:
+                    self._cached_state = dict(self._mirror)
+            self._mirror_live = False
+            self._stream_stop.wait(STREAM_RETRY_S)
+    
+    def _apply_stream_message(self, event: str, data: dict) -> None:
+        """Apply one snapshot/diff/deleted/heartbeat message to the mirror."""
+        with self._mirror_lock:
+            if event == "snapshot":
+                state = data.get("trains", {}).get(f"train_{self.train_id}")
+                self._mirror = dict(state) if state is not None else self.default_state.copy()
+                self._mirror_epoch = data.get("epoch")
+            elif event == "diff" and self._mirror is not None:
+                self._mirror.update(data.get("fields", {}))
+            elif event == "deleted":
+                self._mirror = self.default_state.copy()
+            elif event != "heartbeat":
+                return
+            if self._mirror is not None:
+                # Every change up to this version has been sent
+                self._mirror_version = data.get("version", self._mirror_version)
+                self._mirror_live = True
+    
+    def _apply_to_mirror(self, state_dict: dict) -> None:
+        """Show a write in the mirror before the server's diff for it arrives."""
+        with self._mirror_lock:
+            if self._mirror is not None:
+                self._mirror.update(state_dict)
+    
+    def _bulk_request(self, method: str, **kwargs):
+        """One request to /api/trains/state with retries; the parsed body, or None."""
+        url = f"{self.server_url}/api/trains/state"
+        for attempt in range(self.max_retries):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code in (200, 207):
+                    return response.json()
+                if attempt == self.max_retries - 1:
+                    print(f"[API Client] Bulk {method} failed with status {response.status_code}")
+            except requests.exceptions.RequestException as e:
+                if attempt == self.max_retries - 1:
+                    print(f"[API Client] Bulk {method} request failed: {e}")
+        return None
+    
+    def get_states(self, train_ids=None, fields=None) -> dict:
+        """Get several trains' states in one request.
+        
+        Args:
+            train_ids: Train IDs to fetch (default: every train on the server).
+            fields: Only fetch these fields (default: all).
+        
+        Returns:
+            dict: train_id -> flat state dict. Trains the server doesn't have
+            are left out; empty if the server is unreachable.
+        """
+        params = {}
+        if train_ids:
+            params['ids'] = ','.join(str(train_id) for train_id in train_ids)
+        if fields:
+            params['fields'] = ','.join(fields)
+        body = self._bulk_request('GET', params=params)
+        if body is None:
+            return {}
+        return {int(key.split('_')[1]): {**state.get('inputs', {}), **state.get('outputs', {})}
+                for key, state in body.get('trains', {}).items()}
+    
+    def update_states(self, updates: dict) -> dict:
+        """Update several trains in one request.
+        
+        Args:
+            updates: train_id -> dictionary of state values to update.
+        
+        Returns:
+            dict: train_id -> {"ok": True, "version": ...} or
+            {"ok": False, "error": ...}; empty if the server is unreachable.
+        """
+        body = self._bulk_request('PATCH', json={str(train_id): fields
+                                                  for train_id, fields in updates.items()})
+        if body is None:
+            return {}
+        results = {int(key) if key.isdigit() else key: result
+                   for key, result in body.get('results', {}).items()}
+        own = results.get(self.train_id)
+        if own is not None and own.get('ok') and self._cached_state is not None:
+            self._cached_state.update(updates[self.train_id])
+        return results
+    
     def update_from_train_data(self) -> None:
         """Stub method for compatibility with local API.
         
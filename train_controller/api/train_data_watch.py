@@ -0,0 +1,108 @@
+"""Sync of the Train Model's train_data.json into the server's train states.
+
+The Train Model (and its test UI) write controller inputs to
+train_data.json; the REST server copies them into each train's state so
+hardware controllers can read them over the network.
+
+TrainDataWatch.run() blocks on the train_data change notification, which
+the Train Model and journal appends publish, and only looks at the file
+when it wakes up: on a notification, or every wait_s seconds to catch
+writers that don't publish (the file's stat tells whether anything
+changed). Each pass writes only the trains whose inputs differ from what
+the previous pass wrote, and forgets trains that left the file.
+
+Usage:
+    watch = TrainDataWatch(read_train_data, fleet.update)
+    Thread(target=watch.run, args=(lambda: sync_running,), daemon=True).start()
+"""
+
+import os
+import sys
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.append(_PROJECT_ROOT)
+from channel_notify import ChangeTracker, current_generation, wait_for_change
+
+try:
+    from . import train_state_schema as schema
+except ImportError:
+    import train_state_schema as schema
+
+# Seconds run() blocks waiting for a train_data notification before it
+# checks the file's stat anyway
+TRAIN_DATA_WAIT_S = 5.0
+
+
+def train_data_inputs(section) -> dict:
+    """Controller inputs carried by one train_X section of train_data.json."""
+    parts = {"inputs": section.get("inputs", {}), "outputs": section.get("outputs", {})}
+    fields = {**schema.TRAIN_DATA_FIELDS, **schema.TRAIN_DATA_BEACON_FIELDS}
+    return {name: parts[part].get(key, schema.DEFAULTS[name])
+            for name, (part, key) in fields.items()}
+
+
+class TrainDataWatch:
+    """Writes changed train_data.json inputs to the train states.
+
+    Attributes:
+        synced: train_key -> inputs written by the last pass.
+    """
+
+    def __init__(self, read, write, path: str = None, channel: str = "train_data",
+                 wait_s: float = TRAIN_DATA_WAIT_S):
+        """
+        Args:
+            read: Function returning the parsed train_data.json.
+            write: Function taking (train_id, inputs) that updates only
+                those fields of the train's state.
+            path: train_data.json (default: the channel's file).
+            channel: change notification channel of the file.
+            wait_s: Longest time run() blocks without a notification.
+        """
+        self._read = read
+        self._write = write
+        self.channel = channel
+        self.path = path
+        self.wait_s = wait_s
+        self.synced = {}
+
+    def sync(self, train_data) -> int:
+        """Write the inputs of every train that changed since the last pass.
+
+        Returns:
+            int: Number of trains written.
+        """
+        written = 0
+        seen = set()
+        for key, section in (train_data or {}).items():
+            if not key.startswith("train_") or not isinstance(section, dict):
+                continue
+            try:
+                train_id = int(key[6:])
+            except ValueError:
+                continue
+            seen.add(key)
+            inputs = train_data_inputs(section)
+            if self.synced.get(key) == inputs:
+                continue
+            # Update ONLY the inputs of the train (outputs are preserved),
+            # including beacon info (current_station, next_stop, station_side)
+            self._write(train_id, inputs)
+            self.synced[key] = inputs
+            written += 1
+        for key in self.synced.keys() - seen:
+            del self.synced[key]
+        return written
+
+    def run(self, running) -> None:
+        """Sync on every change until running() returns False."""
+        tracker = ChangeTracker(self.channel, self.path)
+        generation = current_generation(self.channel)
+        while running():
+            try:
+                if tracker.changed():
+                    self.sync(self._read())
+            except Exception as e:
+                print(f"[Server] Error in sync thread: {e}")
+            generation = wait_for_change(self.channel, generation, self.wait_s)
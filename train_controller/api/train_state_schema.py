@@ -0,0 +1,211 @@
+"""The train controller state schema.
+
+Every per-train state field is defined once here: the section it lives in
+(inputs from the Train Model, outputs to it), its type, default value and
+unit. The API, the REST client and server, the state stores/backends and the
+SQLite database used to keep their own copies of the field lists and
+defaults, with small differences; they all import them from this module now.
+
+Compiled from FIELDS at import time:
+
+    DEFAULT_INPUTS / DEFAULT_OUTPUTS   default templates (name -> default)
+    SECTION_OF                         routing table (name -> "inputs"/"outputs")
+    VALIDATORS                         name -> function that checks and coerces a value
+    SQL_TYPES                          name -> SQLite column type
+
+so classifying the fields of an update is one dict lookup per field:
+
+    sections = split_fields({'power_command': 1200.0, 'train_velocity': 20.0})
+    # {'inputs': {'train_velocity': 20.0}, 'outputs': {'power_command': 1200.0}}
+"""
+
+from collections.abc import Mapping
+from typing import NamedTuple, Optional
+
+INPUTS = "inputs"
+OUTPUTS = "outputs"
+
+
+class Field(NamedTuple):
+    name: str
+    section: str
+    type: type
+    default: object
+    unit: Optional[str] = None
+    nullable: bool = False
+
+
+# Field order is the on-disk order (JSON sections, shared-memory records)
+FIELDS = (
+    # Inputs FROM Train Model
+    Field('commanded_speed', INPUTS, float, 0.0, 'mph'),
+    Field('commanded_authority', INPUTS, float, 0.0, 'yd'),
+    Field('speed_limit', INPUTS, float, 0.0, 'mph'),
+    Field('train_velocity', INPUTS, float, 0.0, 'mph'),
+    Field('current_station', INPUTS, str, ''),
+    Field('next_stop', INPUTS, str, ''),
+    Field('station_side', INPUTS, str, ''),
+    Field('train_temperature', INPUTS, float, 70.0, 'degF'),
+    # Train Model failure flags (activated by Train Model)
+    Field('train_model_engine_failure', INPUTS, bool, False),
+    Field('train_model_signal_failure', INPUTS, bool, False),
+    Field('train_model_brake_failure', INPUTS, bool, False),
+    # Train Controller failure flags (detected by Train Controller)
+    Field('train_controller_engine_failure', INPUTS, bool, False),
+    Field('train_controller_signal_failure', INPUTS, bool, False),
+    Field('train_controller_brake_failure', INPUTS, bool, False),
+    # Set by Train Model when a beacon read is blocked
+    Field('beacon_read_blocked', INPUTS, bool, False),
+
+    # Outputs TO Train Model (Train Controller commands)
+    Field('manual_mode', OUTPUTS, bool, False),
+    Field('driver_velocity', OUTPUTS, float, 0.0, 'mph'),
+    Field('service_brake', OUTPUTS, bool, False),
+    Field('right_door', OUTPUTS, bool, False),
+    Field('left_door', OUTPUTS, bool, False),
+    Field('interior_lights', OUTPUTS, bool, True),
+    Field('exterior_lights', OUTPUTS, bool, True),
+    Field('set_temperature', OUTPUTS, float, 70.0, 'degF'),
+    Field('temperature_up', OUTPUTS, bool, False),
+    Field('temperature_down', OUTPUTS, bool, False),
+    Field('announcement', OUTPUTS, str, ''),
+    Field('announce_pressed', OUTPUTS, bool, False),
+    Field('emergency_brake', OUTPUTS, bool, False),
+    Field('kp', OUTPUTS, float, None, nullable=True),  # Must be set through UI
+    Field('ki', OUTPUTS, float, None, nullable=True),  # Must be set through UI
+    Field('engineering_panel_locked', OUTPUTS, bool, False),
+    Field('power_command', OUTPUTS, float, 0.0, 'W'),
+)
+
+FIELDS_BY_NAME = {f.name: f for f in FIELDS}
+SECTION_OF = {f.name: f.section for f in FIELDS}
+DEFAULT_INPUTS = {f.name: f.default for f in FIELDS if f.section == INPUTS}
+DEFAULT_OUTPUTS = {f.name: f.default for f in FIELDS if f.section == OUTPUTS}
+DEFAULTS = {**DEFAULT_INPUTS, **DEFAULT_OUTPUTS}
+UNITS = {f.name: f.unit for f in FIELDS if f.unit}
+
+# Train Model train_data.json -> controller inputs: field -> (section, key)
+TRAIN_DATA_FIELDS = {
+    'commanded_speed': (INPUTS, 'commanded speed'),
+    'commanded_authority': (INPUTS, 'commanded authority'),
+    'speed_limit': (INPUTS, 'speed limit'),
+    'train_velocity': (OUTPUTS, 'velocity_mph'),
+    'train_temperature': (OUTPUTS, 'temperature_F'),
+    'train_model_engine_failure': (INPUTS, 'train_model_engine_failure'),
+    'train_model_signal_failure': (INPUTS, 'train_model_signal_failure'),
+    'train_model_brake_failure': (INPUTS, 'train_model_brake_failure'),
+}
+# Beacon fields in train_data.json (the Train Model also writes them to
+# train_states.json itself, with signal-failure handling)
+TRAIN_DATA_BEACON_FIELDS = {
+    'current_station': (INPUTS, 'current station'),
+    'next_stop': (INPUTS, 'next station'),
+    'station_side': (INPUTS, 'side_door'),
+}
+
+
+# ----------------------------------------------------------------------
+# Validators
+# ----------------------------------------------------------------------
+def _check_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"expected a number, got {type(value).__name__}")
+    return float(value)
+
+
+def _check_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    raise TypeError(f"expected a boolean, got {value!r}")
+
+
+def _check_str(value):
+    if not isinstance(value, str):
+        raise TypeError(f"expected a string, got {type(value).__name__}")
+    return value
+
+
+_CHECKS = {float: _check_float, bool: _check_bool, str: _check_str}
+
+
+def _compile_validator(field):
+    check = _CHECKS[field.type]
+    if not field.nullable:
+        return check
+    return lambda value: None if value is None else check(value)
+
+
+VALIDATORS = {f.name: _compile_validator(f) for f in FIELDS}
+SQL_TYPES = {f.name: {float: "REAL", bool: "INTEGER", str: "TEXT"}[f.type] for f in FIELDS}
+
+
+def validate(fields, strict: bool = False) -> dict:
+    """Checked and coerced copy of the known fields in fields.
+
+    Unknown keys (train_id, nested train_X sections) are dropped unless strict.
+
+    Raises:
+        ValueError: fields is not a mapping, a value has the wrong type, or
+            an unknown key when strict
+    """
+    if not isinstance(fields, Mapping):
+        raise ValueError(f"expected an object of fields, got {type(fields).__name__}")
+    result = {}
+    for name, value in fields.items():
+        validator = VALIDATORS.get(name)
+        if validator is None:
+            if strict:
+                raise ValueError(f"unknown train state field '{name}'")
+            continue
+        try:
+            result[name] = validator(value)
+        except TypeError as e:
+            raise ValueError(f"{name}: {e}") from None
+    return result
+
+
+# ----------------------------------------------------------------------
+# Routing and templates
+# ----------------------------------------------------------------------
+def split_fields(fields) -> dict:
+    """Route fields into {'inputs': {...}, 'outputs': {...}}; unknown keys are dropped."""
+    sections = {INPUTS: {}, OUTPUTS: {}}
+    for name, value in fields.items():
+        section = SECTION_OF.get(name)
+        if section is not None:
+            sections[section][name] = value
+    return sections
+
+
+def default_sections(**overrides) -> dict:
+    """A new train's {'inputs': ..., 'outputs': ...} with the given fields set."""
+    sections = {INPUTS: dict(DEFAULT_INPUTS), OUTPUTS: dict(DEFAULT_OUTPUTS)}
+    for name, value in overrides.items():
+        sections[SECTION_OF[name]][name] = value
+    return sections
+
+
+def default_state(train_id: int = None) -> dict:
+    """A new train's flat state (inputs + outputs), optionally with train_id."""
+    state = {'train_id': train_id} if train_id is not None else {}
+    state.update(DEFAULTS)
+    return state
+
+
+def sql_literal(value) -> str:
+    """A default value as an SQL literal (for column DEFAULT clauses)."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(float(value))
+
+
+def sql_columns() -> str:
+    """Column definitions for one row per train, in field order."""
+    return ", ".join(f'"{f.name}" {SQL_TYPES[f.name]} DEFAULT {sql_literal(f.default)}'
+                     for f in FIELDS)
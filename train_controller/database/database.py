@@ -1,15 +1,91 @@
 """Database module for Train Controller state management.
 
 This module provides database operations for storing and retrieving train states.
-It manages the persistence of train data between the test UI and main UI.
+It manages the persistence of train data between the test UI and main UI,
+and keeps a downsampled telemetry history of each train (train_telemetry).
 """
 
 import sqlite3
 from datetime import datetime
 import os
+import queue
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+import train_state_schema as schema
 
 # Database schema version
-SCHEMA_VERSION = 1.0
+SCHEMA_VERSION = 2.0
+
+# Updates the background writer may hold before submit() blocks
+WRITE_QUEUE_SIZE = 1024
+
+# Telemetry history: raw samples and the rollup tables, by period in seconds
+TELEMETRY_TABLES = {0: "train_telemetry", 1: "train_telemetry_1s", 10: "train_telemetry_10s"}
+# How much simulated time each table keeps (None = forever)
+TELEMETRY_RETENTION_S = {0: 600.0, 1: 6 * 3600.0, 10: None}
+# Rollups and pruning run once per this much simulated time
+TELEMETRY_MAINTENANCE_S = 10.0
+
+# Telemetry column -> train state field it is sampled from
+TELEMETRY_FIELDS = {
+    'velocity': 'train_velocity',
+    'power_command': 'power_command',
+    'authority': 'commanded_authority',
+    'service_brake': 'service_brake',
+    'emergency_brake': 'emergency_brake',
+    'engine_failure': 'train_model_engine_failure',
+    'signal_failure': 'train_model_signal_failure',
+    'brake_failure': 'train_model_brake_failure',
+}
+
+# Event types in train_events
+BLOCK_ENTER = "block_enter"
+BLOCK_EXIT = "block_exit"
+AUTHORITY_GRANT = "authority_grant"
+SERVICE_BRAKE = "service_brake"
+EMERGENCY_BRAKE = "emergency_brake"
+FAILURE = "failure"                 # detail: engine / signal / brake
+EVENT_COLUMNS = ("t", "train_id", "block", "event_type", "value", "detail")
+
+# Column names used by version 1 of the table, accepted in state dicts
+LEGACY_FIELDS = {
+    'velocity': ('train_velocity',),
+    'set_speed': ('driver_velocity',),
+    'engine_failure': ('train_model_engine_failure',),
+    'signal_failure': ('train_model_signal_failure',),
+    'brake_failure': ('train_model_brake_failure',),
+    'lights': ('interior_lights', 'exterior_lights'),
+}
+
+def _telemetry_value(value):
+    """value as stored in a telemetry column: 0/1 for bools, a float for
+    numbers and numeric strings, None (NULL) for anything else."""
+    if isinstance(value, bool):
+        return int(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _event_row(event):
+    """An event dict as a train_events row (EVENT_COLUMNS).
+    
+    Raises:
+        ValueError: If the event has no numeric t or no event_type.
+    """
+    try:
+        t = float(event["t"])
+        event_type = event["event_type"]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Events need a numeric t and an event_type: {event!r}") from None
+    if not event_type:
+        raise ValueError(f"Events need a numeric t and an event_type: {event!r}")
+    return (t, event.get("train_id"), event.get("block"), event_type,
+            event.get("value"), event.get("detail"))
+
 
 class train_database:
     """Manages train state persistence using SQLite.
@@ -17,207 +93,617 @@ class train_database:
     This class handles all database operations for the Train Controller module,
     including creation, updates, and retrieval of train states. It maintains
     a separate database file for train controller to ensure module isolation.
+    The train_states columns are generated from train_state_schema, one per
+    state field.
+    
+    One connection is kept open for the life of the object, in WAL mode with
+    synchronous=NORMAL (commits don't wait for fsync; the WAL is synced at
+    checkpoints). Writes are INSERT ... ON CONFLICT DO UPDATE statements that
+    are built once per set of columns and then reused from the connection's
+    statement cache. update_many() writes a whole fleet in one transaction,
+    and start_writer() moves writes to a background thread fed by a bounded
+    queue so control loops never wait on the disk.
     
     Attributes:
         db_path: String path to the SQLite database file.
     """
     
-    def __init__(self):
+    def __init__(self, db_path: str = None):
         """Initialize database connection and create schema.
         
         Creates a new database file in the train_controller directory if it
         doesn't exist, or connects to an existing one. Automatically initializes
         the database schema on creation.
+        
+        Args:
+            db_path: Database file to use instead of train_controller.db.
         """
         # Create database in train_controller directory for module isolation
         base_dir = os.path.dirname(os.path.dirname(__file__))
-        self.db_path = os.path.join(base_dir, "train_controller.db")
+        self.db_path = db_path or os.path.join(base_dir, "train_controller.db")
+        self._lock = threading.RLock()
+        self._upserts = {}
+        self._queue = None
+        self._writer = None
+        self.telemetry_retention = dict(TELEMETRY_RETENTION_S)
+        self._telemetry_trains = set()
+        self._telemetry_time = None
+        self._next_maintenance = None
+        self._last_samples = {}
+        self._blocks = {}
+        self._conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False,
+                                     cached_statements=256)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
         self.init_db()
 
     def init_db(self):
         """Initialize the database schema.
         
-        Creates the train_states table if it doesn't exist. The schema includes:
-            - Train identification
-            - Speed and authority values
-            - Station and beacon information
-            - Brake status
-            - Failure states
-            - Automatic timestamp tracking
+        Creates the train_states table if it doesn't exist: the train id, one
+        column per train_state_schema field (inputs from the Train Model,
+        outputs to it), an automatic timestamp and a version bumped by every
+        write. Tables created by an older version get the missing columns
+        added.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
+        with self._lock, self._conn as conn:
+            conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS train_states (
                     id INTEGER PRIMARY KEY,
-                    -- Engineering Controls (once locked, cannot be changed)
-                    kp REAL,                 -- Proportional gain for speed control
-                    ki REAL,                 -- Integral gain for speed control
-                    engineering_panel_locked BOOLEAN, -- Whether Kp and Ki are locked
-                    
-                    -- Inputs from Train Model
-                    commanded_speed REAL,      -- Target operating speed from CTC (mph)
-                    commanded_authority REAL,  -- Distance train is permitted to travel (yards)
-                    speed_limit REAL,         -- Maximum legal speed (mph)
-                    velocity REAL,            -- Current train velocity (mph)
-                    next_stop TEXT,           -- Next station stop (for announcements)
-                    station_side TEXT,        -- Side doors to open at next station (left/right)
-                    train_temperature INT,    -- Current temperature inside train (°F)
-                    engine_failure BOOLEAN,   -- Train engine failure status
-                    signal_failure BOOLEAN,   -- Signal pickup failure status
-                    brake_failure BOOLEAN,    -- Brake failure status
-                    
-                    -- Inputs from Driver (shown in Test UI)
-                    set_speed REAL,           -- Speed set by driver (mph)
-                    service_brake INT,        -- Service brake percentage
-                    right_door BOOLEAN,       -- Right door control
-                    left_door BOOLEAN,        -- Left door control
-                    lights BOOLEAN,           -- Lights control
-                    temperature_up BOOLEAN,   -- Temperature increase command
-                    temperature_down BOOLEAN, -- Temperature decrease command
-                    announcement TEXT,        -- Announcement system message
-                    emergency_brake BOOLEAN,  -- Emergency brake status
-                    
-                    -- Outputs to Train Model (shown in Test UI)
-                    power_command REAL,       -- Power sent to train model (W)
-                    
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                    {schema.sql_columns()},
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(train_states)")}
+            for field in schema.FIELDS:
+                if field.name not in existing:
+                    conn.execute(f'ALTER TABLE train_states ADD COLUMN "{field.name}" '
+                                 f'{schema.SQL_TYPES[field.name]} DEFAULT {schema.sql_literal(field.default)}')
+            if "version" not in existing:
+                conn.execute("ALTER TABLE train_states ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            # Telemetry history, one row per train per tick
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS train_telemetry (
+                    train_id INTEGER NOT NULL,
+                    sim_time REAL NOT NULL,     -- Simulation time (s)
+                    velocity REAL,              -- Train velocity (mph)
+                    power_command REAL,         -- Power command (W)
+                    authority REAL,             -- Commanded authority (yards)
+                    service_brake INTEGER,
+                    emergency_brake INTEGER,
+                    engine_failure INTEGER,
+                    signal_failure INTEGER,
+                    brake_failure INTEGER,
+                    PRIMARY KEY (train_id, sim_time)
+                ) WITHOUT ROWID
+            """)
+            # Downsampled aggregates; bucket is the start of the period (s)
+            for period in (1, 10):
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {TELEMETRY_TABLES[period]} (
+                        train_id INTEGER NOT NULL,
+                        bucket REAL NOT NULL,
+                        samples INTEGER,
+                        velocity_avg REAL,
+                        velocity_min REAL,
+                        velocity_max REAL,
+                        power_avg REAL,
+                        power_max REAL,
+                        authority_min REAL,
+                        service_brake REAL,     -- Fraction of samples braking
+                        emergency_brake INTEGER,
+                        engine_failure INTEGER,
+                        signal_failure INTEGER,
+                        brake_failure INTEGER,
+                        PRIMARY KEY (train_id, bucket)
+                    ) WITHOUT ROWID
+                """)
+            # Event history, with one covering index per way it is queried
+            # (by train, by block, by type; each ordered by time)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS train_events (
+                    id INTEGER PRIMARY KEY,
+                    t REAL NOT NULL,            -- Simulation time (s)
+                    train_id INTEGER,
+                    block INTEGER,
+                    event_type TEXT NOT NULL,
+                    value REAL,                 -- e.g. granted authority (yards)
+                    detail TEXT
                 )
             """)
+            for key, rest in (("train_id", "block, event_type"),
+                              ("block", "train_id, event_type"),
+                              ("event_type", "train_id, block")):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS train_events_by_{key} "
+                             f"ON train_events ({key}, t, {rest}, value, detail)")
+            # Time-range queries with none of those filters
+            conn.execute("CREATE INDEX IF NOT EXISTS train_events_by_t ON train_events (t)")
+
+    def _fields(self, state_dict: dict) -> dict:
+        """Validated schema fields of state_dict, with version 1 names mapped."""
+        fields = {}
+        for key, value in state_dict.items():
+            for name in LEGACY_FIELDS.get(key, (key,)):
+                fields.setdefault(name, value)
+        return schema.validate(fields)
+
+    def _upsert(self, names: tuple) -> str:
+        """The UPSERT statement for one set of columns (built once, then cached)."""
+        query = self._upserts.get(names)
+        if query is None:
+            columns = "".join(f', "{name}"' for name in names)
+            updates = "".join(f'"{name}" = excluded."{name}", ' for name in names)
+            query = (f"INSERT INTO train_states (id{columns}) "
+                     f"VALUES ({', '.join('?' * (len(names) + 1))}) "
+                     f"ON CONFLICT(id) DO UPDATE SET {updates}timestamp = CURRENT_TIMESTAMP, "
+                     f"version = version + 1")
+            self._upserts[names] = query
+        return query
 
     def update_train_state(self, train_id: int, state_dict: dict) -> None:
         """Update or create a train state in the database.
         
-        Updates an existing train's state if the train_id exists, otherwise
-        creates a new train entry. All numeric values are converted to float
-        where appropriate.
+        Writes the train_state_schema fields present in state_dict with one
+        UPSERT; a new train gets the schema defaults for the rest. The version 1
+        column names (velocity, set_speed, engine_failure, signal_failure,
+        brake_failure, lights) are still accepted.
         
         Args:
             train_id: Unique identifier for the train.
-            state_dict: Dictionary containing train state values:
-                commanded_speed: Speed commanded by CTC (mph)
-                commanded_authority: Distance permitted to travel (yards)
-                speed_limit: Track speed limit (mph)
-                velocity: Current train velocity (mph)
-                next_stop: Next station stop (for announcements)
-                station_side: Side doors to open at next station (left/right)
-                train_temperature: Current temperature (°F)
-                engine_failure: Engine failure status (boolean)
-                signal_failure: Signal pickup failure status (boolean)
-                brake_failure: Brake failure status (boolean)
-                set_speed: Speed set by driver (mph)
-                service_brake: Service brake percentage
-                right_door: Right door control status (boolean)
-                left_door: Left door control status (boolean)
-                lights: Lights control status (boolean)
-                temperature_up: Temperature increase command (boolean)
-                temperature_down: Temperature decrease command (boolean)
-                announcement: Announcement system message
-                emergency_brake: Emergency brake status (boolean)
-                power_command: Power sent to train model (W)
+            state_dict: Dictionary of train state fields, e.g. commanded_speed,
+                train_velocity, driver_velocity, power_command. Unknown keys
+                are ignored.
         
         Raises:
             sqlite3.Error: If database operation fails.
-            ValueError: If numeric values cannot be converted to float.
+            ValueError: If a value has the wrong type for its field.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM train_states WHERE id = ?", (train_id,))
-            train_exists = cursor.fetchone() is not None
-            
-            if train_exists:
-                query = """
-                    UPDATE train_states SET
-                        kp = ?,
-                        ki = ?,
-                        engineering_panel_locked = ?,
-                        commanded_speed = ?,
-                        commanded_authority = ?,
-                        speed_limit = ?,
-                        velocity = ?,
-                        next_stop = ?,
-                        station_side = ?,
-                        train_temperature = ?,
-                        engine_failure = ?,
-                        signal_failure = ?,
-                        brake_failure = ?,
-                        set_speed = ?,
-                        service_brake = ?,
-                        right_door = ?,
-                        left_door = ?,
-                        lights = ?,
-                        temperature_up = ?,
-                        temperature_down = ?,
-                        announcement = ?,
-                        emergency_brake = ?,
-                        power_command = ?,
-                        timestamp = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """
-                values = (
-                    float(state_dict.get('kp', 0.0)),
-                    float(state_dict.get('ki', 0.0)),
-                    bool(state_dict.get('engineering_panel_locked', False)),
-                    float(state_dict.get('commanded_speed', 0.0)),
-                    float(state_dict.get('commanded_authority', 0.0)),
-                    float(state_dict.get('speed_limit', 40.0)),
-                    float(state_dict.get('velocity', 0.0)),
-                    state_dict.get('next_stop', ''),
-                    state_dict.get('station_side', 'right'),
-                    int(state_dict.get('train_temperature', 70)),
-                    bool(state_dict.get('engine_failure', False)),
-                    bool(state_dict.get('signal_failure', False)),
-                    bool(state_dict.get('brake_failure', False)),
-                    float(state_dict.get('set_speed', 0.0)),
-                    int(state_dict.get('service_brake', 0)),
-                    bool(state_dict.get('right_door', False)),
-                    bool(state_dict.get('left_door', False)),
-                    bool(state_dict.get('lights', False)),
-                    bool(state_dict.get('temperature_up', False)),
-                    bool(state_dict.get('temperature_down', False)),
-                    state_dict.get('announcement', ''),
-                    bool(state_dict.get('emergency_brake', False)),
-                    float(state_dict.get('power_command', 0.0)),
-                    train_id
-                )
-            else:
-                query = """
-                    INSERT INTO train_states (
-                        id, kp, ki, engineering_panel_locked,
-                        commanded_speed, commanded_authority, speed_limit,
-                        velocity, next_stop, station_side, train_temperature, 
-                        engine_failure, signal_failure, brake_failure, set_speed,
-                        service_brake, right_door, left_door, lights,
-                        temperature_up, temperature_down, announcement,
-                        emergency_brake, power_command
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                values = (
-                    train_id,
-                    float(state_dict.get('kp', 0.0)),
-                    float(state_dict.get('ki', 0.0)),
-                    bool(state_dict.get('engineering_panel_locked', False)),
-                    float(state_dict.get('commanded_speed', 0.0)),
-                    float(state_dict.get('commanded_authority', 0.0)),
-                    float(state_dict.get('speed_limit', 40.0)),
-                    float(state_dict.get('velocity', 0.0)),
-                    state_dict.get('next_stop', ''),
-                    state_dict.get('station_side', 'right'),
-                    int(state_dict.get('train_temperature', 70)),
-                    bool(state_dict.get('engine_failure', False)),
-                    bool(state_dict.get('signal_failure', False)),
-                    bool(state_dict.get('brake_failure', False)),
-                    float(state_dict.get('set_speed', 0.0)),
-                    int(state_dict.get('service_brake', 0)),
-                    bool(state_dict.get('right_door', False)),
-                    bool(state_dict.get('left_door', False)),
-                    bool(state_dict.get('lights', False)),
-                    bool(state_dict.get('temperature_up', False)),
-                    bool(state_dict.get('temperature_down', False)),
-                    state_dict.get('announcement', ''),
-                    bool(state_dict.get('emergency_brake', False)),
-                    float(state_dict.get('power_command', 0.0))
-                )
-            cursor.execute(query, values)
+        self.update_many({train_id: state_dict})
+
+    def update_many(self, states: dict) -> None:
+        """Update or create several trains in one transaction.
+        
+        Trains whose updates carry the same fields share one executemany()
+        call, so a fleet-wide tick is a handful of statements and one commit.
+        
+        Args:
+            states: Dictionary of train_id -> state_dict (as for
+                update_train_state).
+        
+        Raises:
+            sqlite3.Error: If database operation fails.
+            ValueError: If a value has the wrong type for its field; nothing
+                is written.
+        """
+        batches = {}
+        for train_id, state_dict in states.items():
+            fields = self._fields(state_dict)
+            batches.setdefault(tuple(fields), []).append((int(train_id), *fields.values()))
+        if not batches:
+            return
+        with self._lock, self._conn as conn:
+            for names, rows in batches.items():
+                conn.executemany(self._upsert(names), rows)
+
+    # ------------------------------------------------------------------
+    # Background writer
+    # ------------------------------------------------------------------
+    def start_writer(self, max_pending: int = WRITE_QUEUE_SIZE) -> None:
+        """Start the background writer thread used by submit().
+        
+        Args:
+            max_pending: Queue bound. submit() blocks once this many updates
+                are waiting, so a stalled disk slows producers down instead
+                of growing memory without limit.
+        """
+        if self._writer is not None:
+            return
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_loop, name="train-db-writer",
+                                        daemon=True)
+        self._writer.start()
+
+    def submit(self, train_id: int, state_dict: dict) -> None:
+        """Queue a train update for the background writer.
+        
+        Writes directly if the writer isn't running. Values are validated
+        when they are written; errors are reported by the writer thread.
+        """
+        if self._writer is None:
+            self.update_train_state(train_id, state_dict)
+            return
+        self._queue.put(("state", train_id, dict(state_dict)))
+
+    def submit_many(self, states: dict) -> None:
+        """Queue one tick's updates for several trains (see update_many)."""
+        for train_id, state_dict in states.items():
+            self.submit(train_id, state_dict)
+
+    def submit_telemetry(self, sim_time: float, states: dict) -> None:
+        """Queue one tick of telemetry for the background writer (see
+        record_telemetry); records directly if the writer isn't running.
+        
+        Raises:
+            ValueError: If sim_time or a train ID isn't a number.
+        """
+        if self._writer is None:
+            self.record_telemetry(sim_time, states)
+            return
+        self._queue.put(("telemetry", float(sim_time),
+                         {int(tid): dict(state) for tid, state in states.items()}))
+
+    def submit_events(self, events) -> None:
+        """Queue events for the background writer (see record_events);
+        records directly if the writer isn't running.
+        
+        Raises:
+            ValueError: If an event has no numeric t or no event_type. The
+                events are checked before any is queued.
+        """
+        if self._writer is None:
+            self.record_events(events)
+            return
+        self._queue.put(("events", [_event_row(event) for event in events]))
+
+    def flush(self) -> None:
+        """Wait until every queued update has been written."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _write_pending(self, pending: dict) -> None:
+        """update_many(), falling back to train by train so one bad update
+        doesn't drop the rest of the batch."""
+        try:
+            self.update_many(pending)
+        except ValueError:
+            for train_id, state_dict in pending.items():
+                try:
+                    self.update_train_state(train_id, state_dict)
+                except ValueError as e:
+                    print(f"[train_database] Background write of train {train_id} failed: {e}")
+
+    def _write_loop(self):
+        """Drain the queue, merging each train's pending updates into one row write."""
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            pending = {}
+            telemetry = []
+            stop = False
+            for item in items:
+                if item is None:
+                    stop = True
+                elif item[0] == "state":
+                    pending.setdefault(item[1], {}).update(item[2])
+                else:
+                    telemetry.append(item)
+            # Any error is reported and the loop carries on: if the thread
+            # died, submit() would block on the full queue and flush() and
+            # close() would wait forever
+            try:
+                try:
+                    self._write_pending(pending)
+                except Exception as e:
+                    print(f"[train_database] Background write failed: {e}")
+                for kind, *args in telemetry:
+                    try:
+                        if kind == "telemetry":
+                            self.record_telemetry(*args)
+                        else:
+                            self._write_events(*args)
+                    except Exception as e:
+                        print(f"[train_database] Background {kind} write failed: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def close(self) -> None:
+        """Write any queued updates, stop the writer and close the connection."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Telemetry history
+    # ------------------------------------------------------------------
+    def record_telemetry(self, sim_time: float, states: dict) -> None:
+        """Append one tick of telemetry for several trains.
+        
+        Samples velocity, power command, authority, brakes and failures
+        (TELEMETRY_FIELDS) into train_telemetry in one transaction, and logs
+        brake applications, failures and authority grants seen since each
+        train's previous sample to train_events. Every
+        TELEMETRY_MAINTENANCE_S of simulated time the closed 1 s and 10 s
+        buckets are rolled up and rows past their retention are pruned, so
+        the raw table stays bounded however long the run is.
+        
+        Args:
+            sim_time: Simulation time of the tick in seconds. Expected to
+                increase from tick to tick.
+            states: Dictionary of train_id -> train state dict. Telemetry
+                column names (velocity, authority, ...) are accepted too.
+                Values that aren't numbers are recorded as NULL.
+        
+        Raises:
+            sqlite3.Error: If database operation fails.
+        """
+        sim_time = float(sim_time)
+        rows = []
+        for train_id, state in states.items():
+            row = [int(train_id), sim_time]
+            for column, field in TELEMETRY_FIELDS.items():
+                row.append(_telemetry_value(state.get(field, state.get(column))))
+            rows.append(row)
+        if not rows:
+            return
+        with self._lock:
+            events = []
+            for row in rows:
+                sample = dict(zip(TELEMETRY_FIELDS, row[2:]))
+                events.extend(self._sample_events(sim_time, row[0], sample))
+                self._last_samples[row[0]] = sample
+            with self._conn as conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO train_telemetry (train_id, sim_time, "
+                    f"{', '.join(TELEMETRY_FIELDS)}) "
+                    f"VALUES ({', '.join('?' * (len(TELEMETRY_FIELDS) + 2))})", rows)
+                self._insert_events(conn, events)
+            self._telemetry_trains.update(row[0] for row in rows)
+            if self._telemetry_time is None or sim_time > self._telemetry_time:
+                self._telemetry_time = sim_time
+            if self._next_maintenance is None:
+                self._next_maintenance = sim_time + TELEMETRY_MAINTENANCE_S
+            elif sim_time >= self._next_maintenance:
+                self.maintain_telemetry(sim_time)
+                self._next_maintenance = sim_time + TELEMETRY_MAINTENANCE_S
+
+    def maintain_telemetry(self, now: float = None) -> None:
+        """Roll up closed buckets and prune rows past their retention.
+        
+        A bucket is closed once now has reached its end. Rows are only
+        pruned once they have been rolled up into the next coarser table.
+        
+        Args:
+            now: Current simulation time (s); defaults to the latest
+                recorded sample.
+        """
+        with self._lock:
+            if now is None:
+                now = self._telemetry_time
+            if now is None:
+                return
+            trains = [(tid,) for tid in self._telemetry_trains]
+            with self._conn as conn:
+                if not trains:
+                    trains = [row for row in conn.execute(
+                        "SELECT DISTINCT train_id FROM train_telemetry")]
+                # Rows may only go once the next table up has them
+                rolled_up = {0: self._rollup(conn, trains, 0, 1, now),
+                             1: self._rollup(conn, trains, 1, 10, now)}
+                for period, table in TELEMETRY_TABLES.items():
+                    keep = self.telemetry_retention.get(period)
+                    if keep is None:
+                        continue
+                    cutoff = min(now - keep, rolled_up.get(period, now))
+                    column = "sim_time" if period == 0 else "bucket"
+                    conn.executemany(f"DELETE FROM {table} WHERE train_id = ? AND {column} < ?",
+                                     [(tid, cutoff) for (tid,) in trains])
+
+    def _rollup(self, conn, trains, source, period, now):
+        """Aggregate source rows into the period table for the buckets that
+        closed since the last rollup; returns the end of the last closed bucket."""
+        target = TELEMETRY_TABLES[period]
+        end = (now // period) * period
+        last = conn.execute(f"SELECT MAX(bucket) FROM {target}").fetchone()[0]
+        start = -float("inf") if last is None else last + period
+        if start >= end:
+            return end
+        bucket = f"(CAST(sim_time / {period} AS INTEGER) * {period})"
+        if source == 0:
+            select = f"""
+                SELECT train_id, {bucket}, COUNT(*),
+                       AVG(velocity), MIN(velocity), MAX(velocity),
+                       AVG(power_command), MAX(power_command), MIN(authority),
+                       AVG(service_brake), MAX(emergency_brake),
+                       MAX(engine_failure), MAX(signal_failure), MAX(brake_failure)
+                FROM train_telemetry
+                WHERE train_id = ? AND sim_time >= ? AND sim_time < ?
+                GROUP BY train_id, {bucket}
+            """
+        else:
+            bucket = bucket.replace("sim_time", "bucket")
+            select = f"""
+                SELECT train_id, {bucket}, SUM(samples),
+                       SUM(velocity_avg * samples) / SUM(samples), MIN(velocity_min), MAX(velocity_max),
+                       SUM(power_avg * samples) / SUM(samples), MAX(power_max), MIN(authority_min),
+                       SUM(service_brake * samples) / SUM(samples), MAX(emergency_brake),
+                       MAX(engine_failure), MAX(signal_failure), MAX(brake_failure)
+                FROM {TELEMETRY_TABLES[source]}
+                WHERE train_id = ? AND bucket >= ? AND bucket < ?
+                GROUP BY train_id, {bucket}
+            """
+        conn.executemany(f"INSERT OR REPLACE INTO {target} {select}",
+                         [(tid, start, end) for (tid,) in trains])
+        return end
+
+    def get_telemetry(self, train_id: int, start: float, end: float,
+                      resolution: int = None) -> list:
+        """Telemetry for one train with start <= time < end.
+        
+        Args:
+            train_id: Unique identifier for the train.
+            start: Start of the range (simulation seconds).
+            end: End of the range (simulation seconds).
+            resolution: 0 for raw samples, 1 or 10 for the rollups. By
+                default the finest table still holding start is used.
+        
+        Returns:
+            list: One dict per row, oldest first. Raw rows have sim_time and
+            the TELEMETRY_FIELDS columns; rollup rows have bucket, samples
+            and the aggregate columns.
+        
+        Raises:
+            ValueError: If resolution isn't 0, 1 or 10.
+            sqlite3.Error: If database operation fails.
+        """
+        if resolution is None:
+            resolution = 10
+            latest = self._telemetry_time
+            for period in (0, 1):
+                keep = self.telemetry_retention.get(period)
+                if keep is None or latest is None or start >= latest - keep:
+                    resolution = period
+                    break
+        if resolution not in TELEMETRY_TABLES:
+            raise ValueError(f"resolution must be one of {sorted(TELEMETRY_TABLES)}")
+        column = "sim_time" if resolution == 0 else "bucket"
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT * FROM {TELEMETRY_TABLES[resolution]} "
+                f"WHERE train_id = ? AND {column} >= ? AND {column} < ? ORDER BY {column}",
+                (train_id, start, end))
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    # ------------------------------------------------------------------
+    # Event history
+    # ------------------------------------------------------------------
+    def _sample_events(self, t, train_id, sample):
+        """Events implied by a train's telemetry sample versus its previous one."""
+        last = self._last_samples.get(train_id, {})
+        events = []
+        for column, event_type in (("service_brake", SERVICE_BRAKE),
+                                   ("emergency_brake", EMERGENCY_BRAKE)):
+            if sample[column] and not last.get(column):
+                events.append((t, train_id, None, event_type, None, None))
+        for kind in ("engine", "signal", "brake"):
+            column = f"{kind}_failure"
+            if sample[column] and not last.get(column):
+                events.append((t, train_id, None, FAILURE, None, kind))
+        authority = sample["authority"]
+        if authority is not None and authority > (last.get("authority") or 0.0):
+            events.append((t, train_id, None, AUTHORITY_GRANT, authority, None))
+        return events
+
+    @staticmethod
+    def _insert_events(conn, rows):
+        if rows:
+            conn.executemany(f"INSERT INTO train_events ({', '.join(EVENT_COLUMNS)}) "
+                             f"VALUES ({', '.join('?' * len(EVENT_COLUMNS))})", rows)
+
+    def record_events(self, events) -> None:
+        """Append events in one transaction.
+        
+        Args:
+            events: Iterable of dicts with t and event_type, and optionally
+                train_id, block, value and detail. Brake, failure and
+                authority events are also logged by record_telemetry().
+        
+        Raises:
+            ValueError: If an event has no numeric t or no event_type.
+            sqlite3.Error: If database operation fails.
+        """
+        self._write_events([_event_row(event) for event in events])
+
+    def _write_events(self, rows) -> None:
+        with self._lock, self._conn as conn:
+            self._insert_events(conn, rows)
+
+    def record_block_changes(self, t: float, blocks: dict) -> None:
+        """Log block entries and exits from the trains' current blocks.
+        
+        The events go through the background writer when it is running
+        (see submit_events).
+        
+        Args:
+            t: Simulation time (s).
+            blocks: Dictionary of train_id -> block number the train is in
+                (None once it has left the track).
+        """
+        events = []
+        with self._lock:
+            for train_id, block in blocks.items():
+                previous = self._blocks.get(train_id)
+                if block == previous:
+                    continue
+                if previous is not None:
+                    events.append({"t": t, "train_id": train_id, "block": previous,
+                                   "event_type": BLOCK_EXIT})
+                if block is not None:
+                    events.append({"t": t, "train_id": train_id, "block": block,
+                                   "event_type": BLOCK_ENTER})
+                self._blocks[train_id] = block
+        # Queued outside the lock: the writer needs it to drain a full queue
+        self.submit_events(events)
+
+    def get_events(self, train_id: int = None, block: int = None, event_type: str = None,
+                   start: float = None, end: float = None, limit: int = None) -> list:
+        """Events matching every given filter with start <= t < end.
+        
+        Each combination of train, block and type filters is answered from
+        one of the covering indexes, so the table itself is never read; a
+        time range alone uses the index on t.
+        
+        Returns:
+            list: One dict per event (EVENT_COLUMNS), oldest first (ties in
+            the order recorded).
+        
+        Raises:
+            sqlite3.Error: If database operation fails.
+        """
+        where, args = [], []
+        for column, value in (("train_id", train_id), ("block", block),
+                              ("event_type", event_type)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if start is not None:
+            where.append("t >= ?")
+            args.append(start)
+        if end is not None:
+            where.append("t < ?")
+            args.append(end)
+        query = f"SELECT {', '.join(EVENT_COLUMNS)} FROM train_events"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY t, id"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [dict(zip(EVENT_COLUMNS, row)) for row in rows]
+
+    def trains_in_block(self, block: int, start: float, end: float) -> list:
+        """IDs of the trains that occupied block at any time in [start, end).
+        
+        That is every train with an entry or exit in the range, plus those
+        whose last event in the block before start was an entry.
+        
+        Returns:
+            list: Sorted train IDs.
+        """
+        with self._lock:
+            during = self._conn.execute(
+                "SELECT DISTINCT train_id FROM train_events "
+                "WHERE block = ? AND t >= ? AND t < ?", (block, start, end)).fetchall()
+            # SQLite returns event_type from the row holding MAX(t)
+            before = self._conn.execute(
+                "SELECT train_id, event_type, MAX(t) FROM train_events "
+                "WHERE block = ? AND t < ? GROUP BY train_id", (block, start)).fetchall()
+        trains = {row[0] for row in during}
+        trains.update(train_id for train_id, event_type, _ in before if event_type == BLOCK_ENTER)
+        return sorted(trains)
 
     def get_train_state(self, train_id: int) -> tuple:
         """Retrieve the current state of a specific train.
@@ -226,21 +712,16 @@ class train_database:
             train_id: Unique identifier for the train.
             
         Returns:
-            tuple: Contains all state values in schema order:
-                (id, commanded_speed, commanded_authority, speed_limit,
-                velocity, train_temperature, engine_failure,
-                signal_failure, brake_failure, set_speed,
-                service_brake, right_door, left_door, lights,
-                temperature_up, temperature_down, announcement,
-                emergency_brake, power_command, timestamp)
+            tuple: Contains all state values in column order:
+                (id, <train_state_schema fields in schema order>, timestamp,
+                version) for a new database.
             None if train_id doesn't exist.
             
         Raises:
             sqlite3.Error: If database operation fails.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM train_states WHERE id = ?", (train_id,))
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM train_states WHERE id = ?", (train_id,))
             return cursor.fetchone()
     
     def get_all_train_ids(self) -> list:
@@ -253,7 +734,42 @@ class train_database:
         Raises:
             sqlite3.Error: If database operation fails.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM train_states ORDER BY id")
-            return [row[0] for row in cursor.fetchall()]
\ No newline at end of file
+        with self._lock:
+            cursor = self._conn.execute("SELECT id FROM train_states ORDER BY id")
+            return [row[0] for row in cursor.fetchall()]
+
+    def _state_dicts(self, where: str = "", args: tuple = ()) -> dict:
+        names = [field.name for field in schema.FIELDS]
+        columns = ", ".join(f'"{name}"' for name in names)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, {columns} FROM train_states{where} ORDER BY id", args).fetchall()
+        result = {}
+        for train_id, *values in rows:
+            state = {}
+            for field, value in zip(schema.FIELDS, values):
+                state[field.name] = bool(value) if field.type is bool and value is not None else value
+            result[train_id] = state
+        return result
+
+    def get_state(self, train_id: int) -> dict:
+        """The train_state_schema fields of one train by name.
+        
+        Returns:
+            dict: Field name -> value (booleans as bool), or None if
+            train_id doesn't exist.
+        """
+        return self._state_dicts(" WHERE id = ?", (int(train_id),)).get(int(train_id))
+
+    def get_all_states(self) -> dict:
+        """Dictionary of train_id -> get_state() for every train, by ID."""
+        return self._state_dicts()
+
+    def change_token(self) -> tuple:
+        """Value that changes whenever a train is written, added or removed.
+        
+        Covers writes through other connections (other processes) too.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT count(*), total(version) FROM train_states").fetchone()
@@ -6,7 +6,7 @@ and provides endpoints for Raspberry Pi clients to connect to.
 Run this on the main computer (server).
 
 Usage:
-    python start_server.py [--port PORT] [--host HOST]
+    python start_server.py [--port PORT] [--host HOST] [--state-backend {json,sqlite,shm}]
 
 Example:
     python start_server.py --port 5000 --host 0.0.0.0
@@ -37,7 +37,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Train System REST API Server")
     parser.add_argument("--port", type=int, default=5000, help="Port to run server on (default: 5000)")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to bind to (default: 0.0.0.0)")
+    parser.add_argument("--write-behind", type=float, default=None, metavar="SECONDS",
+                        help="Seconds between persisting train states to train_states.json (default: 0.2)")
+    parser.add_argument("--state-backend", choices=("json", "sqlite", "shm"), default=None,
+                        help="Where the server keeps train states: train_states.json, "
+                             "train_controller.db or shared memory (default: GROUP4_STATE_BACKEND or json)")
     args = parser.parse_args()
+    if args.write_behind is not None:
+        os.environ["GROUP4_WRITE_BEHIND_S"] = str(args.write_behind)
+    if args.state_backend is not None:
+        os.environ["GROUP4_STATE_BACKEND"] = args.state_backend
     
     # Import and start server
     from train_api_server import app
@@ -0,0 +1,206 @@
+"""
+Unit tests for the server's in-memory fleet state.
+
+Run with: python -m unittest test_fleet_state.py
+Or: python test_fleet_state.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+import fleet_state
+from fleet_state import FleetState
+
+
+class TestFleetState(unittest.TestCase):
+    """Memory as the source of truth, write-behind and merging file changes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "train_states.json")
+        self.write_file({"train_1": {"inputs": {"commanded_speed": 10.0},
+                                     "outputs": {"power_command": 5.0}},
+                         "note": "kept"})
+        self.saves = 0
+        self.fleet = FleetState(self.path, load=self.load, save=self.save, interval=60.0)
+
+    def tearDown(self):
+        self.fleet.stop()
+        self.tmp.cleanup()
+
+    def write_file(self, doc):
+        with open(self.path, "w") as f:
+            json.dump(doc, f)
+
+    def read_file(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def load(self):
+        try:
+            return self.read_file()
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, doc):
+        self.saves += 1
+        self.write_file(doc)
+
+    def test_reads_and_writes_stay_in_memory(self):
+        self.assertEqual(self.fleet.get(1)["inputs"]["commanded_speed"], 10.0)
+        state = self.fleet.update(1, {"driver_velocity": 20.0})
+        self.assertEqual(state["outputs"]["driver_velocity"], 20.0)
+        self.assertEqual(self.fleet.get(1)["outputs"]["driver_velocity"], 20.0)
+        self.assertNotIn("driver_velocity", self.read_file()["train_1"]["outputs"])
+        self.assertEqual(self.saves, 0)
+        self.assertIsNone(self.fleet.get(9))
+
+    def test_flush_writes_only_changed_fields(self):
+        self.fleet.update(1, {"driver_velocity": 20.0})
+        # A local module changes another field in the meantime
+        doc = self.read_file()
+        doc["train_1"]["inputs"]["commanded_speed"] = 30.0
+        self.write_file(doc)
+        self.fleet.flush()
+        saved = self.read_file()
+        self.assertEqual(saved["train_1"]["inputs"]["commanded_speed"], 30.0)
+        self.assertEqual(saved["train_1"]["outputs"]["driver_velocity"], 20.0)
+        self.assertEqual(saved["note"], "kept")
+        self.fleet.flush()
+        self.assertEqual(self.saves, 1)
+
+    def test_file_changes_are_merged_but_pending_writes_win(self):
+        self.fleet.update(1, {"power_command": 7.0})
+        self.write_file({"train_1": {"inputs": {"commanded_speed": 40.0},
+                                     "outputs": {"power_command": 1.0}},
+                         "train_2": {"commanded_speed": 3.0}})
+        self.fleet.sync()
+        self.assertEqual(self.fleet.get(1)["inputs"]["commanded_speed"], 40.0)
+        self.assertEqual(self.fleet.get(1)["outputs"]["power_command"], 7.0)
+        self.assertEqual(self.fleet.get(2)["inputs"]["commanded_speed"], 3.0)
+        self.assertEqual(self.read_file()["train_1"]["outputs"]["power_command"], 7.0)
+
+    def test_new_reset_and_deleted_trains(self):
+        self.fleet.update(3, {"kp": 10.0})
+        self.fleet.reset(1)
+        self.assertTrue(self.fleet.delete(3))
+        self.assertFalse(self.fleet.delete(3))
+        self.fleet.update(4, {"ki": 1.0})
+        self.fleet.stop()
+        saved = self.read_file()
+        self.assertNotIn("train_3", saved)
+        self.assertEqual(saved["train_4"]["outputs"]["ki"], 1.0)
+        self.assertEqual(saved["train_1"]["inputs"]["commanded_speed"], 0.0)
+        # Deleted locally: dropped from memory on the next pass
+        del saved["train_4"]
+        self.write_file(saved)
+        self.fleet.sync()
+        self.assertIsNone(self.fleet.get(4))
+
+    def test_bulk_reads_and_updates(self):
+        versions = self.fleet.update_many({1: {"power_command": 9.0}, 2: {"kp": 3.0}})
+        self.assertEqual(versions[2], self.fleet.version)
+        self.assertLess(versions[1], versions[2])
+        states = self.fleet.get_many([1, 2, 5])
+        self.assertEqual(states[1]["outputs"]["power_command"], 9.0)
+        self.assertEqual(states[2]["outputs"]["kp"], 3.0)
+        self.assertIsNone(states[5])
+
+    def test_bulk_update_results_use_the_callers_keys(self):
+        def apply(valid):
+            return {train_id: {"version": version}
+                    for train_id, version in self.fleet.update_many(valid).items()}
+        results = fleet_state.bulk_update({"train_1": {"kp": 2.0}, "2": {"kp": 3.0},
+                                           "train_3": {"kp": "fast"}, "x": {"kp": 1.0},
+                                           "4": [1.0]}, apply)
+        self.assertEqual(sorted(results), ["2", "4", "train_1", "train_3", "x"])
+        self.assertEqual(results["train_1"], {"ok": True, "version": self.fleet.versions["train_1"]})
+        self.assertTrue(results["2"]["ok"])
+        self.assertFalse(any(results[key]["ok"] for key in ("train_3", "x", "4")))
+        self.assertIsNone(self.fleet.get(3))
+
+    def test_versions_are_monotonic(self):
+        start = self.fleet.version
+        self.fleet.update(1, {"power_command": 5.0})  # unchanged value
+        self.assertEqual(self.fleet.version, start)
+        self.fleet.update(1, {"power_command": 6.0})
+        self.fleet.update(2, {"power_command": 1.0})
+        self.assertEqual(self.fleet.version, start + 2)
+        self.assertEqual(self.fleet.versions["train_2"], start + 2)
+
+    def test_changes_since_returns_changed_fields(self):
+        start = self.fleet.version
+        self.fleet.update(1, {"power_command": 6.0, "commanded_speed": 10.0})
+        self.fleet.update(2, {"kp": 3.0})
+        self.fleet.delete(2)
+        changes = self.fleet.changes_since(start)
+        self.assertEqual([(v - start, key) for v, key, _ in changes],
+                         [(1, "train_1"), (2, "train_2"), (3, "train_2")])
+        self.assertEqual(changes[0][2], {"power_command": 6.0})
+        self.assertEqual(changes[1][2]["kp"], 3.0)
+        self.assertIsNone(changes[2][2])
+        self.assertEqual(self.fleet.changes_since(start, keys={"train_1"}), changes[:1])
+        self.assertEqual(self.fleet.changes_since(self.fleet.version), [])
+        # From a previous server run
+        self.assertIsNone(self.fleet.changes_since(self.fleet.version + 5))
+
+    def test_changes_fall_off_the_log(self):
+        original = fleet_state.CHANGE_LOG_SIZE
+        fleet_state.CHANGE_LOG_SIZE = 3
+        try:
+            fleet = FleetState(self.path, load=self.load, save=self.save, interval=60.0)
+        finally:
+            fleet_state.CHANGE_LOG_SIZE = original
+        for value in range(5):
+            fleet.update(1, {"power_command": float(value) + 100.0})
+        self.assertIsNone(fleet.changes_since(1))
+        self.assertEqual(len(fleet.changes_since(fleet.version - 3)), 3)
+
+    def test_wait_for_changes_wakes_on_update(self):
+        version = self.fleet.version
+        timer = threading.Timer(0.05, self.fleet.update, (1, {"kp": 2.0}))
+        timer.start()
+        self.assertEqual(self.fleet.wait_for_changes(version, timeout=5.0), version + 1)
+        timer.join()
+        self.assertEqual(self.fleet.wait_for_changes(version + 1, timeout=0.01), version + 1)
+
+    def test_tags_are_per_run(self):
+        state, version = self.fleet.get_versioned(1)
+        self.assertEqual(state["inputs"]["commanded_speed"], 10.0)
+        tag = self.fleet.tag(version)
+        self.assertEqual(self.fleet.parse_tag(tag), version)
+        self.assertEqual(self.fleet.parse_tag(f'"{tag}"'), version)
+        self.assertEqual(self.fleet.parse_tag(str(version)), version)
+        self.fleet.update(1, {"kp": 2.0})
+        self.assertNotEqual(self.fleet.tag(self.fleet.get_versioned(1)[1]), tag)
+        restarted = FleetState(self.path, load=self.load, save=self.save, interval=60.0)
+        self.assertIsNone(restarted.parse_tag(tag))
+        self.assertIsNone(self.fleet.parse_tag("garbage"))
+        self.assertEqual(self.fleet.get_versioned(9), (None, None))
+
+    def test_patch_merges_other_fields_and_rejects_conflicts(self):
+        _, base = self.fleet.get_versioned(1)
+        self.fleet.update(1, {"power_command": 8.0})   # another writer
+        state, version, conflicts = self.fleet.patch(1, {"kp": 4.0}, base)
+        self.assertEqual(conflicts, [])
+        self.assertEqual(state["outputs"]["kp"], 4.0)
+        self.assertEqual(version, self.fleet.version)
+        state, version, conflicts = self.fleet.patch(1, {"power_command": 1.0, "ki": 1.0}, base)
+        self.assertEqual(conflicts, ["power_command"])
+        self.assertEqual(state["outputs"]["power_command"], 8.0)
+        self.assertNotIn("ki", state["outputs"])
+        self.assertEqual(self.fleet.patch(1, {"power_command": 1.0}, version)[2], [])
+        # Unknown base (-1): every field conflicts
+        self.assertEqual(self.fleet.patch(1, {"kp": 5.0}, -1)[2], ["kp"])
+        self.assertEqual(self.fleet.patch(9, {"kp": 5.0}, base), (None, None, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
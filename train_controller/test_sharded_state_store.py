@@ -0,0 +1,110 @@
+"""
+Unit tests for the sharded per-train state store.
+
+Run with: python -m unittest test_sharded_state_store.py
+Or: python test_sharded_state_store.py
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+from sharded_state_store import ShardedStateStore
+from shared_state_store import JsonExportAdapter
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS
+
+
+class TestShardedStateStore(unittest.TestCase):
+    """Test cases for ShardedStateStore."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ShardedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS,
+                                       directory=self.tmp.name, stripes=4)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_new_train_gets_defaults(self):
+        """A new shard is filled from the templates and listed in the manifest."""
+        self.assertTrue(self.store.ensure_train(1))
+        self.assertFalse(self.store.ensure_train(1))
+        state = self.store.read(1)
+        self.assertEqual(state['set_temperature'], 70.0)
+        self.assertIsNone(state['kp'])
+        self.assertEqual(set(state), set(DEFAULT_INPUTS) | set(DEFAULT_OUTPUTS))
+        self.assertEqual(self.store.train_ids(), [1])
+
+    def test_write_touches_only_its_shard(self):
+        """Fields are routed to sections; other trains' shards are not rewritten."""
+        self.store.write(2, {'commanded_speed': 30, 'kp': 10.0, 'train_id': 2, 'unknown': 1})
+        self.store.write(3, {'power_command': 5.0})
+        before = os.stat(self.store.shard_path(3)).st_mtime_ns
+        self.store.write(2, {'power_command': 1500.5})
+        self.assertEqual(os.stat(self.store.shard_path(3)).st_mtime_ns, before)
+        inputs, outputs = self.store.read_sections(2)
+        self.assertEqual(inputs['commanded_speed'], 30)
+        self.assertEqual(outputs['power_command'], 1500.5)
+        self.assertNotIn('unknown', outputs)
+        self.assertEqual(self.store.read_field(2, 'kp'), 10.0)
+
+    def test_second_handle_sees_writes(self):
+        """Another handle on the same directory reads the same shards."""
+        self.store.write(3, {'emergency_brake': True})
+        other = ShardedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS, directory=self.tmp.name)
+        try:
+            self.assertFalse(other.owner)
+            self.assertTrue(other.read(3)['emergency_brake'])
+            other.write(3, {'service_brake': True})
+            self.assertTrue(self.store.read(3)['service_brake'])
+        finally:
+            other.close()
+
+    def test_remove_and_generation(self):
+        self.store.ensure_train(4)
+        gen = self.store.generation
+        self.assertTrue(self.store.remove_train(4))
+        self.assertFalse(self.store.remove_train(4))
+        self.assertNotEqual(self.store.generation, gen)
+        self.assertEqual(self.store.read_sections(4), (None, None))
+
+    def test_concurrent_writers_do_not_lose_updates(self):
+        """Read-modify-write under the stripe lock keeps every field."""
+        names = ['right_door', 'left_door', 'interior_lights', 'exterior_lights']
+
+        def writer(name):
+            for _ in range(20):
+                self.store.write(5, {name: True})
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        state = self.store.read(5)
+        self.assertTrue(all(state[n] for n in names))
+
+    def test_export_assembles_fleet_view(self):
+        self.store.import_dict({'train_1': {'inputs': {'commanded_speed': 12.0},
+                                            'outputs': {'kp': 5.0}},
+                                'train_2': {'left_door': True}, 'junk': 1})
+        path = os.path.join(self.tmp.name, "train_states.json")
+        exporter = JsonExportAdapter(self.store, path)
+        self.assertTrue(exporter.export_now())
+        self.assertFalse(exporter.export_now())
+        with open(path) as f:
+            data = json.load(f)
+        self.assertEqual(sorted(data), ['train_1', 'train_2'])
+        self.assertEqual(data['train_1']['inputs']['commanded_speed'], 12.0)
+        self.assertTrue(data['train_2']['outputs']['left_door'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+Unit tests for the shared-memory train state store.
+
+Run with: python -m unittest test_shared_state_store.py
+Or: python test_shared_state_store.py
+"""
+
+import os
+import sys
+import json
+import struct
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+from shared_state_store import SharedStateStore, JsonExportAdapter
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS
+
+
+class TestSharedStateStore(unittest.TestCase):
+    """Test cases for SharedStateStore."""
+
+    def setUp(self):
+        self.name = f"g4ts_test_{os.getpid()}"
+        self.store = SharedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS,
+                                      name=self.name, max_trains=8)
+
+    def tearDown(self):
+        lock_path = self.store.lock_path
+        self.store.unlink()
+        self.store.close()
+        if lock_path is not None:
+            self.assertFalse(os.path.exists(lock_path))
+
+    def test_new_train_gets_defaults(self):
+        """A new record is filled from the templates."""
+        self.assertTrue(self.store.ensure_train(1))
+        self.assertFalse(self.store.ensure_train(1))
+        state = self.store.read(1)
+        self.assertEqual(state['set_temperature'], 70.0)
+        self.assertIsNone(state['kp'])
+        self.assertEqual(state['announcement'], '')
+        self.assertEqual(set(state), set(DEFAULT_INPUTS) | set(DEFAULT_OUTPUTS))
+
+    def test_write_routes_fields_to_sections(self):
+        """Fields are written in place into the right section."""
+        self.store.write(2, {'commanded_speed': 30, 'power_command': 1500.5,
+                             'kp': 10.0, 'next_stop': 'Glenbury',
+                             'train_id': 2, 'unknown': 1})
+        inputs, outputs = self.store.read_sections(2)
+        self.assertEqual(inputs['commanded_speed'], 30.0)
+        self.assertEqual(inputs['next_stop'], 'Glenbury')
+        self.assertEqual(outputs['power_command'], 1500.5)
+        self.assertEqual(outputs['kp'], 10.0)
+        self.assertNotIn('unknown', outputs)
+        self.assertEqual(self.store.read_field(2, 'kp'), 10.0)
+
+    def test_second_handle_sees_writes(self):
+        """Another handle on the same segment reads the same records."""
+        self.store.write(3, {'emergency_brake': True})
+        other = SharedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS,
+                                 name=self.name, max_trains=8)
+        try:
+            self.assertFalse(other.owner)
+            self.assertTrue(other.read_field(3, 'emergency_brake'))
+            other.write(3, {'emergency_brake': False})
+            self.assertFalse(self.store.read_field(3, 'emergency_brake'))
+        finally:
+            other.close()
+
+    def test_remove_and_generation(self):
+        """Removing a train frees its slot and bumps the generation."""
+        self.store.write(4, {'service_brake': True})
+        generation = self.store.generation
+        self.assertTrue(self.store.remove_train(4))
+        self.assertGreater(self.store.generation, generation)
+        self.assertIsNone(self.store.read(4))
+        self.assertEqual(self.store.train_ids(), [])
+
+    def test_read_retries_when_the_slot_is_reused(self):
+        """A read racing a remove + reuse of the slot never returns the new train."""
+        seq_read = self.store._seq_read
+
+        def reuse_slot(seq_pos, copy):
+            # Train 1 leaves and train 3 takes its slot mid-read
+            if self.store.has_train(1):
+                self.store.remove_train(1)
+                self.store.write(3, {'commanded_speed': 30.0})
+            return seq_read(seq_pos, copy)
+
+        for read in (lambda: self.store.read_sections(1),
+                     lambda: self.store.read_field(1, 'commanded_speed')):
+            self.store.remove_train(3)
+            self.store.write(1, {'commanded_speed': 10.0})
+            self.store.write(2, {'commanded_speed': 20.0})
+            with mock.patch.object(self.store, "_seq_read", side_effect=reuse_slot):
+                self.assertIn(read(), (None, (None, None)))
+            self.assertEqual(self.store.read_field(3, 'commanded_speed'), 30.0)
+
+    def test_reads_are_consistent_during_writes(self):
+        """Readers never see a half-written section."""
+        self.store.ensure_train(5)
+        stop = threading.Event()
+
+        def writer():
+            value = 0.0
+            while not stop.is_set():
+                value += 1.0
+                self.store.write(5, {'commanded_speed': value,
+                                     'commanded_authority': value,
+                                     'speed_limit': value})
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            for _ in range(2000):
+                inputs, _ = self.store.read_sections(5)
+                self.assertEqual(inputs['commanded_speed'], inputs['commanded_authority'])
+                self.assertEqual(inputs['commanded_speed'], inputs['speed_limit'])
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_reader_times_out_on_dead_writer(self):
+        """A section left mid-write raises TimeoutError instead of spinning."""
+        self.store.write(6, {'commanded_speed': 12.0})
+        self.store.read_timeout_s = 0.05
+        slot = self.store._find_slot(6)
+        seq_pos = self.store._record_offset(slot) + self.store.inputs.seq_offset
+        struct.pack_into("<Q", self.store.buf, seq_pos, 1)  # writer "died" here
+        with self.assertRaises(TimeoutError):
+            self.store.read_field(6, 'commanded_speed')
+        with self.assertRaises(TimeoutError):
+            self.store.read_sections(6)
+        self.assertEqual(self.store.read_field(6, 'power_command'), 0.0)
+
+    def test_lock_file_removed_on_unlink(self):
+        """The writer lock lives in the temp dir and is removed by unlink()."""
+        self.assertEqual(os.path.dirname(self.store.lock_path), tempfile.gettempdir())
+        self.assertTrue(os.path.exists(self.store.lock_path))
+
+    def test_json_round_trip(self):
+        """import_dict / JsonExportAdapter keep the train_states.json layout."""
+        self.store.import_dict({
+            'train_7': {'inputs': {'speed_limit': 43.5}, 'outputs': {'ki': 0.5}},
+        })
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "train_states.json")
+            adapter = JsonExportAdapter(self.store, path)
+            self.assertTrue(adapter.export_now())
+            self.assertFalse(adapter.export_now())
+            with open(path) as f:
+                data = json.load(f)
+        self.assertEqual(data['train_7']['inputs']['speed_limit'], 43.5)
+        self.assertEqual(data['train_7']['outputs']['ki'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Unit tests for the pluggable controller state backends.
+
+Run with: python -m unittest test_state_backend.py
+Or: python test_state_backend.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+from shared_state_store import SharedStateStore
+from state_backend import (JsonFileBackend, SqliteStateBackend, StateBackend, StoreBackend,
+                           create_backend)
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS, train_controller_api
+
+
+class _BackendContract:
+    """Behaviour every StateBackend must have."""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = self.make_backend()
+
+    def tearDown(self):
+        self.backend.close()
+        self.tmp.cleanup()
+
+    def test_is_a_state_backend(self):
+        self.assertIsInstance(self.backend, StateBackend)
+
+    def test_update_routes_fields_and_keeps_others(self):
+        self.assertIsNone(self.backend.get(1))
+        self.backend.update(1, {'commanded_speed': 30.0, 'kp': 10.0, 'left_door': True,
+                                'train_id': 1, 'unknown': 5})
+        self.backend.update(1, {'power_command': 1500.5})
+        state = self.backend.get(1)
+        self.assertEqual(state['commanded_speed'], 30.0)
+        self.assertEqual(state['kp'], 10.0)
+        self.assertIs(state['left_door'], True)
+        self.assertEqual(state['power_command'], 1500.5)
+        self.assertIsNone(state['ki'])
+        self.assertEqual(state['set_temperature'], 70.0)
+        self.assertNotIn('unknown', state)
+
+    def test_snapshot_lists_every_train(self):
+        self.backend.update(2, {'power_command': 2.0})
+        self.backend.update(5, {'power_command': 5.0})
+        snapshot = self.backend.snapshot()
+        self.assertEqual(sorted(snapshot), [2, 5])
+        self.assertEqual(snapshot[5]['power_command'], 5.0)
+
+    def test_subscribe_reports_changed_fields(self):
+        self.backend.update(1, {'power_command': 1.0})
+        events = []
+        seen = threading.Event()
+
+        def callback(train_id, changed):
+            events.append((train_id, changed))
+            seen.set()
+        unsubscribe = self.backend.subscribe(callback)
+        self.backend.update(1, {'power_command': 2.0, 'kp': None})
+        self.assertTrue(seen.wait(2.0))
+        self.assertEqual(events[0], (1, {'power_command': 2.0}))
+        unsubscribe()
+
+
+class TestJsonFileBackend(_BackendContract, unittest.TestCase):
+
+    def make_backend(self):
+        return JsonFileBackend(os.path.join(self.tmp.name, "train_states.json"))
+
+
+class TestSqliteStateBackend(_BackendContract, unittest.TestCase):
+
+    def make_backend(self):
+        return SqliteStateBackend(os.path.join(self.tmp.name, "train_controller.db"))
+
+    def test_second_connection_sees_writes(self):
+        other = SqliteStateBackend(self.backend.path)
+        try:
+            self.backend.update(3, {'emergency_brake': True})
+            self.assertIs(other.get(3)['emergency_brake'], True)
+        finally:
+            other.close()
+
+    def test_shares_the_train_database_table(self):
+        """Rows written by train_database are the backend's rows, and back."""
+        db = self.backend.db
+        db.update_train_state(4, {'commanded_speed': 12.0, 'service_brake': True})
+        state = self.backend.get(4)
+        self.assertEqual(state['commanded_speed'], 12.0)
+        self.assertIs(state['service_brake'], True)
+        self.backend.update(4, {'power_command': 800.0})
+        self.assertEqual(db.get_state(4)['power_command'], 800.0)
+        self.assertEqual(db.get_all_train_ids(), [4])
+
+    def test_export_and_import_train_states_layout(self):
+        self.backend.import_dict({'train_2': {'inputs': {'speed_limit': 40.0},
+                                              'outputs': {'kp': 5.0}},
+                                  'train_3': {'inputs': {'speed_limit': 'fast'}}})
+        doc = self.backend.export_dict()
+        self.assertEqual(list(doc), ['train_2'])
+        self.assertEqual(doc['train_2']['inputs']['speed_limit'], 40.0)
+        self.assertEqual(doc['train_2']['outputs']['kp'], 5.0)
+        self.assertIs(self.backend.export_dict(), doc)  # unchanged: same object
+        self.backend.update(2, {'kp': 6.0})
+        self.assertEqual(self.backend.export_dict()['train_2']['outputs']['kp'], 6.0)
+
+
+class TestStoreBackend(_BackendContract, unittest.TestCase):
+
+    def make_backend(self):
+        self.store = SharedStateStore(DEFAULT_INPUTS, DEFAULT_OUTPUTS,
+                                      name=f"group4_test_backend_{os.getpid()}",
+                                      lock_path=os.path.join(self.tmp.name, "shm.lock"))
+        return StoreBackend(self.store)
+
+    def tearDown(self):
+        self.backend.close()
+        self.store.close()
+        self.store.unlink()
+        self.tmp.cleanup()
+
+
+class TestApiWithBackend(unittest.TestCase):
+    """train_controller_api keeps its state in a StateBackend."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = SqliteStateBackend(os.path.join(self.tmp.name, "train_controller.db"))
+
+    def tearDown(self):
+        self.backend.close()
+        self.tmp.cleanup()
+
+    def test_api_reads_and_writes_the_backend(self):
+        api = train_controller_api(train_id=7, backend=self.backend)
+        self.assertIs(api.backend, self.backend)
+        self.assertIs(self.backend.get(7)['interior_lights'], True)
+        api.update_state({'driver_velocity': 25.0})
+        self.assertEqual(self.backend.get(7)['driver_velocity'], 25.0)
+        with api.transaction():
+            api.update_state({'power_command': 900.0})
+        self.assertEqual(api.get_state()['power_command'], 900.0)
+
+    def test_unknown_backend_name(self):
+        with self.assertRaises(ValueError):
+            create_backend("floppy")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Unit tests for batched controller-cycle transactions.
+
+Run with: python -m unittest test_state_transaction.py
+Or: python test_state_transaction.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+sys.path.insert(0, os.path.join(current_dir, "ui"))
+
+from state_transaction import StateTransaction, TransactionScope
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS, train_controller_api
+
+
+def _temp_api(state_file, train_id=1):
+    """A train_controller_api bound to a temporary train_states.json."""
+    api = object.__new__(train_controller_api)
+    api.train_id = train_id
+    api.store = None
+    api.bus = None
+    api.state_file = state_file
+    api.default_inputs = DEFAULT_INPUTS.copy()
+    api.default_outputs = DEFAULT_OUTPUTS.copy()
+    api.train_states = {**api.default_inputs, **api.default_outputs}
+    api._transactions = TransactionScope()
+    api.save_state(api.train_states.copy())
+    return api
+
+
+class TestStateTransaction(unittest.TestCase):
+    """Dirty-field tracking of the working copy."""
+
+    def test_changes_skip_unchanged_assignments(self):
+        txn = StateTransaction({'a': 1, 'b': 2, 'c': 3})
+        txn['a'] = 1
+        txn.update({'b': 5}, c=3)
+        txn.setdefault('d', 4)
+        self.assertEqual(txn.dirty, {'a', 'b', 'c', 'd'})
+        self.assertEqual(txn.changes(), {'b': 5, 'd': 4})
+
+
+class TestApiTransaction(unittest.TestCase):
+    """train_controller_api.transaction() against a temporary state file."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.api = _temp_api(os.path.join(self.tmp.name, "train_states.json"))
+        self.writes = 0
+        store_states = self.api._store_states
+
+        def counting_store(all_states):
+            self.writes += 1
+            store_states(all_states)
+        self.api._store_states = counting_store
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cycle_is_one_write_at_exit(self):
+        with self.api.transaction() as st:
+            self.api.update_state({'driver_velocity': 20.0})
+            self.api.update_state({'set_temperature': 70.0})  # unchanged
+            self.assertEqual(self.api.get_state()['driver_velocity'], 20.0)
+            st['power_command'] = 1200.0
+            self.assertEqual(self.writes, 0)
+        self.assertEqual(self.writes, 1)
+        state = self.api.get_state()
+        self.assertEqual(state['driver_velocity'], 20.0)
+        self.assertEqual(state['power_command'], 1200.0)
+
+    def test_no_write_without_changes(self):
+        with self.api.transaction():
+            self.api.get_state()
+        self.assertEqual(self.writes, 0)
+
+    def test_only_changed_fields_are_written(self):
+        """Fields written by others during the cycle are not overwritten."""
+        other = _temp_api(self.api.state_file)
+        with self.api.transaction():
+            self.api.update_state({'emergency_brake': True})
+            other.update_state({'train_velocity': 33.0, 'emergency_brake': False})
+        state = other.get_state()
+        self.assertTrue(state['emergency_brake'])
+        self.assertEqual(state['train_velocity'], 33.0)
+
+    def test_nested_transaction_joins_outer(self):
+        with self.api.transaction() as outer:
+            with self.api.transaction() as inner:
+                self.assertIs(inner, outer)
+                self.api.update_state({'left_door': True})
+            self.assertEqual(self.writes, 0)
+        self.assertEqual(self.writes, 1)
+        self.assertTrue(self.api.get_state()['left_door'])
+
+    def test_controller_logic_runs_inside(self):
+        """set_emergency_brake / auto_manage_service_brake work on the working copy."""
+        from train_controller_sw_ui import train_controller
+        controller = train_controller(self.api)
+        self.api.update_state({'kp': 10.0, 'ki': 0.5, 'speed_limit': 50.0,
+                               'commanded_authority': 100.0, 'train_velocity': 30.0,
+                               'driver_velocity': 20.0})
+        self.writes = 0
+        with self.api.transaction():
+            controller.set_emergency_brake(True)
+            self.assertTrue(self.api.get_state()['emergency_brake'])
+            controller.auto_manage_service_brake(self.api.get_state())
+            self.assertEqual(self.writes, 0)
+        self.assertEqual(self.writes, 1)
+        state = self.api.get_state()
+        self.assertTrue(state['emergency_brake'])
+        self.assertFalse(state['service_brake'])
+        self.assertEqual(state['driver_velocity'], 0)
+
+        self.api.update_state({'emergency_brake': False, 'driver_velocity': 20.0})
+        self.writes = 0
+        with self.api.transaction():
+            controller.auto_manage_service_brake(self.api.get_state())
+            self.assertTrue(self.api.get_state()['service_brake'])
+        self.assertEqual(self.writes, 1)
+        self.assertTrue(self.api.get_state()['service_brake'])
+
+
+if __name__ == '__main__':
+    unittest.main()
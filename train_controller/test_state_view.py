@@ -0,0 +1,106 @@
+"""
+Unit tests for copy-on-write state views.
+
+Run with: python -m unittest test_state_view.py
+Or: python test_state_view.py
+"""
+
+import copy
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+from state_transaction import TransactionScope
+from state_view import StateView
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS, train_controller_api
+
+
+class TestStateView(unittest.TestCase):
+    """Layer lookup and copy-on-write behaviour."""
+
+    def setUp(self):
+        self.defaults = {'a': 0, 'b': 0, 'c': 0}
+        self.inputs = {'a': 1}
+        self.outputs = {'b': 2, 'd': 4}
+        self.view = StateView(self.defaults, self.inputs, self.outputs)
+
+    def test_later_layers_win(self):
+        self.assertEqual(dict(self.view), {'a': 1, 'b': 2, 'c': 0, 'd': 4})
+        self.assertEqual(list(self.view), ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(self.view), 4)
+        self.assertEqual(self.view, {'a': 1, 'b': 2, 'c': 0, 'd': 4})
+        self.assertIsNone(self.view.get('missing'))
+        with self.assertRaises(KeyError):
+            self.view['missing']
+
+    def test_writes_never_touch_layers(self):
+        self.view['a'] = 10
+        self.view.update({'e': 5})
+        del self.view['c']
+        self.assertEqual(dict(self.view), {'a': 10, 'b': 2, 'd': 4, 'e': 5})
+        self.assertEqual(self.defaults, {'a': 0, 'b': 0, 'c': 0})
+        self.assertEqual(self.inputs, {'a': 1})
+        with self.assertRaises(KeyError):
+            del self.view['c']
+
+    def test_copies_are_independent(self):
+        self.view['a'] = 10
+        other = self.view.copy()
+        other['a'] = 20
+        self.view['b'] = 30
+        self.assertEqual((self.view['a'], self.view['b']), (10, 30))
+        self.assertEqual((other['a'], other['b']), (20, 2))
+        self.assertEqual(copy.copy(self.view), self.view)
+
+    def test_serializes_as_dict(self):
+        self.assertEqual(json.loads(json.dumps(dict(self.view))), dict(self.view))
+        self.assertEqual(copy.deepcopy(self.view), dict(self.view))
+
+
+class TestGetStateView(unittest.TestCase):
+    """get_state() returns views over the shared parsed file."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        api = object.__new__(train_controller_api)
+        api.train_id = 1
+        api.store = None
+        api.bus = None
+        api.state_file = os.path.join(self.tmp.name, "train_states.json")
+        api.default_inputs = DEFAULT_INPUTS.copy()
+        api.default_outputs = DEFAULT_OUTPUTS.copy()
+        api.train_states = {**api.default_inputs, **api.default_outputs}
+        api._transactions = TransactionScope()
+        api.save_state({**api.train_states, 'driver_velocity': 12.0})
+        self.api = api
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_mutating_a_state_does_not_leak(self):
+        state = self.api.get_state()
+        self.assertIsInstance(state, StateView)
+        state['driver_velocity'] = 99.0
+        new_state = state.copy()
+        new_state['power_command'] = 5.0
+        fresh = self.api.get_state()
+        self.assertEqual(fresh['driver_velocity'], 12.0)
+        self.assertEqual(fresh['power_command'], 0.0)
+        self.assertEqual(new_state['driver_velocity'], 99.0)
+
+    def test_save_accepts_views(self):
+        state = self.api.get_state()
+        state['left_door'] = True
+        self.api.save_state(state)
+        self.assertTrue(self.api.get_state()['left_door'])
+        self.api.update_state({'right_door': True})
+        self.assertTrue(self.api.get_state()['right_door'])
+
+
+if __name__ == '__main__':
+    unittest.main()
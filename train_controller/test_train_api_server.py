@@ -0,0 +1,231 @@
+"""
+Route tests for the REST API server, through Flask's test client.
+
+The server's in-memory fleet and event database are swapped for ones in a
+temporary directory, so the repo's train_states.json and
+train_controller.db are never written.
+
+Run with: python -m unittest test_train_api_server.py
+Or: python test_train_api_server.py
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+sys.path.insert(0, os.path.join(current_dir, "database"))
+sys.path.insert(0, os.path.dirname(current_dir))
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("GROUP4_NOTIFY_DIR", os.path.join(_tmp.name, "notify"))
+
+HAVE_FLASK = all(importlib.util.find_spec(name) is not None for name in ("flask", "flask_cors"))
+if HAVE_FLASK:
+    import train_api_server as server
+    from database import train_database
+    from fleet_state import FleetState
+
+
+def read_event(response):
+    """Next Server-Sent Events message of a streamed response as (event, id, data)."""
+    chunk = next(response.response)
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode()
+    fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+    return fields["event"], fields.get("id"), json.loads(fields["data"])
+
+
+@unittest.skipUnless(HAVE_FLASK, "flask is not installed")
+class TestTrainApiServer(unittest.TestCase):
+    """Train state, bulk, stream and event routes over the in-memory fleet."""
+
+    @classmethod
+    def setUpClass(cls):
+        if server.fleet is None:
+            raise unittest.SkipTest("the server is not using the in-memory fleet (JSON mode)")
+        # Nothing is written through the fleet opened at import
+        server.fleet.stop()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        path = os.path.join(self.tmp.name, "train_states.json")
+        self.saved = []
+        self.fleet = FleetState(path, load=dict, save=self.saved.append, interval=60.0)
+        self.db = train_database(os.path.join(self.tmp.name, "train_controller.db"))
+        self.addCleanup(self.db.close)
+        for name, value in (("fleet", self.fleet), ("event_db", self.db)):
+            patcher = mock.patch.object(server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = server.app.test_client()
+        self.post_state(1, {"commanded_speed": 10.0, "power_command": 5.0})
+        self.post_state(2, {"commanded_speed": 20.0})
+
+    def post_state(self, train_id, fields):
+        response = self.client.post(f"/api/train/{train_id}/state", json=fields)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def stream(self, url, **kwargs):
+        response = self.client.get(url, buffered=False, **kwargs)
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        return response
+
+    # ---------- single train ----------
+
+    def test_get_answers_304_while_the_etag_matches(self):
+        first = self.client.get("/api/train/1/state")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_json()["inputs"]["commanded_speed"], 10.0)
+        etag = first.headers["ETag"]
+        unchanged = self.client.get("/api/train/1/state", headers={"If-None-Match": etag})
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged.data, b"")
+        self.post_state(1, {"kp": 3.0})
+        changed = self.client.get("/api/train/1/state", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertEqual(self.client.get("/api/train/9/state").status_code, 404)
+
+    def test_patch_merges_other_fields_and_conflicts_on_the_same_field(self):
+        etag = self.client.get("/api/train/1/state").headers["ETag"]
+        self.post_state(1, {"power_command": 7.0})
+        # Another writer changed power_command, not kp: merged
+        merged = self.client.patch("/api/train/1/state", json={"kp": 4.0},
+                                   headers={"If-Match": etag})
+        self.assertEqual(merged.status_code, 200)
+        self.assertEqual(merged.get_json()["state"]["outputs"]["kp"], 4.0)
+        self.assertEqual(merged.get_json()["state"]["outputs"]["power_command"], 7.0)
+        self.assertEqual(merged.headers["ETag"].strip('"'), merged.get_json()["version"])
+        # Same field: 409 with the current state, nothing applied
+        conflict = self.client.patch("/api/train/1/state", json={"power_command": 1.0},
+                                     headers={"If-Match": etag})
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.get_json()["conflicts"], ["power_command"])
+        self.assertEqual(conflict.get_json()["state"]["outputs"]["power_command"], 7.0)
+        self.assertEqual(self.fleet.get(1)["outputs"]["power_command"], 7.0)
+
+    def test_patch_with_a_stale_if_match_is_412(self):
+        for etag in ('"0123abcd.2"', '""'):
+            with self.subTest(etag=etag):
+                response = self.client.patch("/api/train/1/state", json={"kp": 4.0},
+                                             headers={"If-Match": etag})
+                self.assertEqual(response.status_code, 412)
+                current = response.headers["ETag"]
+                self.assertEqual(current.strip('"'), response.get_json()["version"])
+                self.assertEqual(response.get_json()["state"]["inputs"]["commanded_speed"], 10.0)
+        self.assertEqual(self.fleet.get(1)["outputs"]["kp"], server.schema.DEFAULTS["kp"])
+        # The ETag of the 412 works for the retry
+        retry = self.client.patch("/api/train/1/state", json={"kp": 4.0},
+                                  headers={"If-Match": current})
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(self.client.patch("/api/train/9/state", json={"kp": 4.0},
+                                           headers={"If-Match": current}).status_code, 404)
+
+    def test_bad_bodies_are_400(self):
+        for method, url, body in (
+                ("post", "/api/train/1/state", {"kp": "high"}),
+                ("post", "/api/train/1/state", [["kp", 1.0]]),
+                ("post", "/api/train/1/state", {}),
+                ("patch", "/api/train/1/state", {"left_door": "open"}),
+                ("patch", "/api/trains/state", []),
+                ("patch", "/api/trains/state", {}),
+                ("post", "/api/events", {"events": "none"}),
+                ("post", "/api/events", [{"t": "soon", "event_type": "x"}])):
+            with self.subTest(method=method, url=url, body=body):
+                response = getattr(self.client, method)(url, json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.get_json())
+        for url in ("/api/trains/state?ids=1,x", "/api/trains/stream?ids=x",
+                    "/api/block/77/trains?start=0"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.fleet.get(1)["outputs"]["kp"], server.schema.DEFAULTS["kp"])
+
+    def test_reset_and_delete(self):
+        reset = self.client.post("/api/train/1/reset")
+        self.assertEqual(reset.status_code, 200)
+        self.assertEqual(self.fleet.get(1)["inputs"]["commanded_speed"], 0.0)
+        self.assertEqual(self.client.delete("/api/train/1").status_code, 200)
+        self.assertIsNone(self.fleet.get(1))
+        self.assertEqual(self.client.delete("/api/train/1").status_code, 404)
+        self.assertEqual(self.client.get("/api/train/1/state").status_code, 404)
+
+    # ---------- bulk ----------
+
+    def test_bulk_get_filters_fields_and_lists_missing_trains(self):
+        body = self.client.get("/api/trains/state?ids=1,2,5&fields=commanded_speed").get_json()
+        self.assertEqual(body["trains"], {"train_1": {"inputs": {"commanded_speed": 10.0}, "outputs": {}},
+                                          "train_2": {"inputs": {"commanded_speed": 20.0}, "outputs": {}}})
+        self.assertEqual(body["missing"], [5])
+        everything = self.client.get("/api/trains/state").get_json()
+        self.assertEqual(sorted(everything["trains"]), ["train_1", "train_2"])
+
+    def test_bulk_patch_results_are_keyed_as_sent(self):
+        response = self.client.patch("/api/trains/state", json={
+            "1": {"power_command": 9.0}, "train_2": {"kp": 2.0},
+            "3": {"kp": "bad"}, "next": {"kp": 1.0}})
+        self.assertEqual(response.status_code, 207)
+        results = response.get_json()["results"]
+        self.assertEqual(sorted(results), ["1", "3", "next", "train_2"])
+        self.assertEqual({key: result["ok"] for key, result in results.items()},
+                         {"1": True, "train_2": True, "3": False, "next": False})
+        self.assertIn("version", results["1"])
+        self.assertEqual(self.fleet.get(1)["outputs"]["power_command"], 9.0)
+        self.assertEqual(self.fleet.get(2)["outputs"]["kp"], 2.0)
+        self.assertIsNone(self.fleet.get(3))
+        ok = self.client.patch("/api/trains/state", json={"train_1": {"kp": 1.0}})
+        self.assertEqual(ok.status_code, 200)
+        self.assertEqual(list(ok.get_json()["results"]), ["train_1"])
+
+    # ---------- streams ----------
+
+    def test_stream_sends_a_snapshot_then_one_diff_per_write(self):
+        response = self.stream("/api/train/1/stream")
+        event, event_id, data = read_event(response)
+        self.assertEqual(event, "snapshot")
+        self.assertEqual(list(data["trains"]), ["train_1"])
+        self.assertEqual(data["trains"]["train_1"]["commanded_speed"], 10.0)
+        self.post_state(2, {"kp": 1.0})  # another train: not on this stream
+        self.post_state(1, {"power_command": 8.0})
+        event, diff_id, data = read_event(response)
+        self.assertEqual(event, "diff")
+        self.assertEqual((data["train_id"], data["fields"]), (1, {"power_command": 8.0}))
+        self.assertEqual(diff_id, self.fleet.tag(data["version"]))
+        self.client.delete("/api/train/1")
+        event, _, data = read_event(response)
+        self.assertEqual((event, data["train_id"]), ("deleted", 1))
+
+    def test_stream_resumes_after_the_last_event_id(self):
+        since = self.fleet.tag(self.fleet.version)
+        self.post_state(1, {"kp": 5.0})
+        self.post_state(2, {"kp": 6.0})
+        response = self.stream("/api/trains/stream?ids=2", headers={"Last-Event-ID": since})
+        event, _, data = read_event(response)
+        self.assertEqual((event, data["train_id"], data["fields"]), ("diff", 2, {"kp": 6.0}))
+
+    # ---------- events ----------
+
+    def test_events_round_trip(self):
+        response = self.client.post("/api/events", json={"events": [
+            {"t": 10.0, "train_id": 1, "event_type": "block_enter", "block": 77},
+            {"t": 20.0, "train_id": 1, "event_type": "block_exit", "block": 77}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["count"], 2)
+        events = self.client.get("/api/events?train_id=1&type=block_exit").get_json()["events"]
+        self.assertEqual([(e["t"], e["block"]) for e in events], [(20.0, 77)])
+        block = self.client.get("/api/block/77/trains?start=12&end=15").get_json()
+        self.assertEqual(block["trains"], [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+"""
+Unit tests for the REST client's pooled session, read cache and write coalescing.
+
+The transport is a stand-in Session answering from an in-memory train, so
+neither requests nor a running server is needed.
+
+Run with: python -m unittest test_train_controller_api_client.py
+Or: python test_train_controller_api_client.py
+"""
+
+import importlib.util
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+
+class RequestException(Exception):
+    pass
+
+
+class Timeout(RequestException):
+    pass
+
+
+def _stub_requests():
+    """A module with the parts of requests the client uses besides Session."""
+    module = types.ModuleType("requests")
+    module.exceptions = types.SimpleNamespace(RequestException=RequestException, Timeout=Timeout)
+    module.adapters = types.SimpleNamespace(HTTPAdapter=None)
+    return module
+
+
+# The client imports requests at module level; lend it the stub if the real
+# one isn't installed (each test swaps the client's transport either way)
+if importlib.util.find_spec("requests") is None:
+    sys.modules["requests"] = _stub_requests()
+    import train_controller_api_client as client_module
+    del sys.modules["requests"]
+else:
+    import train_controller_api_client as client_module
+
+SERVER = "http://server:5000"
+STATE_URL = f"{SERVER}/api/train/1/state"
+
+
+class Response:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self._body = body
+        self.headers = headers or {}
+        self.content = b""
+
+    def json(self):
+        return self._body
+
+
+class Adapter:
+    def __init__(self, pool_connections, pool_maxsize):
+        self.pool_maxsize = pool_maxsize
+
+
+class Session:
+    """Stand-in requests.Session: records every request and answers it
+    from one train held in memory."""
+
+    instances = []
+
+    def __init__(self):
+        self.requests = []
+        self.mounted = {}
+        self.closed = False
+        self.state = {"inputs": {"commanded_speed": 10.0}, "outputs": {"power_command": 0.0}}
+        self.version = 1
+        Session.instances.append(self)
+
+    def mount(self, prefix, adapter):
+        self.mounted[prefix] = adapter
+
+    def close(self):
+        self.closed = True
+
+    def etag(self):
+        return f'"run.{self.version}"'
+
+    def request(self, method, url, headers=None, json=None, **kwargs):
+        self.requests.append((method, url, json))
+        if url == f"{SERVER}/api/health":
+            return Response(200, {"status": "ok"})
+        if url == STATE_URL and method == "GET":
+            if (headers or {}).get("If-None-Match") == self.etag():
+                return Response(304)
+            return Response(200, self.state, {"ETag": self.etag()})
+        if url == STATE_URL and method == "POST":
+            for name, value in json.items():
+                section = "inputs" if name in self.state["inputs"] else "outputs"
+                self.state[section][name] = value
+            self.version += 1
+            return Response(200, {"message": "updated"})
+        if url == f"{SERVER}/api/train/1/reset" and method == "POST":
+            self.state = {"inputs": {"commanded_speed": 0.0}, "outputs": {"power_command": 0.0}}
+            self.version += 1
+            return Response(200, {"message": "reset"})
+        if url == f"{SERVER}/api/trains/state" and method == "GET":
+            return Response(200, {"trains": {"train_1": self.state}, "missing": []})
+        return Response(404, {"error": "not found"})
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+
+class TestRestClient(unittest.TestCase):
+    """Requests the client sends for reads and writes."""
+
+    def setUp(self):
+        Session.instances = []
+        transport = _stub_requests()
+        transport.Session = Session
+        transport.adapters.HTTPAdapter = Adapter
+        patcher = mock.patch.object(client_module, "requests", transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = client_module.train_controller_api_client(
+            1, SERVER, stream=False, max_retries=1, cache_ttl=60.0, coalesce_s=60.0)
+        self.addCleanup(self.client.close)
+        self.session = self.client.session
+
+    def sent(self, method, url=STATE_URL):
+        return [body for m, u, body in self.session.requests if (m, u) == (method, url)]
+
+    def expire_cache(self):
+        self.client._cached_at -= 2 * self.client.cache_ttl
+
+    def test_reads_within_the_ttl_are_served_from_the_cache(self):
+        self.assertEqual(self.client.get_state()["commanded_speed"], 10.0)
+        self.client.get_state()
+        self.assertEqual(len(self.sent("GET")), 1)
+        # Expired but unchanged on the server: a 304 keeps the cached copy
+        self.expire_cache()
+        self.assertEqual(self.client.get_state()["commanded_speed"], 10.0)
+        self.assertEqual(len(self.sent("GET")), 2)
+        # Changed on the server: the next fetch after the TTL picks it up
+        self.session.state["inputs"]["commanded_speed"] = 20.0
+        self.session.version += 1
+        self.assertEqual(self.client.get_state()["commanded_speed"], 10.0)
+        self.expire_cache()
+        self.assertEqual(self.client.get_state()["commanded_speed"], 20.0)
+        self.assertEqual(len(self.sent("GET")), 3)
+
+    def test_writes_update_the_cache_and_reset_invalidates_it(self):
+        self.client.get_state()
+        self.client.update_state({"power_command": 5.0})
+        self.assertEqual(self.client.get_state()["power_command"], 5.0)
+        self.assertEqual(len(self.sent("GET")), 1)
+        # A refetch before the write is sent doesn't undo it
+        self.expire_cache()
+        self.session.version += 1
+        self.assertEqual(self.client.get_state()["power_command"], 5.0)
+        self.client.flush()
+        self.assertEqual(self.session.state["outputs"]["power_command"], 5.0)
+        # reset_state() drops the cached copy, so the next read fetches
+        self.client.reset_state()
+        self.assertEqual(self.client.get_state()["commanded_speed"], 0.0)
+        self.assertEqual(len(self.sent("GET")), 3)
+
+    def test_field_writes_are_coalesced_into_one_post(self):
+        self.client.update_state({"power_command": 1.0})
+        self.client.update_state({"power_command": 2.0, "kp": 3.0})
+        self.client.update_state({"ki": 4.0})
+        self.assertEqual(self.sent("POST"), [])
+        self.client.flush()
+        self.assertEqual(self.sent("POST"), [{"power_command": 2.0, "kp": 3.0, "ki": 4.0}])
+        self.client.flush()
+        self.assertEqual(len(self.sent("POST")), 1)
+
+    def test_coalesced_writes_are_sent_when_the_window_ends(self):
+        self.client.coalesce_s = 0.01
+        self.client.update_state({"power_command": 1.0})
+        self.client.update_state({"kp": 2.0})
+        timer = self.client._flush_timer
+        timer.join(timeout=5.0)
+        self.assertEqual(self.sent("POST"), [{"power_command": 1.0, "kp": 2.0}])
+
+    def test_every_request_reuses_one_pooled_session(self):
+        self.client.get_state()
+        self.client.update_state({"power_command": 1.0})
+        self.client.flush()
+        self.client.get_states()
+        self.client.reset_state()
+        self.assertEqual(len(Session.instances), 1)
+        self.assertEqual([method for method, _, _ in self.session.requests],
+                         ["GET", "GET", "POST", "GET", "POST"])
+        adapter = self.session.mounted["http://"]
+        self.assertIs(self.session.mounted["https://"], adapter)
+        self.assertEqual(adapter.pool_maxsize, client_module.POOL_SIZE)
+        self.client.close()
+        self.assertTrue(self.session.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
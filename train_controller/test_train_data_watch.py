@@ -0,0 +1,115 @@
+"""
+Unit tests for the server's train_data.json -> train states sync.
+
+Run with: python -m unittest test_train_data_watch.py
+Or: python test_train_data_watch.py
+"""
+
+import copy
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+sys.path.insert(0, os.path.dirname(current_dir))
+
+import channel_notify
+from train_data_watch import TrainDataWatch
+
+
+def train_section(speed):
+    return {"inputs": {"commanded speed": speed, "commanded authority": 100.0},
+            "outputs": {"velocity_mph": 0.0}}
+
+
+class TestTrainDataWatch(unittest.TestCase):
+    """Which trains a pass writes, and when run() looks at the file."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "train_data.json")
+        self.doc = {"train_1": train_section(10.0), "train_2": train_section(20.0),
+                    "specs": {"length_ft": 66.0}}
+        self.reads = 0
+        self.writes = []
+        self.watch = TrainDataWatch(self.read, self.write, self.path, wait_s=60.0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        self.reads += 1
+        with open(self.path) as f:
+            return json.load(f)
+
+    def write(self, train_id, inputs):
+        self.writes.append((train_id, inputs))
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.doc, f)
+
+    def wait_until(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out")
+            time.sleep(0.005)
+
+    def test_unchanged_file_writes_nothing(self):
+        self.assertEqual(self.watch.sync(self.doc), 2)
+        self.writes.clear()
+        self.assertEqual(self.watch.sync(copy.deepcopy(self.doc)), 0)
+        self.assertEqual(self.writes, [])
+
+    def test_one_changed_train_is_one_targeted_write(self):
+        self.watch.sync(self.doc)
+        self.writes.clear()
+        self.doc["train_2"]["inputs"]["commanded speed"] = 25.0
+        self.assertEqual(self.watch.sync(self.doc), 1)
+        self.assertEqual([train_id for train_id, _ in self.writes], [2])
+        self.assertEqual(self.writes[0][1]["commanded_speed"], 25.0)
+
+    def test_removed_trains_are_forgotten(self):
+        self.watch.sync(self.doc)
+        del self.doc["train_2"]
+        self.watch.sync(self.doc)
+        self.assertEqual(sorted(self.watch.synced), ["train_1"])
+        # Back again: written like a new train
+        self.doc["train_2"] = train_section(20.0)
+        self.writes.clear()
+        self.assertEqual(self.watch.sync(self.doc), 1)
+
+    def test_run_reads_only_when_notified(self):
+        channel_notify.use_process_local(True, ["train_data"])
+        self.addCleanup(channel_notify.use_process_local, False)
+        self.save()
+        running = True
+        thread = threading.Thread(target=self.watch.run, args=(lambda: running,), daemon=True)
+        thread.start()
+        self.wait_until(lambda: len(self.writes) == 2)
+        # Idle: no notification, no read (and no stat) until wait_s runs out
+        time.sleep(0.2)
+        self.assertEqual(self.reads, 1)
+        # Published but unchanged: read once, nothing written
+        channel_notify.publish_change("train_data")
+        self.wait_until(lambda: self.reads == 2)
+        self.doc["train_1"]["inputs"]["commanded authority"] = 50.0
+        self.save()
+        channel_notify.publish_change("train_data")
+        self.wait_until(lambda: len(self.writes) == 3)
+        self.assertEqual(self.writes[2][0], 1)
+        running = False
+        channel_notify.publish_change("train_data")
+        thread.join(timeout=5.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(self.writes), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
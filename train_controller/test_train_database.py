@@ -0,0 +1,217 @@
+"""
+Unit tests for the train controller SQLite database.
+
+Run with: python -m unittest test_train_database.py
+Or: python test_train_database.py
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "database"))
+
+import database
+from database import train_database
+
+
+class TestTrainDatabase(unittest.TestCase):
+    """Persistent connection, UPSERTs, batches and the background writer."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = train_database(os.path.join(self.tmp.name, "train_controller.db"))
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def column(self, train_id, name):
+        conn = sqlite3.connect(self.db.db_path)
+        try:
+            row = conn.execute(f'SELECT "{name}" FROM train_states WHERE id = ?',
+                               (train_id,)).fetchone()
+            return row and row[0]
+        finally:
+            conn.close()
+
+    def test_wal_mode(self):
+        mode = self.db._conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_upsert_keeps_other_columns(self):
+        self.db.update_train_state(1, {'velocity': 12.0, 'kp': 10.0})
+        self.db.update_train_state(1, {'power_command': 500.0})
+        self.assertEqual(self.column(1, 'train_velocity'), 12.0)
+        self.assertEqual(self.column(1, 'kp'), 10.0)
+        self.assertEqual(self.column(1, 'power_command'), 500.0)
+        self.assertEqual(self.db.get_all_train_ids(), [1])
+
+    def test_update_many_is_all_or_nothing(self):
+        self.db.update_many({1: {'power_command': 1.0}, 2: {'power_command': 2.0,
+                                                            'left_door': True}})
+        self.assertEqual(self.db.get_all_train_ids(), [1, 2])
+        with self.assertRaises(ValueError):
+            self.db.update_many({3: {'power_command': 3.0}, 4: {'power_command': "x"}})
+        self.assertEqual(self.db.get_all_train_ids(), [1, 2])
+
+    def test_background_writer_merges_updates(self):
+        self.db.start_writer(max_pending=4)
+        for tick in range(20):
+            self.db.submit_many({1: {'power_command': float(tick)},
+                                 2: {'driver_velocity': float(tick)}})
+        self.db.submit(3, {'power_command': "bad"})
+        self.db.submit(2, {'emergency_brake': True})
+        self.db.flush()
+        self.assertEqual(self.column(1, 'power_command'), 19.0)
+        self.assertEqual(self.column(2, 'driver_velocity'), 19.0)
+        self.assertEqual(self.column(2, 'emergency_brake'), 1)
+        self.assertIsNone(self.column(3, 'power_command'))
+
+
+class TestTelemetry(unittest.TestCase):
+    """Telemetry history, rollups and retention."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = train_database(os.path.join(self.tmp.name, "train_controller.db"))
+        self.db.telemetry_retention = {0: 30.0, 1: 120.0, 10: None}
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def record(self, seconds, trains=2):
+        for tick in range(seconds * 4):
+            self.db.record_telemetry(tick / 4, {
+                train_id: {'train_velocity': float(tick % 4), 'power_command': 100.0 * train_id,
+                           'commanded_authority': 500.0 - tick, 'service_brake': tick % 2 == 0,
+                           'emergency_brake': False}
+                for train_id in range(1, trains + 1)})
+
+    def test_raw_range_query(self):
+        self.record(5)
+        rows = self.db.get_telemetry(2, 1.0, 2.0)
+        self.assertEqual([r['sim_time'] for r in rows], [1.0, 1.25, 1.5, 1.75])
+        self.assertEqual(rows[0]['power_command'], 200.0)
+        self.assertEqual(rows[0]['service_brake'], 1)
+
+    def test_rollups_aggregate_closed_buckets(self):
+        self.record(25)
+        second = self.db.get_telemetry(1, 3.0, 4.0, resolution=1)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(second[0]['samples'], 4)
+        self.assertEqual((second[0]['velocity_min'], second[0]['velocity_max']), (0.0, 3.0))
+        self.assertEqual(second[0]['velocity_avg'], 1.5)
+        self.assertEqual(second[0]['service_brake'], 0.5)
+        ten = self.db.get_telemetry(1, 0.0, 20.0, resolution=10)
+        self.assertEqual([r['bucket'] for r in ten], [0.0, 10.0])
+        self.assertEqual(ten[1]['samples'], 40)
+        self.assertEqual(ten[1]['authority_min'], 500.0 - 79)
+
+    def test_retention_prunes_rolled_up_rows(self):
+        self.record(200)
+        self.assertEqual(self.db.get_telemetry(1, 0.0, 100.0, resolution=0), [])
+        self.assertTrue(self.db.get_telemetry(1, 170.0, 171.0, resolution=0))
+        self.assertEqual(self.db.get_telemetry(1, 0.0, 50.0, resolution=1), [])
+        self.assertEqual(len(self.db.get_telemetry(1, 0.0, 50.0)), 5)
+        with self.assertRaises(ValueError):
+            self.db.get_telemetry(1, 0.0, 1.0, resolution=5)
+
+    def test_background_writer_records_telemetry(self):
+        self.db.start_writer()
+        self.db.submit_telemetry(0.0, {1: {'velocity': 3.0}})
+        self.db.flush()
+        self.assertEqual(self.db.get_telemetry(1, 0.0, 1.0)[0]['velocity'], 3.0)
+
+    def test_non_numeric_values_are_recorded_as_null(self):
+        self.db.start_writer()
+        self.db.submit_telemetry(0.0, {1: {'commanded_authority': 'far', 'velocity': '2.5'}})
+        self.db.submit_telemetry(1.0, {1: {'commanded_authority': 50.0, 'velocity': None}})
+        self.db.flush()
+        self.assertTrue(self.db._writer.is_alive())
+        rows = self.db.get_telemetry(1, 0.0, 2.0)
+        self.assertEqual([(r['authority'], r['velocity']) for r in rows],
+                         [(None, 2.5), (50.0, None)])
+
+
+class TestEvents(unittest.TestCase):
+    """Event history and its query helpers."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = train_database(os.path.join(self.tmp.name, "train_controller.db"))
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_block_changes_and_occupancy(self):
+        self.db.record_block_changes(10.0, {1: 76, 2: 77})
+        self.db.record_block_changes(20.0, {1: 77})
+        self.db.record_block_changes(30.0, {2: 78})
+        self.db.record_block_changes(40.0, {1: 78})
+        self.assertEqual(self.db.trains_in_block(77, 12.0, 15.0), [2])
+        self.assertEqual(self.db.trains_in_block(77, 25.0, 26.0), [1, 2])
+        self.assertEqual(self.db.trains_in_block(77, 35.0, 60.0), [1])
+        self.assertEqual(self.db.trains_in_block(77, 41.0, 60.0), [])
+        exits = self.db.get_events(train_id=1, event_type=database.BLOCK_EXIT)
+        self.assertEqual([(e["t"], e["block"]) for e in exits], [(20.0, 76), (40.0, 77)])
+
+    def test_telemetry_logs_transitions(self):
+        self.db.record_telemetry(0.0, {1: {'commanded_authority': 100.0}})
+        self.db.record_telemetry(1.0, {1: {'commanded_authority': 90.0, 'emergency_brake': True}})
+        self.db.record_telemetry(2.0, {1: {'commanded_authority': 300.0, 'emergency_brake': True,
+                                           'train_model_signal_failure': True}})
+        events = [(e["t"], e["event_type"], e["value"], e["detail"]) for e in self.db.get_events(train_id=1)]
+        self.assertEqual(events, [(0.0, database.AUTHORITY_GRANT, 100.0, None),
+                                  (1.0, database.EMERGENCY_BRAKE, None, None),
+                                  (2.0, database.FAILURE, None, "signal"),
+                                  (2.0, database.AUTHORITY_GRANT, 300.0, None)])
+        recent = self.db.get_events(event_type=database.EMERGENCY_BRAKE, start=0.5, end=5.0)
+        self.assertEqual(len(recent), 1)
+
+    def test_bad_events_do_not_stop_the_writer(self):
+        self.db.start_writer(max_pending=2)
+        for bad in ({"event_type": database.BLOCK_ENTER}, {"t": "soon", "event_type": "x"},
+                    {"t": 1.0}, None):
+            with self.assertRaises(ValueError):
+                self.db.submit_events([{"t": 0.0, "event_type": "ok"}, bad])
+        with mock.patch.object(self.db, "_sample_events", side_effect=KeyError("authority")):
+            self.db.submit_telemetry(1.0, {1: {'velocity': 1.0}})
+            self.db.flush()
+        for t in (2.0, 3.0, 4.0):
+            self.db.submit_events([{"t": t, "train_id": 1, "event_type": database.FAILURE}])
+        self.db.submit(1, {'power_command': 5.0})
+        self.db.flush()
+        self.assertTrue(self.db._writer.is_alive())
+        self.assertEqual([e["t"] for e in self.db.get_events()], [2.0, 3.0, 4.0])
+        self.assertEqual(self.db.get_state(1)['power_command'], 5.0)
+
+    def test_queries_use_covering_indexes(self):
+        for query, args in (("SELECT t FROM train_events WHERE block = ? AND t >= ?", (77, 0.0)),
+                            ("SELECT detail FROM train_events WHERE train_id = ? AND t < ?", (1, 5.0)),
+                            ("SELECT train_id FROM train_events WHERE event_type = ? AND t >= ?",
+                             (database.FAILURE, 0.0))):
+            plan = " ".join(row[-1] for row in
+                            self.db._conn.execute("EXPLAIN QUERY PLAN " + query, args))
+            self.assertIn("COVERING INDEX", plan)
+        plan = " ".join(row[-1] for row in self.db._conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM train_events WHERE t >= ? AND t < ?", (0.0, 5.0)))
+        self.assertIn("train_events_by_t", plan)
+
+    def test_block_changes_go_through_the_writer(self):
+        self.db.start_writer(max_pending=1)
+        for tick in range(5):
+            self.db.record_block_changes(float(tick), {1: 60 + tick})
+        self.db.flush()
+        self.assertEqual(len(self.db.get_events(train_id=1, event_type=database.BLOCK_ENTER)), 5)
+        self.assertEqual(self.db.trains_in_block(63, 3.0, 3.5), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Unit tests for the train controller state schema.
+
+Run with: python -m unittest test_train_state_schema.py
+Or: python test_train_state_schema.py
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(current_dir, "api"))
+
+import train_state_schema as schema
+from train_controller_api import DEFAULT_INPUTS, DEFAULT_OUTPUTS
+
+
+class TestTrainStateSchema(unittest.TestCase):
+    """Compiled tables, routing, validation and templates."""
+
+    def test_every_field_has_one_section(self):
+        self.assertEqual(set(schema.DEFAULT_INPUTS) & set(schema.DEFAULT_OUTPUTS), set())
+        self.assertEqual(len(schema.DEFAULTS), len(schema.FIELDS))
+        self.assertEqual(DEFAULT_INPUTS, schema.DEFAULT_INPUTS)
+        self.assertEqual(DEFAULT_OUTPUTS, schema.DEFAULT_OUTPUTS)
+        for name, (section, _) in {**schema.TRAIN_DATA_FIELDS,
+                                   **schema.TRAIN_DATA_BEACON_FIELDS}.items():
+            self.assertEqual(schema.SECTION_OF[name], schema.INPUTS)
+
+    def test_split_fields_routes_and_drops_unknown(self):
+        sections = schema.split_fields({'power_command': 1200.0, 'train_velocity': 20.0,
+                                        'train_id': 3})
+        self.assertEqual(sections, {'inputs': {'train_velocity': 20.0},
+                                    'outputs': {'power_command': 1200.0}})
+
+    def test_validate_coerces_and_rejects(self):
+        self.assertEqual(schema.validate({'commanded_speed': 30, 'left_door': 1, 'kp': None,
+                                          'train_id': 1}),
+                         {'commanded_speed': 30.0, 'left_door': True, 'kp': None})
+        with self.assertRaises(ValueError):
+            schema.validate({'driver_velocity': "fast"})
+        with self.assertRaises(ValueError):
+            schema.validate({'power_command': None})
+        with self.assertRaises(ValueError):
+            schema.validate({'train_id': 1}, strict=True)
+        for body in ([['kp', 1.0]], "kp=1", 5):
+            with self.assertRaises(ValueError):
+                schema.validate(body)
+
+    def test_templates_are_fresh_copies(self):
+        sections = schema.default_sections(commanded_speed=25.0, kp=10.0)
+        self.assertEqual(sections['inputs']['commanded_speed'], 25.0)
+        self.assertEqual(sections['outputs']['kp'], 10.0)
+        sections['outputs']['power_command'] = 5.0
+        self.assertEqual(schema.DEFAULT_OUTPUTS['power_command'], 0.0)
+        state = schema.default_state(4)
+        self.assertEqual(state['train_id'], 4)
+        self.assertIs(state['interior_lights'], True)
+
+    def test_sql_columns_create_a_table(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(f"CREATE TABLE t (id INTEGER PRIMARY KEY, {schema.sql_columns()})")
+        conn.execute("INSERT INTO t (id) VALUES (1)")
+        row = conn.execute('SELECT "set_temperature", "kp", "station_side" FROM t').fetchone()
+        self.assertEqual(row, (70.0, None, ''))
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
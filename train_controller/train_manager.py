@@ -10,6 +10,7 @@ and manages their state in the shared train_states.json file.
 Author: Julen Coca-Knorr
 """
 
+import atexit
 import os
 import sys
 import json
@@ -27,7 +28,25 @@ train_model_dir = os.path.join(parent_dir, "Train_Model")
 sys.path.append(train_model_dir)
 
 # Import required classes
-from api.train_controller_api import train_controller_api
+from api.train_controller_api import (
+    train_controller_api,
+    USE_STATE_STORE,
+    get_state_store,
+)
+from api import train_state_schema as schema
+
+# train_controller_api put the project root on sys.path
+from channel_notify import ChangeTracker, publish_path
+from sim_bus import active_bus_for
+from double_buffer import load as load_published, publish as publish_file
+
+# Telemetry history (train_database in ./database)
+sys.path.append(os.path.join(current_dir, "database"))
+from database import train_database
+
+# Seconds between simulation ticks, which is also the simulated time one
+# tick advances the telemetry clock by
+UPDATE_INTERVAL_S = 0.5
 
 
 class TrainPair:
@@ -100,6 +119,17 @@ class TrainManager:
         # IMPORTANT: seed trains from the Train_Model folder's track-to-train file
         self.track_model_file = os.path.join(train_model_dir_actual, "track_model_Train_Model.json")
         
+        # Per-train state store (TRAIN_STATE_SHM=1 / TRAIN_STATE_SHARDS=1), None = JSON file only
+        self.state_store = get_state_store() if USE_STATE_STORE else None
+
+        # Telemetry and event history in train_controller.db, opened on the first tick
+        self.telemetry_db = None
+        self.sim_time = 0.0
+        # Train positions the wayside controllers report to the CTC, logged as
+        # block entries and exits when the file changes
+        self.ctc_file = os.path.join(parent_dir, "ctc_track_controller.json")
+        self._ctc_tracker = ChangeTracker("ctc_track_controller", self.ctc_file)
+        
         # Ensure state file exists
         self._initialize_state_file()
     
@@ -107,8 +137,7 @@ class TrainManager:
         """Initialize the train_states.json file if it doesn't exist."""
         if not os.path.exists(self.state_file):
             # Create empty state file
-            with open(self.state_file, 'w') as f:
-                json.dump({}, f, indent=4)
+            self._safe_write_json(self.state_file, {})
     
     def add_train(self, train_specs: dict = None, create_uis: bool = True, 
                   use_hardware: bool = False, is_remote: bool = False, server_url: str = None) -> int:
@@ -268,11 +297,10 @@ class TrainManager:
             train_id: ID of the train to initialize.
         """
         # Read current state file
-        with open(self.state_file, 'r') as f:
-            try:
-                all_states = json.load(f)
-            except json.JSONDecodeError:
-                all_states = {}
+        try:
+            all_states = self._read_states()
+        except json.JSONDecodeError:
+            all_states = {}
         
         train_key = f"train_{train_id}"
 
@@ -297,55 +325,53 @@ class TrainManager:
         station_side = beacon.get("side_door", "") or ""
 
         # Default state for new train (matches track inputs)
-        all_states[train_key] = {
-            "train_id": train_id,
-            "commanded_speed": commanded_speed,
-            "commanded_authority": commanded_authority,
-            "speed_limit": speed_limit,
-            "train_velocity": 0.0,
-            "next_stop": next_stop,
-            "station_side": station_side,
-            "train_temperature": 70.0,
-            "train_model_engine_failure": False,
-            "train_model_signal_failure": False,
-            "train_model_brake_failure": False,
-            "manual_mode": False,
-            "driver_velocity": 0.0,
-            "service_brake": False,
-            "right_door": False,
-            "left_door": False,
-            "interior_lights": True,
-            "exterior_lights": True,
-            "set_temperature": 70.0,
-            "temperature_up": False,
-            "temperature_down": False,
-            "announcement": "",
-            "announce_pressed": False,
-            "emergency_brake": False,
-            "engineering_panel_locked": False,
-            "power_command": 0.0,
-            "beacon_read_blocked": False,
-            "current_station": next_stop
-        }
+        all_states[train_key] = schema.default_state(train_id)
+        all_states[train_key].update(
+            commanded_speed=commanded_speed,
+            commanded_authority=commanded_authority,
+            speed_limit=speed_limit,
+            next_stop=next_stop,
+            station_side=station_side,
+            current_station=next_stop,
+        )
+        
+        if self.state_store is not None:
+            self.state_store.write(train_id, all_states[train_key])
+            return
         
         # Write back to file
-        with open(self.state_file, 'w') as f:
-            json.dump(all_states, f, indent=4)
+        self._write_states(all_states)
+
+    def _read_states(self) -> dict:
+        """Parse train_states.json (or its SimBus channel)."""
+        bus = active_bus_for(self.state_file)
+        if bus is not None:
+            return bus.read_path(self.state_file, {})
+        return load_published(self.state_file)
+
+    def _write_states(self, all_states: dict):
+        self._safe_write_json(self.state_file, all_states)
 
     # --- NEW: helpers to sync train_data.json with track model inputs ---
     def _safe_read_json(self, path: str) -> dict:
+        bus = active_bus_for(path)
+        if bus is not None:
+            return bus.read_path(path, {})
         try:
-            with open(path, "r") as f:
-                return json.load(f)
+            return load_published(path)
         except FileNotFoundError:
             return {}
         except json.JSONDecodeError:
             return {}
 
     def _safe_write_json(self, path: str, data: dict):
+        bus = active_bus_for(path)
+        if bus is not None:
+            bus.write_path(path, data)
+            return
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            json.dump(data, f, indent=4)
+        publish_file(path, json.dumps(data, indent=4))
+        publish_path(path)
 
     def _initialize_train_data_entry(self, train_id: int, index: int):
         """Create/initialize Train Model/train_data.json section for this train_id using track model data."""
@@ -477,14 +503,15 @@ class TrainManager:
         # Remove from dictionary
         del self.trains[train_id]
         
-        # Remove from state file
-        with open(self.state_file, 'r') as f:
-            all_states = json.load(f)
-        train_key = f"train_{train_id}"
-        if train_key in all_states:
-            del all_states[train_key]
-        with open(self.state_file, 'w') as f:
-            json.dump(all_states, f, indent=4)
+        # Remove from state store / state file
+        if self.state_store is not None:
+            self.state_store.remove_train(train_id)
+        else:
+            all_states = self._read_states()
+            train_key = f"train_{train_id}"
+            if train_key in all_states:
+                del all_states[train_key]
+            self._write_states(all_states)
 
         # Remove matching entry from Train Model/train_data.json
         try:
@@ -536,17 +563,19 @@ class TrainManager:
             print(f"Train {train_id} not found")
             return False
         
+        if self.state_store is not None:
+            self.state_store.write(train_id, state_updates)
+            return True
+        
         # Read state file
-        with open(self.state_file, 'r') as f:
-            all_states = json.load(f)
+        all_states = self._read_states()
         
         train_key = f"train_{train_id}"
         if train_key in all_states:
             all_states[train_key].update(state_updates)
         
         # Write back
-        with open(self.state_file, 'w') as f:
-            json.dump(all_states, f, indent=4)
+        self._write_states(all_states)
         
         return True
     
@@ -559,8 +588,13 @@ class TrainManager:
         Returns:
             Dictionary of train state, or None if not found.
         """
-        with open(self.state_file, 'r') as f:
-            all_states = json.load(f)
+        if self.state_store is not None:
+            inputs, outputs = self.state_store.read_sections(train_id)
+            if inputs is None:
+                return None
+            return {'inputs': inputs, 'outputs': outputs}
+        
+        all_states = self._read_states()
         
         train_key = f"train_{train_id}"
         return all_states.get(train_key, None)
@@ -624,6 +658,50 @@ class TrainManager:
             # This prevents conflicts when both Train Manager and Train Model are running
             # The Train Model is the source of truth for motion outputs
 
+        self.record_history()
+
+    def record_history(self):
+        """Advance the simulation clock one tick and queue every train's
+        state to the telemetry history (train_database.submit_telemetry).
+        
+        Trains with their own UIs are included, so the history covers the
+        whole fleet however each train is driven. When the wayside
+        controllers have moved a train, its block exit and entry are
+        logged to the event history too.
+        """
+        self.sim_time += UPDATE_INTERVAL_S
+        states = {}
+        for train_id in self.trains:
+            state = self.get_train_state(train_id)
+            if state is None:
+                continue
+            if 'inputs' in state:
+                state = {**state['inputs'], **(state.get('outputs') or {})}
+            states[train_id] = state
+        if not states:
+            return
+        if self.telemetry_db is None:
+            self.telemetry_db = train_database()
+            self.telemetry_db.start_writer()
+            atexit.register(self.telemetry_db.close)
+        self.telemetry_db.submit_telemetry(self.sim_time, states)
+        if self._ctc_tracker.changed():
+            self.telemetry_db.record_block_changes(self.sim_time, self._train_blocks())
+
+    def _train_blocks(self) -> dict:
+        """train_id -> block each train is in, from the "Train Position"
+        entries of ctc_track_controller.json (None while in the yard)."""
+        blocks = {}
+        trains = self._safe_read_json(self.ctc_file).get("Trains", {})
+        for name, info in trains.items():
+            try:
+                train_id = int(str(name).split()[-1])
+                block = int(info.get("Train Position") or 0)
+            except (AttributeError, IndexError, TypeError, ValueError):
+                continue
+            blocks[train_id] = block or None
+        return blocks
+
 
 class TrainManagerUI(tk.Tk):
     """UI for managing multiple trains.
@@ -976,7 +1054,7 @@ and control Train {train_id}."""
                 print(f"Simulation loop error: {e}")
             
             # Schedule next update (500ms)
-            self.after(500, self.simulation_loop)
+            self.after(int(UPDATE_INTERVAL_S * 1000), self.simulation_loop)
     
     def stop_simulation(self):
         """Stop the periodic simulation updates."""
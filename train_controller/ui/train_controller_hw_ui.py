@@ -352,7 +352,7 @@ class train_controller:
 
 class train_controller_ui(tk.Tk):
 
-    def __init__(self, train_id=1, server_url=None, timeout=5.0):
+    def __init__(self, train_id=1, server_url=None, timeout=5.0, state_backend=None):
         """Initialize the hardware driver interface.
         
         Args:
@@ -361,6 +361,8 @@ class train_controller_ui(tk.Tk):
                        If None, uses local file-based API (default).
                        Example: "http://192.168.1.100:5000"
             timeout: Network timeout in seconds for remote API (default: 5.0).
+            state_backend: StateBackend (or backend name) for the local API.
+                       Defaults to GROUP4_STATE_BACKEND (train_states.json).
         """
         super().__init__()
 
@@ -376,8 +378,8 @@ class train_controller_ui(tk.Tk):
         else:
             # Local mode - use file-based API
             from api.train_controller_api import train_controller_api
-            self.api = train_controller_api(train_id=train_id)
-            print(f"[HW UI] Using LOCAL API (file-based)")
+            self.api = train_controller_api(train_id=train_id, backend=state_backend)
+            print(f"[HW UI] Using LOCAL API ({type(self.api.backend).__name__ if self.api.backend else 'file-based'})")
 
         #set window title and size
         title = f"Train {train_id} - Hardware Controller" if train_id else "Train Controller - Hardware Driver Interface"
@@ -529,108 +531,110 @@ class train_controller_ui(tk.Tk):
 
     def periodic_update(self):
         try:
-            # Only read from train_data.json in local mode (not when using remote server)
-            if not self.server_url:
-                self.api.update_from_train_data()
+            # One state read and one write of the changed fields per cycle
+            with self.api.transaction():
+                # Only read from train_data.json in local mode (not when using remote server)
+                if not self.server_url:
+                    self.api.update_from_train_data()
             
-            state = self.api.get_state()
+                state = self.api.get_state()
             
-            # Detect failures based on Train Model behavior
-            self.controller.detect_and_respond_to_failures(state)
+                # Detect failures based on Train Model behavior
+                self.controller.detect_and_respond_to_failures(state)
             
-            # Reload state after failure detection updates
-            state = self.api.get_state()
+                # Reload state after failure detection updates
+                state = self.api.get_state()
             
-            # Handle automatic vs manual mode behaviors
-            manual_mode = state.get('manual_mode', False)
+                # Handle automatic vs manual mode behaviors
+                manual_mode = state.get('manual_mode', False)
             
-            if not manual_mode:  # Automatic mode
-                # Auto-set driver velocity to commanded speed
-                if state['driver_velocity'] != state['commanded_speed']:
-                    self.api.update_state({'driver_velocity': state['commanded_speed']})
-                    state = self.api.get_state()
+                if not manual_mode:  # Automatic mode
+                    # Auto-set driver velocity to commanded speed
+                    if state['driver_velocity'] != state['commanded_speed']:
+                        self.api.update_state({'driver_velocity': state['commanded_speed']})
+                        state = self.api.get_state()
                 
-                # Auto-regulate temperature to 70°F
-                if state['set_temperature'] != 70.0:
-                    self.api.update_state({'set_temperature': 70.0})
-                    state = self.api.get_state()
+                    # Auto-regulate temperature to 70°F
+                    if state['set_temperature'] != 70.0:
+                        self.api.update_state({'set_temperature': 70.0})
+                        state = self.api.get_state()
                 
-                # Auto-announcement when beacon changes
-                current_station = state.get('current_station', '')
-                if current_station and current_station != self.controller._last_beacon_for_announcement:
-                    # Beacon changed - make announcement
-                    next_stop = state.get('next_stop', '')
-                    if next_stop:
-                        announcement = f"Next stop: {next_stop}"
-                        self.api.update_state({'announcement': announcement})
-                    self.controller._last_beacon_for_announcement = current_station
-            else:  # Manual mode
-                # Update beacon tracking even in manual mode
-                current_station = state.get('current_station', '')
-                if current_station:
-                    self.controller._last_beacon_for_announcement = current_station
+                    # Auto-announcement when beacon changes
+                    current_station = state.get('current_station', '')
+                    if current_station and current_station != self.controller._last_beacon_for_announcement:
+                        # Beacon changed - make announcement
+                        next_stop = state.get('next_stop', '')
+                        if next_stop:
+                            announcement = f"Next stop: {next_stop}"
+                            self.api.update_state({'announcement': announcement})
+                        self.controller._last_beacon_for_announcement = current_station
+                else:  # Manual mode
+                    # Update beacon tracking even in manual mode
+                    current_station = state.get('current_station', '')
+                    if current_station:
+                        self.controller._last_beacon_for_announcement = current_station
             
-            # Auto-release emergency brake when velocity reaches 0
-            if state['emergency_brake'] and state['train_velocity'] == 0.0:
-                print("[Train Controller] Train stopped - Releasing emergency brake")
-                self.controller.set_emergency_brake(False)
-                state = self.api.get_state()
+                # Auto-release emergency brake when velocity reaches 0
+                if state['emergency_brake'] and state['train_velocity'] == 0.0:
+                    print("[Train Controller] Train stopped - Releasing emergency brake")
+                    self.controller.set_emergency_brake(False)
+                    state = self.api.get_state()
             
-            # Check for critical failures that require emergency brake
-            critical_failure = (state.get('train_controller_engine_failure', False) or 
-                              state.get('train_controller_signal_failure', False) or 
-                              state.get('train_controller_brake_failure', False))
+                # Check for critical failures that require emergency brake
+                critical_failure = (state.get('train_controller_engine_failure', False) or 
+                                  state.get('train_controller_signal_failure', False) or 
+                                  state.get('train_controller_brake_failure', False))
             
-            if critical_failure and not state['emergency_brake']:
-                # Automatically engage emergency brake on critical failure
-                self.controller.set_emergency_brake(True)
-                state = self.api.get_state()
+                if critical_failure and not state['emergency_brake']:
+                    # Automatically engage emergency brake on critical failure
+                    self.controller.set_emergency_brake(True)
+                    state = self.api.get_state()
             
-            # Auto-manage service brake based on speed difference
-            # This will engage/release service brake when train needs to slow down
-            self.controller.auto_manage_service_brake(state)
+                # Auto-manage service brake based on speed difference
+                # This will engage/release service brake when train needs to slow down
+                self.controller.auto_manage_service_brake(state)
             
-            # Refresh state after potential service brake change
-            state = self.api.get_state()
-
-            # Read ADC (potentiometer inputs) ONLY in manual mode
-            # In automatic mode, the controller sets these values automatically
-            hw = getattr(self.controller, 'hardware', None)
-            if manual_mode and hw and hw.i2c_devices.get('adc', False):
-                try:
-                    hw.read_current_adc()
-                except Exception as e:
-                    print(f"ADC read/update error: {e}")
+                # Refresh state after potential service brake change
+                state = self.api.get_state()
+
+                # Read ADC (potentiometer inputs) ONLY in manual mode
+                # In automatic mode, the controller sets these values automatically
+                hw = getattr(self.controller, 'hardware', None)
+                if manual_mode and hw and hw.i2c_devices.get('adc', False):
+                    try:
+                        hw.read_current_adc()
+                    except Exception as e:
+                        print(f"ADC read/update error: {e}")
             
-            # Recalculate power command based on current state
-            if (not state['emergency_brake'] and 
-                state['service_brake'] == 0 and 
-                not critical_failure):
-                power = self.controller.calculate_power_command(state)
-                if power != state['power_command']:
-                    self.controller.vital_control_check_and_update({'power_command': power})
-            else:
-                # Reset accumulated error when brakes are active
-                self.controller._accumulated_error = 0
-                # No power when brakes are active or failures present
-                self.controller.vital_control_check_and_update({
-                    'power_command': 0,
-                    'driver_velocity': 0
-                })
-            # try:
-            # # Recalculate power command based on current state
-            #     if not state['emergency_brake'] and state['service_brake'] == 0:
-            #         power = self.calculate_power_command(state)
-            #         if power != state['power_command']:
-            #             self.api.update_state({'power_command': power})
-            #     else:
-            #         # No power when brakes are active
-            #         self.api.update_state({'power_command': 0})
-            # except Exception as e:
-            #     print(f"Power command calculation error: {e}")
-
-            # Reload state one final time before display to ensure all updates are reflected
-            state = self.api.get_state()
+                # Recalculate power command based on current state
+                if (not state['emergency_brake'] and 
+                    state['service_brake'] == 0 and 
+                    not critical_failure):
+                    power = self.controller.calculate_power_command(state)
+                    if power != state['power_command']:
+                        self.controller.vital_control_check_and_update({'power_command': power})
+                else:
+                    # Reset accumulated error when brakes are active
+                    self.controller._accumulated_error = 0
+                    # No power when brakes are active or failures present
+                    self.controller.vital_control_check_and_update({
+                        'power_command': 0,
+                        'driver_velocity': 0
+                    })
+                # try:
+                # # Recalculate power command based on current state
+                #     if not state['emergency_brake'] and state['service_brake'] == 0:
+                #         power = self.calculate_power_command(state)
+                #         if power != state['power_command']:
+                #             self.api.update_state({'power_command': power})
+                #     else:
+                #         # No power when brakes are active
+                #         self.api.update_state({'power_command': 0})
+                # except Exception as e:
+                #     print(f"Power command calculation error: {e}")
+
+                # Reload state one final time before display to ensure all updates are reflected
+                state = self.api.get_state()
 
             # Update important parameters in the treeview
             children = self.info_treeview.get_children()
@@ -888,6 +892,8 @@ if __name__ == "__main__":
                        help="Server URL for remote API (e.g., http://192.168.1.100:5000). If not provided, uses local file-based API.")
     parser.add_argument("--timeout", type=float, default=5.0,
                        help="Network timeout in seconds for remote API (default: 5.0)")
+    from api.state_backend import add_backend_arguments, backend_from_args
+    add_backend_arguments(parser)
     args = parser.parse_args()
     
     print("=" * 70)
@@ -899,10 +905,12 @@ if __name__ == "__main__":
         print(f"  Server: {args.server}")
         print(f"  Timeout: {args.timeout}s")
     else:
-        print(f"  Mode: LOCAL (file-based)")
+        print(f"  Mode: LOCAL ({args.state_backend} state backend)")
     print("=" * 70)
     print()
     
     # Create and run app
-    app = train_controller_ui(train_id=args.train_id, server_url=args.server, timeout=args.timeout)
+    state_backend = None if args.server else backend_from_args(args)
+    app = train_controller_ui(train_id=args.train_id, server_url=args.server, timeout=args.timeout,
+                              state_backend=state_backend)
     app.mainloop()
\ No newline at end of file
@@ -590,18 +590,20 @@ class train_controller_ui(tk.Tk):
         emergency_brake_release_timer: Timer ID for emergency brake auto-release.
     """
     
-    def __init__(self, train_id=None):
+    def __init__(self, train_id=None, state_backend=None):
         """Initialize the driver interface.
         
         Args:
             train_id: Optional train ID for multi-train support. If None, uses root level (legacy).
+            state_backend: StateBackend (or backend name) for the API; defaults
+                to GROUP4_STATE_BACKEND.
         """
         super().__init__()
         
         self.train_id = train_id
         
         # Initialize API with train_id
-        self.api = train_controller_api(train_id=train_id)
+        self.api = train_controller_api(train_id=train_id, backend=state_backend)
         
         # Create controller instance with shared API
         self.controller = train_controller(self.api)
@@ -872,84 +874,86 @@ class train_controller_ui(tk.Tk):
     def periodic_update(self):
         """Update display every update_interval milliseconds."""
         try:
-            # Read inputs from train_data.json (written by Test UI or Train Model)
-            self.api.update_from_train_data()
+            # One state read and one write of the changed fields per cycle
+            with self.api.transaction():
+                # Read inputs from train_data.json (written by Test UI or Train Model)
+                self.api.update_from_train_data()
             
-            # Sync beacon and commanded speed/authority from Train Model
-            self.controller.update_from_train_model()
+                # Sync beacon and commanded speed/authority from Train Model
+                self.controller.update_from_train_model()
             
-            current_state = self.api.get_state()
+                current_state = self.api.get_state()
             
-            # Detect failures based on Train Model behavior
-            self.detect_and_respond_to_failures(current_state)
+                # Detect failures based on Train Model behavior
+                self.detect_and_respond_to_failures(current_state)
             
-            # Reload state after failure detection updates
-            current_state = self.api.get_state()
+                # Reload state after failure detection updates
+                current_state = self.api.get_state()
             
-            # Handle automatic vs manual mode behaviors
-            manual_mode = current_state.get('manual_mode', False)
+                # Handle automatic vs manual mode behaviors
+                manual_mode = current_state.get('manual_mode', False)
             
-            if not manual_mode:  # Automatic mode
-                # Auto-set driver velocity to commanded speed
-                if current_state['driver_velocity'] != current_state['commanded_speed']:
-                    self.api.update_state({'driver_velocity': current_state['commanded_speed']})
-                    current_state = self.api.get_state()
+                if not manual_mode:  # Automatic mode
+                    # Auto-set driver velocity to commanded speed
+                    if current_state['driver_velocity'] != current_state['commanded_speed']:
+                        self.api.update_state({'driver_velocity': current_state['commanded_speed']})
+                        current_state = self.api.get_state()
                 
-                # Auto-regulate temperature to 70°F
-                if current_state['set_temperature'] != 70.0:
-                    self.api.update_state({'set_temperature': 70.0})
-                    current_state = self.api.get_state()
+                    # Auto-regulate temperature to 70°F
+                    if current_state['set_temperature'] != 70.0:
+                        self.api.update_state({'set_temperature': 70.0})
+                        current_state = self.api.get_state()
                 
-                # Auto-announcement when beacon changes
-                current_station = current_state.get('current_station', '')
-                if current_station and current_station != self._last_beacon_for_announcement:
-                    # Beacon changed - make announcement
-                    next_stop = current_state.get('next_stop', '')
-                    if next_stop:
-                        announcement = f"Next stop: {next_stop}"
-                        self.api.update_state({'announcement': announcement})
-                    self._last_beacon_for_announcement = current_station
-            else:  # Manual mode
-                # Update beacon tracking even in manual mode
-                current_station = current_state.get('current_station', '')
-                if current_station:
-                    self._last_beacon_for_announcement = current_station
+                    # Auto-announcement when beacon changes
+                    current_station = current_state.get('current_station', '')
+                    if current_station and current_station != self._last_beacon_for_announcement:
+                        # Beacon changed - make announcement
+                        next_stop = current_state.get('next_stop', '')
+                        if next_stop:
+                            announcement = f"Next stop: {next_stop}"
+                            self.api.update_state({'announcement': announcement})
+                        self._last_beacon_for_announcement = current_station
+                else:  # Manual mode
+                    # Update beacon tracking even in manual mode
+                    current_station = current_state.get('current_station', '')
+                    if current_station:
+                        self._last_beacon_for_announcement = current_station
             
-            # Enable/disable buttons based on mode
-            self.update_button_enabled_states(manual_mode, current_state['emergency_brake'])
+                # Enable/disable buttons based on mode
+                self.update_button_enabled_states(manual_mode, current_state['emergency_brake'])
             
-            # Check for critical failures that require emergency brake
-            critical_failure = (current_state.get('train_controller_engine_failure', False) or 
-                              current_state.get('train_controller_signal_failure', False) or 
-                              current_state.get('train_controller_brake_failure', False))
+                # Check for critical failures that require emergency brake
+                critical_failure = (current_state.get('train_controller_engine_failure', False) or 
+                                  current_state.get('train_controller_signal_failure', False) or 
+                                  current_state.get('train_controller_brake_failure', False))
             
-            if critical_failure and not current_state['emergency_brake']:
-                # Automatically engage emergency brake on critical failure
-                self.controller.set_emergency_brake(True)
+                if critical_failure and not current_state['emergency_brake']:
+                    # Automatically engage emergency brake on critical failure
+                    self.controller.set_emergency_brake(True)
             
-            # Auto-manage service brake based on speed difference
-            # This will engage/release service brake when train needs to slow down
-            self.controller.auto_manage_service_brake(current_state)
+                # Auto-manage service brake based on speed difference
+                # This will engage/release service brake when train needs to slow down
+                self.controller.auto_manage_service_brake(current_state)
             
-            # Refresh state after potential service brake change
-            current_state = self.api.get_state()
+                # Refresh state after potential service brake change
+                current_state = self.api.get_state()
                 
-            # Recalculate power command based on current state
-            if (not current_state['emergency_brake'] and 
-                not current_state['service_brake'] and 
-                not critical_failure):
-                power = self.controller.calculate_power_command(current_state)
-                print(f"[DEBUG POWER] train_vel={current_state['train_velocity']:.2f}, driver_vel={current_state['driver_velocity']:.2f}, calculated_power={power:.2f}")
-                # Always update power command even if same to ensure it's written
-                self.controller.vital_control_check_and_update({'power_command': power})
-            else:
-                # Reset accumulated error when brakes are active
-                self.controller._accumulated_error = 0
-                # Set power to 0 when brakes are active or failures present
-                self.controller.vital_control_check_and_update({
-                    'power_command': 0
-                })
-            
+                # Recalculate power command based on current state
+                if (not current_state['emergency_brake'] and 
+                    not current_state['service_brake'] and 
+                    not critical_failure):
+                    power = self.controller.calculate_power_command(current_state)
+                    print(f"[DEBUG POWER] train_vel={current_state['train_velocity']:.2f}, driver_vel={current_state['driver_velocity']:.2f}, calculated_power={power:.2f}")
+                    # Always update power command even if same to ensure it's written
+                    self.controller.vital_control_check_and_update({'power_command': power})
+                else:
+                    # Reset accumulated error when brakes are active
+                    self.controller._accumulated_error = 0
+                    # Set power to 0 when brakes are active or failures present
+                    self.controller.vital_control_check_and_update({
+                        'power_command': 0
+                    })
+
             # Update current speed display
             self.speed_display.config(text=f"{current_state['train_velocity']:.1f} MPH")
             
@@ -1189,7 +1193,14 @@ class train_controller_ui(tk.Tk):
             tk.messagebox.showerror("Error", "Kp and Ki must be valid numbers")
 
 if __name__ == "__main__":
-    app = train_controller_ui()
+    import argparse
+    from api.state_backend import add_backend_arguments, backend_from_args
+    parser = argparse.ArgumentParser(description="Train Controller Software UI")
+    parser.add_argument("--train-id", type=int, default=None,
+                        help="Train ID to control (default: legacy single-train state)")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+    app = train_controller_ui(train_id=args.train_id, state_backend=backend_from_args(args))
     app.mainloop()
 
 